@@ -0,0 +1,95 @@
+"""
+Benchmark the VoxelsNddataCodec receive path.
+
+Compares the legacy receive loop (stream.read() in fixed 8 KiB chunks,
+copying each temporary string into the array) against the current
+readinto()-based path, which receives directly into the array's memory.
+
+The data is served over a loopback socket by a minimal http responder,
+so the numbers include real socket reads (but no DVID server overhead).
+
+    $ PYTHONPATH=.. python bench_codec_receive.py --megabytes 512
+"""
+import time
+import socket
+import httplib
+import argparse
+import threading
+
+import numpy
+
+from pydvid.voxels import VoxelsNddataCodec
+
+def serve_payload( listen_socket, payload, num_requests ):
+    """
+    Accept a single connection and answer num_requests requests on it,
+    each with the same payload.
+    """
+    header = "HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {}\r\n\r\n"\
+             "".format( len(payload) )
+    conn, _ = listen_socket.accept()
+    try:
+        conn_file = conn.makefile('rb', 0)
+        for _ in range(num_requests):
+            # Consume the request headers
+            while conn_file.readline() not in ("\r\n", ""):
+                pass
+            conn.sendall( header )
+            conn.sendall( payload )
+    finally:
+        conn.close()
+
+def legacy_decode( dtype, stream, shape ):
+    """
+    The receive loop as it was originally implemented, for comparison.
+    """
+    array = numpy.ndarray( shape, dtype=dtype, order='F' )
+    buf = numpy.getbuffer(array)
+    remaining_bytes = len(buf)
+    while remaining_bytes > 0:
+        next_chunk_bytes = min( remaining_bytes, 8192 )
+        chunk_start = len(buf)-remaining_bytes
+        chunk_stop = len(buf)-(remaining_bytes-next_chunk_bytes)
+        buf[chunk_start:chunk_stop] = stream.read( next_chunk_bytes )
+        remaining_bytes -= next_chunk_bytes
+    return array
+
+def run_benchmark( megabytes, repeats ):
+    dtype = numpy.dtype(numpy.uint8)
+    shape = (1, 1024, 1024, megabytes)
+    payload = numpy.random.randint( 0, 255, numpy.prod(shape) ).astype( dtype ).tostring()
+
+    decoders = [ ("legacy 8 KiB read() loop", lambda stream: legacy_decode( dtype, stream, shape )),
+                 ("readinto (adaptive chunks)", lambda stream: VoxelsNddataCodec( dtype ).decode_to_ndarray( stream, shape )),
+                 ("readinto (fixed 8 KiB chunks)", lambda stream: VoxelsNddataCodec( dtype, 8192 ).decode_to_ndarray( stream, shape )) ]
+
+    listen_socket = socket.socket()
+    listen_socket.bind( ("localhost", 0) )
+    listen_socket.listen(1)
+    server_thread = threading.Thread( target=serve_payload, args=(listen_socket, payload, len(decoders)*repeats) )
+    server_thread.start()
+
+    connection = httplib.HTTPConnection( "localhost", listen_socket.getsockname()[1] )
+    try:
+        for name, decode in decoders:
+            timings = []
+            for _ in range(repeats):
+                connection.request( "GET", "/" )
+                response = connection.getresponse()
+                start_time = time.time()
+                decode( response )
+                timings.append( time.time() - start_time )
+                assert response.read() == ""
+            best = min(timings)
+            print "{:32s} best of {}: {:.3f} s ({:.0f} MB/s)".format( name, repeats, best, megabytes / best )
+    finally:
+        connection.close()
+        server_thread.join()
+        listen_socket.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--megabytes", type=int, default=256, help="Size of each transfer" )
+    parser.add_argument( "--repeats", type=int, default=3, help="Number of transfers per variant" )
+    args = parser.parse_args()
+    run_benchmark( args.megabytes, args.repeats )
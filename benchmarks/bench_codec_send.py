@@ -0,0 +1,109 @@
+"""
+Benchmark the VoxelsNddataCodec send (POST) path.
+
+Compares the legacy send path (an EncodedStream that httplib reads in 8 KiB
+blocks, each one a new string copied out of the array) against the current
+path, in which the request body is a memoryview of the array that httplib
+passes straight to socket.sendall().  For reference, the time for a plain
+in-memory copy of the same data is also shown.
+
+The data is received over a loopback socket by a minimal http sink,
+so the numbers include real socket writes (but no DVID server overhead).
+
+    $ PYTHONPATH=.. python bench_codec_send.py --megabytes 512
+"""
+import time
+import socket
+import httplib
+import argparse
+import threading
+
+import numpy
+
+from pydvid.voxels import VoxelsNddataCodec
+
+def sink_requests( listen_socket, num_requests ):
+    """
+    Accept a single connection and answer num_requests POST requests on it, 
+    discarding the request bodies.
+    """
+    conn, _ = listen_socket.accept()
+    try:
+        conn_file = conn.makefile('rb', 0)
+        scratch = memoryview( bytearray(2**20) )
+        for _ in range(num_requests):
+            content_length = 0
+            while True:
+                line = conn_file.readline()
+                if line in ("\r\n", ""):
+                    break
+                if line.lower().startswith("content-length:"):
+                    content_length = int( line.split(':')[1] )
+            while content_length > 0:
+                content_length -= conn.recv_into( scratch, min(len(scratch), content_length) )
+            conn.sendall( "HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n" )
+    finally:
+        conn.close()
+
+class LegacyEncodedStream(object):
+    """
+    The EncodedStream as it was originally implemented (read() copies a slice of the buffer), for comparison.
+    """
+    def __init__(self, buf):
+        self._buffer = buf
+        self._position = 0
+    
+    def read(self, nbytes):
+        nbytes = min( len(self._buffer) - self._position, nbytes )
+        encoded_data = self._buffer[self._position:self._position+nbytes]
+        self._position += nbytes
+        return encoded_data
+
+def run_benchmark( megabytes, repeats ):
+    dtype = numpy.dtype(numpy.uint8)
+    shape = (1, 1024, 1024, megabytes)
+    data = numpy.asfortranarray( numpy.random.randint( 0, 255, shape ).astype( dtype ) )
+    codec = VoxelsNddataCodec( dtype )
+
+    bodies = [ ("legacy EncodedStream (8 KiB copies)", lambda: LegacyEncodedStream( numpy.getbuffer(data) )),
+               ("memoryview body (sendall)", lambda: codec.create_request_body( data )) ]
+
+    listen_socket = socket.socket()
+    listen_socket.bind( ("localhost", 0) )
+    listen_socket.listen(1)
+    sink_thread = threading.Thread( target=sink_requests, args=(listen_socket, len(bodies)*repeats) )
+    sink_thread.start()
+
+    connection = httplib.HTTPConnection( "localhost", listen_socket.getsockname()[1] )
+    try:
+        for name, make_body in bodies:
+            timings = []
+            for _ in range(repeats):
+                headers = { "Content-Length" : str(data.nbytes) }
+                start_time = time.time()
+                connection.request( "POST", "/", body=make_body(), headers=headers )
+                response = connection.getresponse()
+                response.read()
+                timings.append( time.time() - start_time )
+            best = min(timings)
+            print "{:38s} best of {}: {:.3f} s ({:.0f} MB/s)".format( name, repeats, best, megabytes / best )
+    finally:
+        connection.close()
+        sink_thread.join()
+        listen_socket.close()
+
+    destination = numpy.empty_like( data )
+    timings = []
+    for _ in range(repeats):
+        start_time = time.time()
+        destination[:] = data
+        timings.append( time.time() - start_time )
+    best = min(timings)
+    print "{:38s} best of {}: {:.3f} s ({:.0f} MB/s)".format( "(reference: in-memory copy)", repeats, best, megabytes / best )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--megabytes", type=int, default=256, help="Size of each transfer" )
+    parser.add_argument( "--repeats", type=int, default=3, help="Number of transfers per variant" )
+    args = parser.parse_args()
+    run_benchmark( args.megabytes, args.repeats )
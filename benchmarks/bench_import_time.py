@@ -0,0 +1,65 @@
+"""
+Benchmark the time needed to import pydvid.
+
+Each import statement is timed in a fresh interpreter (so nothing is cached in
+sys.modules), and the best of several runs is reported, along with the time
+needed to start an interpreter that imports nothing.  ``import pydvid`` alone
+should cost almost nothing: the submodules (and numpy, jsonschema, vigra, etc.)
+are imported on first use.
+
+Use --max-time to fail (exit status 1) if ``import pydvid`` takes longer than
+the given number of milliseconds, e.g. in a CI job.
+
+    $ PYTHONPATH=.. python bench_import_time.py --runs 10
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+STATEMENTS = [ "pass",
+               "import pydvid",
+               "from pydvid import keyvalue, dvid_connection",
+               "from pydvid import voxels",
+               "import pydvid.async_client" ]
+
+# Run in the child interpreter: time the statement, and count the modules it imported.
+TIMER_SCRIPT = """
+import sys, time
+num_modules = len(sys.modules)
+start = time.time()
+{}
+print time.time() - start, len(sys.modules) - num_modules
+"""
+
+def time_import( statement, runs ):
+    """
+    Return the best time (in seconds) and the number of modules imported by the given statement,
+    each run in a new interpreter.
+    """
+    best = None
+    for _ in range(runs):
+        output = subprocess.check_output( [sys.executable, "-c", TIMER_SCRIPT.format( statement )], env=os.environ )
+        elapsed, num_modules = output.split()
+        if best is None or float(elapsed) < best:
+            best = float(elapsed)
+    return best, int(num_modules)
+
+def run_benchmark( runs, max_time ):
+    results = {}
+    for statement in STATEMENTS:
+        elapsed, num_modules = time_import( statement, runs )
+        results[statement] = elapsed
+        print "{:48s} {:8.1f} ms  {:4d} modules".format( statement, 1000*elapsed, num_modules )
+
+    if max_time is not None and 1000*results["import pydvid"] > max_time:
+        print "FAILED: 'import pydvid' took longer than {} ms".format( max_time )
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--runs", type=int, default=5, help="Number of times to run each import (the best time is reported)" )
+    parser.add_argument( "--max-time", type=float, help="Fail if 'import pydvid' takes longer than this (milliseconds)" )
+    args = parser.parse_args()
+    sys.exit( run_benchmark( args.runs, args.max_time ) )
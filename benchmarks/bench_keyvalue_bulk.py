@@ -0,0 +1,94 @@
+"""
+Benchmark fetching many small keyvalue values.
+
+Compares fetching the keys one at a time with ``keyvalue.get_value()`` (as callers did before
+``get_values()`` existed) against ``keyvalue.get_values()``, which pipelines batches of requests
+over several pooled connections at once.
+
+The values are served over a loopback socket by a minimal http responder in another process.
+To mimic a remote server, the responder waits ``--latency`` seconds before each network round-trip,
+i.e. before answering the last request it has received so far.
+
+    $ PYTHONPATH=.. python bench_keyvalue_bulk.py --keys 2000 --latency 0.001
+"""
+import time
+import socket
+import select
+import argparse
+import threading
+import multiprocessing
+
+from pydvid import keyvalue
+from pydvid.dvid_connection import DvidConnection
+
+def serve_values( listen_socket, value, latency ):
+    """
+    Accept connections, and answer every request on them with the same value.
+    """
+    response = "HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {}\r\n\r\n{}"\
+               "".format( len(value), value )
+    def serve_connection( conn ):
+        try:
+            conn_file = conn.makefile('rb')
+            while True:
+                line = conn_file.readline()
+                if line == "":
+                    break
+                if line == "\r\n":
+                    # (The socket file's buffer may already hold the next request.)
+                    if not conn_file._rbuf.tell() and not select.select( [conn], [], [], 0 )[0]:
+                        time.sleep( latency )
+                    conn.sendall( response )
+        finally:
+            conn.close()
+
+    while True:
+        conn, _ = listen_socket.accept()
+        # Like most servers (including DVID), don't delay small responses (Nagle's algorithm).
+        conn.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        thread = threading.Thread( target=serve_connection, args=(conn,) )
+        thread.daemon = True
+        thread.start()
+
+def legacy_get_values( connection, uuid, data_name, keys ):
+    return [ (key, keyvalue.get_value( connection, uuid, data_name, key ), None) for key in keys ]
+
+def run_benchmark( num_keys, value_bytes, latency, max_connections ):
+    listen_socket = socket.socket()
+    listen_socket.bind( ("localhost", 0) )
+    listen_socket.listen(max_connections)
+    server_process = multiprocessing.Process( target=serve_values, args=(listen_socket, "x"*value_bytes, latency) )
+    server_process.daemon = True
+    server_process.start()
+    hostname = "localhost:{}".format( listen_socket.getsockname()[1] )
+    keys = [ "key{}".format(i) for i in range(num_keys) ]
+    print "{} keys, {} bytes each, {} ms per round-trip:".format( num_keys, value_bytes, latency*1000 )
+
+    variants = [ ("get_value() loop", legacy_get_values, 1, {}),
+                 ("get_values(), pipeline_depth=1", keyvalue.get_values, max_connections, { 'pipeline_depth' : 1 }),
+                 ("get_values()", keyvalue.get_values, max_connections, {}) ]
+    try:
+        for name, get_values, pool_size, kwargs in variants:
+            connection = DvidConnection( hostname, max_connections=pool_size, concurrency_limiter=False )
+            try:
+                start_time = time.time()
+                results = list( get_values( connection, "abc123", "my_keyvalue", keys, **kwargs ) )
+                elapsed = time.time() - start_time
+                assert len(results) == num_keys and all( error is None for _, _, error in results )
+                print "  {:32s} {:7.3f} s  ({:,.0f} keys/s, {} connections)"\
+                      "".format( name, elapsed, num_keys / elapsed, connection.stats['created'] )
+            finally:
+                connection.close()
+    finally:
+        server_process.terminate()
+        server_process.join()
+        listen_socket.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--keys", type=int, default=2000, help="Number of keys to fetch" )
+    parser.add_argument( "--value-bytes", type=int, default=100, help="Size of each value" )
+    parser.add_argument( "--latency", type=float, default=0.001, help="Simulated round-trip time (seconds)" )
+    parser.add_argument( "--max-connections", type=int, default=4, help="Connection pool size for get_values()" )
+    args = parser.parse_args()
+    run_benchmark( args.keys, args.value_bytes, args.latency, args.max_connections )
@@ -0,0 +1,129 @@
+"""
+Benchmark the client's peak memory usage when transferring one large keyvalue value.
+
+Compares ``keyvalue.get_value()`` and ``keyvalue.put_value()``, which hold the whole value in memory,
+against the streaming ``get_value_to()`` (into a file) and ``put_value_from()`` (from an iterable of chunks).
+
+The value is served (and received) over a loopback socket by a minimal http responder in another process,
+which never holds more than one chunk in memory either.  Each variant runs in its own process,
+so its peak resident set size can be measured.
+
+    $ PYTHONPATH=.. python bench_keyvalue_streaming.py --megabytes 512
+"""
+import os
+import time
+import socket
+import argparse
+import resource
+import threading
+import multiprocessing
+
+from pydvid import keyvalue
+from pydvid.dvid_connection import DvidConnection
+
+CHUNK = "x" * 2**20
+
+def serve_value( listen_socket, value_bytes ):
+    """
+    Accept connections.  Answer each GET with a value of the given size,
+    and each POST by reading (and discarding) its body, whether chunked or not.
+    """
+    def serve_connection( conn ):
+        try:
+            conn_file = conn.makefile('rb')
+            while True:
+                request_line = conn_file.readline()
+                if request_line == "":
+                    break
+                headers = {}
+                for line in iter( conn_file.readline, "\r\n" ):
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                if request_line.startswith("GET"):
+                    conn.sendall( "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n".format( value_bytes ) )
+                    remaining = value_bytes
+                    while remaining:
+                        conn.sendall( CHUNK[:remaining] )
+                        remaining -= min( remaining, len(CHUNK) )
+                else:
+                    if headers.get("transfer-encoding") == "chunked":
+                        while True:
+                            chunk_len = int( conn_file.readline(), 16 )
+                            discard( conn_file, chunk_len + 2 )
+                            if chunk_len == 0:
+                                break
+                    else:
+                        discard( conn_file, int( headers["content-length"] ) )
+                    conn.sendall( "HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n" )
+        finally:
+            conn.close()
+
+    while True:
+        conn, _ = listen_socket.accept()
+        thread = threading.Thread( target=serve_connection, args=(conn,) )
+        thread.daemon = True
+        thread.start()
+
+def discard( stream, nbytes ):
+    while nbytes:
+        nbytes -= len( stream.read( min(nbytes, 2**20) ) )
+
+def legacy_get( connection, output_path, value_bytes ):
+    with open( output_path, 'wb' ) as f:
+        f.write( keyvalue.get_value( connection, "abc123", "blobs", "blob" ) )
+
+def streaming_get( connection, output_path, value_bytes ):
+    with open( output_path, 'wb' ) as f:
+        keyvalue.get_value_to( connection, "abc123", "blobs", "blob", f )
+
+def legacy_put( connection, output_path, value_bytes ):
+    value = "".join( CHUNK[:min(len(CHUNK), value_bytes - i)] for i in xrange(0, value_bytes, len(CHUNK)) )
+    keyvalue.put_value( connection, "abc123", "blobs", "blob", value )
+
+def streaming_put( connection, output_path, value_bytes ):
+    chunks = ( CHUNK[:min(len(CHUNK), value_bytes - i)] for i in xrange(0, value_bytes, len(CHUNK)) )
+    keyvalue.put_value_from( connection, "abc123", "blobs", "blob", chunks )
+
+def run_variant( func, hostname, output_path, value_bytes, result_queue ):
+    connection = DvidConnection( hostname, concurrency_limiter=False )
+    baseline_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    start_time = time.time()
+    func( connection, output_path, value_bytes )
+    elapsed = time.time() - start_time
+    connection.close()
+    peak_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    result_queue.put( (elapsed, (peak_rss - baseline_rss) / 1024.0) )
+
+def run_benchmark( megabytes, output_path ):
+    value_bytes = megabytes * 2**20
+    listen_socket = socket.socket()
+    listen_socket.bind( ("localhost", 0) )
+    listen_socket.listen(2)
+    server_process = multiprocessing.Process( target=serve_value, args=(listen_socket, value_bytes) )
+    server_process.daemon = True
+    server_process.start()
+    hostname = "localhost:{}".format( listen_socket.getsockname()[1] )
+    print "One {} MB value:".format( megabytes )
+    try:
+        for name, func in [ ("get_value()", legacy_get), ("get_value_to()", streaming_get),
+                            ("put_value()", legacy_put), ("put_value_from()", streaming_put) ]:
+            result_queue = multiprocessing.Queue()
+            process = multiprocessing.Process( target=run_variant,
+                                               args=(func, hostname, output_path, value_bytes, result_queue) )
+            process.start()
+            elapsed, peak_growth_mb = result_queue.get()
+            process.join()
+            print "  {:18s} {:6.2f} s, peak memory growth {:8.1f} MB".format( name, elapsed, peak_growth_mb )
+    finally:
+        server_process.terminate()
+        server_process.join()
+        listen_socket.close()
+        if os.path.exists( output_path ):
+            os.remove( output_path )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--megabytes", type=int, default=512, help="Size of the value" )
+    parser.add_argument( "--output", default="/tmp/bench_keyvalue_streaming.bin", help="Where to write downloaded values" )
+    args = parser.parse_args()
+    run_benchmark( args.megabytes, args.output )
@@ -0,0 +1,86 @@
+"""
+Benchmark the recovery of many clients from a busy server.
+
+Many threads each send a single request to a simulated server, which can only
+handle a few requests at once and rejects the rest with 503 (busy).
+Compares the legacy retry behavior (sleep a fixed interval after every 503)
+against RetryPolicy (exponential backoff with full jitter), and reports the
+time until all requests have succeeded and the total number of attempts.
+
+No network traffic is involved: the "server" is just a function.
+
+    $ PYTHONPATH=.. python bench_retry_contention.py --clients 200 --capacity 10
+"""
+import time
+import httplib
+import argparse
+import threading
+
+from pydvid.errors import DvidHttpError
+from pydvid.retry import RetryPolicy
+
+class SimulatedServer(object):
+    """
+    Handles up to `capacity` requests at once, each taking `service_time` seconds.
+    Additional requests are rejected immediately.
+    """
+    def __init__(self, capacity, service_time):
+        self._slots = threading.Semaphore( capacity )
+        self._service_time = service_time
+        self._lock = threading.Lock()
+        self.attempts = 0
+
+    def request(self, connection):
+        with self._lock:
+            self.attempts += 1
+        if not self._slots.acquire( False ):
+            raise DvidHttpError( "simulated request", httplib.SERVICE_UNAVAILABLE, "busy", "", "GET", "/" )
+        try:
+            time.sleep( self._service_time )
+        finally:
+            self._slots.release()
+
+class FixedIntervalPolicy(RetryPolicy):
+    """
+    The retry behavior of the original VoxelsAccessor, for comparison.
+    """
+    def __init__(self, interval):
+        super( FixedIntervalPolicy, self ).__init__( circuit_breaker=False )
+        self.interval = interval
+
+    def compute_delay(self, attempt, retry_after=None):
+        return self.interval
+
+def run_clients( policy, num_clients, capacity, service_time ):
+    server = SimulatedServer( capacity, service_time )
+    start_event = threading.Event()
+    def client():
+        start_event.wait()
+        policy.call( server.request, None )
+    threads = [ threading.Thread( target=client ) for _ in range(num_clients) ]
+    for t in threads:
+        t.start()
+    start_time = time.time()
+    start_event.set()
+    for t in threads:
+        t.join()
+    return time.time() - start_time, server.attempts
+
+def run_benchmark( num_clients, capacity, service_time, interval ):
+    policies = [ ("fixed {:.2f} s interval".format( interval ), FixedIntervalPolicy( interval )),
+                 ("backoff + full jitter", RetryPolicy( base_delay=service_time, max_delay=interval, circuit_breaker=False )) ]
+    ideal = num_clients * service_time / capacity
+    print "{} clients, server capacity {}, {:.3f} s per request (ideal total: {:.2f} s)"\
+          "".format( num_clients, capacity, service_time, ideal )
+    for name, policy in policies:
+        elapsed, attempts = run_clients( policy, num_clients, capacity, service_time )
+        print "{:28s} all done after {:.2f} s, {} attempts".format( name, elapsed, attempts )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--clients", type=int, default=200, help="Number of concurrent clients" )
+    parser.add_argument( "--capacity", type=int, default=10, help="Number of requests the server handles at once" )
+    parser.add_argument( "--service-time", type=float, default=0.01, help="Time the server needs per request (seconds)" )
+    parser.add_argument( "--interval", type=float, default=0.25, help="Legacy retry interval, and the maximum backoff delay (seconds)" )
+    args = parser.parse_args()
+    run_benchmark( args.clients, args.capacity, args.service_time, args.interval )
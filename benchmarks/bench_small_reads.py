@@ -0,0 +1,185 @@
+"""
+Benchmark the client-side CPU overhead of tiny voxels reads (e.g. point lookups).
+
+Compares the original get_ndarray() request path (numpy bounds checks, numpy-based URI
+construction and a new codec for every call, over an httplib connection that parses
+each response one byte at a time) against the current implementation.
+
+1. Responses are served from memory by a fake connection (parsed by httplib as usual),
+   which isolates the work pydvid does per request.
+2. Responses are served over a loopback socket by a minimal http responder in another process,
+   so the CPU time includes the system calls made to receive each response.
+
+    $ PYTHONPATH=.. python bench_small_reads.py --edge 1 --edge 8 --edge 32
+"""
+import os
+import time
+import socket
+import httplib
+import argparse
+import threading
+import cStringIO
+import contextlib
+import multiprocessing
+
+import numpy
+
+from pydvid import voxels
+from pydvid.retry import auto_retry
+from pydvid.hooks import instrumented
+from pydvid.dvid_connection import DvidConnection
+from pydvid.voxels import VoxelsMetadata, VoxelsNddataCodec
+
+class CannedResponseConnection(object):
+    """
+    Answers every request with the same raw voxels payload, without any socket.
+    """
+    host = "localhost"
+    port = 8000
+
+    class _FakeSocket(object):
+        def __init__(self, response_bytes):
+            self._response_bytes = response_bytes
+        def makefile(self, *args):
+            return cStringIO.StringIO( self._response_bytes )
+
+    def __init__(self, payload):
+        self._socket = CannedResponseConnection._FakeSocket(
+            "HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {}\r\n\r\n{}"
+            "".format( len(payload), payload ) )
+
+    def request(self, method, url, body=None, headers={}):
+        self.url = url
+
+    def getresponse(self):
+        response = httplib.HTTPResponse( self._socket, method="GET" )
+        response.begin()
+        return response
+
+def serve_payload( listen_socket, payload ):
+    """
+    Accept connections, and answer every request on them with the same payload.
+    """
+    header = "HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {}\r\n\r\n"\
+             "".format( len(payload) )
+    def serve_connection( conn ):
+        try:
+            conn_file = conn.makefile('rb', 0)
+            while True:
+                line = conn_file.readline()
+                if line == "":
+                    break
+                if line == "\r\n":
+                    conn.sendall( header + payload )
+        finally:
+            conn.close()
+
+    while True:
+        conn, _ = listen_socket.accept()
+        thread = threading.Thread( target=serve_connection, args=(conn,) )
+        thread.daemon = True
+        thread.start()
+
+def legacy_validate_query_bounds( start, stop, volume_shape ):
+    start, stop, shape = map( numpy.array, (start, stop, volume_shape) )
+    assert start[0] == 0
+    assert stop[0] == shape[0]
+    assert len(start) == len(stop) == len(shape)
+    assert (start < stop).all()
+    assert (start[0] < shape[0]).all()
+    assert (stop[0] <= shape[0]).all()
+
+def legacy_format_subvolume_rest_uri( uuid, data_name, access_type, start, stop ):
+    start = numpy.asarray(start)[1:]
+    stop = numpy.asarray(stop)[1:]
+    roi_shape_str = "_".join( map(str, stop - start) )
+    start_str = "_".join( map(str, start) )
+    dims_string = "_".join( map(str, range(len(start)) ) )
+    return "/api/node/{uuid}/{data_name}/{access_type}/{dims_string}/{roi_shape_str}/{start_str}"\
+           "".format( uuid=uuid, data_name=data_name, access_type=access_type,
+                      dims_string=dims_string, roi_shape_str=roi_shape_str, start_str=start_str )
+
+@auto_retry
+@instrumented('raw')
+def legacy_get_ndarray( connection, uuid, data_name, access_type, voxels_metadata, start, stop ):
+    """
+    The request path of get_ndarray() as it was originally implemented, for comparison.
+    """
+    legacy_validate_query_bounds( start, stop, voxels_metadata.shape )
+    rest_query = legacy_format_subvolume_rest_uri( uuid, data_name, access_type, start, stop )
+    connection.request( "GET", rest_query )
+    response = connection.getresponse()
+    with contextlib.closing(response):
+        codec = VoxelsNddataCodec( voxels_metadata.dtype )
+        full_roi_shape = numpy.array(stop) - start
+        full_roi_shape[0] = voxels_metadata.shape[0]
+        decoded_data = codec.decode_to_ndarray( response, full_roi_shape )
+        assert response.read() == ""
+        return decoded_data
+
+def httplib_only( connection, uuid, data_name, access_type, voxels_metadata, start, stop ):
+    """
+    Just the http request and response parsing, without any pydvid overhead (the lower bound).
+    """
+    connection.request( "GET", "/" )
+    response = connection.getresponse()
+    response.read()
+    response.close()
+
+def time_requests( get_ndarray, connection, metadata, start, stop, num_requests ):
+    """
+    Return the CPU time of this process per request (in seconds).
+    """
+    for _ in range(100):
+        get_ndarray( connection, "abc123", "grayscale", "raw", metadata, start, stop )
+    times = os.times()
+    start_time = times[0] + times[1]
+    for _ in xrange(num_requests):
+        get_ndarray( connection, "abc123", "grayscale", "raw", metadata, start, stop )
+    times = os.times()
+    return (times[0] + times[1] - start_time) / num_requests
+
+def run_benchmark( edges, dtype, num_requests ):
+    dtype = numpy.dtype(dtype)
+    metadata = VoxelsMetadata.create_default_metadata( (1, 10000, 10000, 10000), dtype, "cxyz", 1.0, "" )
+    for edge in edges:
+        start = (0, 5000, 6000, 7000)
+        stop = (1, 5000+edge, 6000+edge, 7000+edge)
+        payload = numpy.zeros( (1, edge, edge, edge), dtype=dtype ).tostring()
+        print "{}^3 voxels ({} bytes), client CPU time per request:".format( edge, len(payload) )
+
+        connection = CannedResponseConnection( payload )
+        floor = time_requests( httplib_only, connection, metadata, start, stop, num_requests )
+        legacy = time_requests( legacy_get_ndarray, connection, metadata, start, stop, num_requests )
+        current = time_requests( voxels.get_ndarray, connection, metadata, start, stop, num_requests )
+        print "  in-memory responses:  original {:6.1f} us, current {:6.1f} us  (pydvid overhead: {:.1f} us -> {:.1f} us)"\
+              "".format( legacy*1e6, current*1e6, (legacy - floor)*1e6, (current - floor)*1e6 )
+
+        listen_socket = socket.socket()
+        listen_socket.bind( ("localhost", 0) )
+        listen_socket.listen(2)
+        server_process = multiprocessing.Process( target=serve_payload, args=(listen_socket, payload) )
+        server_process.daemon = True
+        server_process.start()
+        port = listen_socket.getsockname()[1]
+        legacy_connection = httplib.HTTPConnection( "localhost", port )
+        dvid_connection = DvidConnection( "localhost:{}".format( port ), max_connections=1, concurrency_limiter=False )
+        try:
+            legacy = time_requests( legacy_get_ndarray, legacy_connection, metadata, start, stop, num_requests )
+            current = time_requests( voxels.get_ndarray, dvid_connection, metadata, start, stop, num_requests )
+            print "  loopback socket:      original {:6.1f} us, current {:6.1f} us  ({:.0f}% less)"\
+                  "".format( legacy*1e6, current*1e6, 100*(1 - current/legacy) )
+        finally:
+            legacy_connection.close()
+            dvid_connection.close()
+            server_process.terminate()
+            server_process.join()
+            listen_socket.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description=__doc__.split('\n\n')[0] )
+    parser.add_argument( "--edge", type=int, action="append", help="Edge length of the requested cube (repeatable)" )
+    parser.add_argument( "--dtype", default="uint64", help="Voxel dtype" )
+    parser.add_argument( "--requests", type=int, default=20000, help="Number of requests per variant" )
+    args = parser.parse_args()
+    run_benchmark( args.edge or [1, 8, 32], args.dtype, args.requests )
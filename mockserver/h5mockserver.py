@@ -25,6 +25,8 @@ Internally, your hdf5 file must be a hierarchy, with symlinks for easy access to
     /abc123 -> /datasets/dataset_name1/nodes/abc123
     /def456 -> /datasets/dataset_name1/nodes/def456
 
+Each node group may have a boolean 'locked' attribute (set via POST /api/node/<uuid>/commit).
+
 Furthermore, each hdf5 volume must:
 - include a channel axis, which must be the first axis
 - have a "metadata" attribute, which is stored as json according to the dvid metadata schema
@@ -37,13 +39,22 @@ Obviously, the aim here is not to implement the full DVID API.
 - The <format> parameter is not supported.
   Data is always returned as binary volume buffer data.
   REST queries including the format parameter will result in error 400 (bad syntax)
+- Compressed transfers are selected via the 'compression' query arg (e.g. ?compression=gzip),
+  using the codecs registered in pydvid.voxels.voxels_nddata_codec.
+  Compressed POST bodies are recognized by their Content-Type.
 """
 import re
+import sys
 import json
+import time
+import socket
+import struct
 import httplib
+import urlparse
 import collections
 import threading
 import multiprocessing
+from SocketServer import ThreadingMixIn
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 
 import numpy
@@ -51,12 +62,32 @@ import h5py
 
 from pydvid.voxels import VoxelsMetadata
 from pydvid.voxels import VoxelsNddataCodec
+from pydvid.voxels.voxels_nddata_codec import get_codec_class, get_codec_class_for_mimetype
+
+class _LimitedReader(object):
+    """
+    Wraps the request body stream so that it ends after Content-Length bytes.
+    (Otherwise, reading to the end of the body -- as the compressed codecs do -- would hang.)
+    """
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, nbytes=-1):
+        if nbytes < 0 or nbytes > self._remaining:
+            nbytes = self._remaining
+        data = self._stream.read( nbytes )
+        self._remaining -= len(data)
+        return data
 
 class H5CutoutRequestHandler(BaseHTTPRequestHandler):
     """
     The request handler for the H5MockServer.
     Implements a subset of the DVID REST API for nd-data over http.
     """
+    # Support keep-alive connections, like the real DVID server.
+    # (Every response must therefore include a Content-length header.)
+    protocol_version = "HTTP/1.1"
 
     class RequestError( Exception ):
         def __init__(self, status_code, message):
@@ -75,7 +106,11 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         Call `_execute_request` and handle any exceptions.
         """
         try:
-            self._execute_request(method)
+            self._simulate_slow_server()
+
+            # Connections are handled in parallel, but the hdf5 file isn't thread-safe.
+            with self.server.request_lock:
+                self._execute_request(method)
         except H5CutoutRequestHandler.RequestError as ex:
             self.send_error( ex.status_code, ex.message )
         except Exception as ex:
@@ -120,6 +155,7 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
                                               ("^/api/repos/info$",                                           { "GET"  : self._do_get_repos_info }),
                                               ("^/api/node/{uuid}/{dataname}/metadata",                       { "GET"  : self._do_get_volume_schema }),
                                               ("^/api/repo/{uuid}/instance$",                                 { "POST" : self._do_create_new_instance }),
+                                              ("^/api/node/{uuid}/commit$",                                   { "POST" : self._do_commit_node }),
                                               
                                               # For now, we ignore format and throttle params
                                               ("^/api/node/{uuid}/{dataname}/raw/{dims}/{shape}/{offset}.*",  { "GET"  : self._do_get_data,
@@ -141,6 +177,8 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
                                              "Unsupported method for query: {} {}"
                                              "".format( method, self.path ) )
                 else:
+                    if self._simulate_busy_server():
+                        return
                     # Execute the command, passing in the matched parameters
                     handler( **match.groupdict() )
                     return
@@ -148,6 +186,48 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         # We couldn't find a command for the user's query.
         raise self.RequestError( httplib.BAD_REQUEST, "Bad query syntax: {}".format( self.path ) )
 
+    def _simulate_slow_server(self):
+        """
+        Useful for testing the client's response to slow requests:
+        While the server's slow_count is nonzero, wait slow_delay seconds before handling the request.
+        (Other requests are handled in the meantime.)
+        """
+        with self.server.request_lock:
+            slow = self.server.slow_count > 0
+            if slow:
+                self.server.slow_count -= 1
+        if slow:
+            time.sleep( self.server.slow_delay )
+
+    def _simulate_busy_server(self):
+        """
+        Useful for testing the client's retry behavior:
+        While the server's reset_count is nonzero, drop the connection without responding.
+        Then, while its busy_count is nonzero, respond with 503 (with a Retry-After header, if busy_retry_after is set).
+        Returns True if the request was rejected.
+        """
+        if self.server.reset_count:
+            self.server.reset_count -= 1
+            # Abort the connection (with a TCP reset) when the handler finishes.
+            self.connection.setsockopt( socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0) )
+            self.close_connection = 1
+            return True
+        if self.server.busy_count:
+            self.server.busy_count -= 1
+            message = "I'm busy. Try again later."
+            self.send_response( httplib.SERVICE_UNAVAILABLE, message )
+            if self.server.busy_retry_after is not None:
+                self.send_header( "Retry-After", str(self.server.busy_retry_after) )
+            self.send_header( "Content-type", "text/plain" )
+            self.send_header( "Content-length", str(len(message)) )
+            # The request body (if any) is not read, so this connection can't be used again.
+            self.send_header( "Connection", "close" )
+            self.end_headers()
+            self.wfile.write( message )
+            self.close_connection = 1
+            return True
+        return False
+
     def _do_get_server_info(self):
         server_info = {
           "Cores": "1",
@@ -196,6 +276,22 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         self.wfile.write( json_text )
 
 
+    def _do_commit_node(self, uuid):
+        """
+        Lock the given node.  (The commit message in the body is ignored.)
+        """
+        if uuid not in self.server.h5_file["all_nodes"]:
+            raise self.RequestError( httplib.NOT_FOUND, "No such node with uuid {}".format( uuid ) )
+        body_len = self.headers.get("Content-Length")
+        if body_len:
+            self.rfile.read( int(body_len) )
+        self.server.h5_file["all_nodes"][uuid].attrs['locked'] = True
+        self.server.h5_file.flush()
+
+        self.send_response(httplib.OK)
+        self.send_header("Content-length", "0" )
+        self.end_headers()
+
     def _do_create_new_instance(self, uuid):
         """
         The http client wants to create a new volume.
@@ -294,7 +390,8 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         shape = (channels,) + (0,)*num_axes
         maxshape = (None,)*len(shape) # No maxsize
         dtype = numpy.dtype(dtypename)
-        self.server.h5_file.create_dataset( volume_path, shape=shape, dtype=dtype, maxshape=maxshape )
+        h5volume = self.server.h5_file.create_dataset( volume_path, shape=shape, dtype=dtype, maxshape=maxshape )
+        h5volume.attrs['typename'] = typename
         linkname = '/datasets/{dataset_name}/nodes/{uuid}/{dataname}'.format( **locals() )
         self.server.h5_file[linkname] = h5py.SoftLink( volume_path )
         self.server.h5_file.flush()
@@ -321,10 +418,6 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         
         All parameters are strings from the REST string.
         """
-        if self.server.busy_count:
-            self.server.busy_count -= 1
-            raise self.RequestError( httplib.SERVICE_UNAVAILABLE, "I'm busy. Try again later." )
-        
         dataset = self._get_h5_dataset(uuid, dataname)
         roi_start, roi_stop = self._determine_request_roi( dataset, dims, shape, offset )
 
@@ -344,15 +437,25 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
             slicing = (slice(None),) + tuple( slice(x,y) for x,y in zip(roi_start, roi_stop) )
             data = dataset[slicing]
         
-        codec = VoxelsNddataCodec( dataset.dtype )
-        buffer_len = codec.calculate_buffer_len( data.shape )
+        query_args = urlparse.parse_qs( urlparse.urlparse( self.path ).query )
+        compression = query_args.get( 'compression', [None] )[0]
+        try:
+            codec = get_codec_class( compression )( dataset.dtype )
+        except (ValueError, ImportError) as ex:
+            raise self.RequestError( httplib.BAD_REQUEST, str(ex) )
 
         self.send_response(httplib.OK)
-        self.send_header("Content-type", VoxelsNddataCodec.VOLUME_MIMETYPE)
-        self.send_header("Content-length", str(buffer_len) )
-        self.end_headers()
-
-        codec.encode_from_ndarray( self.wfile, data )
+        self.send_header("Content-type", codec.VOLUME_MIMETYPE)
+        if compression is None:
+            self.send_header("Content-length", str( codec.calculate_buffer_len( data.shape ) ) )
+            self.end_headers()
+            codec.encode_from_ndarray( self.wfile, data )
+        else:
+            # The compressed size isn't known in advance, so compress the whole thing first.
+            body = codec.create_request_body( data )
+            self.send_header("Content-length", str( len(body) ) )
+            self.end_headers()
+            self.wfile.write( body )
 
     def _do_get_roi_mask(self, uuid, dataname, dims, shape, offset):
         # Just re-use the regular get_data function.
@@ -393,8 +496,10 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         dataset.attrs['dvid_metadata'] = voxels_metadata.to_json()
 
         # Must read the entire message body, even if it isn't used below.
-        codec = VoxelsNddataCodec( dataset.dtype )
-        data = codec.decode_to_ndarray(self.rfile, full_roi_shape)
+        codec_class = get_codec_class_for_mimetype( self.headers.get("Content-Type"), default=VoxelsNddataCodec )
+        codec = codec_class( dataset.dtype )
+        body_len = int( self.headers.get("Content-Length") )
+        data = codec.decode_to_ndarray( _LimitedReader( self.rfile, body_len ), full_roi_shape )
     
         if (numpy.array(roi_start) < 0).any():        
             # We don't support negative coordinates in this mock server.
@@ -411,6 +516,29 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         self.end_headers()
     
 
+    def _read_request_body(self):
+        """
+        Read the whole request body, which is either sent with a Content-Length,
+        or with chunked transfer encoding.
+        """
+        # Must read exact bytes.
+        # Apparently rfile.read() just hangs.
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            body_len = self.headers.get("Content-Length")
+            return self.rfile.read( int(body_len) )
+
+        chunks = []
+        while True:
+            chunk_len = int( self.rfile.readline().split(";")[0], 16 )
+            if chunk_len == 0:
+                break
+            chunks.append( self.rfile.read( chunk_len ) )
+            self.rfile.readline() # CRLF after each chunk
+        # Skip the trailers (if any), up to the final blank line.
+        while self.rfile.readline() not in ("\r\n", "\n", ""):
+            pass
+        return "".join( chunks )
+
     def _do_get_keyvalue(self, uuid, dataname, key):
         """
         Retrieve the value for the given key from the node/data given by 
@@ -437,6 +565,8 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
             raise self.RequestError( httplib.NOT_FOUND, "Data '{}' has no value for key '{}'".format( dataname, key ) )
 
         binary_data = keyvalue_group[key][()]
+        if isinstance( binary_data, numpy.ndarray ):
+            binary_data = binary_data.tostring()
 
         self.send_response(httplib.OK)
         self.send_header("Content-type", "application/octet")
@@ -470,11 +600,9 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         if key in keyvalue_group:
             del keyvalue_group[key]
 
-        # Must read exact bytes.
-        # Apparently rfile.read() just hangs.
-        body_len = self.headers.get("Content-Length")
-        binary_data = self.rfile.read( int(body_len) )
-        keyvalue_group.create_dataset(key, data=binary_data) 
+        # Stored as bytes (uint8), since h5py strings can't hold arbitrary binary data (e.g. NULs).
+        binary_data = self._read_request_body()
+        keyvalue_group.create_dataset(key, data=numpy.frombuffer(binary_data, dtype=numpy.uint8)) 
 
         #self.send_response(httplib.NO_CONTENT) # "No Content" (accepted)
         self.send_response(httplib.OK)
@@ -555,7 +683,7 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
                 # Don't bother with most node info fields
                 dset_info["DAG"]["Nodes"][uuid] = { "UUID" : uuid,
                                                     "VersionID" : 0,
-                                                     "Locked" : False,
+                                                     "Locked" : bool( dataset_group["nodes"][uuid].attrs.get('locked', False) ),
                                                      "Created" : "1999-12-12",
                                                      "Updated" : "2000-01-01",
                                                      "Note" : "",
@@ -580,10 +708,25 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
                 datamap[data_name] = {}
                 datamap[data_name]["Base"] = {}
                 datamap[data_name]["Base"]["Name"] = data_name
+                datamap[data_name]["Base"]["TypeName"] = self._get_typename( h5volume )
                 datamap[data_name]["Base"]["RepoUUID"] = dataset_uuid
                 # TODO: Other fields...
         return info
 
+    def _get_typename(self, h5volume):
+        """
+        Return the DVID type name of the given data instance (an hdf5 group for keyvalue data, or a dataset for voxels).
+        """
+        if isinstance( h5volume, h5py.Group ):
+            return 'keyvalue'
+        if 'typename' in h5volume.attrs:
+            return h5volume.attrs['typename']
+        try:
+            return VoxelsMetadata.create_from_h5_dataset( h5volume ).determine_dvid_typename()
+        except Exception:
+            # DVID has no type for this pixel type and channel count.
+            return 'voxels'
+
     def log_request(self, *args, **kwargs):
         """
         Override from BaseHTTPRequestHandler, so we can respect the H5MockServer's disable_logging setting.
@@ -591,7 +734,11 @@ class H5CutoutRequestHandler(BaseHTTPRequestHandler):
         if not self.server.disable_logging:
             BaseHTTPRequestHandler.log_request(self, *args, **kwargs )
     
-class H5MockServer(HTTPServer):
+class H5MockServer(ThreadingMixIn, HTTPServer):
+    # Each (keep-alive) connection is handled in its own thread.
+    # Idle connections shouldn't prevent the process from exiting.
+    daemon_threads = True
+
     def __init__(self, h5filepath, disable_logging, *args, **kwargs):
         """
         h5filepath: The hdf5 file to serve data from.
@@ -601,10 +748,26 @@ class H5MockServer(HTTPServer):
         self.h5filepath = h5filepath
         self.disable_logging = disable_logging
         self.shutdown_completed_event = threading.Event()
+        self.request_lock = threading.Lock()
         
-        # Useful for testing 503 error handling behavior
+        # Useful for testing 503 error handling behavior (see H5CutoutRequestHandler._simulate_busy_server)
         self.busy_count = 0
+        self.busy_retry_after = None
+        self.reset_count = 0
+
+        # Useful for testing slow responses (see H5CutoutRequestHandler._simulate_slow_server)
+        self.slow_count = 0
+        self.slow_delay = 1.0
     
+    def handle_error(self, request, client_address):
+        """
+        Override from SocketServer.  Clients may close keep-alive connections at any time,
+        so don't print a traceback when that happens.
+        """
+        if isinstance( sys.exc_info()[1], socket.error ):
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
     def serve_forever(self):
         try:
             with h5py.File( self.h5filepath ) as h5_file:
@@ -722,11 +885,12 @@ class H5MockServerDataFile(object):
 
         self._f.flush()
     
-    def add_node(self, dataset_name, node_uuid):
+    def add_node(self, dataset_name, node_uuid, locked=False):
         volumes_group, nodes_group = self._get_dataset_groups(dataset_name)
 
         # Create the node
         node = nodes_group.create_group( node_uuid )
+        node.attrs['locked'] = locked
         
         # Add the node to the global list, too
         self._f['/all_nodes'][node_uuid] = h5py.SoftLink( nodes_group.name + '/' + node_uuid )
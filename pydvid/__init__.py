@@ -1,27 +1,38 @@
 __version__="0.1"
 
-#
-# Monkey-patch HTTPConnection to allow logging of all requests
-#
-import logging
-import httplib
-orig_request = httplib.HTTPConnection.request
-http_connection_logger = logging.getLogger("httplib.HTTPConnection")
-def logged_request(conn, method, url, *args, **kwargs):
-    log_str = "{method} {host}:{port}{url}"\
-              .format( method=method, host=conn.host, port=conn.port, url=url )
-    http_connection_logger.debug( log_str )
-    return orig_request(conn, method, url, *args, **kwargs)    
-httplib.HTTPConnection.request = logged_request
-
-import errors
-import util
-import general
-import voxels
-import keyvalue
-import labelgraph
-import dvid_connection
-
-# Note that we DO NOT automatically import gui here, 
+# The submodules are imported on first use (e.g. ``pydvid.voxels``, or ``from pydvid import voxels``),
+#  so ``import pydvid`` stays fast: it doesn't import numpy, jsonschema or any optional dependency.
+# Note that gui is NOT included in ``from pydvid import *``,
 #  since PyQt4 is an optional dependency
-# import gui
+
+import sys
+import types
+import importlib
+
+_SUBMODULES = ( 'errors', 'util', 'retry', 'hooks', 'metrics', 'general', 'voxels', 'keyvalue', 'labelgraph',
+                'dvid_connection', 'replicated_connection', 'async_client', 'rate_limiter', 'concurrency_limiter',
+                'hedging', 'node_cache', 'gui' )
+
+__all__ = [ name for name in _SUBMODULES if name != 'gui' ]
+
+class _LazyPackage(types.ModuleType):
+    """
+    Replaces this package's module object in ``sys.modules``,
+    so that its submodules can be imported when they are first accessed as attributes.
+    """
+    def __getattr__(self, name):
+        if name not in _SUBMODULES:
+            raise AttributeError( "'module' object has no attribute '{}'".format( name ) )
+        # Importing the submodule also stores it as an attribute of this package.
+        return importlib.import_module( __name__ + '.' + name )
+
+    def __dir__(self):
+        return sorted( set( self.__dict__.keys() + list(_SUBMODULES) ) )
+
+_package = _LazyPackage( __name__, __doc__ )
+_package.__dict__.update( sys.modules[__name__].__dict__ )
+
+# In python 2, a module's globals are cleared when the module object is deleted,
+#  so the original must be kept alive for the functions defined above.
+_package._original_module = sys.modules[__name__]
+sys.modules[__name__] = _package
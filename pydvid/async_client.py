@@ -0,0 +1,680 @@
+"""
+Non-blocking client for the DVID REST API.
+
+An ``AsyncDvidClient`` sends many requests concurrently over a bounded number of
+non-blocking keep-alive HTTP/1.1 connections, all driven by a single event loop
+(``select.poll()`` where available, ``select.select()`` otherwise) in the calling thread.
+No threads are used, so thousands of small requests (e.g. block fetches) can be in flight at once.
+
+Each request method returns an ``AsyncResult`` immediately.  The requests make progress
+whenever the event loop runs, i.e. during ``AsyncResult.result()`` or ``AsyncDvidClient.wait()``.
+
+Example:
+
+.. code-block:: python
+
+    client = AsyncDvidClient( "localhost:8000", max_concurrency=100 )
+    results = [ client.get_ndarray( uuid, "grayscale", voxels_metadata, start, stop ) for (start, stop) in blocks ]
+    client.wait( results )
+    arrays = [ r.result() for r in results ]
+
+Voxels data is received directly into the output array (which may be preallocated by the caller).
+
+.. note:: Python 2 has no asyncio, so this module implements its own minimal event loop.
+          Only ``Content-Length``, chunked, and close-delimited response bodies are supported.
+"""
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import httplib
+import collections
+
+import numpy
+
+from pydvid.errors import DvidHttpError, UnexpectedResponseError
+from pydvid.voxels.voxels import _format_subvolume_rest_uri, _validate_query_bounds
+from pydvid.voxels.voxels_nddata_codec import VoxelsNddataCodec
+
+class AsyncResult(object):
+    """
+    The eventual result of a request sent via ``AsyncDvidClient``.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._done = False
+        self._value = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        """
+        Return the result of the request, running the client's event loop until it is available.
+        If the request failed, its exception is raised here.
+        """
+        if not self._done:
+            self._client.wait( [self], timeout )
+            if not self._done:
+                raise socket.timeout( "Request did not complete within {} seconds".format( timeout ) )
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+    def exception(self):
+        """
+        Return the exception raised by the request (or None).  The request must be done.
+        """
+        assert self._done, "Request isn't done yet."
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(self) when the request completes (or immediately, if it is already done).
+        Callbacks are called from within the client's event loop.
+        """
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append( callback )
+
+    def _set_result(self, value):
+        self._value = value
+        self._finish()
+
+    def _set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+class AsyncDvidClient(object):
+    """
+    Non-blocking counterpart to the ``general``, ``keyvalue`` and ``voxels`` module functions.
+    At most ``max_concurrency`` requests are in flight at once (one per connection).
+    Additional requests are queued until a connection becomes available.
+    """
+    def __init__(self, hostname, max_concurrency=64, timeout=None):
+        """
+        :param hostname: The DVID server hostname, e.g. 'emdata1' or 'localhost:8000'
+        :param max_concurrency: Maximum number of simultaneous connections (and thus, requests in flight).
+        :param timeout: If a request makes no progress for this many seconds, it fails with ``socket.timeout``.
+        """
+        assert max_concurrency >= 1
+        self.hostname = hostname
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        # Parse the host and port the same way HTTPConnection does.  (This doesn't connect.)
+        prototype = httplib.HTTPConnection( hostname )
+        self.host = prototype.host
+        self.port = prototype.port
+
+        self._pending_requests = collections.deque()
+        self._idle_connections = []
+        self._active_connections = {} # fileno -> _AsyncConnection
+        self._poller = _SocketPoller()
+        self._num_connections = 0
+
+    def get_repos_info(self):
+        """
+        Non-blocking version of ``general.get_repos_info()``.
+        """
+        return self._get_json( "/api/repos/info" )
+
+    def get_server_info(self):
+        """
+        Non-blocking version of ``general.get_server_info()``.
+        """
+        return self._get_json( "/api/server/info" )
+
+    def get_value(self, uuid, data_name, key):
+        """
+        Non-blocking version of ``keyvalue.get_value()``.  The result is a str.
+        """
+        rest_query = "/api/node/{uuid}/{data_name}/{key}".format( **locals() )
+        return self._submit( "keyvalue request", "GET", rest_query, None, {}, _StringSink,
+                             lambda sink: sink.getvalue() )
+
+    def put_value(self, uuid, data_name, key, value):
+        """
+        Non-blocking version of ``keyvalue.put_value()``.
+        value must be a str (or another buffer).  The result is None.
+        """
+        rest_query = "/api/node/{uuid}/{data_name}/{key}".format( **locals() )
+        headers = { "Content-Type" : "application/octet-stream" }
+        return self._submit( "keyvalue post", "POST", rest_query, value, headers, _StringSink,
+                             lambda sink: None )
+
+    def get_ndarray(self, uuid, data_name, voxels_metadata, start, stop, out=None, query_args=None, throttle=False, access_type="raw"):
+        """
+        Non-blocking version of ``voxels.get_ndarray()``.
+
+        :param out: If provided, the data is received directly into this array, which is also the result.
+                    It must be F_CONTIGUOUS, with the volume's dtype and shape ``stop - start`` (including all channels).
+                    Otherwise, a new array is allocated.
+        """
+        _validate_query_bounds( start, stop, voxels_metadata.shape )
+        full_roi_shape = numpy.array(stop) - start
+        full_roi_shape[0] = voxels_metadata.shape[0]
+        full_roi_shape = tuple(full_roi_shape)
+        if out is None:
+            out = numpy.ndarray( full_roi_shape, dtype=voxels_metadata.dtype, order='F' )
+        else:
+            assert out.shape == full_roi_shape, "Output array has wrong shape: {} (expected {})".format( out.shape, full_roi_shape )
+            assert out.dtype == voxels_metadata.dtype, "Output array has wrong dtype: {}".format( out.dtype )
+            assert out.flags['F_CONTIGUOUS'], "Output array must be F_CONTIGUOUS"
+        rest_query = _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, "", query_args, throttle )
+        byte_view = VoxelsNddataCodec._get_byte_view( out )
+        return self._submit( "subvolume query", "GET", rest_query, None, {},
+                             lambda: _BufferSink( byte_view ), lambda sink: out )
+
+    def post_ndarray(self, uuid, data_name, voxels_metadata, start, stop, new_data, throttle=False, access_type="raw"):
+        """
+        Non-blocking version of ``voxels.post_ndarray()``.  The result is None.
+        (new_data must not be modified until the request is complete.)
+        """
+        _validate_query_bounds( start, stop, voxels_metadata.shape, allow_overflow_extents=True )
+        codec = VoxelsNddataCodec( voxels_metadata.dtype )
+        body = codec.create_request_body( new_data )
+        if not isinstance( body, memoryview ):
+            # (Not F_CONTIGUOUS.)
+            body = memoryview( numpy.asfortranarray( new_data ).reshape( (-1,), order='F' ).view( numpy.uint8 ) )
+        rest_query = _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, "", None, throttle )
+        headers = { "Content-Type" : VoxelsNddataCodec.VOLUME_MIMETYPE }
+        return self._submit( "subvolume post", "POST", rest_query, body, headers, _StringSink,
+                             lambda sink: None )
+
+    def wait(self, results=None, timeout=None):
+        """
+        Run the event loop until all of the given results are done (or all pending requests, if results is None),
+        or until the timeout expires.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        if results is None:
+            is_finished = lambda: not self._pending_requests and not self._active_connections
+        else:
+            results = list(results)
+            is_finished = lambda: all( r.done() for r in results )
+
+        while not is_finished() and self._active_connections:
+            poll_timeout = None
+            if deadline is not None:
+                poll_timeout = max( 0.0, deadline - time.time() )
+                if poll_timeout == 0.0:
+                    return
+            self._run_once( poll_timeout )
+
+    def close(self):
+        """
+        Close all idle connections.  (Requests that are still in progress are unaffected.)
+        """
+        for connection in self._idle_connections:
+            connection.close()
+        self._num_connections -= len(self._idle_connections)
+        self._idle_connections = []
+
+    def _get_json(self, rest_query):
+        return self._submit( "requesting json for: {}".format( rest_query ), "GET", rest_query, None, {}, _StringSink,
+                             lambda sink: json.loads( sink.getvalue() ) )
+
+    def _submit(self, action_name, method, rest_query, body, headers, create_sink, get_result):
+        """
+        Queue a request, and start sending it if a connection is available.
+
+        :param create_sink: Called to create the object that receives the response body (if the status is OK).
+        :param get_result: Called with the sink when the response is complete.  Returns the request result.
+        """
+        result = AsyncResult( self )
+        request = _Request( action_name, method, rest_query, body, headers, create_sink, get_result, result )
+        self._pending_requests.append( request )
+        self._start_pending_requests()
+        return result
+
+    def _start_pending_requests(self):
+        while self._pending_requests:
+            if self._idle_connections:
+                connection = self._idle_connections.pop()
+            elif self._num_connections < self.max_concurrency:
+                connection = _AsyncConnection( self.host, self.port )
+                self._num_connections += 1
+            else:
+                return
+            request = self._pending_requests.popleft()
+            self._start_request( connection, request )
+
+    def _start_request(self, connection, request):
+        try:
+            connection.start( request )
+        except Exception:
+            self._fail_request( connection, request, sys.exc_info() )
+        else:
+            self._active_connections[ connection.fileno() ] = connection
+            self._poller.register( connection.fileno(), connection.wants_write() )
+
+    def _run_once(self, timeout):
+        """
+        Wait for socket events (at most until the timeout expires), and handle them.
+        """
+        if self.timeout is not None:
+            timeout = self.timeout if timeout is None else min( timeout, self.timeout )
+        for fileno, readable, writable in self._poller.poll( timeout ):
+            connection = self._active_connections.get( fileno )
+            if connection is None:
+                # Already failed (or completed) during this iteration.
+                continue
+            try:
+                if writable:
+                    connection.handle_writable()
+                    self._poller.modify( fileno, connection.wants_write() )
+                if readable:
+                    connection.handle_readable()
+            except Exception:
+                self._fail_request( connection, connection.request, sys.exc_info() )
+                continue
+            if connection.request.response_complete:
+                self._complete_request( connection )
+
+        if self.timeout is not None:
+            expiration_time = time.time() - self.timeout
+            for connection in self._active_connections.values():
+                if connection.last_activity_time < expiration_time:
+                    try:
+                        raise socket.timeout( "No response to {} {} within {} seconds"
+                                              .format( connection.request.method, connection.request.rest_query, self.timeout ) )
+                    except socket.timeout:
+                        self._fail_request( connection, connection.request, sys.exc_info() )
+
+    def _complete_request(self, connection):
+        request = connection.request
+        del self._active_connections[ connection.fileno() ]
+        self._poller.unregister( connection.fileno() )
+        connection.request = None
+        if connection.is_reusable():
+            self._idle_connections.append( connection )
+        else:
+            connection.close()
+            self._num_connections -= 1
+        self._start_pending_requests()
+        request.finish()
+
+    def _fail_request(self, connection, request, exc_info):
+        self._active_connections.pop( connection.fileno(), None )
+        self._poller.unregister( connection.fileno() )
+        connection.close()
+        self._num_connections -= 1
+        if connection.was_reused and not request.response_started and request.attempts == 1 \
+           and isinstance( exc_info[1], (socket.error, httplib.BadStatusLine) ):
+            # The server probably closed this idle keep-alive connection before it received the request.
+            # Try again (first in line).
+            self._pending_requests.appendleft( request )
+        else:
+            request.result._set_exception( exc_info )
+        self._start_pending_requests()
+
+class _Request(object):
+    """
+    A single request, and the state of its response.
+    """
+    def __init__(self, action_name, method, rest_query, body, headers, create_sink, get_result, result):
+        self.action_name = action_name
+        self.method = method
+        self.rest_query = rest_query
+        self.body = body
+        self.headers = headers
+        self.create_sink = create_sink
+        self.get_result = get_result
+        self.result = result
+        self.attempts = 0
+        self.reset()
+
+    def reset(self):
+        self.response_started = False
+        self.response_complete = False
+        self.status = None
+        self.reason = None
+        self.response_headers = {}
+        self.sink = None
+
+    def finish(self):
+        """
+        Called when the response is complete.  Set the result (or exception).
+        """
+        try:
+            if self.status != httplib.OK:
+                raise DvidHttpError( self.action_name, self.status, self.reason, self.sink.getvalue(),
+                                     self.method, self.rest_query,
+                                     "<binary data>" if self.body is not None else "", self.headers,
+                                     self.response_headers.items() )
+            self.sink.check_complete()
+            value = self.get_result( self.sink )
+        except Exception:
+            self.result._set_exception( sys.exc_info() )
+        else:
+            self.result._set_result( value )
+
+class _StringSink(object):
+    """
+    Accumulates a response body in memory.
+    """
+    def __init__(self):
+        self._pieces = []
+
+    def feed(self, data):
+        self._pieces.append( data )
+
+    def receive(self, sock, max_bytes):
+        data = sock.recv( min( max_bytes, _AsyncConnection.RECV_SIZE ) )
+        if data:
+            self._pieces.append( data )
+        return len(data)
+
+    def check_complete(self):
+        pass
+
+    def getvalue(self):
+        return "".join( self._pieces )
+
+class _BufferSink(object):
+    """
+    Receives a response body directly into a preallocated buffer (a writable memoryview of bytes).
+    """
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def feed(self, data):
+        self._check_space( len(data) )
+        self._view[self._position:self._position+len(data)] = data
+        self._position += len(data)
+
+    def receive(self, sock, max_bytes):
+        self._check_space( 1 )
+        nbytes = min( max_bytes, len(self._view) - self._position )
+        received_bytes = sock.recv_into( self._view[self._position:self._position+nbytes], nbytes )
+        self._position += received_bytes
+        return received_bytes
+
+    def check_complete(self):
+        if self._position != len(self._view):
+            raise UnexpectedResponseError( "Response body was shorter than expected: received {} of {} bytes."
+                                           "".format( self._position, len(self._view) ) )
+
+    def _check_space(self, nbytes):
+        if self._position + nbytes > len(self._view):
+            raise UnexpectedResponseError( "Response body was longer than expected ({} bytes).".format( len(self._view) ) )
+
+class _AsyncConnection(object):
+    """
+    A non-blocking HTTP/1.1 connection, which sends one request at a time.
+    The response is parsed incrementally, as data arrives.
+    """
+    RECV_SIZE = 2**16
+    MAX_HEADER_SIZE = 2**16
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.request = None
+        self.was_reused = False
+        self.last_activity_time = time.time()
+        self._sock = None
+        self._fileno = None
+        self._num_requests = 0
+        self._keep_alive = False
+
+    def fileno(self):
+        # (Still valid after close(), so the connection can be found in the client's active connection dict.)
+        return self._fileno
+
+    def start(self, request):
+        """
+        Begin sending the given request.
+        """
+        if self._sock is None:
+            self._sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+            self._sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+            self._sock.setblocking( False )
+            self._fileno = self._sock.fileno()
+            self._num_requests = 0
+            err = self._sock.connect_ex( (self.host, self.port) )
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                raise socket.error( err, errno.errorcode.get(err, "connect failed") )
+        self.was_reused = self._num_requests > 0
+        self._num_requests += 1
+        request.attempts += 1
+        request.reset()
+        self.request = request
+        self.last_activity_time = time.time()
+
+        header_lines = [ "{} {} HTTP/1.1".format( request.method, request.rest_query ),
+                         "Host: {}:{}".format( self.host, self.port ) ]
+        for name, value in request.headers.items():
+            header_lines.append( "{}: {}".format( name, value ) )
+        body = request.body
+        if body is not None or request.method in ("POST", "PUT"):
+            body = memoryview( body if body is not None else "" )
+            header_lines.append( "Content-Length: {}".format( len(body) ) )
+        self._outgoing = collections.deque( [ memoryview( "\r\n".join( header_lines ) + "\r\n\r\n" ) ] )
+        if body:
+            self._outgoing.append( body )
+
+        self._inbuf = ""
+        self._state = "headers"
+        self._remaining = None
+
+    def wants_write(self):
+        return bool( self._outgoing )
+
+    def handle_writable(self):
+        while self._outgoing:
+            try:
+                sent_bytes = self._sock.send( self._outgoing[0] )
+            except socket.error as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.last_activity_time = time.time()
+            if sent_bytes < len(self._outgoing[0]):
+                self._outgoing[0] = self._outgoing[0][sent_bytes:]
+                return
+            self._outgoing.popleft()
+
+    def handle_readable(self):
+        try:
+            if self._state in ("body", "chunk_data") and not self._inbuf and self._remaining:
+                # Receive directly into the sink (e.g. the output array)
+                received_bytes = self.request.sink.receive( self._sock, self._remaining )
+                if received_bytes == 0:
+                    raise httplib.IncompleteRead( "", self._remaining )
+                self._remaining -= received_bytes
+            else:
+                data = self._sock.recv( self.RECV_SIZE )
+                if not data:
+                    self._handle_eof()
+                    return
+                self._inbuf += data
+        except socket.error as ex:
+            if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.last_activity_time = time.time()
+        self.request.response_started = True
+        self._process_input()
+
+    def is_reusable(self):
+        return self._keep_alive and self._sock is not None and not self._inbuf
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _handle_eof(self):
+        if self._state == "until_close":
+            self._keep_alive = False
+            self._finish_response()
+        elif self._state == "headers" and not self._inbuf:
+            raise httplib.BadStatusLine( "" )
+        else:
+            raise httplib.IncompleteRead( self._inbuf )
+
+    def _process_input(self):
+        """
+        Advance the response parsing state machine as far as the received data permits.
+        """
+        while not self.request.response_complete:
+            if self._state == "headers":
+                header_end = self._inbuf.find( "\r\n\r\n" )
+                if header_end == -1:
+                    if len(self._inbuf) > self.MAX_HEADER_SIZE:
+                        raise httplib.LineTooLong( "response headers" )
+                    return
+                header_text, self._inbuf = self._inbuf[:header_end], self._inbuf[header_end+4:]
+                self._parse_headers( header_text )
+            elif self._state in ("body", "chunk_data"):
+                if self._remaining and self._inbuf:
+                    data, self._inbuf = self._inbuf[:self._remaining], self._inbuf[self._remaining:]
+                    self.request.sink.feed( data )
+                    self._remaining -= len(data)
+                if self._remaining:
+                    return
+                if self._state == "body":
+                    self._finish_response()
+                else:
+                    self._state = "chunk_end"
+            elif self._state == "chunk_end":
+                if len(self._inbuf) < 2:
+                    return
+                self._inbuf = self._inbuf[2:]
+                self._state = "chunk_size"
+            elif self._state == "chunk_size":
+                line_end = self._inbuf.find( "\r\n" )
+                if line_end == -1:
+                    return
+                line, self._inbuf = self._inbuf[:line_end], self._inbuf[line_end+2:]
+                self._remaining = int( line.split(';')[0], 16 )
+                self._state = "chunk_data" if self._remaining else "trailers"
+            elif self._state == "trailers":
+                line_end = self._inbuf.find( "\r\n" )
+                if line_end == -1:
+                    return
+                line, self._inbuf = self._inbuf[:line_end], self._inbuf[line_end+2:]
+                if not line:
+                    self._finish_response()
+            elif self._state == "until_close":
+                data, self._inbuf = self._inbuf, ""
+                if data:
+                    self.request.sink.feed( data )
+                return
+
+    def _parse_headers(self, header_text):
+        lines = header_text.split( "\r\n" )
+        version, status, reason = ( lines[0].split( None, 2 ) + [""] )[:3]
+        if not version.startswith( "HTTP/" ):
+            raise httplib.BadStatusLine( lines[0] )
+        status = int(status)
+        if 100 <= status < 200:
+            # Informational (e.g. 100 Continue).  The real response follows.
+            return
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition( ":" )
+            headers[ name.strip().lower() ] = value.strip()
+
+        request = self.request
+        request.status = status
+        request.reason = reason
+        request.response_headers = headers
+        connection_header = headers.get( "connection", "" ).lower()
+        if version == "HTTP/1.0":
+            self._keep_alive = ( connection_header == "keep-alive" )
+        else:
+            self._keep_alive = ( connection_header != "close" )
+
+        if status == httplib.OK:
+            request.sink = request.create_sink()
+        else:
+            request.sink = _StringSink()
+
+        if request.method == "HEAD" or status in (httplib.NO_CONTENT, httplib.NOT_MODIFIED):
+            self._remaining = 0
+            self._state = "body"
+        elif headers.get( "transfer-encoding", "" ).lower() == "chunked":
+            self._state = "chunk_size"
+        elif "content-length" in headers:
+            self._remaining = int( headers["content-length"] )
+            self._state = "body"
+        else:
+            self._state = "until_close"
+
+    def _finish_response(self):
+        self.request.response_complete = True
+
+class _SocketPoller(object):
+    """
+    Tracks the sockets the event loop is waiting on.
+    Uses ``select.poll()`` if available (so the cost of each wait doesn't depend on the
+    number of idle sockets), and falls back to ``select.select()`` otherwise.
+    """
+    def __init__(self):
+        self._poll = None
+        if hasattr( select, 'poll' ):
+            self._poll = select.poll()
+        self._events = {} # fileno -> want_write
+
+    def register(self, fileno, want_write):
+        self._events[fileno] = want_write
+        if self._poll is not None:
+            self._poll.register( fileno, self._poll_mask( want_write ) )
+
+    def modify(self, fileno, want_write):
+        if self._events.get( fileno ) != want_write:
+            self._events[fileno] = want_write
+            if self._poll is not None:
+                self._poll.modify( fileno, self._poll_mask( want_write ) )
+
+    def unregister(self, fileno):
+        if self._events.pop( fileno, None ) is not None and self._poll is not None:
+            self._poll.unregister( fileno )
+
+    def poll(self, timeout):
+        """
+        Wait until at least one registered socket is ready for reading or writing
+        (or until the timeout expires), and return a list of (fileno, readable, writable).
+        """
+        try:
+            if self._poll is not None:
+                if timeout is not None:
+                    timeout = timeout * 1000.0
+                error_events = select.POLLERR | select.POLLHUP | select.POLLNVAL
+                return [ ( fileno, bool(event & (select.POLLIN | error_events)), bool(event & select.POLLOUT) )
+                         for fileno, event in self._poll.poll( timeout ) ]
+
+            read_list = self._events.keys()
+            write_list = [ fileno for fileno, want_write in self._events.items() if want_write ]
+            readable, writable, _ = select.select( read_list, write_list, [], timeout )
+        except select.error as ex:
+            if ex.args[0] == errno.EINTR:
+                return []
+            raise
+        readable, writable = set(readable), set(writable)
+        return [ ( fileno, fileno in readable, fileno in writable ) for fileno in readable | writable ]
+
+    @classmethod
+    def _poll_mask(cls, want_write):
+        if want_write:
+            return select.POLLIN | select.POLLOUT
+        return select.POLLIN
@@ -0,0 +1,265 @@
+"""
+Adaptive limits on the number of concurrent requests to a DVID server.
+
+DVID tells us when it is overloaded (by responding with ``503``), and its response times grow
+when it is near capacity, but it doesn't tell us how many requests it can handle at once.
+An ``AdaptiveConcurrencyLimiter`` finds out, using the same AIMD scheme as TCP congestion control:
+
+- While responses are healthy, the limit is increased additively (by about one request per round-trip),
+  but only while the client is actually using all of its allowed requests.
+- When the server responds with 503 (or 429), the limit is cut multiplicatively.
+  (At most once per round-trip, so a burst of 503s counts only once.)
+- The limit is also cut when response times spike (unless ``latency_backoff`` is disabled),
+  so it stops growing before the server has to reject requests.
+  Response times are tracked separately for each kind of request (and, for voxels requests, each order of magnitude
+  of subvolume size), so a few slow bulk reads among many quick metadata requests don't look like a spike.
+
+Every request sent via a ``DvidConnection`` waits for a permit from the limiter for its host,
+which is shared by all connections (and hence all accessors) in the process.
+A request counts against the limit until its response headers arrive.  (Streaming a large response body
+doesn't occupy the server's request queue, and long-lived downloads shouldn't block other requests after a cut.
+To limit bandwidth, use a ``pydvid.rate_limiter.RateLimiter``.)
+"""
+import time
+import threading
+import collections
+
+from pydvid.retry import BUSY_STATUS_CODES
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Limits the number of requests in flight to a single host.  Thread-safe.
+
+    Usage:
+
+    .. code-block:: python
+
+        permit = limiter.acquire()
+        connection.request( ... )
+        response = connection.getresponse()
+        limiter.record_response( permit, response.status, url )
+        ...read the response...
+        limiter.release( permit )
+    """
+
+    class Permit(object):
+        """
+        Records the progress of a single request, for the limiter's bookkeeping.
+        """
+        def __init__(self, start_time, saturated):
+            self.start_time = start_time
+            self.saturated = saturated
+            self.released = False
+
+    # Smoothing factors for the recent and long-term response times
+    RECENT_LATENCY_WEIGHT = 0.2
+    BASELINE_LATENCY_WEIGHT = 0.02
+
+    # Response times are tracked for at most this many kinds of request.
+    MAX_TRACKED_ENDPOINTS = 1000
+
+    def __init__(self, host, initial_limit=8, min_limit=1, max_limit=256, decrease_factor=0.5,
+                 latency_backoff=True, latency_tolerance=3.0, min_latency_increase=0.05, warmup_samples=20):
+        """
+        :param host: The server this limiter applies to, e.g. 'localhost:8000'. (Used only for messages.)
+        :param initial_limit: Number of concurrent requests allowed at first.
+        :param min_limit, max_limit: Bounds for the limit.
+        :param decrease_factor: When the server is overloaded, the limit is multiplied by this factor.
+        :param latency_backoff: If True, a spike in response times (i.e. the time until the response headers arrive)
+                                is also treated as a sign of overload.  Otherwise, only busy responses (503 or 429) are.
+        :param latency_tolerance: A spike is a recent response time that exceeds the long-term average 
+                                  for the same kind of request by this factor...
+        :param min_latency_increase: ...and by at least this many seconds.  (So jitter in very short response times isn't a spike.)
+        :param warmup_samples: Response times of a kind of request aren't judged until this many have been received.
+        """
+        assert 1 <= min_limit <= initial_limit <= max_limit
+        assert 0 < decrease_factor < 1
+        self.host = host
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_increase = min_latency_increase
+        self.warmup_samples = warmup_samples
+
+        self._condition = threading.Condition( threading.Lock() )
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._last_decrease_time = 0.0
+        self._num_decreases = 0
+
+        # Response time averages for each kind of request: endpoint : _LatencyAverages
+        self._latencies = {}
+
+    @property
+    def limit(self):
+        """
+        The number of requests currently allowed in flight.
+        """
+        with self._condition:
+            return int(self._limit)
+
+    @property
+    def stats(self):
+        """
+        A dict of the limiter's current state:
+
+        - limit: The number of requests currently allowed in flight
+        - in_flight: The number of requests currently in flight (i.e. awaiting their response headers)
+        - decreases: Total number of times the limit was cut
+        - latencies: The recent and long-term average response times (seconds) for each kind of request,
+                     e.g. ``{ 'node/grayscale/raw/2^12' : (0.012, 0.010), ... }``
+        """
+        with self._condition:
+            return { 'limit' : int(self._limit),
+                     'in_flight' : self._in_flight,
+                     'decreases' : self._num_decreases,
+                     'latencies' : { endpoint : (averages.recent, averages.baseline)
+                                     for endpoint, averages in self._latencies.items() } }
+
+    def acquire(self, timeout=None):
+        """
+        Wait until another request is allowed, and return a Permit for it.
+        Returns None if the timeout expired first.
+        """
+        with self._condition:
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while self._in_flight >= int(self._limit):
+                if timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait( remaining )
+            self._in_flight += 1
+            saturated = self._in_flight >= int(self._limit)
+            return AdaptiveConcurrencyLimiter.Permit( time.time(), saturated )
+
+    def record_response(self, permit, status_code, url=None):
+        """
+        Record the arrival of the response (headers) for the given permit's request,
+        and adjust the limit accordingly.  From now on, the request no longer counts against the limit.
+
+        :param url: The request's url, which determines the kind of request its response time is compared with.
+        """
+        latency = time.time() - permit.start_time
+        with self._condition:
+            self._free( permit )
+            if status_code in BUSY_STATUS_CODES:
+                self._decrease( permit )
+            elif self._record_latency( _endpoint_of( url ), latency ):
+                self._decrease( permit )
+            elif permit.saturated:
+                # Additive increase: about one more request per round-trip.
+                self._limit = min( self.max_limit, self._limit + 1.0 / int(self._limit) )
+            self._condition.notify_all()
+
+    def release(self, permit):
+        """
+        Called when the request is finished (i.e. its response has been read), or failed.
+        Frees the permit, unless record_response() already did.  Releasing a permit twice has no effect.
+        """
+        with self._condition:
+            if self._free( permit ):
+                self._condition.notify_all()
+
+    def _free(self, permit):
+        """
+        Stop counting the given permit's request against the limit.
+        Returns False if it was already freed.
+        Must be called with the lock held.
+        """
+        if permit.released:
+            return False
+        permit.released = True
+        self._in_flight -= 1
+        return True
+
+    def _record_latency(self, endpoint, latency):
+        """
+        Update the response time averages for the given kind of request.
+        Returns True if its recent response times indicate that the server is overloaded.
+        Must be called with the lock held.
+        """
+        averages = self._latencies.get( endpoint )
+        if averages is None:
+            if len(self._latencies) < self.MAX_TRACKED_ENDPOINTS:
+                self._latencies[endpoint] = _LatencyAverages( latency )
+            return False
+        averages.num_samples += 1
+        averages.recent += self.RECENT_LATENCY_WEIGHT * ( latency - averages.recent )
+        averages.baseline += self.BASELINE_LATENCY_WEIGHT * ( latency - averages.baseline )
+        spike = self.latency_backoff \
+            and averages.num_samples > self.warmup_samples \
+            and averages.recent > self.latency_tolerance * averages.baseline \
+            and averages.recent - averages.baseline > self.min_latency_increase
+        if spike:
+            # Start over, so the next cut requires new evidence of a spike.
+            averages.recent = averages.baseline
+        return spike
+
+    def _decrease(self, permit):
+        """
+        Multiplicative decrease, unless the limit was already cut after the given request started.
+        Returns True if the limit was cut.
+        Must be called with the lock held.
+        """
+        if permit.start_time < self._last_decrease_time:
+            return False
+        self._limit = max( self.min_limit, self._limit * self.decrease_factor )
+        self._last_decrease_time = time.time()
+        self._num_decreases += 1
+        return True
+
+class _LatencyAverages(object):
+    """
+    Exponentially weighted moving averages of the response time of one kind of request.
+    """
+    __slots__ = ('num_samples', 'recent', 'baseline')
+
+    def __init__(self, latency):
+        self.num_samples = 1
+        self.recent = self.baseline = latency
+
+def _endpoint_of( url ):
+    """
+    Return a label for the kind of request the given url makes, e.g. 'node/grayscale/raw/2^12'
+    for '/api/node/abc123/grayscale/raw/0_1_2/16_16_16/0_0_0'.  Node uuids, keys and coordinates are dropped,
+    but subvolume requests are distinguished by the order of magnitude (a factor of 16) of their size.
+    """
+    if url is None:
+        return None
+    path = url.split('?', 1)[0].strip('/').split('/')
+    if path[:1] == ['api']:
+        path = path[1:]
+    if path[:1] in (['node'], ['repo']):
+        path = path[:1] + path[2:] # (Drop the uuid)
+    if path[:1] != ['node'] or len(path) <= 3:
+        # e.g. 'server/info', or 'node/my_keyvalue' (for any key)
+        return '/'.join( path[:2] )
+    endpoint = '/'.join( path[:3] )
+    if len(path) >= 5:
+        # Subvolume requests: node/{data_name}/{access_type}/{dims}/{shape}/{offset}
+        try:
+            num_voxels = reduce( lambda a, b: a*b, map( int, path[4].split('_') ) )
+        except ValueError:
+            return endpoint
+        endpoint += "/2^{}".format( 4 * ( num_voxels.bit_length() // 4 ) )
+    return endpoint
+
+_concurrency_limiters = {}
+_concurrency_limiters_lock = threading.Lock()
+
+def get_concurrency_limiter( host ):
+    """
+    Return the AdaptiveConcurrencyLimiter shared by all connections to the given host (e.g. 'localhost:8000').
+    """
+    with _concurrency_limiters_lock:
+        try:
+            return _concurrency_limiters[host]
+        except KeyError:
+            limiter = _concurrency_limiters[host] = AdaptiveConcurrencyLimiter( host )
+            return limiter
@@ -1,47 +1,620 @@
+import time
+import select
+import socket
 import httplib
+import weakref
+import functools
 import threading
+import collections
+
+from pydvid.retry import BUSY_STATUS_CODES
+from pydvid.hooks import current_timing
+from pydvid.concurrency_limiter import get_concurrency_limiter
 
 class DvidConnection(object):
     """
-    Simple wrapper around a pool of HTTPConnection instances.
-    One connection is maintained for each thread.
-    All attribute access is forwarded to the underlying connection for the current thread.  
-    So, to clients, this class looks just like a normal HTTPConnection, 
-      but really each thread gets access to its own HTTPConnection.
+    A bounded, thread-safe pool of keep-alive HTTPConnection instances to a single DVID server.
+
+    To clients, this class looks just like a normal HTTPConnection (i.e. it supports ``request()``
+    and ``getresponse()``), but each request is sent on a connection checked out from the pool.
+    The connection is returned to the pool as soon as the response has been completely read (or closed),
+    so any number of threads can share a DvidConnection, and at most ``max_connections`` sockets are open at once.
+
+    - If a response is closed before its body was completely read, the rest of the body is drained
+      (if it is no larger than ``max_drain_bytes``), so the connection can be reused.
+      Otherwise, it is faster to close the connection and open a new one.
+    - Idle connections that were closed by the server (or that have been idle longer than
+      ``idle_timeout``) are discarded instead of being reused.
+    - If a request fails because the server closed a reused keep-alive connection,
+      it is transparently repeated on a new connection (unless its body is a stream, which can't be re-sent).
+    - Each request must first obtain a permit from the connection's ``AdaptiveConcurrencyLimiter``,
+      which adjusts the number of concurrent requests to what the server can sustain.
+      (By default, the limiter is shared by all connections to the same host.)
+      The permit is returned when the response headers arrive, not when the body has been read.
+    - Responses are parsed from a buffered socket file.  (By default, httplib reads the status line and headers
+      one byte per system call, which costs more CPU time than everything else in a small request.)
+      Large bodies are still received directly into their destination (see ``pydvid.util.stream_readinto``).
+    - Optionally, the request rate and bandwidth can be capped with a ``pydvid.rate_limiter.RateLimiter``.
+      Responses carry the limiter as their ``rate_limiter`` attribute, so voxels transfers are paced as they are streamed.
+    - To observe the requests made via this connection (e.g. for logging or tracing), 
+      register a hook with ``pydvid.hooks.add_hook( hook, connection=... )``.
+
+    As with HTTPConnection, each thread must call getresponse() after request() before issuing another request.
+    (If it doesn't, its previous connection is closed.)  But the response need not be completely read:
+    Issuing a new request closes the previous response (draining it, as described above).
     """
 
-    def __init__(self, hostname, timeout=None):
+    class PoolTimeoutError(Exception):
+        """
+        Raised when no connection became available within the pool_timeout.
+        """
+        pass
+
+    def __init__(self, hostname, timeout=None, max_connections=10, idle_timeout=60.0, pool_timeout=None,
+                 max_drain_bytes=2**16, concurrency_limiter=True, rate_limiter=None):
         """
-        hostname: The DVID server hostname, e.g. 'emdata1' or 'localhost:8000'
+        :param hostname: The DVID server hostname, e.g. 'emdata1' or 'localhost:8000'
+        :param timeout: Socket timeout for each connection (see ``httplib.HTTPConnection``)
+        :param max_connections: Maximum number of connections open at once.
+                                Requests beyond this wait until a connection is returned to the pool.
+        :param idle_timeout: Connections that have been idle for longer than this (in seconds) are closed.
+        :param pool_timeout: Maximum time to wait for a connection (and a permit from the concurrency limiter)
+                             to become available.  (None means wait forever.)
+        :param max_drain_bytes: If a response is closed with at most this many bytes left unread,
+                                they are read and discarded so the connection can be reused.
+                                Connections with more unread data are closed instead.
+        :param concurrency_limiter: If True, use the shared ``AdaptiveConcurrencyLimiter`` for this host
+                                    (see ``pydvid.concurrency_limiter.get_concurrency_limiter()``).
+                                    Pass an AdaptiveConcurrencyLimiter instance to use it instead, or False to disable.
+        :param rate_limiter: An optional ``pydvid.rate_limiter.RateLimiter``, shared by all threads that use this connection.
+                             (Pass the same instance to several connections to share a limit between them.)
         """
-        # Open a connection to the server
+        assert max_connections >= 1, "Pool must permit at least one connection"
         self.hostname = hostname
-        self._connections = {}
         self.timeout = timeout
-        self._lock = threading.Lock()
-    
-    def __getattribute__(self, name):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.pool_timeout = pool_timeout
+        self.max_drain_bytes = max_drain_bytes
+
+        # Parse the host and port the same way HTTPConnection does.  (This doesn't connect.)
+        prototype = httplib.HTTPConnection( hostname )
+        self.host = prototype.host
+        self.port = prototype.port
+
+        if concurrency_limiter is True:
+            concurrency_limiter = get_concurrency_limiter( "{}:{}".format( self.host, self.port ) )
+        self.concurrency_limiter = concurrency_limiter or None
+        self.rate_limiter = rate_limiter
+
+        self._condition = threading.Condition( threading.Lock() )
+        self._idle_connections = collections.deque() # (connection, release_time), most recently used on the right
+        self._num_in_use = 0
+        self._stats = collections.Counter()
+
+        # Incremented by close(), so connections that were in use at the time aren't returned to the pool.
+        self._generation = 0
+
+        # The _Lease for the current thread's most recent request
+        self._thread_state = threading.local()
+
+    def request(self, method, url, body=None, headers={}):
+        """
+        Send a request on a connection from the pool.
+        Same signature as ``httplib.HTTPConnection.request()``.
+        """
+        self._release_thread_lease()
+        if self.rate_limiter is not None:
+            self.rate_limiter.throttle_request()
+        permit = self._acquire_permit()
         try:
-            # If we have this attr, use it. 
-            # (e.g. self.hostname, self.close, self._connections)
-            return object.__getattribute__(self, name)
+            lease = self._send( (method, url, body, headers), timing=current_timing() )
         except:
-            # Get/create the HTTPConnection associated with the current thread
-            thread_id = threading.current_thread().ident
+            if permit is not None:
+                self.concurrency_limiter.release( permit )
+            raise
+        lease.permit = permit
+        self._thread_state.lease = lease
+
+    def getresponse(self):
+        """
+        Return the response to this thread's most recent request.
+        Same as ``httplib.HTTPConnection.getresponse()``, except that the connection is returned
+        to the pool when the response has been completely read.
+        """
+        lease = getattr( self._thread_state, 'lease', None )
+        if lease is None or lease.response is not None:
+            raise httplib.ResponseNotReady()
+
+        try:
+            response = lease.connection.getresponse( buffering=True )
+        except (socket.error, httplib.BadStatusLine):
+            if not lease.is_retryable():
+                self._checkin( lease, 'broken' )
+                raise
+            # The server closed this keep-alive connection before it received our request.
+            # Send it again, on a new connection (with the same permit).
+            permit, lease.permit = lease.permit, None
+            self._checkin( lease, 'broken' )
             try:
-                return getattr(self._connections[thread_id], name)
+                lease = self._send( lease.request_args, allow_reuse=False )
             except:
-                with self._lock:
-                    if thread_id not in self._connections:
-                        connection = httplib.HTTPConnection(self.hostname, timeout=self.timeout)
-                        self._connections[thread_id] = connection
-                return getattr(self._connections[thread_id], name)
+                if permit is not None:
+                    self.concurrency_limiter.release( permit )
+                raise
+            lease.permit = permit
+            self._thread_state.lease = lease
+            try:
+                response = lease.connection.getresponse( buffering=True )
+            except:
+                self._checkin( lease, 'broken' )
+                raise
+
+        if lease.permit is not None:
+            self.concurrency_limiter.record_response( lease.permit, response.status, lease.request_args[1] )
+        lease.response = response
+        response.rate_limiter = self.rate_limiter
+        response._pool_release = functools.partial( self._checkin, lease )
+        response._max_drain_bytes = self.max_drain_bytes
+        return response
+
+    def iter_pipelined_responses(self, requests):
+        """
+        Send several requests at once on a single connection from the pool (HTTP/1.1 pipelining),
+        and yield their responses in order, without waiting a round-trip for each one.
+
+        :param requests: A list of (method, url, body, headers), as for ``request()``.
+                         Bodies must be str (or another buffer), and should be small:
+                         all requests are sent before any response is read.
+
+        Each response must be read before the next one is requested from the generator.
+        (Otherwise, the rest of its body is read and discarded.)  If the server closes the connection
+        before answering all of the requests (e.g. after an error response), the generator ends early,
+        and the caller must send the remaining requests again.
+        At least one response is yielded, unless an exception is raised.
+        """
+        self._release_thread_lease()
+        if self.rate_limiter is not None:
+            for _ in requests:
+                self.rate_limiter.throttle_request()
+        permit = self._acquire_permit()
+        lease = None
+        outcome = 'broken'
+        try:
+            lease = self._checkout()
+            try:
+                shared_file = self._send_pipelined( lease.connection, requests )
+                response = _begin_pipelined_response( shared_file, requests[0][0] )
+            except (socket.error, httplib.HTTPException):
+                if not lease.reused:
+                    raise
+                # The server probably closed this idle keep-alive connection.  Try again on a new connection.
+                self._checkin( lease, 'broken' )
+                lease = self._checkout( allow_reuse=False )
+                shared_file = self._send_pipelined( lease.connection, requests )
+                response = _begin_pipelined_response( shared_file, requests[0][0] )
+
+            for index, (method, _, _, _) in enumerate(requests):
+                if response is None:
+                    try:
+                        response = _begin_pipelined_response( shared_file, method )
+                    except (socket.error, httplib.HTTPException):
+                        # The remaining requests are left for the caller to send again.
+                        return
+                if permit is not None and ( index == 0 or response.status in BUSY_STATUS_CODES ):
+                    self.concurrency_limiter.record_response( permit, response.status, requests[index][1] )
+                yield response
+                if not response.isclosed():
+                    response.read()
+                if response.will_close:
+                    lease.connection.close()
+                    outcome = 'complete'
+                    return
+                response = None
+
+            # Anything left in the buffer would be a response to a request we didn't send.
+            if not shared_file.has_buffered_data():
+                outcome = 'complete'
+        finally:
+            if lease is not None:
+                self._checkin( lease, outcome )
+            if permit is not None:
+                self.concurrency_limiter.release( permit )
+
+    def _send_pipelined(self, connection, requests):
+        """
+        Send all of the given requests on the given (idle) HTTPConnection,
+        and return the _PipelinedSocketFile to read the responses from.
+        """
+        if connection.sock is None:
+            connection.connect()
+        host = "{}:{}".format( connection.host, connection.port )
+        pieces = []
+        for method, url, body, headers in requests:
+            pieces.append( "{} {} HTTP/1.1\r\nHost: {}\r\nAccept-Encoding: identity\r\n".format( method, url, host ) )
+            for name, value in (headers or {}).items():
+                pieces.append( "{}: {}\r\n".format( name, value ) )
+            if body is not None or method in ("POST", "PUT"):
+                body = body if body is not None else ""
+                pieces.append( "Content-Length: {}\r\n\r\n".format( len(body) ) )
+                if isinstance( body, memoryview ):
+                    # (In python 2, str() of a memoryview is its repr, not its bytes.)
+                    body = body.tobytes()
+                elif isinstance( body, bytearray ):
+                    body = str(body)
+                pieces.append( body )
+            else:
+                pieces.append( "\r\n" )
+        connection.sock.sendall( "".join( pieces ) )
+        return _PipelinedSocketFile( connection.sock )
+
+    def close(self):
+        """
+        Close all idle connections, and this thread's connection (if any).
+        Connections currently in use by other threads are closed when they are returned to the pool.
+        The DvidConnection can still be used afterwards: new connections are created as needed.
+        """
+        self._release_thread_lease()
+        with self._condition:
+            while self._idle_connections:
+                connection, _ = self._idle_connections.popleft()
+                connection.close()
+            self._generation += 1
+
+    @property
+    def num_in_use(self):
+        """
+        The number of connections currently checked out, i.e. the number of requests in progress.
+        """
+        return self._num_in_use
+
+    @property
+    def stats(self):
+        """
+        A dict of pool statistics:
+
+        - in_use: Connections currently checked out
+        - idle: Open connections waiting in the pool
+        - created: Total connections created
+        - reused: Total requests sent on a previously used connection
+        - drained: Total responses closed before they were completely read, whose remaining body was drained
+                   so the connection could be reused
+        - abandoned: Total responses closed before they were completely read, whose connection was closed 
+                     because too much of the body was left (see ``max_drain_bytes``)
+        - discarded: Total connections closed because they were broken or closed by the server
+        - expired: Total connections closed because they were idle for longer than idle_timeout
+        """
+        with self._condition:
+            return { 'in_use' : self._num_in_use,
+                     'idle' : len(self._idle_connections),
+                     'created' : self._stats['created'],
+                     'reused' : self._stats['reused'],
+                     'drained' : self._stats['drained'],
+                     'abandoned' : self._stats['abandoned'],
+                     'discarded' : self._stats['discarded'],
+                     'expired' : self._stats['expired'] }
+
+    def _acquire_permit(self):
+        """
+        Wait for the concurrency limiter to allow another request.
+        Returns the permit, or None if there is no limiter.
+        """
+        if self.concurrency_limiter is None:
+            return None
+        permit = self.concurrency_limiter.acquire( self.pool_timeout )
+        if permit is None:
+            raise DvidConnection.PoolTimeoutError(
+                "The concurrency limit for {} ({} requests) didn't permit another request within {} seconds."
+                .format( self.hostname, self.concurrency_limiter.limit, self.pool_timeout ) )
+        return permit
+
+    def _send(self, request_args, allow_reuse=True, timing=None):
+        """
+        Check out a connection and send the given request on it.
+        Returns the _Lease for the connection.
+
+        :param timing: The ``pydvid.hooks.RequestTiming`` for the request, if it is instrumented.
+        """
+        lease = self._checkout( allow_reuse )
+        if timing is not None:
+            timing.mark_acquired()
+        lease.request_args = request_args
+        try:
+            lease.connection.request( *request_args )
+        except (socket.error, httplib.HTTPException):
+            self._checkin( lease, 'broken' )
+            if not lease.is_retryable():
+                raise
+            return self._send( request_args, allow_reuse=False )
+        except:
+            # e.g. the request body stream failed
+            self._checkin( lease, 'broken' )
+            raise
+        return lease
+
+    def _checkout(self, allow_reuse=True):
+        """
+        Return a _Lease for an idle connection from the pool, or for a new connection.
+        If the pool is exhausted, wait until a connection is returned (or the pool_timeout expires).
+        """
+        if self.pool_timeout is not None:
+            deadline = time.time() + self.pool_timeout
+        with self._condition:
+            while True:
+                self._expire_idle_connections()
+                while allow_reuse and self._idle_connections:
+                    connection, _ = self._idle_connections.pop()
+                    if _is_connection_reusable( connection ):
+                        self._num_in_use += 1
+                        self._stats['reused'] += 1
+                        return _Lease( connection, self._generation, reused=True )
+                    connection.close()
+                    self._stats['discarded'] += 1
+
+                if self._num_in_use < self.max_connections:
+                    if self._num_in_use + len(self._idle_connections) >= self.max_connections:
+                        # Make room for the new connection
+                        connection, _ = self._idle_connections.popleft()
+                        connection.close()
+                    self._num_in_use += 1
+                    self._stats['created'] += 1
+                    connection = _PooledHTTPConnection( self.hostname, timeout=self.timeout )
+                    return _Lease( connection, self._generation, reused=False )
+
+                if self.pool_timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DvidConnection.PoolTimeoutError(
+                            "No connection to {} became available within {} seconds. "
+                            "(All {} connections are in use.)"
+                            .format( self.hostname, self.pool_timeout, self.max_connections ) )
+                    self._condition.wait( remaining )
+
+    def _checkin(self, lease, outcome):
+        """
+        Return the leased connection to the pool, or close it if it can't be reused.
+        Does nothing if the lease was already returned.
+
+        :param outcome: How the request ended: 'complete' or 'drained' (reusable), 
+                        'abandoned' (response not completely read) or 'broken' (i.e. an error occurred).
+        """
+        with self._condition:
+            if lease.released:
+                return
+            lease.released = True
+            self._num_in_use -= 1
+            # (If the server asked to close the connection, httplib has already closed the socket.)
+            reusable = outcome in ('complete', 'drained')
+            keep = reusable and lease.connection.sock is not None and lease.generation == self._generation
+            if keep:
+                self._idle_connections.append( (lease.connection, time.time()) )
+            if outcome == 'broken':
+                self._stats['discarded'] += 1
+            elif outcome != 'complete':
+                self._stats[outcome] += 1
+            self._condition.notify()
+
+        if lease.permit is not None:
+            self.concurrency_limiter.release( lease.permit )
+
+        # Close outside the lock: closing the connection also closes its response,
+        #  which calls back into this function.
+        if not keep:
+            lease.connection.close()
+
+    def _release_thread_lease(self):
+        """
+        Release this thread's previous connection, if the caller didn't finish reading its response.
+        """
+        lease = getattr( self._thread_state, 'lease', None )
+        self._thread_state.lease = None
+        if lease is None or lease.released:
+            return
+        if lease.response is not None:
+            # Drain the rest of the response (if it's small), and return the connection to the pool.
+            lease.response.close()
+        else:
+            # The response was never received.
+            self._checkin( lease, 'abandoned' )
+
+    def _expire_idle_connections(self):
+        """
+        Close connections that have been idle for longer than idle_timeout.
+        Must be called with the lock held.
+        """
+        expiration_time = time.time() - self.idle_timeout
+        while self._idle_connections and self._idle_connections[0][1] <= expiration_time:
+            connection, _ = self._idle_connections.popleft()
+            connection.close()
+            self._stats['expired'] += 1
+
+_shared_executors = weakref.WeakKeyDictionary()
+_shared_executors_lock = threading.Lock()
+
+def get_shared_executor( connection ):
+    """
+    Return the ``concurrent.futures.ThreadPoolExecutor`` used to execute background requests on the given connection.
+    All callers that use the same connection share the same executor.
+    
+    The number of workers is tied to the number of requests the connection can handle at once:
+    For a DvidConnection (or ReplicatedDvidConnection), it's the pool's ``max_connections``, so workers never wait for a connection.
+    A plain ``httplib.HTTPConnection`` can only handle one request at a time, so its executor has only one worker.
+    (In that case, don't use the connection directly while background requests are pending.)
+    """
+    with _shared_executors_lock:
+        try:
+            return _shared_executors[connection]
+        except KeyError:
+            # (Only pooled connections have a max_connections attribute.)
+            max_workers = getattr( connection, 'max_connections', 1 )
+            import concurrent.futures # (Imported here, since most connections never need an executor.)
+            executor = concurrent.futures.ThreadPoolExecutor( max_workers )
+            _shared_executors[connection] = executor
+            return executor
+
+class _Lease(object):
+    """
+    Records the checkout of a single connection from the pool for a single request.
+    """
+    def __init__(self, connection, generation, reused):
+        self.connection = connection
+        self.generation = generation
+        self.reused = reused
+        self.request_args = None
+        self.response = None
+        self.released = False
+
+        # The permit from the concurrency limiter (if any)
+        self.permit = None
+
+    def is_retryable(self):
+        """
+        A failed request can be repeated if its connection was reused
+        (i.e. the server probably closed it while it was idle),
+        and the request body can be sent again.
+        """
+        body = self.request_args[2]
+        return self.reused and ( body is None or isinstance( body, (str, bytearray, memoryview) ) )
+
+class _PooledHTTPResponse(httplib.HTTPResponse):
+    """
+    An HTTPResponse that returns its connection to the pool when it is closed.
+    (Since it is still an HTTPResponse, pydvid.util.stream_readinto() can receive directly from its socket.)
+    """
+    _pool_release = None
+    _max_drain_bytes = 0
+
+    # See pydvid.rate_limiter
+    rate_limiter = None
+    _reading_chunked = False
+    _draining = False
+
+    # Unread data is drained in chunks of this size.
+    DRAIN_CHUNK_SIZE = 8192
+
+    def close(self):
+        unread = self.fp is not None and ( self.length or self.chunked )
+        if unread and self._pool_release is not None and not self._reading_chunked and not self._draining:
+            # The body wasn't completely read.  If only a little is left, read it so the connection can be reused.
+            # (If that works, the connection is returned to the pool during the final read.)
+            self._drain()
+        httplib.HTTPResponse.close(self)
+        if not self._reading_chunked:
+            if self.length is None and not self.chunked:
+                # The body ends when the server closes the connection, so it can't be reused anyway.
+                self._release_to_pool( 'complete' )
+            elif self.length != 0:
+                self._release_to_pool( 'abandoned' )
+            elif self._draining:
+                self._release_to_pool( 'drained' )
+            else:
+                # The entire body was read, so the connection can be reused.
+                self._release_to_pool( 'complete' )
+
+    def _drain(self):
+        """
+        Read and discard the rest of the body, unless it is longer than _max_drain_bytes.
+        """
+        if self.will_close:
+            # The connection can't be reused anyway.
+            return
+        if self.length is not None and self.length > self._max_drain_bytes:
+            return
+        self._draining = True
+        try:
+            drained_bytes = 0
+            while self.fp is not None:
+                if drained_bytes > self._max_drain_bytes:
+                    # (The length of a chunked response isn't known in advance.)
+                    return
+                data = self.read( self.DRAIN_CHUNK_SIZE )
+                if not data:
+                    break
+                drained_bytes += len(data)
+        except (socket.error, httplib.HTTPException):
+            pass
+        finally:
+            self._draining = False
+
+    def _read_chunked(self, amt):
+        # The base class closes the response after reading the last chunk.
+        # Only then do we know whether or not the response was read successfully.
+        self._reading_chunked = True
+        completed = False
+        try:
+            data = httplib.HTTPResponse._read_chunked(self, amt)
+            completed = True
+            return data
+        finally:
+            self._reading_chunked = False
+            if self.fp is None:
+                if not completed:
+                    self._release_to_pool( 'broken' )
+                elif self._draining:
+                    self._release_to_pool( 'drained' )
+                else:
+                    self._release_to_pool( 'complete' )
+
+    def _release_to_pool(self, outcome):
+        release, self._pool_release = self._pool_release, None
+        if release is not None:
+            release( outcome )
+
+class _PooledHTTPConnection(httplib.HTTPConnection):
+    response_class = _PooledHTTPResponse
+
+class _PipelinedSocketFile(object):
+    """
+    A single buffered file object for all of the responses to a batch of pipelined requests.
+    HTTPResponse normally makes its own file object for the socket (and closes it when it's done),
+    but buffered data that belongs to the next response must not be lost.
+    So this object acts as both the socket and the file for each response, and ignores close().
+    """
+    def __init__(self, sock):
+        self._file = sock.makefile('rb')
+
+    def makefile(self, *args):
+        return self
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def readlines(self, *args):
+        # (Used by httplib for responses without a status line.)
+        return self._file.readlines(*args)
 
     def close(self):
-        # Close all underlying connections for all threads.
-        for conn in self._connections.values():
-            conn.close()
+        pass
+
+    def has_buffered_data(self):
+        return len( self._file._rbuf.getvalue() ) > 0
 
-    # TODO: Implement special request() override that ensures the previous request (if any) has already been fully read, and raises an exception otherwise.
-    #       See httplib docs: https://docs.python.org/2/library/httplib.html#httplib.HTTPConnection.getresponse
-    
\ No newline at end of file
+def _begin_pipelined_response( shared_file, method ):
+    response = httplib.HTTPResponse( shared_file, method=method )
+    response.begin()
+    return response
+
+def _is_connection_reusable( connection ):
+    """
+    Return False if the given idle connection has been closed (by us or by the server).
+    An idle keep-alive socket should have nothing to read.  If it's readable,
+    the server either closed it or sent unexpected data, so it can't be used.
+    """
+    if connection.sock is None:
+        return False
+    try:
+        if hasattr( select, 'poll' ):
+            # (Unlike select(), poll() works for file descriptors >= FD_SETSIZE,
+            #  which are common in processes with many open files.)
+            poller = select.poll()
+            poller.register( connection.sock, select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR )
+            return not poller.poll( 0 )
+        readable, _, _ = select.select( [connection.sock], [], [], 0 )
+    except (socket.error, select.error, ValueError):
+        return False
+    return not readable
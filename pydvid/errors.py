@@ -3,7 +3,8 @@ class DvidHttpError( Exception ):
     Raised when DVID returns an http error code to any request.
     """
     def __init__(self, attempted_action_name, status_code, reason, response_body, 
-                 method, request_uri, request_body="<unspecified>", request_headers="<unspecified>"):
+                 method, request_uri, request_body="<unspecified>", request_headers="<unspecified>",
+                 response_headers=None):
         self.attempted_action_name = attempted_action_name
         self.status_code = status_code
         self.reason = reason
@@ -12,6 +13,10 @@ class DvidHttpError( Exception ):
         self.request_uri = request_uri
         self.request_body = request_body
         self.request_headers = request_headers
+        
+        # The response headers, as a list of (name, value) pairs (e.g. from ``HTTPResponse.getheaders()``).
+        # Needed to honour Retry-After (see pydvid.retry).
+        self.response_headers = response_headers or []
     
     def __str__(self):
         caption = 'While attempting "{}" DVID returned an error: {}, "{}"\n'\
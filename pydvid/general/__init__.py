@@ -1 +1,2 @@
 from .general import *
+from .repo_catalog import RepoCatalog, get_repo_catalog
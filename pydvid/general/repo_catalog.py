@@ -0,0 +1,294 @@
+"""
+An indexed, cached view of the server's ``/api/repos/info``.
+
+``general.get_repos_info()`` returns the raw nested dict, which must be scanned to answer simple questions
+like "which repo owns this node?" or "is this node locked?".  A ``RepoCatalog`` fetches the repos info once,
+indexes it, and answers such questions with dict lookups:
+
+.. code-block:: python
+
+    catalog = get_repo_catalog( connection )
+    catalog.repo_uuid( node_uuid )           # The repo that owns the node
+    catalog.is_locked( node_uuid )
+    catalog.data_instances( node_uuid )      # { name : typename }
+    catalog.ancestors( node_uuid )
+
+The info is fetched again when it is older than the catalog's ``ttl``, or when ``refresh()`` is called.
+Node uuids may be abbreviated to any unique prefix, as in the DVID REST API.
+"""
+import time
+import bisect
+import weakref
+import threading
+
+from pydvid.general.general import get_repos_info
+
+class RepoCatalog(object):
+    """
+    A cache of the repos info of a single server, with indexes for fast queries.  Thread-safe.
+    """
+
+    class UnknownNodeError(KeyError):
+        """
+        Raised if a node uuid (or prefix) doesn't match any node, or matches more than one.
+        """
+
+    class _RepoIndex(object):
+        """
+        The indexes for a single repo.  (Built once, and never modified.)
+        """
+        def __init__(self, repo_uuid, repo_info):
+            self.repo_uuid = repo_uuid
+            self.info = repo_info
+            dag = repo_info.get("DAG") or {}
+            self.root = dag.get("Root")
+            self.nodes = dag.get("Nodes") or {}
+            self.parents = dict( (uuid, tuple(node.get("Parents") or ())) for uuid, node in self.nodes.items() )
+            self.children = dict( (uuid, tuple(node.get("Children") or ())) for uuid, node in self.nodes.items() )
+            self.locked = dict( (uuid, bool(node.get("Locked"))) for uuid, node in self.nodes.items() )
+            self.instance_types = {}
+            for name, instance_info in (repo_info.get("DataInstances") or {}).items():
+                base = instance_info.get("Base") or {}
+                self.instance_types[name] = base.get("TypeName")
+
+    class _Index(object):
+        """
+        The indexes for all repos on the server.  (Replaced as a whole when the catalog is refreshed.)
+        """
+        def __init__(self, repo_indexes, fetch_time):
+            self.repos = repo_indexes # repo uuid : _RepoIndex
+            self.fetch_time = fetch_time
+            self.node_repos = {}      # node uuid : _RepoIndex
+            for repo_index in repo_indexes.values():
+                for uuid in repo_index.nodes:
+                    self.node_repos[uuid] = repo_index
+            self.sorted_uuids = sorted( self.node_repos.keys() )
+
+    def __init__(self, connection, ttl=60.0, min_refresh_interval=1.0):
+        """
+        :param connection: The connection to fetch the repos info with.
+        :param ttl: The repos info is fetched again when a query is made more than this many seconds after it was fetched.
+                    If None, it is only fetched again when ``refresh()`` is called.
+        :param min_refresh_interval: When a query names an unknown node (e.g. one created since the last fetch),
+                                     the info is fetched again, unless it was fetched less than this many seconds ago.
+        """
+        self._connection = connection
+        self._connection_ref = None # (Used instead of _connection by shared catalogs, see get_repo_catalog().)
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._index = None
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """
+        The connection to fetch the repos info with.
+        """
+        if self._connection_ref is not None:
+            return self._connection_ref()
+        return self._connection
+
+    def refresh(self, repos_info=None):
+        """
+        Fetch the repos info from the server now (or use the given repos info, as returned by ``general.get_repos_info()``)
+        and rebuild the indexes.  The indexes of repos whose info hasn't changed are reused.
+        """
+        with self._refresh_lock:
+            self._refresh( repos_info )
+
+    def _refresh(self, repos_info=None):
+        """
+        Must be called with the refresh lock held.
+        """
+        fetch_time = time.time()
+        if repos_info is None:
+            repos_info = get_repos_info( self.connection )
+        old_repos = self._index.repos if self._index is not None else {}
+        repo_indexes = {}
+        for repo_uuid, repo_info in repos_info.items():
+            if not isinstance( repo_info, dict ):
+                continue # (e.g. a top-level version field)
+            old_repo_index = old_repos.get( repo_uuid )
+            if old_repo_index is not None and old_repo_index.info == repo_info:
+                repo_indexes[repo_uuid] = old_repo_index
+            else:
+                repo_indexes[repo_uuid] = RepoCatalog._RepoIndex( repo_uuid, repo_info )
+        self._index = RepoCatalog._Index( repo_indexes, fetch_time )
+
+    @property
+    def age(self):
+        """
+        The time since the repos info was fetched (in seconds), or None if it hasn't been fetched yet.
+        """
+        index = self._index
+        if index is None:
+            return None
+        return time.time() - index.fetch_time
+
+    def _get_index(self):
+        """
+        Return the current index, after fetching the repos info if it's missing or expired.
+        """
+        index = self._index
+        if index is None or (self.ttl is not None and time.time() - index.fetch_time > self.ttl):
+            with self._refresh_lock:
+                # Another thread may have refreshed it while we waited.
+                if self._index is index:
+                    self._refresh()
+                index = self._index
+        return index
+
+    def _find_node(self, uuid):
+        """
+        Return (full_uuid, repo_index) for the given node uuid or unique prefix.
+        If it isn't found, the repos info is fetched again (at most once per min_refresh_interval).
+        """
+        index = self._get_index()
+        try:
+            return self._lookup( index, uuid )
+        except RepoCatalog.UnknownNodeError:
+            if time.time() - index.fetch_time < self.min_refresh_interval:
+                raise
+        with self._refresh_lock:
+            if self._index is index:
+                self._refresh()
+            index = self._index
+        return self._lookup( index, uuid )
+
+    @classmethod
+    def _lookup(cls, index, uuid):
+        repo_index = index.node_repos.get( uuid )
+        if repo_index is not None:
+            return uuid, repo_index
+        # Find all uuids that start with the given prefix
+        start = bisect.bisect_left( index.sorted_uuids, uuid )
+        matches = []
+        for full_uuid in index.sorted_uuids[start:start+2]:
+            if full_uuid.startswith( uuid ):
+                matches.append( full_uuid )
+        if len(matches) != 1:
+            problem = "is ambiguous" if matches else "doesn't match any node"
+            raise RepoCatalog.UnknownNodeError( "Node uuid '{}' {}".format( uuid, problem ) )
+        return matches[0], index.node_repos[ matches[0] ]
+
+    def __contains__(self, uuid):
+        try:
+            self._find_node( uuid )
+            return True
+        except RepoCatalog.UnknownNodeError:
+            return False
+
+    def resolve_uuid(self, uuid):
+        """
+        Return the full uuid of the node with the given uuid prefix.
+        """
+        return self._find_node( uuid )[0]
+
+    def repo_uuids(self):
+        return sorted( self._get_index().repos.keys() )
+
+    def repo_uuid(self, uuid):
+        """
+        Return the uuid (i.e. the repos info key) of the repo that owns the given node.
+        """
+        return self._find_node( uuid )[1].repo_uuid
+
+    def repo_info(self, uuid):
+        """
+        Return the raw repos info entry for the repo that owns the given node.
+        (It is shared, so don't modify it.)
+        """
+        return self._find_node( uuid )[1].info
+
+    def root(self, uuid):
+        """
+        Return the root node of the DAG that contains the given node.
+        """
+        return self._find_node( uuid )[1].root
+
+    def nodes(self, uuid):
+        """
+        Return the uuids of all nodes in the DAG that contains the given node.
+        """
+        return sorted( self._find_node( uuid )[1].nodes.keys() )
+
+    def node_info(self, uuid):
+        """
+        Return the raw repos info entry for the given node.
+        """
+        full_uuid, repo_index = self._find_node( uuid )
+        return repo_index.nodes[full_uuid]
+
+    def is_locked(self, uuid):
+        """
+        Return True if the given node is locked (committed), i.e. its data can no longer change.
+        """
+        full_uuid, repo_index = self._find_node( uuid )
+        return repo_index.locked[full_uuid]
+
+    def parents(self, uuid):
+        full_uuid, repo_index = self._find_node( uuid )
+        return repo_index.parents[full_uuid]
+
+    def children(self, uuid):
+        full_uuid, repo_index = self._find_node( uuid )
+        return repo_index.children[full_uuid]
+
+    def ancestors(self, uuid):
+        """
+        Return the uuids of all ancestors of the given node, nearest first (breadth-first).
+        """
+        full_uuid, repo_index = self._find_node( uuid )
+        ancestors = []
+        visited = set([full_uuid])
+        queue = list( repo_index.parents[full_uuid] )
+        while queue:
+            parent = queue.pop(0)
+            if parent in visited:
+                continue
+            visited.add( parent )
+            ancestors.append( parent )
+            queue += repo_index.parents.get( parent, () )
+        return ancestors
+
+    def is_ancestor(self, ancestor_uuid, uuid):
+        """
+        Return True if the first node is an ancestor of the second.
+        """
+        return self.resolve_uuid( ancestor_uuid ) in self.ancestors( uuid )
+
+    def data_instances(self, uuid):
+        """
+        Return a dict of { name : typename } for the data instances in the repo that owns the given node.
+        """
+        return dict( self._find_node( uuid )[1].instance_types )
+
+    def instance_type(self, uuid, data_name):
+        """
+        Return the type name (e.g. 'grayscale8' or 'keyvalue') of the given data instance.
+        Raises KeyError if the repo has no such instance.
+        """
+        instance_types = self._find_node( uuid )[1].instance_types
+        try:
+            return instance_types[data_name]
+        except KeyError:
+            raise KeyError( "Repo of node '{}' has no data instance '{}'".format( uuid, data_name ) )
+
+# Catalogs shared by all callers that use the same connection
+_repo_catalogs = weakref.WeakKeyDictionary()
+_repo_catalogs_lock = threading.Lock()
+
+def get_repo_catalog( connection ):
+    """
+    Return the RepoCatalog shared by all callers that use the given connection.
+    (Components of pydvid that need the repos info use this catalog.)
+    """
+    with _repo_catalogs_lock:
+        try:
+            return _repo_catalogs[connection]
+        except KeyError:
+            catalog = RepoCatalog( connection )
+            # The catalog mustn't keep its connection alive (or it would never be removed from the dict).
+            catalog._connection, catalog._connection_ref = None, weakref.ref( connection )
+            _repo_catalogs[connection] = catalog
+            return catalog
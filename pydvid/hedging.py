@@ -0,0 +1,331 @@
+"""
+Hedged requests, to cut the tail latency of small reads.
+
+Most block reads from DVID are fast, but a few are slow (e.g. because the server is briefly stalled,
+or the request landed behind a large one).  When many small reads are combined into one result,
+those few slow reads determine the total time.  A ``HedgingPolicy`` mitigates that:
+
+- It tracks the time until the response headers arrive ("time to first byte") for recent requests.
+- If a request hasn't received its first byte within a high percentile of those times (e.g. p95),
+  a duplicate request is sent on another connection.
+- Whichever request finishes first is used.  The other one is cancelled:
+  its response is closed as soon as it receives any data.  (A ``DvidConnection`` reads and discards
+  the rest of that response if it is small enough, so the connection can be reused.  See ``max_drain_bytes``.)
+- With a ``ReplicatedDvidConnection``, the duplicate is sent to a different server than the original,
+  if another healthy server is available.
+- A budget limits the duplicates to a small fraction of all requests,
+  so hedging can't add much load to a server that is slow across the board.
+
+Hedged requests need a connection that can be used by several threads at once (i.e. a ``DvidConnection``).
+The requests run on a pool of ``MAX_WORKERS`` threads, which all policies share.
+Only use hedging for idempotent requests (GET).  See the ``hedging`` parameter of ``VoxelsAccessor``.
+"""
+import sys
+import time
+import threading
+import collections
+
+import concurrent.futures
+
+from pydvid.util import stream_readinto
+from pydvid.retry import call_without_retries
+from pydvid.replicated_connection import ReplicatedDvidConnection
+
+# The number of threads that run hedged requests (for all policies combined).
+MAX_WORKERS = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """
+    Return the thread pool that runs hedged requests, which is created when it is first needed.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor( MAX_WORKERS )
+        return _executor
+
+class HedgingPolicy(object):
+    """
+    Decides when to send a duplicate request, and runs the resulting 'race'.  Thread-safe.
+
+    Example:
+
+    .. code-block:: python
+
+        policy = HedgingPolicy( percentile=95.0, budget=0.05 )
+        data = policy.call( voxels.get_ndarray, connection, uuid, 'grayscale', metadata, start, stop )
+    """
+
+    class RequestCancelled(Exception):
+        """
+        Raised (in the background) by a hedged request that lost the race.
+        """
+        pass
+
+    def __init__(self, percentile=95.0, budget=0.05, max_burst=10, min_delay=0.001,
+                 min_samples=20, window=200):
+        """
+        :param percentile: A duplicate request is sent if the first byte of the response
+                           hasn't arrived within this percentile of recent response times.
+        :param budget: Duplicates are limited to this fraction of all requests.
+        :param max_burst: At most this many duplicates can be saved up (and sent in quick succession).
+        :param min_delay: Never send a duplicate sooner than this (seconds).
+        :param min_samples: No duplicates are sent until this many response times have been recorded.
+        :param window: The number of recent response times the percentile is computed from.
+        """
+        assert 0 < percentile < 100
+        assert 0 <= budget <= 1
+        self.percentile = percentile
+        self.budget = budget
+        self.max_burst = max_burst
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque( maxlen=window )
+        self._tokens = 0.0
+        self._delay = None
+        self._delay_outdated = True
+        self._num_requests = 0
+        self._num_hedges = 0
+        self._num_hedge_wins = 0
+
+    @property
+    def stats(self):
+        """
+        A dict of the policy's current state:
+
+        - requests: Total number of (original) requests
+        - hedges: Number of duplicate requests sent
+        - hedge_wins: Number of duplicate requests that finished before the original
+        - delay: The current delay before a duplicate is sent (None while there are too few samples)
+        """
+        with self._lock:
+            return { 'requests' : self._num_requests,
+                     'hedges' : self._num_hedges,
+                     'hedge_wins' : self._num_hedge_wins,
+                     'delay' : self._get_delay() }
+
+    def call(self, func, connection, *args, **kwargs):
+        """
+        Call ``func(connection, *args, **kwargs)``, and possibly a duplicate of it.
+        Returns the result of the first call that succeeds.
+        If all calls fail, the first exception is raised.
+
+        The calls are not retried.  (Use a ``RetryPolicy`` around this function for that.)
+        """
+        with self._lock:
+            self._num_requests += 1
+            self._tokens = min( self.max_burst, self._tokens + self.budget )
+            delay = self._get_delay()
+
+        if delay is None:
+            # Not enough samples yet: just call the function directly (and measure it).
+            return func( _HedgedConnection( connection, _Attempt( self, None ) ), *args, **kwargs )
+
+        race = _Race()
+        self._start_attempt( race, func, connection, args, kwargs )
+        if not race.wait_for_first_byte( delay ) and self._take_token():
+            self._start_attempt( race, func, connection, args, kwargs )
+
+        winner = race.wait_for_winner()
+        if winner.index > 0:
+            with self._lock:
+                self._num_hedge_wins += 1
+        return winner.result()
+
+    def record_latency(self, latency):
+        """
+        Record the time until the first byte of a response arrived.
+        """
+        with self._lock:
+            self._latencies.append( latency )
+            self._delay_outdated = True
+
+    def _get_delay(self):
+        """
+        Return the time to wait for the first byte before sending a duplicate request,
+        or None if there aren't enough samples yet.  Must be called with the lock held.
+        """
+        if len(self._latencies) < self.min_samples:
+            return None
+        if self._delay_outdated:
+            latencies = sorted( self._latencies )
+            index = min( len(latencies)-1, int( len(latencies) * self.percentile / 100.0 ) )
+            self._delay = max( self.min_delay, latencies[index] )
+            self._delay_outdated = False
+        return self._delay
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def _start_attempt(self, race, func, connection, args, kwargs):
+        attempt = race.add_attempt( self )
+        if attempt.index > 0:
+            with self._lock:
+                self._num_hedges += 1
+        hedged_connection = _HedgedConnection( connection, attempt )
+        attempt.future = _get_executor().submit( attempt.run, call_without_retries, func, hedged_connection, *args, **kwargs )
+
+class _Race(object):
+    """
+    The original request and its duplicate (if any).
+    """
+    def __init__(self):
+        self._condition = threading.Condition( threading.Lock() )
+        self.attempts = []
+        self.winner = None
+
+    def add_attempt(self, policy):
+        with self._condition:
+            attempt = _Attempt( policy, self, len(self.attempts) )
+            self.attempts.append( attempt )
+            return attempt
+
+    def hostnames_used(self, attempt):
+        """
+        Return the servers that the other attempts sent their requests to (so far).
+        """
+        with self._condition:
+            return set( a.hostname for a in self.attempts if a is not attempt and a.hostname is not None )
+
+    def wait_for_first_byte(self, timeout):
+        """
+        Wait for the first byte of any response (or the end of any attempt).
+        Returns False if the timeout expired first.
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while not any( a.first_byte_received or a.done for a in self.attempts ):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait( remaining )
+            return True
+
+    def wait_for_winner(self):
+        """
+        Wait for the first attempt that succeeds (or for all attempts to fail),
+        cancel the others, and return the winner (or the first failure).
+        """
+        with self._condition:
+            while self.winner is None and not all( a.done for a in self.attempts ):
+                # (Waiting with a timeout allows KeyboardInterrupt.)
+                self._condition.wait( 1.0 )
+            winner = self.winner or self.attempts[0]
+            for attempt in self.attempts:
+                if attempt is not winner:
+                    attempt.cancelled = True
+        for attempt in self.attempts:
+            if attempt is not winner:
+                attempt.future.cancel()
+        return winner
+
+    def notify(self, attempt):
+        with self._condition:
+            if attempt.done and attempt.exc_info is None and self.winner is None:
+                self.winner = attempt
+            self._condition.notify_all()
+
+class _Attempt(object):
+    """
+    A single request within a race.
+    """
+    def __init__(self, policy, race, index=0):
+        self.policy = policy
+        self.race = race
+        self.index = index
+        self.future = None
+        self.hostname = None
+        self.start_time = time.time()
+        self.first_byte_received = False
+        self.cancelled = False
+        self.done = False
+        self._result = None
+        self.exc_info = None
+
+    def run(self, func, *args, **kwargs):
+        try:
+            self._result = func( *args, **kwargs )
+        except:
+            self.exc_info = sys.exc_info()
+        self.done = True
+        self.race.notify( self )
+
+    def result(self):
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self._result
+
+    def on_first_byte(self):
+        self.first_byte_received = True
+        self.policy.record_latency( time.time() - self.start_time )
+        if self.race is not None:
+            self.race.notify( self )
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise HedgingPolicy.RequestCancelled( "Another request for the same data finished first." )
+
+class _HedgedConnection(object):
+    """
+    Wraps a connection for a single attempt, to measure the time to its first byte,
+    and to stop reading its response if the attempt is cancelled.
+    With a ``ReplicatedDvidConnection``, it also keeps the attempts of a race on different servers.
+    """
+    def __init__(self, connection, attempt):
+        self._connection = connection
+        self._attempt = attempt
+
+    def __getattr__(self, name):
+        return getattr( self._connection, name )
+
+    def request(self, *args, **kwargs):
+        self._attempt.check_cancelled()
+        if not isinstance( self._connection, ReplicatedDvidConnection ) or self._attempt.race is None:
+            self._connection.request( *args, **kwargs )
+            return
+        avoid_hostnames = self._attempt.race.hostnames_used( self._attempt )
+        self._connection.request( *args, avoid_hostnames=avoid_hostnames, **kwargs )
+        self._attempt.hostname = self._connection.current_hostname
+
+    def getresponse(self):
+        response = self._connection.getresponse()
+        self._attempt.on_first_byte()
+        response = _CancellableResponse( response, self._attempt )
+        try:
+            self._attempt.check_cancelled()
+        except:
+            response.close()
+            raise
+        return response
+
+class _CancellableResponse(object):
+    """
+    Wraps a response, and raises RequestCancelled as soon as its attempt is cancelled.
+    (Closing the response before it is completely read drains or discards its connection, as usual.)
+    """
+    def __init__(self, response, attempt):
+        self._response = response
+        self._attempt = attempt
+
+    def __getattr__(self, name):
+        return getattr( self._response, name )
+
+    def read(self, *args):
+        self._attempt.check_cancelled()
+        return self._response.read( *args )
+
+    def readinto(self, view):
+        self._attempt.check_cancelled()
+        return stream_readinto( self._response, view )
+
+    def close(self):
+        self._response.close()
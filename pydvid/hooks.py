@@ -0,0 +1,312 @@
+"""
+Opt-in hooks that observe the requests made by pydvid (e.g. for logging, tracing or metrics).
+
+A hook is a ``RequestHook`` subclass.  Register it for all requests, or only for the requests
+made via a particular connection (e.g. a ``DvidConnection``):
+
+.. code-block:: python
+
+    pydvid.hooks.add_hook( LoggingHook() )
+    pydvid.hooks.add_hook( my_tracing_hook, connection=my_connection )
+
+The request functions in ``pydvid.general``, ``pydvid.keyvalue``, ``pydvid.labelgraph`` and ``pydvid.voxels``
+(and hence ``VoxelsAccessor``) call the hooks as each request progresses, with a ``RequestTiming``
+that records the request's phases:
+
+- acquire: Waiting for a pooled connection and the limiters' permission (``DvidConnection`` only)
+- send: Sending the request (headers and body)
+- first_byte: Waiting for the response headers
+- transfer: Receiving the response body
+- decode: Everything else, i.e. decoding the response and copying the data
+
+Until a hook is registered, each request function only checks a single global variable.
+(Unlike earlier versions, pydvid doesn't modify ``httplib``, so requests made by other libraries are unaffected.)
+"""
+import time
+import logging
+import operator
+import functools
+import threading
+
+from pydvid.util import stream_readinto
+from pydvid.errors import DvidHttpError
+from pydvid.retry import current_attempt
+
+PHASES = ( 'acquire', 'send', 'first_byte', 'transfer', 'decode' )
+
+class RequestHook(object):
+    """
+    Base class for request subscribers.  Override the methods for the events you're interested in.
+    The methods are called in the thread that makes the request, so they should return quickly.
+    """
+    def request_started(self, timing):
+        """
+        Called just before the request is sent.  (The timing's method, url, host and port are known.)
+        """
+        pass
+
+    def response_received(self, timing):
+        """
+        Called when the response headers have arrived.  (The timing's status is known.)
+        """
+        pass
+
+    def request_finished(self, timing):
+        """
+        Called when the request is complete, or failed (see ``timing.error``).
+        """
+        pass
+
+class LoggingHook(RequestHook):
+    """
+    Logs each request as it is sent, and its outcome.
+    """
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger("pydvid.requests")
+        self.level = level
+
+    def request_started(self, timing):
+        self.logger.log( self.level, "{} {}:{}{}".format( timing.method, timing.host, timing.port, timing.url ) )
+
+    def request_finished(self, timing):
+        outcome = timing.status if timing.error is None else repr(timing.error)
+        self.logger.log( self.level, "{} {}:{}{} -> {} ({:.1f} ms)"
+                         .format( timing.method, timing.host, timing.port, timing.url, outcome, 1000*timing.total ) )
+
+class RequestTiming(object):
+    """
+    The measurements for a single request (i.e. a single attempt, if the request is retried).
+    Durations are in seconds.
+
+    Hooks may store their own data for the request (e.g. a tracing span) in the ``context`` attribute.
+    """
+    __slots__ = ( 'endpoint', 'method', 'url', 'host', 'port', 'attempt', 'status', 'error', 'start_time', 'total',
+                  'acquire', 'send', 'first_byte', 'transfer', 'decode', 'bytes_sent', 'bytes_received',
+                  'context', '_request_start' )
+
+    def __init__(self, endpoint, attempt=1):
+        self.endpoint = endpoint
+        self.method = None
+        self.url = None
+        self.host = None
+        self.port = None
+        self.attempt = attempt
+        self.status = None
+        self.error = None
+        self.start_time = time.time()
+        self.total = None
+        self.acquire = 0.0
+        self.send = 0.0
+        self.first_byte = 0.0
+        self.transfer = 0.0
+        self.decode = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.context = None
+        self._request_start = None
+
+    def mark_acquired(self):
+        """
+        Called by the connection once it has obtained a socket for the request.
+        """
+        self.acquire = time.time() - self._request_start
+
+    def finish(self):
+        self.total = time.time() - self.start_time
+        self.decode = max( 0.0, self.total - self.acquire - self.send - self.first_byte - self.transfer )
+
+    def to_dict(self):
+        d = dict( (name, getattr(self, name)) for name in self.__slots__ if not name.startswith('_') )
+        del d['context']
+        if d['error'] is not None:
+            d['error'] = repr( d['error'] )
+        return d
+
+# Hooks for all requests
+_global_hooks = ()
+
+# The number of hooks registered for particular connections
+_num_connection_hooks = 0
+
+# True if any hook is registered.  (Otherwise, requests aren't instrumented at all.)
+_hooks_in_use = False
+
+_hooks_lock = threading.Lock()
+
+# The RequestTiming of the request in progress in the current thread (if any).
+_thread_state = threading.local()
+
+def add_hook( hook, connection=None ):
+    """
+    Call the given ``RequestHook`` for all requests, or only for those made via the given connection.
+    """
+    global _global_hooks, _num_connection_hooks
+    with _hooks_lock:
+        if connection is None:
+            _global_hooks = _global_hooks + (hook,)
+        else:
+            connection.request_hooks = getattr( connection, 'request_hooks', () ) + (hook,)
+            _num_connection_hooks += 1
+        _update_hooks_in_use()
+
+def remove_hook( hook, connection=None ):
+    """
+    Unregister a hook that was registered via ``add_hook()`` (with the same connection).
+    """
+    global _global_hooks, _num_connection_hooks
+    with _hooks_lock:
+        if connection is None:
+            hooks = _global_hooks
+        else:
+            hooks = getattr( connection, 'request_hooks', () )
+        if hook not in hooks:
+            return
+        index = hooks.index(hook)
+        hooks = hooks[:index] + hooks[index+1:]
+        if connection is None:
+            _global_hooks = hooks
+        else:
+            connection.request_hooks = hooks
+            _num_connection_hooks -= 1
+        _update_hooks_in_use()
+
+def get_hooks( connection=None ):
+    """
+    Return the hooks that are called for requests made via the given connection.
+    """
+    return _global_hooks + getattr( connection, 'request_hooks', () )
+
+def _update_hooks_in_use():
+    global _hooks_in_use
+    _hooks_in_use = bool(_global_hooks) or _num_connection_hooks > 0
+
+def current_timing():
+    """
+    Return the RequestTiming for the instrumented request in progress in this thread, or None.
+    """
+    if not _hooks_in_use:
+        return None
+    return getattr( _thread_state, 'timing', None )
+
+def set_endpoint( endpoint ):
+    """
+    Override the endpoint label of the instrumented request in progress in this thread (if any).
+    """
+    timing = current_timing()
+    if timing is not None:
+        timing.endpoint = endpoint
+
+def instrumented( endpoint ):
+    """
+    Decorator for request functions, whose first argument is the connection.
+    If any hooks are registered for the connection, the function's request is timed,
+    and the hooks are called with the given endpoint label, e.g. 'keyvalue'.
+    (Nested instrumented functions are treated as a single request.)
+    """
+    def decorator( func ):
+        @functools.wraps(func)
+        def _instrumented_wrapper( connection, *args, **kwargs ):
+            if not _hooks_in_use or getattr( _thread_state, 'timing', None ) is not None:
+                return func( connection, *args, **kwargs )
+            hooks = get_hooks( connection )
+            if not hooks:
+                return func( connection, *args, **kwargs )
+            return _call_instrumented( hooks, endpoint, func, connection, args, kwargs )
+        return _instrumented_wrapper
+    return decorator
+
+def _call_instrumented( hooks, endpoint, func, connection, args, kwargs ):
+    timing = RequestTiming( endpoint, current_attempt() )
+    _thread_state.timing = timing
+    try:
+        return func( _TimedConnection( connection, timing, hooks ), *args, **kwargs )
+    except DvidHttpError as ex:
+        timing.status = ex.status_code
+        timing.error = ex
+        raise
+    except Exception as ex:
+        timing.status = None
+        timing.error = ex
+        raise
+    finally:
+        _thread_state.timing = None
+        timing.finish()
+        for hook in hooks:
+            hook.request_finished( timing )
+
+class _TimedConnection(object):
+    """
+    Wraps a connection to measure the phases of the requests sent on it, and to call the hooks.
+    """
+    def __init__(self, connection, timing, hooks):
+        self._connection = connection
+        self._timing = timing
+        self._hooks = hooks
+
+    def __getattr__(self, name):
+        return getattr( self._connection, name )
+
+    def request(self, method, url, body=None, headers={}):
+        timing = self._timing
+        timing.method = method
+        timing.url = url
+        timing.host = getattr( self._connection, 'host', None )
+        timing.port = getattr( self._connection, 'port', None )
+        timing.bytes_sent += _body_size( body )
+        for hook in self._hooks:
+            hook.request_started( timing )
+
+        timing._request_start = time.time()
+        timing.acquire = 0.0
+        self._connection.request( method, url, body, headers )
+        timing.send += time.time() - timing._request_start - timing.acquire
+
+    def getresponse(self):
+        start_time = time.time()
+        response = self._connection.getresponse()
+        self._timing.first_byte += time.time() - start_time
+        self._timing.status = response.status
+        for hook in self._hooks:
+            hook.response_received( self._timing )
+        return _TimedResponse( response, self._timing )
+
+class _TimedResponse(object):
+    """
+    Wraps a response to measure the time spent receiving its body.
+    """
+    def __init__(self, response, timing):
+        self._response = response
+        self._timing = timing
+
+    def __getattr__(self, name):
+        return getattr( self._response, name )
+
+    def read(self, *args):
+        start_time = time.time()
+        data = self._response.read( *args )
+        self._timing.transfer += time.time() - start_time
+        self._timing.bytes_received += len(data)
+        return data
+
+    def readinto(self, view):
+        start_time = time.time()
+        nbytes = stream_readinto( self._response, view )
+        self._timing.transfer += time.time() - start_time
+        self._timing.bytes_received += nbytes
+        return nbytes
+
+    def close(self):
+        self._response.close()
+
+def _body_size( body ):
+    """
+    Return the size of the given request body, or 0 if it can't be determined (e.g. for a file).
+    """
+    if body is None:
+        return 0
+    if isinstance( body, memoryview ):
+        return reduce( operator.mul, body.shape, 1 ) * body.itemsize
+    try:
+        return len(body)
+    except TypeError:
+        return 0
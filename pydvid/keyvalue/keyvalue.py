@@ -1,9 +1,18 @@
+import Queue
+import socket
 import httplib
+import threading
 import contextlib
+import collections
 from pydvid.errors import DvidHttpError, UnexpectedResponseError
-from pydvid.util import get_json_generic
+from pydvid.util import get_json_generic, stream_readinto, stream_write
+from pydvid.retry import auto_retry, get_default_policy, BUSY_STATUS_CODES
+from pydvid.hooks import instrumented, get_hooks
+from pydvid.node_cache import cached_read, invalidating, get_cache
+from pydvid.dvid_connection import get_shared_executor
 import json
 
+@instrumented('keyvalue')
 def create_new( connection, uuid, data_name ):
     """
     Create a new keyvalue table in the dvid server.
@@ -18,8 +27,11 @@ def create_new( connection, uuid, data_name ):
         #if response.status != httplib.NO_CONTENT:
         if response.status != httplib.OK:
             raise DvidHttpError( "keyvalue.create_new", response.status, response.reason, 
-                                 response.read(), "POST", rest_cmd )
+                                 response.read(), "POST", rest_cmd, response_headers=response.getheaders() )
 
+@cached_read( 'value', lambda connection, uuid, data_name, key: (uuid, data_name, key) )
+@auto_retry
+@instrumented('keyvalue')
 def get_value( connection, uuid, data_name, key ):
     """
     Request the value for the given key and return the whole thing.
@@ -27,11 +39,19 @@ def get_value( connection, uuid, data_name, key ):
     response = get_value_response( connection, uuid, data_name, key ) 
     return response.read()
 
+@invalidating
 def put_value( connection, uuid, data_name, key, value ):
     """
     Store the given value to the keyvalue data.
     value should be either str or a file-like object with fileno() and read() methods.
+    (A file-like value can't be sent twice, so failed requests are retried only if value is a str.)
     """
+    if isinstance( value, (str, bytearray, memoryview) ):
+        return get_default_policy().call( _put_value, connection, uuid, data_name, key, value )
+    return _put_value( connection, uuid, data_name, key, value )
+
+@instrumented('keyvalue')
+def _put_value( connection, uuid, data_name, key, value ):
     rest_cmd = "/api/node/{uuid}/{data_name}/{key}".format( **locals() )
     headers = { "Content-Type" : "application/octet-stream" }
     connection.request( "POST", rest_cmd, body=value, headers=headers )
@@ -40,18 +60,415 @@ def put_value( connection, uuid, data_name, key, value ):
         if response.status != httplib.OK:
             raise DvidHttpError( 
                 "keyvalue post", response.status, response.reason, response.read(),
-                 "POST", rest_cmd, "<binary data>", headers)
+                 "POST", rest_cmd, "<binary data>", headers, response.getheaders() )
         
         # Something (either dvid or the httplib) gets upset if we don't read the full response.
         response.read()
 
+@instrumented('keyvalue')
+def get_value_to( connection, uuid, data_name, key, destination, chunk_bytes=2**20 ):
+    """
+    Stream the value for the given key into the given destination, 
+    without holding the whole value in memory.  Returns the number of bytes received.
+
+    :param destination: Either a file-like object with a write() method, which receives the value 
+                        in chunks of at most ``chunk_bytes``, or a writable buffer of bytes 
+                        (e.g. a bytearray or an mmap), which the value is received into directly.
+                        A buffer must be large enough for the whole value.
+    """
+    with contextlib.closing( get_value_response( connection, uuid, data_name, key ) ) as response:
+        if hasattr( destination, 'write' ):
+            chunk = memoryview( bytearray( _value_chunk_bytes( response, chunk_bytes ) ) )
+            total_bytes = 0
+            while True:
+                received_bytes = _read_value_chunk( response, chunk )
+                if received_bytes == 0:
+                    return total_bytes
+                stream_write( destination, chunk[:received_bytes] )
+                total_bytes += received_bytes
+
+        view = memoryview( destination )
+        if response.length is not None and response.length > len(view):
+            raise ValueError( "The value for key '{}' ({} bytes) is larger than the destination buffer ({} bytes)"
+                              "".format( key, response.length, len(view) ) )
+        chunk_bytes = _value_chunk_bytes( response, chunk_bytes )
+        position = 0
+        while position < len(view):
+            received_bytes = _read_value_chunk( response, view[position:position+chunk_bytes] )
+            if received_bytes == 0:
+                return position
+            position += received_bytes
+        if response.read(1) != "":
+            raise ValueError( "The value for key '{}' is larger than the destination buffer ({} bytes)"
+                              "".format( key, len(view) ) )
+        return position
+
+def iter_value_chunks( connection, uuid, data_name, key, chunk_bytes=2**20 ):
+    """
+    Return an iterator over the value for the given key, as a series of strings of at most ``chunk_bytes`` each.
+    The value is streamed from the server as the iterator is consumed.
+    (Close the iterator to abandon the rest of the value.)
+    """
+    response = get_value_response( connection, uuid, data_name, key )
+    return _iter_response_chunks( response, _value_chunk_bytes( response, chunk_bytes ) )
+
+def _iter_response_chunks( response, chunk_bytes ):
+    rate_limiter = getattr( response, 'rate_limiter', None )
+    with contextlib.closing( response ):
+        while True:
+            data = response.read( chunk_bytes )
+            if not data:
+                return
+            if rate_limiter is not None:
+                rate_limiter.throttle_bytes( len(data) )
+            yield data
+
+def _value_chunk_bytes( response, chunk_bytes ):
+    """
+    If the response is paced by a rate limiter, read it in smaller chunks so it's paced smoothly.
+    """
+    rate_limiter = getattr( response, 'rate_limiter', None )
+    if rate_limiter is not None and rate_limiter.max_chunk_size is not None:
+        return min( chunk_bytes, rate_limiter.max_chunk_size )
+    return chunk_bytes
+
+def _read_value_chunk( response, view ):
+    """
+    Receive up to len(view) bytes of the response directly into the view.
+    Returns the number of bytes received, which is less than len(view) only at the end of the value.
+    """
+    position = 0
+    while position < len(view):
+        received_bytes = stream_readinto( response, view[position:] )
+        if received_bytes == 0:
+            break
+        position += received_bytes
+    rate_limiter = getattr( response, 'rate_limiter', None )
+    if rate_limiter is not None:
+        rate_limiter.throttle_bytes( position )
+    return position
+
+@invalidating
+@instrumented('keyvalue')
+def put_value_from( connection, uuid, data_name, key, source, length=None, chunk_bytes=2**20 ):
+    """
+    Store a value that is read from the given source as it is sent, without holding the whole value in memory.
+
+    :param source: Either a file-like object with a read() method, or an iterable of str (or buffer) chunks.
+    :param length: The total size of the value, if known.  Otherwise, the value is sent with chunked 
+                   transfer encoding.  (A ValueError is raised if the source's size doesn't match the given length.)
+    :param chunk_bytes: The size of each read() from a file-like source.
+
+    Since the source can't be sent twice, a failed request is not retried.
+    """
+    rest_cmd = "/api/node/{uuid}/{data_name}/{key}".format( **locals() )
+    headers = { "Content-Type" : "application/octet-stream" }
+    if length is None:
+        headers["Transfer-Encoding"] = "chunked"
+    else:
+        headers["Content-Length"] = str(length)
+    body = _StreamingBody( source, length, chunk_bytes )
+    body.rate_limiter = getattr( connection, 'rate_limiter', None )
+    connection.request( "POST", rest_cmd, body=body, headers=headers )
+    with contextlib.closing( connection.getresponse() ) as response:
+        if response.status != httplib.OK:
+            raise DvidHttpError( 
+                "keyvalue post", response.status, response.reason, response.read(),
+                 "POST", rest_cmd, "<streamed data>", headers, response.getheaders() )
+        response.read()
+
+class _StreamingBody(object):
+    """
+    A (forward-only) request body stream for put_value_from(), which reads the value from its source lazily.
+    httplib sends whatever read() returns, until it returns an empty string.
+    If the length isn't known, each piece is framed for chunked transfer encoding.
+    (This class intentionally has no __len__ or fileno(), so httplib doesn't add a Content-Length header of its own.)
+    As with VoxelsNddataCodec.EncodedStream, a rate_limiter may be assigned to pace read().
+    """
+    rate_limiter = None
+
+    def __init__(self, source, length, chunk_bytes):
+        if hasattr( source, 'read' ):
+            self._pieces = self._iter_stream( source, chunk_bytes )
+        else:
+            self._pieces = iter( source )
+        self._remaining = length
+        self._pending = collections.deque()
+        self._finished = False
+
+    @staticmethod
+    def _iter_stream( stream, chunk_bytes ):
+        while True:
+            data = stream.read( chunk_bytes )
+            if not data:
+                return
+            yield data
+
+    def read(self, nbytes=None):
+        # (nbytes is ignored: the source's pieces are passed on as they are, to avoid copying them.)
+        while not self._pending and not self._finished:
+            self._read_next_piece()
+        if not self._pending:
+            return ""
+        return self._pending.popleft()
+
+    def _read_next_piece(self):
+        piece = next( self._pieces, None )
+        if piece is None:
+            self._finished = True
+            if self._remaining is None:
+                self._pending.append( "0\r\n\r\n" )
+            elif self._remaining > 0:
+                raise ValueError( "The value ended {} bytes short of its given length.".format( self._remaining ) )
+            return
+
+        piece_bytes = len( piece )
+        if piece_bytes == 0:
+            return
+        if self.rate_limiter is not None:
+            self.rate_limiter.throttle_bytes( piece_bytes )
+        if self._remaining is None:
+            self._pending.extend( [ "{:x}\r\n".format( piece_bytes ), piece, "\r\n" ] )
+        else:
+            if piece_bytes > self._remaining:
+                raise ValueError( "The value is longer than its given length." )
+            self._remaining -= piece_bytes
+            self._pending.append( piece )
+
+def get_values( connection, uuid, data_name, keys, max_concurrency=None, pipeline_depth=16 ):
+    """
+    Fetch the values of many keys at once.
+    Returns an iterator of ``(key, value, error)`` tuples, which are produced as soon as the values arrive
+    (so not necessarily in the same order as ``keys``).  If a key's value couldn't be fetched
+    (e.g. because the key doesn't exist), its value is None and error is the exception.
+
+    The requests are run on the connection's shared executor (see ``get_shared_executor()``).
+    Over a ``DvidConnection``, the keys are requested in batches of ``pipeline_depth``, each of which is sent
+    at once on a single connection (see ``DvidConnection.iter_pipelined_responses()``).
+    Otherwise (or while request hooks or the node cache are in use), each key is fetched via ``get_value()``.
+
+    :param max_concurrency: The maximum number of batches in progress at once.
+                            (Default: the connection's ``max_connections``, or 1.)
+    :param pipeline_depth: The number of requests sent at once on each connection.
+    """
+    keys = list(keys)
+    if _can_pipeline( connection ):
+        batches = [ keys[i:i+pipeline_depth] for i in range(0, len(keys), pipeline_depth) ]
+        batch_func = _get_values_pipelined
+    else:
+        batches = [ [key] for key in keys ]
+        batch_func = _get_values_one_by_one
+    return _run_batches( connection, uuid, data_name, batch_func, batches, max_concurrency )
+
+def put_values( connection, uuid, data_name, items, max_concurrency=None, pipeline_depth=16, max_batch_bytes=2**16 ):
+    """
+    Store many values at once.  ``items`` is a dict or an iterable of ``(key, value)`` pairs.
+    Returns an iterator of ``(key, error)`` tuples, which are produced as soon as each write is finished.
+    (error is None if the write succeeded.)  The writes start immediately, and are all carried out
+    even if the iterator is never consumed.  Consume it (e.g. with ``list()``) to wait for them and check for errors.
+
+    Small values are sent in pipelined batches, as in ``get_values()``.
+    A batch is at most ``pipeline_depth`` values and ``max_batch_bytes`` in total,
+    since all of its values are sent before any response is read.
+    Larger values (and file-like values) are sent one at a time via ``put_value()``.
+    """
+    if isinstance( items, dict ):
+        items = items.items()
+    pipelining = _can_pipeline( connection )
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for key, value in items:
+        if not pipelining or not isinstance( value, (str, bytearray, memoryview) ) or len(value) > max_batch_bytes:
+            batches.append( [(key, value)] )
+            continue
+        if batch and ( len(batch) == pipeline_depth or batch_bytes + len(value) > max_batch_bytes ):
+            batches.append( batch )
+            batch = []
+            batch_bytes = 0
+        batch.append( (key, value) )
+        batch_bytes += len(value)
+    if batch:
+        batches.append( batch )
+    return _start_batches( connection, uuid, data_name, _put_values_batch, batches, max_concurrency )
+
+def _can_pipeline( connection ):
+    """
+    Pipelined requests bypass the per-request hooks and the node cache,
+    so they're only used if neither is active.
+    """
+    return ( hasattr( connection, 'iter_pipelined_responses' )
+             and get_cache() is None
+             and not get_hooks( connection ) )
+
+def _run_batches( connection, uuid, data_name, batch_func, batches, max_concurrency ):
+    """
+    Run ``batch_func( connection, uuid, data_name, batch )`` for each batch on the connection's shared executor,
+    with at most max_concurrency batches in progress at once, and yield each batch's results as it finishes.
+    Batches that haven't started yet are cancelled if the generator is closed.
+    """
+    import concurrent.futures
+    executor = get_shared_executor( connection )
+    if max_concurrency is None:
+        max_concurrency = getattr( connection, 'max_connections', 1 )
+    batches = iter(batches)
+    pending = set()
+    try:
+        while True:
+            for batch in batches:
+                pending.add( executor.submit( batch_func, connection, uuid, data_name, batch ) )
+                if len(pending) >= max_concurrency:
+                    break
+            if not pending:
+                return
+            done, pending = concurrent.futures.wait( pending, return_when=concurrent.futures.FIRST_COMPLETED )
+            for future in done:
+                for result in future.result():
+                    yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _start_batches( connection, uuid, data_name, batch_func, batches, max_concurrency ):
+    """
+    Like _run_batches(), but the batches are started right away, and all of them are run
+    whether or not the returned iterator (of each batch's results, as it finishes) is consumed.
+    """
+    executor = get_shared_executor( connection )
+    if max_concurrency is None:
+        max_concurrency = getattr( connection, 'max_connections', 1 )
+    batches = list(batches)
+    unstarted = iter(batches)
+    unstarted_lock = threading.Lock()
+    finished = Queue.Queue()
+
+    def start_next_batch():
+        with unstarted_lock:
+            batch = next( unstarted, None )
+        if batch is not None:
+            executor.submit( batch_func, connection, uuid, data_name, batch ).add_done_callback( on_batch_done )
+
+    def on_batch_done( future ):
+        # (Called in the worker thread, which then starts the next batch.)
+        finished.put( future )
+        start_next_batch()
+
+    for _ in range( min( max_concurrency, len(batches) ) ):
+        start_next_batch()
+    return _iter_batch_results( finished, len(batches) )
+
+def _iter_batch_results( finished, num_batches ):
+    for _ in range( num_batches ):
+        for result in finished.get().result():
+            yield result
+
+def _get_values_one_by_one( connection, uuid, data_name, keys ):
+    results = []
+    for key in keys:
+        try:
+            results.append( (key, get_value( connection, uuid, data_name, key ), None) )
+        except Exception as ex:
+            results.append( (key, None, ex) )
+    return results
+
+def _get_values_pipelined( connection, uuid, data_name, keys ):
+    """
+    Fetch the given keys with pipelined requests.
+    If the server closes the connection before answering all of them (e.g. after an error response),
+    the rest are sent again.  Keys whose requests failed outright, or that were answered with a "busy" status,
+    are fetched via ``get_value()`` (with the usual retries).  So is the last key, if it's the only one left.
+    Any other exception is reported as the error of every key that hasn't been answered.
+    """
+    results = []
+    retry_keys = []
+    remaining = keys
+    while len(remaining) > 1:
+        requests = [ ("GET", "/api/node/{}/{}/{}".format( uuid, data_name, key ), None, {}) for key in remaining ]
+        num_answered = 0
+        try:
+            with contextlib.closing( connection.iter_pipelined_responses( requests ) ) as responses:
+                for response in responses:
+                    key = remaining[num_answered]
+                    if response.status == httplib.OK:
+                        results.append( (key, response.read(), None) )
+                    elif response.status in BUSY_STATUS_CODES:
+                        response.read()
+                        retry_keys.append( key )
+                    else:
+                        error = DvidHttpError( 
+                            "keyvalue request", response.status, response.reason, response.read(),
+                            "GET", requests[num_answered][1], "", response_headers=response.getheaders() )
+                        results.append( (key, None, error) )
+                    num_answered += 1
+        except (socket.error, httplib.HTTPException):
+            pass
+        except Exception as ex:
+            # Not a network problem (e.g. PoolTimeoutError), so don't retry:
+            #  the keys that haven't been answered yet all get this error.
+            return results + [ (key, None, ex) for key in retry_keys + remaining[num_answered:] ]
+        if num_answered == 0:
+            break
+        remaining = remaining[num_answered:]
+    return results + _get_values_one_by_one( connection, uuid, data_name, retry_keys + remaining )
+
+@invalidating
+def _put_values_batch( connection, uuid, data_name, items ):
+    """
+    Store the given (key, value) pairs with pipelined requests.
+    As in _get_values_pipelined(), unanswered requests are sent again,
+    and failed or rejected requests are repeated via ``put_value()``.
+    """
+    results = []
+    retry_items = []
+    remaining = items
+    while len(remaining) > 1:
+        headers = { "Content-Type" : "application/octet-stream" }
+        requests = [ ("POST", "/api/node/{}/{}/{}".format( uuid, data_name, key ), value, headers)
+                     for key, value in remaining ]
+        num_answered = 0
+        try:
+            with contextlib.closing( connection.iter_pipelined_responses( requests ) ) as responses:
+                for response in responses:
+                    key, value = remaining[num_answered]
+                    body = response.read()
+                    if response.status == httplib.OK:
+                        results.append( (key, None) )
+                    elif response.status in BUSY_STATUS_CODES:
+                        retry_items.append( (key, value) )
+                    else:
+                        error = DvidHttpError( 
+                            "keyvalue post", response.status, response.reason, body,
+                             "POST", requests[num_answered][1], "<binary data>", headers, response.getheaders() )
+                        results.append( (key, error) )
+                    num_answered += 1
+        except (socket.error, httplib.HTTPException):
+            pass
+        except Exception as ex:
+            # As in _get_values_pipelined()
+            return results + [ (key, ex) for key, _ in retry_items + remaining[num_answered:] ]
+        if num_answered == 0:
+            break
+        remaining = remaining[num_answered:]
+
+    for key, value in retry_items + remaining:
+        try:
+            put_value( connection, uuid, data_name, key, value )
+            results.append( (key, None) )
+        except Exception as ex:
+            results.append( (key, ex) )
+    return results
+
 def del_value( connection, uuid, data_name, key, value ):
     assert False, "TODO"
 
+@cached_read( 'keys', lambda connection, uuid, data_name: (uuid, data_name, ()) )
+@auto_retry
+@instrumented('keyvalue')
 def get_keys( connection, uuid, data_name ):
     rest_query = "/api/node/{uuid}/{data_name}/keys".format( **locals() )
     return get_json_generic( connection, rest_query, schema='dvid-keyvalue-keys-v0.01.schema.json' )
 
+@auto_retry
 def get_value_response( connection, uuid, data_name, key ):
     """
     Request the value for the given key return the raw HTTPResponse object.
@@ -63,7 +480,7 @@ def get_value_response( connection, uuid, data_name, key ):
     if response.status != httplib.OK:
         raise DvidHttpError( 
             "keyvalue request", response.status, response.reason, response.read(),
-            "GET", rest_query, "" )
+            "GET", rest_query, "", response_headers=response.getheaders() )
     return response
 
 if __name__ == "__main__":
@@ -1,8 +1,11 @@
 import httplib
 import contextlib
 from pydvid.errors import DvidHttpError, UnexpectedResponseError
+from pydvid.retry import auto_retry
+from pydvid.hooks import instrumented
 import json
 
+@instrumented('labelgraph')
 def create_new( connection, uuid, data_name ):
     """
     Create a new labelgraph in the dvid server.
@@ -17,7 +20,7 @@ def create_new( connection, uuid, data_name ):
         #if response.status != httplib.NO_CONTENT:
         if response.status != httplib.OK:
             raise DvidHttpError( "labelgraph.create_new", response.status, response.reason, 
-                                 response.read(), "POST", rest_cmd )
+                                 response.read(), "POST", rest_cmd, response_headers=response.getheaders() )
 
 
 def update_vertices( connection, uuid, data_name, vertex_list ):
@@ -37,6 +40,8 @@ def update_vertex( connection, uuid, data_name, vert, weight ):
     _update_vertices(conection, uuid, data_name, vertex_list) 
 
 
+@auto_retry
+@instrumented('labelgraph')
 def _update_vertices( connection, uuid, data_name, vertex_list):
     """
     Create or update vertices in the label graph
@@ -62,7 +67,7 @@ def _update_vertices( connection, uuid, data_name, vertex_list):
         if response.status != httplib.OK:
             raise DvidHttpError( 
                 "labelgraph vertex post", response.status, response.reason, response.read(),
-                 "POST", rest_cmd, "json data", headers)
+                 "POST", rest_cmd, "json data", headers, response.getheaders() )
         
         # Something (either dvid or the httplib) gets upset if we don't read the full response.
         response.read()
@@ -88,6 +93,8 @@ def update_edge( connection, uuid, data_name, vert1, vert2, weight ):
     _update_edges(conection, uuid, data_name, edge_list) 
 
 
+@auto_retry
+@instrumented('labelgraph')
 def _update_edges( connection, uuid, data_name, edge_list):
     # construct graph                                                                            
     graph_data = {}
@@ -110,7 +117,7 @@ def _update_edges( connection, uuid, data_name, edge_list):
         if response.status != httplib.OK:
             raise DvidHttpError( 
                 "labelgraph edge post", response.status, response.reason, response.read(),
-                 "POST", rest_cmd, "json data", headers)
+                 "POST", rest_cmd, "json data", headers, response.getheaders() )
         
         # Something (either dvid or the httplib) gets upset if we don't read the full response.
         response.read()
@@ -0,0 +1,247 @@
+"""
+An in-process registry of request metrics.
+
+Enable it to record every request made by the request functions in ``pydvid.general``, ``pydvid.keyvalue``,
+``pydvid.labelgraph`` and ``pydvid.voxels`` (and hence by ``VoxelsAccessor``):
+
+.. code-block:: python
+
+    registry = pydvid.metrics.enable()
+    ...
+    print registry.to_prometheus()
+
+The duration of each request's phases (see ``pydvid.hooks``), the number of bytes sent and received,
+and the number of requests and retries are recorded in the registry, labelled by endpoint
+('raw', 'mask', 'keyvalue', 'labelgraph', 'metadata' or 'server') and HTTP method.
+Callbacks can be registered to receive the ``RequestTiming`` of each request.
+
+The registry is a request hook, so while it is disabled (and no other hooks are registered),
+requests aren't instrumented at all.
+"""
+import json
+import bisect
+import threading
+
+from pydvid.hooks import RequestHook, RequestTiming, PHASES, add_hook, remove_hook
+
+# Upper bounds of the histogram buckets for durations (seconds) and sizes (bytes)
+DURATION_BUCKETS = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+SIZE_BUCKETS = tuple( 2**n for n in range(8, 32, 2) )
+
+class Histogram(object):
+    """
+    Counts observations in buckets with fixed upper bounds (cumulatively, as in Prometheus).
+    Not thread-safe by itself: the registry's lock protects it.
+    """
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[ bisect.bisect_left( self.bounds, value ) ] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        Return a list of (upper_bound, count) pairs, where count includes all observations <= upper_bound.
+        """
+        total = 0
+        result = []
+        for bound, count in zip( self.bounds + (float('inf'),), self.counts ):
+            total += count
+            result.append( (bound, total) )
+        return result
+
+class MetricsRegistry(RequestHook):
+    """
+    Stores histograms and counters, each identified by a name and a set of labels.  Thread-safe.
+
+    As a ``RequestHook``, it records each request it is called for.
+    (``enable()`` registers it for all requests, but it may also be registered for a single connection.)
+    """
+
+    # name : (type, help)
+    DESCRIPTIONS = { 'pydvid_request_duration_seconds' : ('histogram', 'Duration of each phase of a request'),
+                     'pydvid_request_size_bytes' : ('histogram', 'Size of request and response bodies'),
+                     'pydvid_requests_total' : ('counter', 'Requests, by response status'),
+                     'pydvid_request_retries_total' : ('counter', 'Requests that repeated a failed request') }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {} # (name, labels) : Histogram
+        self._counters = {}   # (name, labels) : value
+        self._descriptions = dict( MetricsRegistry.DESCRIPTIONS )
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        """
+        Register a function to be called with the ``RequestTiming`` of each recorded request.
+        (It is called in the thread that made the request, so it should return quickly.)
+        """
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks = [ c for c in self._callbacks if c != callback ]
+
+    def describe(self, name, metric_type, help_text):
+        """
+        Provide the type ('histogram' or 'counter') and description of a custom metric, for the Prometheus export.
+        """
+        with self._lock:
+            self._descriptions[name] = (metric_type, help_text)
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        """
+        Add an observation to the given histogram.
+        """
+        key = ( name, tuple(sorted(labels.items())) )
+        with self._lock:
+            self._observe( key, value, buckets )
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increase the given counter.
+        """
+        key = ( name, tuple(sorted(labels.items())) )
+        with self._lock:
+            self._counters[key] = self._counters.get( key, 0 ) + amount
+
+    def record(self, timing):
+        """
+        Record the measurements of a finished request, and pass them on to the callbacks.
+        """
+        labels = ( ('endpoint', timing.endpoint), ('method', timing.method) )
+        status = str(timing.status) if timing.status is not None else 'error'
+        with self._lock:
+            name = 'pydvid_request_duration_seconds'
+            self._observe( (name, labels + (('phase', 'total'),)), timing.total, DURATION_BUCKETS )
+            for phase in PHASES:
+                self._observe( (name, labels + (('phase', phase),)), getattr(timing, phase), DURATION_BUCKETS )
+
+            name = 'pydvid_request_size_bytes'
+            self._observe( (name, labels + (('direction', 'sent'),)), timing.bytes_sent, SIZE_BUCKETS )
+            self._observe( (name, labels + (('direction', 'received'),)), timing.bytes_received, SIZE_BUCKETS )
+
+            key = ( 'pydvid_requests_total', labels + (('status', status),) )
+            self._counters[key] = self._counters.get( key, 0 ) + 1
+            if timing.attempt > 1:
+                key = ( 'pydvid_request_retries_total', labels )
+                self._counters[key] = self._counters.get( key, 0 ) + 1
+            callbacks = self._callbacks
+
+        for callback in callbacks:
+            callback( timing )
+
+    def request_finished(self, timing):
+        self.record( timing )
+
+    def reset(self):
+        """
+        Discard all recorded values.  (Callbacks remain registered.)
+        """
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """
+        Return the current values of all metrics, as a dict that can be serialized to json:
+        ``{ 'histograms' : [ {'name', 'labels', 'buckets', 'sum', 'count'}, ... ], 'counters' : [ {'name', 'labels', 'value'}, ... ] }``
+        (Each histogram's buckets are a list of cumulative ``[upper_bound, count]`` pairs, with None for +Inf.)
+        """
+        with self._lock:
+            histograms = [ { 'name' : name,
+                             'labels' : dict(labels),
+                             'buckets' : [ [None if bound == float('inf') else bound, count]
+                                           for bound, count in histogram.cumulative_counts() ],
+                             'sum' : histogram.sum,
+                             'count' : histogram.count }
+                           for (name, labels), histogram in sorted( self._histograms.items() ) ]
+            counters = [ { 'name' : name, 'labels' : dict(labels), 'value' : value }
+                         for (name, labels), value in sorted( self._counters.items() ) ]
+        return { 'histograms' : histograms, 'counters' : counters }
+
+    def to_json(self):
+        return json.dumps( self.snapshot() )
+
+    def to_prometheus(self):
+        """
+        Return the current values of all metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = sorted( (key, h.cumulative_counts(), h.sum, h.count) for key, h in self._histograms.items() )
+            counters = sorted( self._counters.items() )
+            descriptions = dict( self._descriptions )
+
+        lines = []
+        described = set()
+        def describe( name, default_type ):
+            if name not in described:
+                described.add( name )
+                metric_type, help_text = descriptions.get( name, (default_type, None) )
+                if help_text:
+                    lines.append( "# HELP {} {}".format( name, help_text ) )
+                lines.append( "# TYPE {} {}".format( name, metric_type ) )
+
+        for (name, labels), buckets, total, count in histograms:
+            describe( name, 'histogram' )
+            for bound, bucket_count in buckets:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append( "{}_bucket{} {}".format( name, _format_labels( labels + (('le', le),) ), bucket_count ) )
+            lines.append( "{}_sum{} {}".format( name, _format_labels( labels ), repr(total) ) )
+            lines.append( "{}_count{} {}".format( name, _format_labels( labels ), count ) )
+        for (name, labels), value in counters:
+            describe( name, 'counter' )
+            lines.append( "{}{} {}".format( name, _format_labels( labels ), value ) )
+        return "\n".join( lines ) + "\n"
+
+    def _observe(self, key, value, buckets):
+        """
+        Must be called with the lock held.
+        """
+        try:
+            histogram = self._histograms[key]
+        except KeyError:
+            histogram = self._histograms[key] = Histogram( buckets )
+        histogram.observe( value )
+
+def _format_labels( labels ):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join( '{}="{}"'.format( name, escape(value) ) for name, value in labels ) + "}"
+
+# The registry that receives all measurements, or None if it is disabled.
+_active_registry = None
+
+def enable( registry=None ):
+    """
+    Start recording requests in the given registry (or a new one).  Returns the registry.
+    """
+    global _active_registry
+    if registry is None:
+        registry = MetricsRegistry()
+    disable()
+    add_hook( registry )
+    _active_registry = registry
+    return registry
+
+def disable():
+    """
+    Stop recording requests.
+    """
+    global _active_registry
+    if _active_registry is not None:
+        remove_hook( _active_registry )
+    _active_registry = None
+
+def get_registry():
+    """
+    Return the registry that is currently recording requests, or None if it is disabled.
+    """
+    return _active_registry
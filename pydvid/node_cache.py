@@ -0,0 +1,286 @@
+"""
+An opt-in cache of read results, which exploits the immutability of locked DVID nodes.
+
+Once a node is locked (committed), its data never changes, so anything read from it can be cached
+indefinitely, without asking the server again.  Data in unlocked nodes may change at any time,
+so results read from them are cached only briefly (``unlocked_ttl``), or not at all.
+
+.. code-block:: python
+
+    cache = pydvid.node_cache.enable( max_bytes=2**30 )
+    ...
+    print cache.stats
+
+While the cache is enabled, these request functions consult it first:
+``voxels.get_metadata()``, ``voxels.get_ndarray()`` (and hence ``VoxelsAccessor`` reads),
+``keyvalue.get_value()`` and ``keyvalue.get_keys()``.
+Writes via ``voxels.post_ndarray()`` and ``keyvalue.put_value()`` discard the cached results for that data instance.
+
+Whether a node is locked is determined from the server's repos info (via a ``RepoCatalog`` for each server).
+A locked node stays locked, so that is remembered forever.  Nodes that aren't (yet) locked are checked
+again when the catalog's info expires.
+
+Cached results are copied when they are returned, so callers may modify them.
+"""
+import copy
+import time
+import httplib
+import functools
+import threading
+import collections
+
+from pydvid.general.repo_catalog import RepoCatalog
+
+class NodeCache(object):
+    """
+    A thread-safe, size-limited (LRU) cache of results read from DVID nodes.
+    """
+
+    class _Entry(object):
+        __slots__ = ('value', 'nbytes', 'expiration', 'instance')
+        def __init__(self, value, nbytes, expiration, instance):
+            self.value = value
+            self.nbytes = nbytes
+            self.expiration = expiration # None for results from locked nodes
+            self.instance = instance
+
+    def __init__(self, max_bytes=256*2**20, unlocked_ttl=1.0, catalog_ttl=60.0, catalog_timeout=10.0):
+        """
+        :param max_bytes: The total size of the cached results.  The least recently used results are discarded first.
+        :param unlocked_ttl: How long results from unlocked nodes are cached (seconds).  If 0, they aren't cached.
+        :param catalog_ttl: How often the repos info is fetched to find out whether nodes are still unlocked (seconds).
+        :param catalog_timeout: Socket timeout for fetching the repos info.
+        """
+        self.max_bytes = max_bytes
+        self.unlocked_ttl = unlocked_ttl
+        self.catalog_ttl = catalog_ttl
+        self.catalog_timeout = catalog_timeout
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # key : _Entry, least recently used first
+        self._instance_keys = {}                  # (host, port, uuid, data_name) : set of keys
+        self._num_bytes = 0
+        self._locked_nodes = set()                # (host, port, uuid)
+        self._catalogs = {}                       # (host, port) : RepoCatalog
+        self._catalog_failures = {}               # (host, port) : time of the last failed fetch
+        self._catalogs_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self):
+        """
+        Cache statistics, as a dict.
+        """
+        with self._lock:
+            return { 'hits' : self._hits,
+                     'misses' : self._misses,
+                     'entries' : len(self._entries),
+                     'bytes' : self._num_bytes,
+                     'locked_nodes' : len(self._locked_nodes) }
+
+    def clear(self):
+        """
+        Discard all cached results.  (Nodes that are known to be locked are remembered.)
+        """
+        with self._lock:
+            self._entries.clear()
+            self._instance_keys.clear()
+            self._num_bytes = 0
+
+    def is_locked(self, connection, uuid):
+        """
+        Return True if the given node is known to be locked.
+        (If its repos info can't be fetched, the node is assumed to be unlocked.)
+        """
+        host, port = connection.host, connection.port
+        if (host, port, uuid) in self._locked_nodes:
+            return True
+        catalog = self._get_catalog( host, port )
+        if catalog.age is None and time.time() - self._catalog_failures.get( (host, port), 0.0 ) < self.catalog_ttl:
+            # The repos info couldn't be fetched recently.  Don't try again for every request.
+            return False
+        try:
+            locked = catalog.is_locked( uuid )
+        except RepoCatalog.UnknownNodeError:
+            return False
+        except Exception:
+            # e.g. an older server that can't provide the repos info
+            self._catalog_failures[(host, port)] = time.time()
+            return False
+        if locked:
+            with self._lock:
+                self._locked_nodes.add( (host, port, uuid) )
+        return locked
+
+    def _get_catalog(self, host, port):
+        """
+        Return the RepoCatalog for the given server.
+        The catalog has its own connection, since the caller's connection may be a temporary wrapper.
+        """
+        with self._catalogs_lock:
+            try:
+                return self._catalogs[(host, port)]
+            except KeyError:
+                connection = httplib.HTTPConnection( host, port, timeout=self.catalog_timeout )
+                # Unknown nodes are rare here, so they don't need to trigger a refresh.
+                catalog = RepoCatalog( connection, ttl=self.catalog_ttl, min_refresh_interval=self.catalog_ttl )
+                self._catalogs[(host, port)] = catalog
+                return catalog
+
+    def get(self, key):
+        """
+        Return (True, value) for the given key, or (False, None) if it isn't cached (or has expired).
+        """
+        with self._lock:
+            entry = self._entries.get( key )
+            if entry is not None and entry.expiration is not None and entry.expiration < time.time():
+                self._discard( key )
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return False, None
+            self._hits += 1
+            # Mark as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+        return True, _copy_value( entry.value )
+
+    def put(self, key, instance, value, locked):
+        """
+        Store a result.
+
+        :param key: A hashable key, which identifies the server, node, data instance and request.
+        :param instance: (host, port, uuid, data_name), for invalidation.
+        :param locked: True if the result was read from a locked node (it never expires).
+        """
+        if locked:
+            expiration = None
+        elif self.unlocked_ttl > 0:
+            expiration = time.time() + self.unlocked_ttl
+        else:
+            return
+        nbytes = _value_size( value )
+        if nbytes > self.max_bytes:
+            return
+        entry = NodeCache._Entry( _copy_value( value ), nbytes, expiration, instance )
+        with self._lock:
+            if key in self._entries:
+                self._discard( key )
+            self._entries[key] = entry
+            self._instance_keys.setdefault( instance, set() ).add( key )
+            self._num_bytes += nbytes
+            while self._num_bytes > self.max_bytes:
+                self._discard( next(iter(self._entries)) )
+
+    def invalidate(self, instance):
+        """
+        Discard all cached results for the given data instance, i.e. (host, port, uuid, data_name).
+        """
+        with self._lock:
+            for key in list( self._instance_keys.get( instance, () ) ):
+                self._discard( key )
+
+    def _discard(self, key):
+        """
+        Must be called with the lock held.
+        """
+        entry = self._entries.pop( key )
+        self._num_bytes -= entry.nbytes
+        keys = self._instance_keys[entry.instance]
+        keys.discard( key )
+        if not keys:
+            del self._instance_keys[entry.instance]
+
+def _copy_value( value ):
+    if isinstance( value, str ):
+        return value # immutable
+    if hasattr( value, '__array_interface__' ):
+        return value.copy( order='K' ) # Preserve the memory order of the array
+    return copy.deepcopy( value )
+
+def _value_size( value ):
+    """
+    Return the (approximate) memory size of a cached result.
+    """
+    nbytes = getattr( value, 'nbytes', None )
+    if nbytes is not None:
+        return nbytes
+    if isinstance( value, str ):
+        return len(value)
+    return 1024 # e.g. metadata: small, but not free.
+
+# The cache consulted by the read functions, or None if it is disabled.
+_active_cache = None
+
+def enable( cache=None, **kwargs ):
+    """
+    Start caching read results in the given NodeCache (or a new one, constructed with the given kwargs).
+    Returns the cache.
+    """
+    global _active_cache
+    if cache is None:
+        cache = NodeCache( **kwargs )
+    _active_cache = cache
+    return cache
+
+def disable():
+    """
+    Stop caching.  (The cache's contents are no longer used.)
+    """
+    global _active_cache
+    _active_cache = None
+
+def get_cache():
+    """
+    Return the active NodeCache, or None if caching is disabled.
+    """
+    return _active_cache
+
+def cached_read( kind, key_func ):
+    """
+    Decorator for read functions, whose first argument is the connection.
+    While a cache is enabled, results are looked up in the cache first.
+
+    :param kind: Distinguishes the results of different functions, e.g. 'metadata'.
+    :param key_func: Called with the same arguments as the function.  Returns (uuid, data_name, request_key),
+                     where request_key is a hashable value that identifies the request within that data instance,
+                     or None if the result must not be cached.
+    """
+    def decorator( func ):
+        @functools.wraps(func)
+        def _cached_wrapper( connection, *args, **kwargs ):
+            cache = _active_cache
+            if cache is None:
+                return func( connection, *args, **kwargs )
+            key_info = key_func( connection, *args, **kwargs )
+            if key_info is None:
+                return func( connection, *args, **kwargs )
+            uuid, data_name, request_key = key_info
+            instance = (connection.host, connection.port, uuid, data_name)
+            key = (instance, kind, request_key)
+            found, value = cache.get( key )
+            if found:
+                return value
+            # (The lock status is checked before reading, in case the node is locked in the meantime.)
+            locked = cache.is_locked( connection, uuid )
+            value = func( connection, *args, **kwargs )
+            cache.put( key, instance, value, locked )
+            return value
+        return _cached_wrapper
+    return decorator
+
+def invalidating( func ):
+    """
+    Decorator for write functions, whose first three arguments are (connection, uuid, data_name).
+    Cached results for that data instance are discarded after the write (even if it failed).
+    """
+    @functools.wraps(func)
+    def _invalidating_wrapper( connection, uuid, data_name, *args, **kwargs ):
+        try:
+            return func( connection, uuid, data_name, *args, **kwargs )
+        finally:
+            cache = _active_cache
+            if cache is not None:
+                cache.invalidate( (connection.host, connection.port, uuid, data_name) )
+    return _invalidating_wrapper
@@ -0,0 +1,93 @@
+"""
+Bandwidth and request-rate limits for traffic to a DVID server.
+
+Bulk jobs can easily saturate a DVID server that is shared with interactive users.
+A ``RateLimiter`` caps the rate of requests and the rate of data transferred (in both directions),
+so background jobs get predictable throughput without starving everyone else.
+
+Attach a RateLimiter to a ``DvidConnection`` (see its ``rate_limiter`` parameter).
+All threads that use the connection share the same limits.  Large voxels transfers are
+paced as they are streamed (by ``VoxelsNddataCodec``), rather than sent in a single burst.
+"""
+import time
+import threading
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket: tokens accumulate at a fixed rate, up to the bucket's capacity.
+
+    consume() may take more tokens than are available (even more than the capacity).
+    The bucket goes into debt, and the caller sleeps until the debt is paid off.
+    Since every caller takes its tokens immediately, concurrent callers are served in order.
+    """
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens that can accumulate (i.e. the largest burst).
+        """
+        assert rate > 0 and capacity > 0
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last_update = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, num_tokens):
+        """
+        Take the given number of tokens, and wait until they would have been available.
+        Returns the time spent waiting.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min( self.capacity, self._tokens + (now - self._last_update) * self.rate )
+            self._last_update = now
+            self._tokens -= num_tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep( wait )
+        return wait
+
+class RateLimiter(object):
+    """
+    Limits the request rate and/or the bandwidth of all traffic that passes through it.  Thread-safe.
+    """
+    def __init__(self, bytes_per_second=None, requests_per_second=None, burst_seconds=0.1):
+        """
+        :param bytes_per_second: Maximum transfer rate (request and response bodies combined), or None for no limit.
+        :param requests_per_second: Maximum request rate, or None for no limit.
+        :param burst_seconds: Traffic may exceed the limits in bursts of at most this duration's worth.
+                              This also determines the size of the chunks in which transfers are paced.
+        """
+        self.bytes_per_second = bytes_per_second
+        self.requests_per_second = requests_per_second
+        self._byte_bucket = None
+        self._request_bucket = None
+        if bytes_per_second:
+            self._byte_bucket = TokenBucket( bytes_per_second, max( 1.0, bytes_per_second * burst_seconds ) )
+        if requests_per_second:
+            self._request_bucket = TokenBucket( requests_per_second, max( 1.0, requests_per_second * burst_seconds ) )
+
+    @property
+    def max_chunk_size(self):
+        """
+        The largest number of bytes that should be transferred at once, so the transfer is paced smoothly.
+        (None if there is no bandwidth limit.)
+        """
+        if self._byte_bucket is None:
+            return None
+        return int( self._byte_bucket.capacity )
+
+    def throttle_request(self):
+        """
+        Called before each request.  Waits until the request rate permits another request.
+        """
+        if self._request_bucket is not None:
+            self._request_bucket.consume( 1 )
+
+    def throttle_bytes(self, num_bytes):
+        """
+        Called after (or before) transferring the given number of bytes.
+        Waits until the bandwidth limit would have permitted them.
+        """
+        if self._byte_bucket is not None and num_bytes > 0:
+            self._byte_bucket.consume( num_bytes )
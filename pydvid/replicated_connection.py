@@ -0,0 +1,258 @@
+"""
+A connection to a group of DVID servers: a primary, and read-only replicas of it.
+
+A ``ReplicatedDvidConnection`` looks just like a ``DvidConnection``, but it spreads reads
+across all of the group's healthy servers, so read throughput scales with the number of replicas:
+
+- Each read (``GET`` or ``HEAD``) is sent to the less busy of two randomly chosen healthy servers
+  ("power of two choices"), judged by the number of requests each one has in progress.
+- Everything else (i.e. all writes) is sent to the primary.
+- A background thread checks each server periodically (via ``general.get_server_info()``).
+  Servers that fail the check (or whose connections fail during a request) no longer receive reads,
+  until they pass the check again.  If no server is healthy, reads are sent to the primary.
+"""
+import random
+import httplib
+import logging
+import weakref
+import threading
+
+from pydvid import general
+from pydvid.retry import CONNECTION_ERRORS, call_without_retries
+from pydvid.dvid_connection import DvidConnection
+
+logger = logging.getLogger(__name__)
+
+# Requests that may be sent to any replica
+READ_METHODS = ('GET', 'HEAD')
+
+class ReplicatedDvidConnection(object):
+    """
+    A thread-safe connection to a primary DVID server and its read-only replicas.
+    Each server has its own pool of connections (a ``DvidConnection``).
+
+    Example:
+
+    .. code-block:: python
+
+        connection = ReplicatedDvidConnection( ["emdata1:8000", "emdata2:8000", "emdata3:8000"] )
+        dvid_volume = VoxelsAccessor( connection, uuid, 'grayscale' )
+    """
+
+    class _Replica(object):
+        def __init__(self, hostname, connection):
+            self.hostname = hostname
+            self.connection = connection
+            self.healthy = True
+            self.last_error = None
+            self.requests = 0
+
+    def __init__(self, hostnames, primary=None, read_from_primary=True,
+                 health_check_interval=5.0, health_check_timeout=2.0, **connection_kwargs):
+        """
+        :param hostnames: The servers in the group, e.g. ['emdata1:8000', 'emdata2:8000']
+        :param primary: The server that receives all writes.  By default, the first one in the list.
+        :param read_from_primary: If False, reads are sent to the primary only if none of the replicas is healthy.
+        :param health_check_interval: Time between health checks of all servers (in seconds).
+                                      If None, there are no background checks.  (See ``check_health()``.)
+        :param health_check_timeout: Socket timeout for each health check.
+        :param connection_kwargs: Passed to the ``DvidConnection`` for each server (e.g. ``max_connections``).
+        """
+        assert hostnames, "At least one host is required."
+        if primary is None:
+            primary = hostnames[0]
+        if primary not in hostnames:
+            hostnames = [primary] + list(hostnames)
+        self.read_from_primary = read_from_primary
+        self.health_check_timeout = health_check_timeout
+
+        self._lock = threading.Lock()
+        self._replicas = [ ReplicatedDvidConnection._Replica( hostname, DvidConnection( hostname, **connection_kwargs ) )
+                           for hostname in hostnames ]
+        self._primary = self._replicas[ hostnames.index(primary) ]
+
+        # Requests go to the primary's circuit breaker, and its limits apply to all servers.
+        self.hostname = self._primary.connection.hostname
+        self.host = self._primary.connection.host
+        self.port = self._primary.connection.port
+        self.timeout = self._primary.connection.timeout
+        self.rate_limiter = self._primary.connection.rate_limiter
+        self.max_connections = sum( r.connection.max_connections for r in self._replicas )
+
+        # The DvidConnection used for the current thread's most recent request
+        self._thread_state = threading.local()
+
+        self._stop_event = threading.Event()
+        if health_check_interval is not None:
+            thread = threading.Thread( target=_health_check_loop,
+                                       args=( weakref.ref(self), self._stop_event, health_check_interval ),
+                                       name="ReplicatedDvidConnection health checks" )
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def hostnames(self):
+        return [ r.hostname for r in self._replicas ]
+
+    @property
+    def healthy_hostnames(self):
+        """
+        The servers that currently receive reads.
+        """
+        with self._lock:
+            return [ r.hostname for r in self._replicas if r.healthy ]
+
+    @property
+    def stats(self):
+        """
+        A dict of per-server statistics: { hostname : stats }, where each server's stats are its
+        ``DvidConnection.stats``, and additionally:
+
+        - healthy: Whether the server currently receives reads
+        - requests: Total requests sent to the server
+        - primary: Whether the server is the primary
+        """
+        with self._lock:
+            stats = {}
+            for replica in self._replicas:
+                stats[replica.hostname] = dict( replica.connection.stats,
+                                                healthy=replica.healthy,
+                                                requests=replica.requests,
+                                                primary=(replica is self._primary) )
+            return stats
+
+    @property
+    def current_hostname(self):
+        """
+        The server that received this thread's most recent request (or None).
+        """
+        replica = getattr( self._thread_state, 'replica', None )
+        return replica and replica.hostname
+
+    def request(self, method, url, body=None, headers={}, avoid_hostnames=()):
+        """
+        Send a request to the primary (for writes) or a healthy server (for reads).
+        Same signature as ``httplib.HTTPConnection.request()``, except for:
+
+        :param avoid_hostnames: Send reads to one of these servers only if no other healthy server is available.
+                                (Used by ``pydvid.hedging`` to send a duplicate request to a different server.)
+        """
+        if method in READ_METHODS:
+            replica = self._choose_replica( avoid_hostnames )
+        else:
+            replica = self._primary
+
+        # As with DvidConnection, a new request releases the thread's previous connection,
+        #  even if it belongs to a different server.
+        previous = getattr( self._thread_state, 'replica', None )
+        if previous is not None and previous is not replica:
+            previous.connection._release_thread_lease()
+        self._thread_state.replica = replica
+
+        with self._lock:
+            replica.requests += 1
+        try:
+            replica.connection.request( method, url, body, headers )
+        except CONNECTION_ERRORS as ex:
+            self._eject( replica, ex )
+            raise
+
+    def getresponse(self):
+        """
+        Return the response to this thread's most recent request.
+        Same as ``DvidConnection.getresponse()``.
+        """
+        replica = getattr( self._thread_state, 'replica', None )
+        if replica is None:
+            raise httplib.ResponseNotReady()
+        try:
+            return replica.connection.getresponse()
+        except CONNECTION_ERRORS as ex:
+            self._eject( replica, ex )
+            raise
+
+    def check_health(self):
+        """
+        Check each server now (by requesting its server info), and update its health status accordingly.
+        Returns the list of healthy servers.
+        """
+        for replica in self._replicas:
+            error = self._probe( replica.hostname )
+            if error is not None:
+                self._eject( replica, error )
+            else:
+                with self._lock:
+                    readmitted = not replica.healthy
+                    replica.healthy = True
+                    replica.last_error = None
+                if readmitted:
+                    logger.info( "DVID server {} is healthy again.".format( replica.hostname ) )
+        return self.healthy_hostnames
+
+    def close(self):
+        """
+        Close all idle connections to all servers, and stop the background health checks.
+        """
+        self._stop_event.set()
+        for replica in self._replicas:
+            replica.connection.close()
+
+    def _choose_replica(self, avoid_hostnames=()):
+        """
+        Power of two choices: pick two healthy servers at random, and return the one with fewer requests in progress.
+        Servers in ``avoid_hostnames`` are only chosen if there are no other candidates.
+        """
+        with self._lock:
+            candidates = [ r for r in self._replicas if r.healthy and ( self.read_from_primary or r is not self._primary ) ]
+        preferred = [ r for r in candidates if r.hostname not in avoid_hostnames ]
+        if preferred:
+            candidates = preferred
+        if not candidates:
+            return self._primary
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.sample( candidates, 2 )
+        if b.connection.num_in_use < a.connection.num_in_use:
+            return b
+        return a
+
+    def _probe(self, hostname):
+        """
+        Request the server info from the given host, on a new connection.
+        Returns None if that worked, or the exception otherwise.
+        """
+        connection = httplib.HTTPConnection( hostname, timeout=self.health_check_timeout )
+        try:
+            call_without_retries( general.get_server_info, connection )
+        except Exception as ex:
+            # Any failure (including an invalid response) means the server isn't healthy.
+            return ex
+        finally:
+            connection.close()
+        return None
+
+    def _eject(self, replica, error):
+        """
+        Stop sending reads to the given server (until it passes a health check).
+        """
+        if len(self._replicas) == 1:
+            return
+        with self._lock:
+            ejected = replica.healthy
+            replica.healthy = False
+            replica.last_error = error
+        if ejected:
+            logger.warning( "DVID server {} is unhealthy, and won't receive reads until it recovers: {}"
+                            .format( replica.hostname, error ) )
+
+def _health_check_loop( connection_ref, stop_event, interval ):
+    """
+    Check the health of the connection's servers every ``interval`` seconds,
+    until the stop_event is set or the connection no longer exists.
+    """
+    while not stop_event.wait( interval ):
+        connection = connection_ref()
+        if connection is None:
+            return
+        connection.check_health()
+        del connection
@@ -0,0 +1,351 @@
+"""
+Automatic retries for requests that fail because the DVID server is busy or unreachable.
+
+When DVID is overloaded, it may indicate its busy status by returning a ``503`` (service unavailable)
+error (or ``429``, too many requests).  The connection to the server may also be reset, e.g. when it restarts.
+In those cases, a ``RetryPolicy`` repeats the failed request:
+
+- The delay before each retry is chosen at random ("full jitter"), from a range that grows exponentially
+  with each failed attempt.  That way, many clients that were rejected at the same time don't all retry in lockstep.
+- If the server provides a ``Retry-After`` header, we wait at least that long.
+- A ``CircuitBreaker`` is shared by all requests to the same host.  After many consecutive failures,
+  it stops sending requests to that host for a short while, and then lets a single request through
+  to check whether the server has recovered.
+- Socket timeouts are not retried: a slow server isn't helped by sending the request again,
+  and the caller's timeout would be multiplied.
+
+The request functions in ``pydvid.general``, ``pydvid.keyvalue``, ``pydvid.labelgraph`` and ``pydvid.voxels``
+use the default policy (see ``set_default_policy()``).  ``VoxelsAccessor`` has its own policy,
+which can be configured via its constructor.
+"""
+import sys
+import time
+import socket
+import random
+import httplib
+import warnings
+import threading
+import functools
+import email.utils
+
+from pydvid.errors import DvidHttpError
+
+# Failures that indicate a problem with the connection rather than the request itself.
+# (Except socket.timeout, which is a socket.error, but is never retried: see RetryPolicy.call().)
+CONNECTION_ERRORS = ( socket.error, httplib.BadStatusLine, httplib.IncompleteRead )
+
+# Status codes that indicate that the server is busy, and the request may be repeated.
+TOO_MANY_REQUESTS = 429
+BUSY_STATUS_CODES = ( httplib.SERVICE_UNAVAILABLE, TOO_MANY_REQUESTS )
+
+class RetryPolicy(object):
+    """
+    Determines when and how often failed requests are repeated.
+
+    Example:
+
+    .. code-block:: python
+
+        policy = RetryPolicy( timeout=10.0 )
+        value = policy.call( keyvalue.get_value, connection, uuid, 'my_keyvalue', 'my_key' )
+    """
+
+    class RetryTimeoutError(Exception):
+        """
+        Raised when the server is still busy after the policy's timeout has expired.
+        """
+        pass
+
+    def __init__(self, timeout=60.0, base_delay=0.05, max_delay=2.0, max_connection_attempts=3,
+                 warning_interval=30.0, retry_status_codes=BUSY_STATUS_CODES, circuit_breaker=True):
+        """
+        :param timeout: Total time to spend repeating a request while the server is busy.
+                        (Set to 0 to prevent retries.)
+        :param base_delay: The upper bound of the (random) delay before the first retry.
+                           It doubles with each subsequent failure, until it reaches max_delay.
+        :param max_delay: The largest upper bound for the delay between attempts.
+                          (A longer ``Retry-After`` from the server is still honoured.)
+        :param max_connection_attempts: Number of attempts before giving up on a request
+                                        whose connection keeps failing (e.g. because the server is down).
+                                        The original exception is raised after the last attempt.
+        :param warning_interval: If the server has been busy for this long (but the timeout hasn't expired yet),
+                                 a warning is emitted.
+        :param retry_status_codes: Responses with these status codes are retried.
+        :param circuit_breaker: If True, use the shared ``CircuitBreaker`` for each request's host (see ``get_circuit_breaker()``).
+                                Pass a CircuitBreaker instance to use it instead, or False to disable.
+        """
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_connection_attempts = max_connection_attempts
+        self.warning_interval = warning_interval
+        self.retry_status_codes = retry_status_codes
+        self.circuit_breaker = circuit_breaker
+
+    def call(self, func, connection, *args, **kwargs):
+        """
+        Call ``func(connection, *args, **kwargs)``, and repeat it if it fails with a retryable error.
+
+        If this is called again (for the same thread) while the function is running,
+        the inner call isn't retried separately.  (Only the outermost call repeats requests.)
+        """
+        if getattr( _thread_state, 'active', False ):
+            return func( connection, *args, **kwargs )
+        _thread_state.active = True
+        try:
+            return self._call_with_retries( func, connection, args, kwargs )
+        finally:
+            _thread_state.active = False
+
+    def compute_delay(self, attempt, retry_after=None):
+        """
+        Return the time to wait after the given (1-based) attempt failed.
+        The delay is chosen uniformly from [0, min(max_delay, base_delay * 2**(attempt-1))],
+        but is never shorter than retry_after (if provided).
+        """
+        exponent = min( attempt-1, 32 )
+        delay = random.uniform( 0, min( self.max_delay, self.base_delay * 2**exponent ) )
+        if retry_after is not None:
+            delay = max( delay, retry_after )
+        return delay
+
+    def _call_with_retries(self, func, connection, args, kwargs):
+        breaker = self._get_circuit_breaker( connection )
+        start_time = time.time()
+        deadline = start_time + self.timeout
+        last_warning_time = start_time
+        attempt = 0
+        connection_failures = 0
+
+        while True:
+            if breaker is not None:
+                wait = breaker.acquire()
+                if wait:
+                    if time.time() + wait > deadline:
+                        raise RetryPolicy.RetryTimeoutError(
+                            "Timeout: Requests to {} are suspended after repeated failures.".format( breaker.host ) )
+                    time.sleep( wait )
+                    continue
+
+            attempt += 1
+            _thread_state.attempt = attempt
+            try:
+                result = func( connection, *args, **kwargs )
+            except socket.timeout:
+                # The server is slow, not unreachable.  Repeating the request would silently
+                #  multiply the caller's socket timeout.
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except CONNECTION_ERRORS:
+                exc_info = sys.exc_info()
+                if breaker is not None:
+                    breaker.record_failure()
+                _reset_connection( connection )
+                connection_failures += 1
+                if connection_failures >= self.max_connection_attempts or time.time() >= deadline:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                retry_after = None
+            except DvidHttpError as ex:
+                if ex.status_code not in self.retry_status_codes:
+                    # Not busy: this is a real problem.
+                    if breaker is not None:
+                        breaker.record_success()
+                    raise
+                if breaker is not None:
+                    breaker.record_failure()
+                now = time.time()
+                if now >= deadline:
+                    raise RetryPolicy.RetryTimeoutError(
+                        "Timeout due to repeated {} responses: "
+                        "DVID Server is still too busy after {} attempts over {:.1f} seconds"
+                        .format( ex.status_code, attempt, now - start_time ) )
+                retry_after = get_retry_after( ex.response_headers )
+            except:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+
+            now = time.time()
+            if now - last_warning_time > self.warning_interval:
+                warnings.warn( "DVID Server has been busy for {:.1f} seconds.  Still retrying..."
+                               .format( now - start_time ) )
+                last_warning_time = now
+            time.sleep( max( 0.0, min( self.compute_delay( attempt, retry_after ), deadline - time.time() ) ) )
+
+    def _get_circuit_breaker(self, connection):
+        if self.circuit_breaker is True:
+            host = "{}:{}".format( getattr( connection, 'host', None ), getattr( connection, 'port', None ) )
+            return get_circuit_breaker( host )
+        return self.circuit_breaker or None
+
+class CircuitBreaker(object):
+    """
+    Tracks the consecutive failures of requests to a single host.
+
+    - closed: Requests are sent normally.
+    - open: After ``failure_threshold`` consecutive failures, no requests are sent for ``reset_timeout`` seconds.
+    - half-open: Then, a single request is allowed through.  If it succeeds, the breaker is closed again.
+      Otherwise, it is re-opened.
+
+    Thread-safe.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, host, failure_threshold=20, reset_timeout=1.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CircuitBreaker.CLOSED
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        # Time when the current half-open probe request started
+        self._probe_start = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def acquire(self):
+        """
+        Called before each request.
+        Returns 0 if the request may be sent now, or else the time to wait before asking again.
+        """
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return 0
+            now = time.time()
+            if self._state == CircuitBreaker.OPEN:
+                if now < self._open_until:
+                    # Spread the waiting clients out a bit, so they don't all return at once.
+                    return ( self._open_until - now ) + random.uniform( 0, 0.1 * self.reset_timeout )
+                self._state = CircuitBreaker.HALF_OPEN
+                self._probe_start = None
+
+            # Half-open: allow a single probe request at a time.
+            # (If the probe never reports back, allow another one after reset_timeout.)
+            if self._probe_start is None or now - self._probe_start > self.reset_timeout:
+                self._probe_start = now
+                return 0
+            return random.uniform( 0.1, 0.2 ) * self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self._state = CircuitBreaker.CLOSED
+            self._consecutive_failures = 0
+            self._probe_start = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == CircuitBreaker.HALF_OPEN \
+               or self._consecutive_failures >= self.failure_threshold:
+                self._state = CircuitBreaker.OPEN
+                self._open_until = time.time() + self.reset_timeout
+                self._probe_start = None
+
+    def release(self):
+        """
+        Called when a request failed for a reason that says nothing about the server's health.
+        """
+        with self._lock:
+            self._probe_start = None
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker( host ):
+    """
+    Return the CircuitBreaker shared by all requests to the given host (e.g. 'localhost:8000').
+    """
+    with _circuit_breakers_lock:
+        try:
+            return _circuit_breakers[host]
+        except KeyError:
+            breaker = _circuit_breakers[host] = CircuitBreaker( host )
+            return breaker
+
+def get_retry_after( headers ):
+    """
+    Return the delay (in seconds) requested by the Retry-After header in the given
+    response headers (a dict or list of (name, value) pairs), or None if there is no such header.
+    The header may contain a number of seconds or an HTTP date.
+    """
+    if isinstance( headers, dict ):
+        headers = headers.items()
+    for name, value in headers:
+        if name.lower() != 'retry-after':
+            continue
+        value = value.strip()
+        try:
+            return max( 0.0, float(value) )
+        except ValueError:
+            parsed_date = email.utils.parsedate_tz( value )
+            if parsed_date is None:
+                return None
+            return max( 0.0, email.utils.mktime_tz( parsed_date ) - time.time() )
+    return None
+
+def _reset_connection( connection ):
+    """
+    After a connection error, a plain HTTPConnection can't be used again until it is closed.
+    (A DvidConnection discards broken connections by itself.)
+    """
+    if isinstance( connection, httplib.HTTPConnection ):
+        connection.close()
+
+# Set while a RetryPolicy is executing a request in the current thread.
+_thread_state = threading.local()
+
+def current_attempt():
+    """
+    Return the number of the attempt (1 for the first) that a RetryPolicy is executing in this thread.
+    (Returns 1 if no RetryPolicy is active.)
+    """
+    if not getattr( _thread_state, 'active', False ):
+        return 1
+    return getattr( _thread_state, 'attempt', 1 )
+
+_default_policy = RetryPolicy()
+
+def get_default_policy():
+    return _default_policy
+
+def set_default_policy( policy ):
+    """
+    Set the RetryPolicy used by the module-level request functions (e.g. ``keyvalue.get_value()``).
+    """
+    global _default_policy
+    _default_policy = policy
+
+def call_without_retries( func, *args, **kwargs ):
+    """
+    Call ``func(*args, **kwargs)`` with automatic retries disabled for all requests it makes in this thread.
+    (Useful when the caller repeats the whole operation itself.)
+    """
+    was_active = getattr( _thread_state, 'active', False )
+    _thread_state.active = True
+    try:
+        return func( *args, **kwargs )
+    finally:
+        _thread_state.active = was_active
+
+def auto_retry(func):
+    """
+    Decorator.  Call the decorated request function via the default RetryPolicy.
+    The function's first argument must be the connection.
+    """
+    @functools.wraps(func)
+    def _retry_wrapper( connection, *args, **kwargs ):
+        return _default_policy.call( func, connection, *args, **kwargs )
+    _retry_wrapper.__wrapped__ = func # Emulate python 3 behavior of @wraps
+    return _retry_wrapper
@@ -1,19 +1,24 @@
+import io
 import os
 import json
+import errno
+import random
+import socket
 import httplib
+import cStringIO
+import threading
 import contextlib
 
-import jsonschema
-
 import pydvid
 
 import re
 
-def get_json_generic( connection, resource_path, schema=None ):
+def get_json_generic( connection, resource_path, schema=None, validation=None ):
     """
     Request the json data found at the given resource path, e.g. '/api/datasets/info'
     If schema is a dict, validate the response against it.
     If schema is a str, it should be the name of a schema file found in pydvid/schemas.
+    The validation level ('off', 'sampled' or 'strict') defaults to the global level (see ``set_validation_level()``).
     """
     connection.request( "GET", resource_path )
     with contextlib.closing( connection.getresponse() ) as response:
@@ -21,7 +26,7 @@ def get_json_generic( connection, resource_path, schema=None ):
             raise pydvid.errors.DvidHttpError( 
                 "requesting json for: {}".format( resource_path ),
                 response.status, response.reason, response.read(),
-                "GET", resource_path, "")
+                "GET", resource_path, "", response_headers=response.getheaders() )
         
         try:
             parsed_response = json.loads( response.read() )
@@ -30,13 +35,93 @@ def get_json_generic( connection, resource_path, schema=None ):
                              "{}".format( ex.args ) )
         
         if schema:
-            if isinstance( schema, str ):
-                schema = parse_schema( schema )
-            assert isinstance( schema, dict )
-            jsonschema.validate( parsed_response, schema )
+            validate_json( parsed_response, schema, validation )
 
         return parsed_response
 
+VALIDATION_LEVELS = ('off', 'sampled', 'strict')
+
+# The global validation level, and the fraction of responses validated at the 'sampled' level.
+# The defaults can be chosen via the environment, e.g. PYDVID_VALIDATION=sampled:0.05
+_validation_level, _, _sample_rate = os.environ.get( 'PYDVID_VALIDATION', 'strict' ).partition(':')
+_sample_rate = float( _sample_rate or 0.01 )
+if _validation_level not in VALIDATION_LEVELS:
+    raise ValueError( "Invalid PYDVID_VALIDATION level: {}".format( _validation_level ) )
+
+def set_validation_level( level, sample_rate=None ):
+    """
+    Choose how thoroughly json responses (and VoxelsMetadata) are checked against their schemas:
+    
+    - 'off': Not at all.
+    - 'sampled': Validate a random fraction (``sample_rate``) of them, e.g. to catch server changes in production cheaply.
+    - 'strict': Validate all of them (the default, e.g. for tests and CI).
+    
+    Applies to all threads.  Individual calls may override it via their ``validation`` parameter.
+    """
+    global _validation_level, _sample_rate
+    assert level in VALIDATION_LEVELS, "Invalid validation level: {}".format( level )
+    if sample_rate is not None:
+        assert 0.0 <= sample_rate <= 1.0
+        _sample_rate = sample_rate
+    _validation_level = level
+
+def get_validation_level():
+    """
+    Return the global validation level and sample rate, as a tuple.
+    """
+    return _validation_level, _sample_rate
+
+def validate_json( instance, schema, validation=None ):
+    """
+    Validate the given parsed json against the given schema (a dict, or the name of a schema file, as for get_json_generic),
+    according to the given validation level (or the global level, if None).
+    Raises ``jsonschema.ValidationError`` if the json is invalid.
+    """
+    level = validation or _validation_level
+    assert level in VALIDATION_LEVELS, "Invalid validation level: {}".format( level )
+    if level == 'off' or (level == 'sampled' and random.random() >= _sample_rate):
+        return
+    get_validator( schema ).validate( instance )
+
+# Parsed schemas and compiled validators, which are shared by all threads
+_schemas = {}    # schema filename : schema
+_validators = {} # schema filename : validator
+_schemas_lock = threading.Lock()
+
+def get_schema( schema_filename ):
+    """
+    Return the schema with the given filename (see ``parse_schema()``), which is parsed only once.
+    The result is shared, so don't modify it.
+    """
+    try:
+        return _schemas[schema_filename]
+    except KeyError:
+        schema = parse_schema( schema_filename )
+        with _schemas_lock:
+            return _schemas.setdefault( schema_filename, schema )
+
+def get_validator( schema ):
+    """
+    Return a jsonschema validator object for the given schema (a dict, or the name of a schema file).
+    For schema files, the validator is created (and the schema itself is checked) only once.
+    Validators for dict schemas aren't cached, since there may be any number of those.
+    """
+    if not isinstance( schema, str ):
+        return _create_validator( schema )
+    try:
+        return _validators[schema]
+    except KeyError:
+        validator = _create_validator( get_schema( schema ) )
+        with _schemas_lock:
+            return _validators.setdefault( schema, validator )
+
+def _create_validator( schema ):
+    import jsonschema # (Imported here, since it is slow to import.)
+    assert isinstance( schema, dict )
+    validator_class = jsonschema.validators.validator_for( schema )
+    validator_class.check_schema( schema )
+    return validator_class( schema )
+
 # Pattern for all json schema filenames, e.g. dvid-server-info-v0.01.schema.json
 schema_name_pattern = re.compile('(?P<message_name>.*)-v\d+\.\d+\.schema.json')
 
@@ -65,3 +150,81 @@ def parse_schema( schema_filename ):
     # Parse the json
     with open( schema_path ) as schema_file:
         return json.load( schema_file )
+
+def stream_readinto( stream, view ):
+    """
+    Read up to len(view) bytes from the given stream directly into view, 
+    which must be a writable memoryview of bytes.
+    Returns the number of bytes read, which is 0 only at the end of the stream.
+    
+    - If the stream has a readinto() method, it is used.
+    - An ``httplib.HTTPResponse`` has no readinto() in python 2, so we receive directly 
+      from the underlying socket if possible (i.e. if the response isn't chunked and 
+      no data has been buffered yet).
+    - Otherwise, we fall back to stream.read() and copy the result into the view.
+    """
+    readinto = getattr( stream, 'readinto', None )
+    if readinto is not None:
+        return readinto( view ) or 0
+    if isinstance( stream, httplib.HTTPResponse ):
+        nbytes = _response_readinto( stream, view )
+        if nbytes is not None:
+            return nbytes
+    data = stream.read( len(view) )
+    view[:len(data)] = data
+    return len(data)
+
+def _response_readinto( response, view ):
+    """
+    Receive data for the given HTTPResponse directly from its socket into the given view.
+    Returns None if that isn't possible for this response (the caller must fall back to read()).
+    """
+    fp = response.fp
+    if fp is None:
+        return 0
+    sock = getattr( fp, '_sock', None )
+    rbuf = getattr( fp, '_rbuf', None )
+    if response.chunked or response.length is None or sock is None \
+       or rbuf is None or len(rbuf.getvalue()) > 0:
+        return None
+
+    nbytes = min( len(view), response.length )
+    if nbytes == 0:
+        response.close()
+        return 0
+
+    while True:
+        try:
+            received = sock.recv_into( view, nbytes )
+            break
+        except socket.error as ex:
+            if ex.args[0] != errno.EINTR:
+                raise
+
+    # Keep the response's bookkeeping consistent with what read() would do.
+    response.length -= received
+    if received == 0 or response.length == 0:
+        response.close()
+    return received
+
+def stream_write( stream, view ):
+    """
+    Write the given memoryview of bytes to the stream, without copying it if possible.
+    
+    - Sockets (or anything else with a sendall() method) receive the view directly.
+    - For socket file objects (e.g. a request handler's wfile), any buffered data 
+      is flushed and then the view is sent directly to the underlying socket.
+    - Real files, io streams and cStringIO accept the view as-is.
+    - Anything else gets a copy of the data as a str, since some streams 
+      (notably ``StringIO.StringIO``) don't handle memoryview objects correctly.
+    """
+    sendall = getattr( stream, 'sendall', None )
+    if sendall is not None:
+        sendall( view )
+    elif isinstance( stream, socket._fileobject ) and stream._sock is not None:
+        stream.flush()
+        stream._sock.sendall( view )
+    elif isinstance( stream, (file, io.IOBase, cStringIO.OutputType) ):
+        stream.write( view )
+    else:
+        stream.write( view.tobytes() )
@@ -1,4 +1,4 @@
 from voxels import *
 from voxels_metadata import VoxelsMetadata
-from voxels_accessor import VoxelsAccessor, RoiMaskAccessor
+from voxels_accessor import VoxelsAccessor, RoiMaskAccessor, wait_all
 
@@ -1,22 +1,77 @@
 import json
+import numbers
 import httplib
+import threading
 import contextlib
 
 import numpy
 
 from pydvid.errors import DvidHttpError, UnexpectedResponseError
 from pydvid.util import get_json_generic
+from pydvid.retry import auto_retry
+from pydvid.hooks import instrumented, set_endpoint
+from pydvid.node_cache import cached_read, invalidating
+from pydvid.dvid_connection import get_shared_executor
+from pydvid.general.repo_catalog import RepoCatalog, get_repo_catalog
 from pydvid.voxels.voxels_metadata import VoxelsMetadata
-from pydvid.voxels.voxels_nddata_codec import VoxelsNddataCodec
+from pydvid.voxels.voxels_nddata_codec import VoxelsNddataCodec, get_codec, get_codec_class, get_codec_class_for_mimetype
 
-def get_metadata( connection, uuid, data_name ):
+# Import for side-effects: registers the compressed transfer codecs.
+import pydvid.voxels.voxels_compressed_codecs
+
+@cached_read( 'metadata', lambda connection, uuid, data_name, validation=None: (uuid, data_name, ()) )
+@auto_retry
+@instrumented('metadata')
+def get_metadata( connection, uuid, data_name, validation=None ):
     """
     Query the voxels metedata for the given node/data_name.
+    The validation level ('off', 'sampled' or 'strict') defaults to the global level (see ``pydvid.util.set_validation_level()``).
     """
     rest_query = "/api/node/{uuid}/{data_name}/metadata".format( uuid=uuid, data_name=data_name )
     parsed_json = get_json_generic( connection, rest_query )
-    return VoxelsMetadata( parsed_json )
+    return VoxelsMetadata( parsed_json, validation )
+
+# DVID type names of the data instances that provide voxels metadata
+VOXELS_TYPENAMES = frozenset( VoxelsMetadata.TYPENAMES.values() ) | \
+                   frozenset( [ 'uint8blk', 'uint16blk', 'uint32blk', 'uint64blk', 'float32blk',
+                                'labelblk', 'rgba8blk', 'labelarray', 'labelmap', 'voxels' ] )
 
+def get_metadata_bulk( connection, uuid, repos_info=None, data_names=None, validation=None ):
+    """
+    Fetch the metadata of every voxels data instance (see ``VOXELS_TYPENAMES``) in the given node, concurrently.
+    Returns two dicts: ``{ data_name : VoxelsMetadata }`` for the instances whose metadata could be fetched,
+    and ``{ data_name : exception }`` for the rest.
+    
+    The requests are run on the connection's shared executor (see ``get_shared_executor()``),
+    so they run in parallel over a pooled connection (e.g. a ``DvidConnection``), and one at a time otherwise.
+
+    :param repos_info: The output of ``general.get_repos_info()``, which lists the repo's data instances.
+                       If not given, the connection's shared ``RepoCatalog`` is used.
+    :param data_names: If given, only these instances are fetched (whatever their type).
+    :param validation: The schema validation level for the metadata (see ``get_metadata()``).
+    """
+    if data_names is None:
+        if repos_info is None:
+            catalog = get_repo_catalog( connection )
+        else:
+            catalog = RepoCatalog( connection, ttl=None, min_refresh_interval=float('inf') )
+            catalog.refresh( repos_info )
+        instance_types = catalog.data_instances( uuid )
+        data_names = sorted( name for name, typename in instance_types.items() if typename in VOXELS_TYPENAMES )
+
+    executor = get_shared_executor( connection )
+    futures = [ (data_name, executor.submit( get_metadata, connection, uuid, data_name, validation ))
+                for data_name in data_names ]
+    metadata = {}
+    errors = {}
+    for data_name, future in futures:
+        try:
+            metadata[data_name] = future.result()
+        except Exception as ex:
+            errors[data_name] = ex
+    return metadata, errors
+
+@instrumented('metadata')
 def create_new( connection, uuid, data_name, voxels_metadata ):
     """
     Create a new volume in the dvid server.
@@ -46,21 +101,65 @@ def create_new( connection, uuid, data_name, voxels_metadata ):
         if response.status != httplib.OK:
             raise DvidHttpError( 
                 "voxels.new", response.status, response.reason, response.read(),
-                 "POST", rest_query, message_json, headers)
+                 "POST", rest_query, message_json, headers, response.getheaders() )
 
         # Apparently dvid returns a status message in the response.  
         # We can just read it and ignore it.
         response_text = response.read()
 
-def get_ndarray( connection, uuid, data_name, access_type, voxels_metadata, start, stop, query_args=None, throttle=False ):
+def _ndarray_cache_key( connection, uuid, data_name, access_type, voxels_metadata, start, stop, query_args=None, throttle=False,
+                        out_dtype=None, check_overflow=False, axis_order=None, order='F', compression=None ):
+    """
+    The node_cache key for get_ndarray().  (Throttling and the transfer compression don't affect the result.)
+    """
+    request_key = ( access_type, tuple(start), tuple(stop), voxels_metadata.dtype.str, voxels_metadata.shape[0],
+                    tuple( sorted( (query_args or {}).items() ) ), out_dtype and numpy.dtype(out_dtype).str,
+                    check_overflow, axis_order, order )
+    return uuid, data_name, request_key
+
+@cached_read( 'ndarray', _ndarray_cache_key )
+@auto_retry
+@instrumented('raw')
+def get_ndarray( connection, uuid, data_name, access_type, voxels_metadata, start, stop, query_args=None, throttle=False,
+                 out_dtype=None, check_overflow=False, axis_order=None, order='F', compression=None ):
+    """
+    Request the subvolume specified by the given start and stop pixel coordinates.
+    
+    If out_dtype is given, the data is converted to that dtype as it is received.
+    If check_overflow is also True, an error is raised if any value doesn't fit in out_dtype.
+    
+    If axis_order is given (e.g. 'czyx'), the returned array's axes are permuted accordingly.
+    Together with order='C', this produces data in the layout most C-order libraries expect, 
+    without an extra full-volume transpose copy.
+    (Note that start and stop are always given in the volume's own axis order, i.e. ``voxels_metadata.axiskeys``.)
+    
+    If compression is given (e.g. 'gzip', 'lz4', 'zstd', 'labelpalette'), that transfer codec is requested.
+    The data is decoded according to the Content-Type of the response, so servers that
+    ignore the request and send raw data are still handled correctly.
+    
+    See ``VoxelsNddataCodec.decode_to_ndarray`` for details.
+    """
+    set_endpoint( access_type ) # e.g. 'raw' or 'mask'
     _validate_query_bounds( start, stop, voxels_metadata.shape )
-    codec = VoxelsNddataCodec( voxels_metadata.dtype )
-    response = get_subvolume_response( connection, uuid, data_name, access_type, start, stop, query_args=query_args, throttle=throttle )
+    codec_class = get_codec_class( compression )
+    axes = None
+    if axis_order is not None:
+        axes = _get_axis_permutation( voxels_metadata.axiskeys, axis_order )
+    query_args = _get_codec_query_args( codec_class, query_args )
+    response = get_subvolume_response( connection, uuid, data_name, access_type, start, stop, 
+                                       format=codec_class.REST_FORMAT, query_args=query_args, throttle=throttle )
     with contextlib.closing(response):
+        codec_class = get_codec_class_for_mimetype( response.getheader("Content-Type"), default=codec_class )
+        codec = get_codec( codec_class, voxels_metadata.dtype )
+
         # "Full" roi shape includes channel axis and ALL channels
-        full_roi_shape = numpy.array(stop) - start
-        full_roi_shape[0] = voxels_metadata.shape[0]
-        decoded_data = codec.decode_to_ndarray( response, full_roi_shape )
+        full_roi_shape = (voxels_metadata.shape[0],) + tuple( b - a for a, b in zip(start[1:], stop[1:]) )
+        num_bytes = voxels_metadata.dtype.itemsize * _product( full_roi_shape )
+        if num_bytes <= SMALL_REQUEST_MAX_BYTES and codec_class is VoxelsNddataCodec \
+           and out_dtype is None and axes is None and order == 'F':
+            decoded_data = _receive_small_ndarray( codec, response, full_roi_shape, num_bytes )
+        else:
+            decoded_data = codec.decode_to_ndarray( response, full_roi_shape, out_dtype, check_overflow, axes, order )
     
         # Was the response fully consumed?  Check.
         # NOTE: This last read() is not optional.
@@ -70,30 +169,86 @@ def get_ndarray( connection, uuid, data_name, access_type, voxels_metadata, star
         if excess_data:
             # Uh-oh, we expected it to be empty.
             raise UnexpectedResponseError( "Received data was longer than expected by {} bytes.  (Expected only {} bytes.)"
-                                           "".format( len(excess_data), len(numpy.getbuffer(decoded_data)) ) ) 
+                                           "".format( len(excess_data), codec.calculate_buffer_len(full_roi_shape) ) ) 
         # Select the requested channels from the returned data.
         return decoded_data
 
+# Raw subvolumes of up to this many bytes (e.g. 32**3 uint64 voxels) are received via a reusable
+#  per-thread buffer instead of the general (chunked, converting) decoder.  Set to 0 to disable.
+SMALL_REQUEST_MAX_BYTES = 2**18
+
+_small_receive_buffers = threading.local()
+
+def _receive_small_ndarray( codec, stream, full_roi_shape, num_bytes ):
+    """
+    Receive a small raw subvolume into this thread's reusable receive buffer, and return a copy of it
+    (in fortran order).  For small requests, that is cheaper than setting up a view of a new array to receive into.
+    """
+    buf = getattr( _small_receive_buffers, 'buf', None )
+    if buf is None or len(buf) < num_bytes:
+        buf = bytearray( max( num_bytes, SMALL_REQUEST_MAX_BYTES ) )
+        _small_receive_buffers.buf = buf
+        _small_receive_buffers.view = memoryview( buf )
+    codec._read_to_buffer( _small_receive_buffers.view[:num_bytes], stream )
+    flat_data = numpy.frombuffer( buf, codec.dtype, num_bytes // codec.dtype.itemsize )
+    return flat_data.reshape( full_roi_shape, order='F' ).copy( order='F' )
+
+def _product( shape ):
+    product = 1
+    for n in shape:
+        product *= n
+    return product
+
 
-def post_ndarray( connection, uuid, data_name, access_type, voxels_metadata, start, stop, new_data, throttle=False ):
+@invalidating
+@auto_retry
+@instrumented('raw')
+def post_ndarray( connection, uuid, data_name, access_type, voxels_metadata, start, stop, new_data, throttle=False, axis_order=None,
+                  compression=None ):
+    """
+    Overwrite subvolume specified by the given start and stop pixel coordinates with new_data.
+    
+    If axis_order is given (e.g. 'czyx'), new_data is indexed in that order instead of ``voxels_metadata.axiskeys``.
+    Data that isn't already laid out in DVID (F) order is sent in small transposed pieces, 
+    without making a full-volume copy.
+
+    If compression is given (e.g. 'gzip'), the data is compressed with that transfer codec before it is sent.
+    """
+    set_endpoint( access_type )
     _validate_query_bounds( start, stop, voxels_metadata.shape, allow_overflow_extents=True )
-    codec = VoxelsNddataCodec( voxels_metadata.dtype )
-    rest_query = _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, format="", query_args=None, throttle=throttle )
-    body_data_stream = codec.create_encoded_stream_from_ndarray(new_data)
+    codec_class = get_codec_class( compression )
+    codec = get_codec( codec_class, voxels_metadata.dtype )
+    if axis_order is not None:
+        # Obtain a view of the data, indexed in DVID order.
+        new_data = new_data.transpose( _get_axis_permutation( axis_order, voxels_metadata.axiskeys ) )
+    query_args = _get_codec_query_args( codec_class, None )
+    rest_query = _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, 
+                                             format=codec_class.REST_FORMAT, query_args=query_args, throttle=throttle )
+
+    rate_limiter = getattr( connection, 'rate_limiter', None )
+    if rate_limiter is None:
+        # For F_CONTIGUOUS data, the body is a memoryview of new_data itself, 
+        #  which httplib sends to the socket in one call, without copying.
+        body = codec.create_request_body(new_data)
+    else:
+        # Send the body as a stream, which httplib reads in small blocks.
+        # That way, the transfer is paced by the connection's rate limiter.
+        body = codec.create_encoded_stream_from_ndarray(new_data)
+        body.rate_limiter = rate_limiter
     
     # Slightly tricky here:
     # The httplib docs say that we can only send a stream that has a fileno() method,
     #  but it turns out we can send any stream as long as we provide our own content-length header.
-    headers = { "Content-Type" : VoxelsNddataCodec.VOLUME_MIMETYPE,
-                "Content-Length" : str(codec.calculate_buffer_len(new_data.shape)) }
+    headers = { "Content-Type" : codec.VOLUME_MIMETYPE,
+                "Content-Length" : str(len(body)) }
     
-    connection.request( "POST", rest_query, body=body_data_stream, headers=headers )
+    connection.request( "POST", rest_query, body=body, headers=headers )
     with contextlib.closing( connection.getresponse() ) as response:
         #if response.status != httplib.NO_CONTENT:
         if response.status != httplib.OK:
             raise DvidHttpError( 
                 "subvolume post", response.status, response.reason, response.read(),
-                 "POST", rest_query, "<binary data>", headers)
+                 "POST", rest_query, "<binary data>", headers, response.getheaders() )
         
         # Something (either dvid or the httplib) gets upset if we don't read the full response.
         response.read()
@@ -109,7 +264,7 @@ def get_subvolume_response( connection, uuid, data_name, access_type, start, sto
     if response.status != httplib.OK:
         raise DvidHttpError( 
             "subvolume query", response.status, response.reason, response.read(),
-            "GET", rest_query, "" )
+            "GET", rest_query, "", response_headers=response.getheaders() )
     return response
 
 
@@ -117,30 +272,25 @@ def _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, forma
     """
     Construct the REST URI for get/post of a voxels subvolume.
     """
-    start = numpy.asarray(start)
-    stop = numpy.asarray(stop)
-    query_args = query_args or {}
-    query_args = { str(k) : str(v) for k,v in query_args.items() }
-
     # Drop channel before requesting from DVID
-    start = start[1:]
-    stop = stop[1:]
+    start = tuple(start[1:])
+    stop = tuple(stop[1:])
+
+    # (The template formats coordinates with %d, which would silently truncate e.g. floats.)
+    assert all( isinstance( x, numbers.Integral ) for x in start + stop ), \
+        "Subvolume coordinates must be integers: {}, {}".format( start, stop )
 
     # Dvid roi shape doesn't include channel
-    dvid_roi_shape = stop - start
-    roi_shape_str = "_".join( map(str, dvid_roi_shape) )
-    start_str = "_".join( map(str, start) )
-    
-    dims_string = "_".join( map(str, range(len(start)) ) )
-    rest_query = "/api/node/{uuid}/{data_name}/{access_type}/{dims_string}/{roi_shape_str}/{start_str}"\
-                 "".format( uuid=uuid, 
-                            data_name=data_name, 
-                            access_type=access_type,
-                            dims_string=dims_string, 
-                            roi_shape_str=roi_shape_str, 
-                            start_str=start_str )
+    dvid_roi_shape = tuple( b - a for a, b in zip(start, stop) )
+    template = _get_subvolume_uri_template( uuid, data_name, access_type, len(start) )
+    rest_query = template % ( dvid_roi_shape + start )
     if format != "":
         rest_query += "/" + format
+    if not query_args and not throttle:
+        return rest_query
+
+    query_args = query_args or {}
+    query_args = { str(k) : str(v) for k,v in query_args.items() }
 
     # throttle is a special arg: normally it is set explicity as an arg to this function.
     # but if the user also supplied it in the query_args, just verify consistency.
@@ -156,6 +306,47 @@ def _format_subvolume_rest_uri( uuid, data_name, access_type, start, stop, forma
         rest_query += "?" + "&".join( map( "=".join, query_args.items() ) )
     return rest_query
 
+# (uuid, data_name, access_type, ndim) : template, e.g. "/api/node/abc/grayscale/raw/0_1_2/%d_%d_%d/%d_%d_%d"
+_subvolume_uri_templates = {}
+_MAX_SUBVOLUME_URI_TEMPLATES = 1000
+
+def _get_subvolume_uri_template( uuid, data_name, access_type, ndim ):
+    """
+    Return the (cached) %-format template for subvolume URIs of the given data instance,
+    to be formatted with the roi shape and start (excluding the channel axis).
+    """
+    key = (uuid, data_name, access_type, ndim)
+    try:
+        return _subvolume_uri_templates[key]
+    except KeyError:
+        pass
+    dims_string = "_".join( map(str, range(ndim)) )
+    coords_template = "_".join( ("%d",)*ndim )
+    prefix = "/api/node/{uuid}/{data_name}/{access_type}/{dims_string}"\
+             "".format( uuid=uuid, data_name=data_name, access_type=access_type, dims_string=dims_string )
+    template = prefix.replace( "%", "%%" ) + "/" + coords_template + "/" + coords_template
+    if len(_subvolume_uri_templates) >= _MAX_SUBVOLUME_URI_TEMPLATES:
+        _subvolume_uri_templates.clear()
+    _subvolume_uri_templates[key] = template
+    return template
+
+
+def _get_codec_query_args( codec_class, query_args ):
+    """
+    Return a copy of query_args, including the query args that select the given codec.
+    """
+    query_args = dict( query_args or {} )
+    query_args.update( codec_class.REST_QUERY_ARGS )
+    return query_args or None
+
+def _get_axis_permutation( from_axiskeys, to_axiskeys ):
+    """
+    Return the axis permutation that converts an array indexed by from_axiskeys 
+    into an array indexed by to_axiskeys, e.g. ('cxyz', 'czyx') -> (0,3,2,1)
+    """
+    assert sorted(from_axiskeys) == sorted(to_axiskeys), \
+        "Axis order '{}' is not a permutation of '{}'".format( to_axiskeys, from_axiskeys )
+    return tuple( from_axiskeys.index(k) for k in to_axiskeys )
 
 def _validate_query_bounds( start, stop, volume_shape, allow_overflow_extents=True ):
     """
@@ -164,19 +355,21 @@ def _validate_query_bounds( start, stop, volume_shape, allow_overflow_extents=Tr
     start/stop fields exceed the current bounds of the dataset.
     (For writing, it's okay to exceed the bounds.  
     For reading, that would probably be an error.)
+    
+    (The checks are done with python scalars: for small requests, building numpy arrays here would cost
+    more than the rest of the request preparation.)
     """
-    shape = volume_shape
-    start, stop, shape = map( numpy.array, (start, stop, shape) )
     assert start[0] == 0, "Subvolume get/post must include all channels.  Invalid roi: {}, {}".format( start, stop )
-    assert stop[0] == shape[0], "Subvolume get/post must include all channels.  Invalid roi: {}, {}".format( start, stop )
-    assert len(start) == len(stop) == len(shape), \
-        "start/stop/shape mismatch: {}/{}/{}".format( start, stop, shape )
-    assert (start < stop).all(), "Invalid start/stop: {}/{}".format( start, stop )
-    #assert (start >= 0).all(), "Invalid start: {}".format( start )
+    assert stop[0] == volume_shape[0], "Subvolume get/post must include all channels.  Invalid roi: {}, {}".format( start, stop )
+    assert len(start) == len(stop) == len(volume_shape), \
+        "start/stop/shape mismatch: {}/{}/{}".format( start, stop, volume_shape )
+    for a, b in zip(start, stop):
+        assert a < b, "Invalid start/stop: {}/{}".format( start, stop )
     
-    if not allow_overflow_extents and (None not in list(shape)):
-        assert (start < shape).all(), "Invalid start/shape: {}/{}".format( start, shape )
-        assert (stop <= shape).all(), "Invalid stop/shape: {}/{}".format( stop, shape )
+    if not allow_overflow_extents and (None not in list(volume_shape)):
+        for a, b, n in zip(start, stop, volume_shape):
+            assert a < n, "Invalid start/shape: {}/{}".format( start, volume_shape )
+            assert b <= n, "Invalid stop/shape: {}/{}".format( stop, volume_shape )
     else:
-        assert (start[0] < shape[0]).all(), "Invalid channel start/shape: {}/{}".format( start, shape )
-        assert (stop[0] <= shape[0]).all(), "Invalid channel stop/shape: {}/{}".format( stop, shape )
+        assert start[0] < volume_shape[0], "Invalid channel start/shape: {}/{}".format( start, volume_shape )
+        assert stop[0] <= volume_shape[0], "Invalid channel stop/shape: {}/{}".format( stop, volume_shape )
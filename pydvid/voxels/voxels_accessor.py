@@ -1,13 +1,14 @@
 import copy
-import time
 import httplib
 import functools
-import warnings
 
 import numpy
+import concurrent.futures
 import voxels
 
-from pydvid.errors import DvidHttpError
+from pydvid.retry import RetryPolicy
+from pydvid.hedging import HedgingPolicy
+from pydvid.dvid_connection import get_shared_executor
 from pydvid.voxels import VoxelsMetadata
 
 class VoxelsAccessor(object):
@@ -21,8 +22,8 @@ class VoxelsAccessor(object):
     * Allow users to provide a pre-allocated array when requesting data
     """
     
-    class ThrottleTimeoutException(Exception):
-        pass
+    # Raised when the server is still busy after retry_timeout
+    ThrottleTimeoutException = RetryPolicy.RetryTimeoutError
     
     def __init__(self, connection, uuid, data_name, 
                  query_args=None, 
@@ -30,6 +31,11 @@ class VoxelsAccessor(object):
                  retry_timeout=60.0, 
                  retry_interval=1.0, 
                  warning_interval=30.0, 
+                 out_dtype=None,
+                 check_overflow=False,
+                 compression=None,
+                 retry_policy=None,
+                 hedging=None,
                  _metadata=None,
                  _access_type="raw"):
         """
@@ -39,24 +45,49 @@ class VoxelsAccessor(object):
         :param throttle: Enable the DVID 'throttle' flag for all get/post requests
         :param retry_timeout: Total time to spend repeating failed requests before giving up.
                               (Set to 0 to prevent retries.)
-        :param retry_interval: Time to wait before repeating a failed get/post.
+        :param retry_interval: Maximum time to wait before repeating a failed request.
+                               (The actual delay is random, and grows with each failed attempt.)
         :param warning_interval: If the retry period exceeds this interval (but hasn't 
                                  hit the retry_timeout yet), a warning is emitted.
+        :param out_dtype: If provided, retrieved data is converted to this dtype as it is received.
+                          (By default, data is returned in the volume's native dtype.)
+        :param check_overflow: If True, raise ``VoxelsNddataCodec.DtypeOverflowError`` when 
+                               retrieved data can't be represented by out_dtype.
+        :param compression: If provided, the name of the transfer codec to use for all get/post requests, 
+                            e.g. 'gzip', 'lz4', 'zstd', or 'labelpalette' (recommended for label volumes).
+        :param retry_policy: A ``pydvid.retry.RetryPolicy``.  If provided, the retry_timeout, retry_interval 
+                             and warning_interval parameters are ignored.
+        :param hedging: If True (or a ``pydvid.hedging.HedgingPolicy``), reads that are unusually slow to respond
+                        are duplicated on another connection, and the first response is used.
+                        Requires a connection that can be shared by several threads, e.g. a ``DvidConnection``.
         :param _metadata: If provided, used as the metadata for the accessor.  Otherwise, the server is queried to obtain this volume's metadata.
         
         .. note:: When DVID is overloaded, it may indicate its busy status by returning a ``503`` 
                   (service unavailable) error in response to a get/post request.  In that case, 
                   the get/post methods below will automatically repeat the failed request until 
-                  the `retry_timeout` is reached.
+                  the `retry_timeout` is reached.  Requests that fail due to a connection reset are 
+                  also repeated (a few times).  See ``pydvid.retry`` for details.
         """
         self.uuid = uuid
         self.data_name = data_name
         self._connection = connection
-        self._retry_timeout = retry_timeout
-        self._retry_interval = retry_interval
-        self._warning_interval = warning_interval
+        self._retry_policy = retry_policy
+        if self._retry_policy is None:
+            self._retry_policy = RetryPolicy( timeout=retry_timeout, 
+                                              max_delay=retry_interval, 
+                                              warning_interval=warning_interval )
+        if hedging is True:
+            hedging = HedgingPolicy()
+        self._get_ndarray_func = voxels.get_ndarray
+        if hedging:
+            assert not isinstance( connection, httplib.HTTPConnection ), \
+                "Hedged requests require a connection that can be used by several threads at once, e.g. a DvidConnection."
+            self._get_ndarray_func = functools.partial( hedging.call, voxels.get_ndarray )
         self._query_args = query_args or {}
         self._access_type = _access_type
+        self._out_dtype = out_dtype
+        self._check_overflow = check_overflow
+        self._compression = compression
         
         # Special case: throttle can be set explicity via the keyword or implicitly via the query_args.
         # Make sure they are consistent.
@@ -75,7 +106,7 @@ class VoxelsAccessor(object):
         # Request this volume's metadata from DVID
         self.voxels_metadata = _metadata
         if self.voxels_metadata is None:
-            self.voxels_metadata = voxels.get_metadata( self._connection, uuid, data_name )
+            self.voxels_metadata = self._retry_policy.call( voxels.get_metadata, self._connection, uuid, data_name )
 
     @property
     def shape(self):
@@ -112,98 +143,62 @@ class VoxelsAccessor(object):
         """
         return self.voxels_metadata.axiskeys
 
-    def _auto_retry(func):
-        """
-        Decorator.  If the function raises a DvidHttpError with 
-        the 503 (SERVICE_UNAVAILABLE) status code, try again 
-        until successful or a timeout is reached.
-        """
-        @functools.wraps(func)
-        def _retry_wrapper( self, *args, **kwargs ):
-            try:
-                # Fast path for the first attempt
-                return func(self, *args, **kwargs)
-            except DvidHttpError as ex:
-                if ex.status_code != httplib.SERVICE_UNAVAILABLE:
-                    raise # not 503: this is a real problem
-                elif self._retry_timeout <= self._retry_interval:
-                    raise VoxelsAccessor.ThrottleTimeoutException( 
-                        "Timeout due to 503 response. "
-                        "VoxelsAccessor auto-retry is disabled. "
-                        "(timeout <= retry: {} <= {})"
-                        .format( self._retry_timeout, self._retry_interval ) )
-                
-                start_time = time.time()
-                time_so_far = 0.0
-                last_warning_time = 0.0
-                n_attempts = 1
-
-                # Keep retrying until we timeout
-                while time_so_far < self._retry_timeout:
-                    if time_so_far - last_warning_time > self._warning_interval:
-                        warnings.warn("DVID Server has been busy for {:.1f} seconds.  Still retrying..."
-                                      .format( time_so_far ))
-                        last_warning_time = time_so_far
-                    time.sleep( self._retry_interval )
-                    n_attempts += 1
-                    try:
-                        return func(self, *args, **kwargs)
-                    except DvidHttpError as ex:
-                        if ex.status_code == httplib.SERVICE_UNAVAILABLE:
-                            # 503 error from DVID indicates 'busy'
-                            # We'll keep looping...
-                            time_so_far = time.time() - start_time
-                        else:
-                            raise # not 503: this is a real problem
-
-                # Loop finished: we timed out.
-                raise VoxelsAccessor.ThrottleTimeoutException( 
-                    "Timeout due to repeated 503 responses: "
-                    "DVID Server is still too busy after {} attempts over {:.1f} seconds"
-                    .format(n_attempts, time_so_far) )
-
-        _retry_wrapper.__wrapped__ = func # Emulate python 3 behavior of @wraps
-        return _retry_wrapper
-
-    @_auto_retry
-    def get_ndarray( self, start, stop ):
+    def get_ndarray( self, start, stop, out_dtype=None, axis_order=None, order='F' ):
         """
         Request the subvolume specified by the given start and stop pixel coordinates.
+        
+        :param out_dtype: If provided, overrides the ``out_dtype`` this accessor was constructed with.
+        :param axis_order: If provided (e.g. 'czyx'), the axes of the returned array are permuted into this order.
+                           (start/stop are still specified in the order of ``self.axiskeys``.)
+        :param order: Memory order of the returned array ('F' or 'C').
         """
-        return voxels.get_ndarray( self._connection, 
-                                   self.uuid, 
-                                   self.data_name, 
-                                   self._access_type,
-                                   self.voxels_metadata, 
-                                   start, 
-                                   stop,
-                                   self._query_args, 
-                                   self._throttle )
-
-    def post_ndarray( self, start, stop, new_data ):
+        if out_dtype is None:
+            out_dtype = self._out_dtype
+        return self._retry_policy.call( self._get_ndarray_func,
+                                        self._connection, 
+                                        self.uuid, 
+                                        self.data_name, 
+                                        self._access_type,
+                                        self.voxels_metadata, 
+                                        start, 
+                                        stop,
+                                        self._query_args, 
+                                        self._throttle,
+                                        out_dtype,
+                                        self._check_overflow,
+                                        axis_order,
+                                        order,
+                                        self._compression )
+
+    def post_ndarray( self, start, stop, new_data, axis_order=None ):
         """
         Overwrite subvolume specified by the given start and stop pixel coordinates with new_data.
+
+        :param axis_order: If provided (e.g. 'czyx'), new_data is indexed in this order instead of ``self.axiskeys``.
+                           (start/stop are still specified in the order of ``self.axiskeys``.)
         """
         # Post the data (with auto-retry)
-        self._post_ndarray(start, stop, new_data)
+        self._post_ndarray(start, stop, new_data, axis_order)
 
         if ( numpy.array(stop) > self.shape ).any() or \
            ( numpy.array(start) < self.minindex ).any():
             # It looks like this post UPDATED the volume's extents.
             # Therefore, RE-request this volume's metadata from DVID so we get the new volume shape
-            self.voxels_metadata = voxels.get_metadata( self._connection, self.uuid, self.data_name )
-
-    @_auto_retry
-    def _post_ndarray( self, start, stop, new_data ):
-        voxels.post_ndarray( self._connection, 
-                             self.uuid, 
-                             self.data_name, 
-                             self._access_type,
-                             self.voxels_metadata, 
-                             start, 
-                             stop, 
-                             new_data,
-                             self._throttle )
+            self.voxels_metadata = self._retry_policy.call( voxels.get_metadata, self._connection, self.uuid, self.data_name )
+
+    def _post_ndarray( self, start, stop, new_data, axis_order=None ):
+        self._retry_policy.call( voxels.post_ndarray,
+                                 self._connection, 
+                                 self.uuid, 
+                                 self.data_name, 
+                                 self._access_type,
+                                 self.voxels_metadata, 
+                                 start, 
+                                 stop, 
+                                 new_data,
+                                 self._throttle,
+                                 axis_order,
+                                 self._compression )
 
     def __getitem__(self, slicing):
         """
@@ -251,14 +246,7 @@ class VoxelsAccessor(object):
                 # The above is equivalent to this:
                 a = v[:,:10,:10,:][...,::2]            
         """
-        shape = self.voxels_metadata.shape
-        expanded_slicing = VoxelsAccessor._expand_slicing(slicing, shape)
-        explicit_slicing = VoxelsAccessor._explicit_slicing(expanded_slicing, shape)
-        request_slicing, result_slicing = self._determine_request_slicings(explicit_slicing, shape)
-
-        start = map( lambda s: s.start, request_slicing )
-        stop = map( lambda s: s.stop, request_slicing )
-
+        start, stop, result_slicing = self._determine_getitem_request(slicing)
         retrieved_volume = self.get_ndarray(start, stop)
         return retrieved_volume[result_slicing]
 
@@ -287,6 +275,66 @@ class VoxelsAccessor(object):
                 # Forbidden: attempt to write only a subset of channels (the first axis)
                 v[1,...] = green_data # Error!
         """
+        start, stop = self._determine_setitem_request(slicing, array_data)
+        self.post_ndarray(start, stop, array_data)
+
+    def get_ndarray_async( self, start, stop, out_dtype=None, axis_order=None, order='F' ):
+        """
+        Like ``get_ndarray()``, but returns immediately.
+        The request is executed in the background (see ``get_shared_executor()``).
+        
+        :returns: A ``concurrent.futures.Future``, whose result is the requested array.
+                  If the request hasn't started yet, it can be cancelled via ``Future.cancel()``.
+        """
+        return self._submit( self.get_ndarray, start, stop, out_dtype, axis_order, order )
+
+    def post_ndarray_async( self, start, stop, new_data, axis_order=None ):
+        """
+        Like ``post_ndarray()``, but returns immediately.
+        The request is executed in the background (see ``get_shared_executor()``).
+        new_data must not be modified until the request is complete.
+        
+        :returns: A ``concurrent.futures.Future``, whose result is None.
+        """
+        return self._submit( self.post_ndarray, start, stop, new_data, axis_order )
+
+    def getitem_async(self, slicing):
+        """
+        Non-blocking equivalent of ``self[slicing]``.
+        Returns a ``concurrent.futures.Future``, whose result is the requested array.
+        """
+        start, stop, result_slicing = self._determine_getitem_request(slicing)
+        return self._submit( lambda: self.get_ndarray(start, stop)[result_slicing] )
+
+    def setitem_async(self, slicing, array_data):
+        """
+        Non-blocking equivalent of ``self[slicing] = array_data``.
+        Returns a ``concurrent.futures.Future``, whose result is None.
+        """
+        start, stop = self._determine_setitem_request(slicing, array_data)
+        return self._submit( self.post_ndarray, start, stop, array_data )
+
+    def _submit(self, func, *args):
+        return get_shared_executor( self._connection ).submit( func, *args )
+
+    def _determine_getitem_request(self, slicing):
+        """
+        Return the start and stop coordinates to request for the given slicing,
+        and the slicing to apply to the requested volume.
+        """
+        shape = self.voxels_metadata.shape
+        expanded_slicing = VoxelsAccessor._expand_slicing(slicing, shape)
+        explicit_slicing = VoxelsAccessor._explicit_slicing(expanded_slicing, shape)
+        request_slicing, result_slicing = self._determine_request_slicings(explicit_slicing, shape)
+
+        start = map( lambda s: s.start, request_slicing )
+        stop = map( lambda s: s.stop, request_slicing )
+        return start, stop, result_slicing
+
+    def _determine_setitem_request(self, slicing, array_data):
+        """
+        Return the start and stop coordinates to post the given data to.
+        """
         shape = self.voxels_metadata.shape
         expanded_slicing = VoxelsAccessor._expand_slicing(slicing, shape)
         explicit_slicing = VoxelsAccessor._explicit_slicing(expanded_slicing, shape)
@@ -318,8 +366,7 @@ class VoxelsAccessor(object):
             "Provided data does not match the shape of the slicing:"\
             "data has shape {}, slicing {} has shape: {}"\
             "".format( array_data.shape, slicing, slicing_shape )
-
-        self.post_ndarray(start, stop, array_data)
+        return start, stop
 
     @classmethod
     def _determine_request_slicings(cls, full_slicing, shape):
@@ -432,25 +479,51 @@ class RoiMaskAccessor(VoxelsAccessor):
         Create a new VoxelsAccessor with all the same properties as the current instance, 
         except that it accesses a roi mask volume.
         """
-        # Create default mask metadata.
-        mask_metadata = {}
-        mask_metadata["Properties"] = { "Values" : [ { "DataType" : "uint8", "Label": "roi-mask" } ] }
-
-        # For now, we hardcode XYZ order
-        # The size/offset are left as None, because that doesn't apply to ROI data.
-        default_axis_info = { "Label": "", "Resolution": 1, "Units": "", "Size": 0, "Offset" : 0 }
-        mask_metadata["Axes"] = [copy.copy(default_axis_info),
-                                 copy.copy(default_axis_info),
-                                 copy.copy(default_axis_info)]
-        mask_metadata["Axes"][0]["Label"] = "X"
-        mask_metadata["Axes"][1]["Label"] = "Y"
-        mask_metadata["Axes"][2]["Label"] = "Z"
-        
         assert '_metadata' not in kwargs or kwargs['_metadata'] is None
-        kwargs['_metadata'] = VoxelsMetadata(mask_metadata)
+        kwargs['_metadata'] = RoiMaskAccessor._get_mask_metadata().copy()
         
         assert '_access_type' not in kwargs or kwargs['_access_type'] is None        
         kwargs['_access_type'] = 'mask'
 
         # Init base class with pre-formed metadata instead of querying for it.
         super(RoiMaskAccessor, self).__init__( connection, uuid, data_name, *args, **kwargs )
+
+    # The default mask metadata, which is created only once (and copied for each accessor).
+    _mask_metadata = None
+
+    @classmethod
+    def _get_mask_metadata(cls):
+        if cls._mask_metadata is None:
+            mask_metadata = {}
+            mask_metadata["Properties"] = { "Values" : [ { "DataType" : "uint8", "Label": "roi-mask" } ] }
+
+            # For now, we hardcode XYZ order
+            # The size/offset are left as None, because that doesn't apply to ROI data.
+            default_axis_info = { "Label": "", "Resolution": 1, "Units": "", "Size": 0, "Offset" : 0 }
+            mask_metadata["Axes"] = [copy.copy(default_axis_info),
+                                     copy.copy(default_axis_info),
+                                     copy.copy(default_axis_info)]
+            mask_metadata["Axes"][0]["Label"] = "X"
+            mask_metadata["Axes"][1]["Label"] = "Y"
+            mask_metadata["Axes"][2]["Label"] = "Z"
+            cls._mask_metadata = VoxelsMetadata( mask_metadata )
+        return cls._mask_metadata
+
+def wait_all( futures, timeout=None ):
+    """
+    Wait for all of the given futures (e.g. from ``VoxelsAccessor.get_ndarray_async()``) and return their results, in order.
+    If any of them fails, the others that haven't started yet are cancelled, and the exception is raised.
+    
+    :param timeout: Maximum time to wait (in seconds).  If it expires, ``concurrent.futures.TimeoutError`` is raised.
+    """
+    futures = list(futures)
+    done, not_done = concurrent.futures.wait( futures, timeout, return_when=concurrent.futures.FIRST_EXCEPTION )
+    failed = [ f for f in futures if f in done and not f.cancelled() and f.exception() is not None ]
+    if failed:
+        for f in not_done:
+            f.cancel()
+        return failed[0].result() # raises
+    if not_done:
+        raise concurrent.futures.TimeoutError( "{} of {} requests did not complete within {} seconds"
+                                               "".format( len(not_done), len(futures), timeout ) )
+    return [ f.result() for f in futures ]
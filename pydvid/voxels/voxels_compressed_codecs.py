@@ -0,0 +1,311 @@
+"""
+Compressed transfer formats for voxels data.
+
+Each codec here compresses the raw DVID nd-data byte stream (see VoxelsNddataCodec),
+and decompresses it on the fly while decoding, directly into the output array.
+All codecs are registered in the codec registry, so they can be selected by
+format name (e.g. ``get_codec_class('gzip')``) or by the mimetype of a response.
+
+- ``gzip``: Standard gzip (via zlib).
+- ``lz4``: LZ4 frame format.  (Requires the optional ``lz4`` package.)
+- ``zstd``: Zstandard.  (Requires the optional ``zstandard`` package.)
+- ``labelpalette``: A simple blocked codec for label volumes.
+  Each block of voxels is sent as a table of its unique values,
+  followed by each voxel's index into that table, using the smallest sufficient integer type.
+"""
+import zlib
+import struct
+
+import numpy
+
+try:
+    import lz4.frame
+    _have_lz4 = True
+except ImportError:
+    _have_lz4 = False
+
+try:
+    import zstandard
+    _have_zstandard = True
+except ImportError:
+    _have_zstandard = False
+
+from pydvid.errors import UnexpectedResponseError
+from pydvid.voxels.voxels_nddata_codec import VoxelsNddataCodec, register_codec
+
+class CompressedVoxelsNddataCodec(VoxelsNddataCodec):
+    """
+    Base class for codecs that compress the raw voxels byte stream.
+    Subclasses must implement _create_compressor() and _create_decompressor().
+    """
+    # Compressed data is read from the stream in chunks of this size.
+    COMPRESSED_READ_SIZE = 2**16 # (bytes)
+
+    def _create_compressor(self):
+        """
+        Return a new object with compress(str) -> str and flush() -> str methods.
+        """
+        raise NotImplementedError
+
+    def _create_decompressor(self):
+        """
+        Return a new object with a decompress(str) -> str method.
+        """
+        raise NotImplementedError
+
+    def create_encoded_stream_from_ndarray(self, array):
+        return VoxelsNddataCodec.EncodedStream( memoryview( self.create_request_body(array) ) )
+
+    def create_request_body(self, array):
+        """
+        Compress the array and return the compressed data as a str.
+        (The entire compressed body is held in memory, so its length is known in advance.)
+        """
+        return "".join( span.tobytes() for span in self._iter_encoded_spans(array) )
+
+    def _iter_encoded_spans(self, array):
+        compressor = self._create_compressor()
+        for raw_span in self._iter_raw_spans(array):
+            compressed_data = compressor.compress( raw_span )
+            if compressed_data:
+                yield memoryview( compressed_data )
+        compressed_data = compressor.flush()
+        if compressed_data:
+            yield memoryview( compressed_data )
+
+    def _create_decoded_stream(self, stream):
+        return _DecompressingReader( stream, self._create_decompressor(), self.COMPRESSED_READ_SIZE )
+
+    def _finish_decoded_stream(self, decoded_stream):
+        decoded_stream.finish()
+
+class _DecompressingReader(object):
+    """
+    A read-only stream that decompresses the data from another stream on the fly.
+    Supports only readinto(), which is all VoxelsNddataCodec needs.
+    If the underlying stream has a rate_limiter, the compressed data is read no faster than it permits.
+    """
+    def __init__(self, stream, decompressor, read_size):
+        self._stream = stream
+        self._decompressor = decompressor
+        self._rate_limiter = getattr( stream, 'rate_limiter', None )
+        self._read_size = read_size
+        if self._rate_limiter is not None and self._rate_limiter.max_chunk_size is not None:
+            self._read_size = min( read_size, self._rate_limiter.max_chunk_size )
+        self._pending = memoryview("")
+        self._eof = False
+
+    def readinto(self, view):
+        while len(self._pending) == 0:
+            if self._eof:
+                return 0
+            self._pending = memoryview( self._decompress_next() )
+        nbytes = min( len(view), len(self._pending) )
+        view[:nbytes] = self._pending[:nbytes]
+        self._pending = self._pending[nbytes:]
+        return nbytes
+
+    def finish(self):
+        """
+        Consume the rest of the compressed stream (e.g. trailers),
+        and verify that it contained no more data than was read.
+        """
+        extra_bytes = len(self._pending)
+        while not self._eof:
+            extra_bytes += len( self._decompress_next() )
+        if extra_bytes:
+            raise UnexpectedResponseError( "Decompressed data was longer than expected by {} bytes."
+                                           "".format( extra_bytes ) )
+
+    def _decompress_next(self):
+        compressed_data = self._stream.read( self._read_size )
+        if self._rate_limiter is not None:
+            self._rate_limiter.throttle_bytes( len(compressed_data) )
+        if not compressed_data:
+            self._eof = True
+            flush = getattr( self._decompressor, 'flush', None )
+            if flush is not None:
+                return flush() or ""
+            return ""
+        if isinstance(compressed_data, memoryview):
+            # e.g. from EncodedStream.  (In python 2, most decompressors don't accept memoryview objects.)
+            compressed_data = compressed_data.tobytes()
+        return self._decompressor.decompress( compressed_data )
+
+@register_codec
+class GzipVoxelsNddataCodec(CompressedVoxelsNddataCodec):
+    FORMAT_NAME = "gzip"
+    VOLUME_MIMETYPE = "application/x-gzip"
+    REST_QUERY_ARGS = { "compression" : "gzip" }
+
+    # zlib compression level (0-9)
+    COMPRESSION_LEVEL = 6
+
+    def _create_compressor(self):
+        return _GzipCompressor( self.COMPRESSION_LEVEL )
+
+    def _create_decompressor(self):
+        return zlib.decompressobj( 16 + zlib.MAX_WBITS )
+
+class _GzipCompressor(object):
+    def __init__(self, level):
+        self._compressobj = zlib.compressobj( level, zlib.DEFLATED, 16 + zlib.MAX_WBITS )
+
+    def compress(self, data):
+        # In python 2, zlib doesn't accept memoryview objects.
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return self._compressobj.compress( data )
+
+    def flush(self):
+        return self._compressobj.flush()
+
+@register_codec
+class Lz4VoxelsNddataCodec(CompressedVoxelsNddataCodec):
+    FORMAT_NAME = "lz4"
+    VOLUME_MIMETYPE = "application/x-lz4"
+    REST_QUERY_ARGS = { "compression" : "lz4" }
+
+    def __init__(self, *args, **kwargs):
+        if not _have_lz4:
+            raise ImportError( "The lz4 transfer format requires the 'lz4' package." )
+        super( Lz4VoxelsNddataCodec, self ).__init__( *args, **kwargs )
+
+    def _create_compressor(self):
+        return _Lz4FrameCompressor()
+
+    def _create_decompressor(self):
+        return lz4.frame.LZ4FrameDecompressor()
+
+class _Lz4FrameCompressor(object):
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        compressed_data = self._header + self._compressor.compress( data )
+        self._header = ""
+        return compressed_data
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+@register_codec
+class ZstdVoxelsNddataCodec(CompressedVoxelsNddataCodec):
+    FORMAT_NAME = "zstd"
+    VOLUME_MIMETYPE = "application/zstd"
+    REST_QUERY_ARGS = { "compression" : "zstd" }
+
+    def __init__(self, *args, **kwargs):
+        if not _have_zstandard:
+            raise ImportError( "The zstd transfer format requires the 'zstandard' package." )
+        super( ZstdVoxelsNddataCodec, self ).__init__( *args, **kwargs )
+
+    def _create_compressor(self):
+        return zstandard.ZstdCompressor().compressobj()
+
+    def _create_decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+@register_codec
+class LabelPaletteVoxelsNddataCodec(CompressedVoxelsNddataCodec):
+    """
+    A blocked codec for label volumes, which typically contain only a few distinct labels per block.
+    Each block of the (fortran-order) voxel stream is encoded as:
+
+    - header: number of voxels (uint64), number of palette entries (uint32), index itemsize in bytes (uint8)
+    - palette: the block's unique values (in the codec dtype)
+    - indices: the palette index of each voxel, as uint8, uint16 or uint32
+
+    All values are little-endian.
+    """
+    FORMAT_NAME = "labelpalette"
+    VOLUME_MIMETYPE = "application/x-labelpalette"
+    REST_QUERY_ARGS = { "compression" : "labelpalette" }
+
+    def _create_compressor(self):
+        return _LabelPaletteCompressor( self.dtype )
+
+    def _create_decompressor(self):
+        return _LabelPaletteDecompressor( self.dtype )
+
+_LABEL_PALETTE_HEADER = struct.Struct("<QIB")
+
+class _LabelPaletteCompressor(object):
+    def __init__(self, dtype):
+        self._dtype = numpy.dtype(dtype).newbyteorder('<')
+
+    def compress(self, data):
+        # (In python 2, numpy.frombuffer() doesn't accept memoryview objects.)
+        voxels = numpy.asarray( memoryview(data) ).view( self._dtype )
+        palette, indices = numpy.unique( voxels, return_inverse=True )
+        for index_dtype in (numpy.uint8, numpy.uint16, numpy.uint32):
+            if len(palette) <= numpy.iinfo(index_dtype).max + 1:
+                break
+        indices = indices.astype( numpy.dtype(index_dtype).newbyteorder('<') )
+        header = _LABEL_PALETTE_HEADER.pack( len(voxels), len(palette), indices.dtype.itemsize )
+        return header + palette.tostring() + indices.tostring()
+
+    def flush(self):
+        return ""
+
+class _LabelPaletteDecompressor(object):
+    INDEX_DTYPES = { 1 : numpy.dtype('<u1'), 2 : numpy.dtype('<u2'), 4 : numpy.dtype('<u4') }
+
+    def __init__(self, dtype):
+        self._dtype = numpy.dtype(dtype).newbyteorder('<')
+
+        # Received data that doesn't complete a block yet.  The chunks are joined only once 
+        #  the next block is complete, so large blocks aren't copied once per network chunk.
+        self._pending = []
+        self._pending_bytes = 0
+
+        # The number of bytes needed before the next block (or at least its header) can be decoded
+        self._needed_bytes = _LABEL_PALETTE_HEADER.size
+
+    def decompress(self, data):
+        """
+        Decode all complete blocks in the given data (plus any data left over from previous calls).
+        """
+        self._pending.append( data )
+        self._pending_bytes += len(data)
+        if self._pending_bytes < self._needed_bytes:
+            return ""
+
+        buf = "".join( self._pending )
+        decoded_blocks = []
+        position = 0
+        while True:
+            if len(buf) - position < _LABEL_PALETTE_HEADER.size:
+                self._needed_bytes = _LABEL_PALETTE_HEADER.size
+                break
+            num_voxels, palette_len, index_itemsize = _LABEL_PALETTE_HEADER.unpack_from( buf, position )
+            if index_itemsize not in self.INDEX_DTYPES:
+                raise UnexpectedResponseError( "Invalid labelpalette block: index itemsize is {}".format( index_itemsize ) )
+            palette_start = position + _LABEL_PALETTE_HEADER.size
+            indices_start = palette_start + palette_len * self._dtype.itemsize
+            block_stop = indices_start + num_voxels * index_itemsize
+            if len(buf) < block_stop:
+                self._needed_bytes = block_stop - position
+                break
+
+            palette = numpy.frombuffer( buf, self._dtype, palette_len, palette_start )
+            indices = numpy.frombuffer( buf, self.INDEX_DTYPES[index_itemsize], num_voxels, indices_start )
+            if num_voxels > 0 and palette_len == 0:
+                raise UnexpectedResponseError( "Invalid labelpalette block: {} voxels, but the palette is empty".format( num_voxels ) )
+            if num_voxels > 0 and indices.max() >= palette_len:
+                raise UnexpectedResponseError( "Invalid labelpalette block: palette index {} exceeds the palette length {}"
+                                               "".format( indices.max(), palette_len ) )
+            decoded_blocks.append( palette[indices].tostring() )
+            position = block_stop
+
+        leftover = buf[position:]
+        self._pending = [leftover] if leftover else []
+        self._pending_bytes = len(leftover)
+        return "".join( decoded_blocks )
+
+    def flush(self):
+        if self._pending_bytes:
+            raise UnexpectedResponseError( "labelpalette stream ended with an incomplete block ({} bytes)."
+                                           "".format( self._pending_bytes ) )
+        return ""
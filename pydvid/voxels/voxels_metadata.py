@@ -1,29 +1,116 @@
 import json
+import collections
 
 import numpy
-import jsonschema
-
-try:
-    import vigra
-    _have_vigra = True
-except ImportError:
-    _have_vigra = False
-    
-try:
-    import h5py
-    _have_h5py = True
-except:
-    _have_h5py = False
 
 import pydvid.util
-metadata_schema = pydvid.util.parse_schema( 'dvid-voxels-metadata-v0.02.schema.json' )
+
+METADATA_SCHEMA = 'dvid-voxels-metadata-v0.02.schema.json'
+
+def get_metadata_schema():
+    """
+    Return the json schema for the voxels metadata, which is parsed the first time it is needed.
+    """
+    return pydvid.util.get_schema( METADATA_SCHEMA )
+
+# None until the first import attempt, then the vigra module (or False if it isn't installed).
+_vigra = None
+
+def _import_vigra():
+    """
+    Import vigra (an optional dependency, which is slow to import) the first time it is needed.
+    Returns None if it isn't installed.
+    """
+    global _vigra
+    if _vigra is None:
+        try:
+            import vigra
+            _vigra = vigra
+        except ImportError:
+            _vigra = False
+    return _vigra or None
+
+class VoxelsGeometry(collections.namedtuple( 'VoxelsGeometry', 'shape minindex dtype axiskeys' )):
+    """
+    The fields of a ``VoxelsMetadata`` that are derived from its json data.
+    Immutable, so copies of the metadata share it.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, metadata):
+        """
+        Compute the geometry of the given (parsed) metadata json.
+        """
+        dtypes = []
+        for channel_fields in metadata["Properties"]["Values"]:
+            dtypes.append( numpy.dtype( channel_fields["DataType"] ) )
+
+        assert all( map( lambda dtype: dtype == dtypes[0], dtypes ) ), \
+            "Can't support heterogeneous channel types: {}".format( dtypes )
+        
+        # We always in include "channel" as the FIRST axis
+        # (DVID uses fortran-order notation.)
+        shape = []
+        minindex = []
+        minindex.append( 0 )
+        shape.append( len(metadata["Properties"]["Values"]) ) 
+        assert shape[0] is not None, \
+            "Volume metadata is not required to have a complete shape, "\
+            "but must at least have a completely specified number of channels."
+
+        for axisfields in metadata['Axes']:
+            # If size is 0, then the offset should be ignored.
+            if axisfields["Size"] is not None:
+                minindex.append( axisfields["Offset"] )
+            else:
+                minindex.append( None )
+            if not axisfields["Size"]:
+                shape.append( None )
+            else:
+                shape.append( axisfields["Size"] + axisfields["Offset"] )
+
+        axiskeys = 'c'
+        for axisfields in metadata['Axes']:
+            axiskeys += str(axisfields["Label"]).lower()
+
+        shape = tuple(shape)
+        minindex = tuple(minindex)
+        return cls( tuple(shape), tuple(minindex), dtypes[0], axiskeys )
+
+    def with_shape(self, shape):
+        return self._replace( shape=tuple(shape) )
+
+    def with_minindex(self, minindex):
+        return self._replace( minindex=tuple(minindex) )
+
+def _copy_json( obj ):
+    """
+    Copy the given parsed json (nested dicts and lists).  Much faster than ``copy.deepcopy()``.
+    """
+    if isinstance( obj, dict ):
+        return dict( (k, _copy_json(v)) for k, v in obj.iteritems() )
+    if isinstance( obj, list ):
+        return [ _copy_json(v) for v in obj ]
+    return obj # str, number, bool or None: immutable
 
 class VoxelsMetadata(dict):
     """
     A dict subclass for the dvid nd-data metadata response.
     Also provides the following convenience attributes: ``minindex``, ``shape``, ``dtype``, ``axiskeys``
+    (and ``geometry``, which holds all of them).
     """
+    # The derived fields are kept in a single immutable object,
+    #  so copies of the metadata don't need to recompute them.
+    __slots__ = ('_geometry',)
     
+    @property
+    def geometry(self):
+        """
+        Property.  The ``VoxelsGeometry`` of this volume: its shape, minindex, dtype and axiskeys.
+        """
+        return self._geometry
+
     @property
     def shape(self):
         """
@@ -31,7 +118,7 @@ class VoxelsMetadata(dict):
         This is the stop coordinate of the volume's bounding box.
         All data above this coordinate in any dimension is guaranteed to be invalid.
         """
-        return self._shape
+        return self._geometry.shape
 
     @shape.setter
     def shape(self, new_shape):
@@ -41,14 +128,15 @@ class VoxelsMetadata(dict):
         for axisinfo, new_axis_max, axis_min in zip(self["Axes"], new_shape[1:], self.minindex[1:]):
             axisinfo["Size"] = new_axis_max - axis_min
 
-        self._shape = new_shape
+        self._geometry = self._geometry.with_shape( new_shape )
+
     @property
     def minindex(self):
         """
         Property.  The starting coordinate of the volume's bounding box.
         All data below this coordinate in any dimension is guaranteed to be invalid.
         """
-        return self._minindex
+        return self._geometry.minindex
 
     @minindex.setter
     def minindex(self, new_minindex):
@@ -59,14 +147,14 @@ class VoxelsMetadata(dict):
             axisinfo["Offset"] = int(new_axis_min)
             axisinfo["Size"] = int(axis_shape) - int(new_axis_min)
 
-        self._minindex = new_minindex
+        self._geometry = self._geometry.with_minindex( new_minindex )
 
     @property
     def dtype(self):
         """
         Property.  The pixel datatype of the remote DVID volume, as a ``numpy.dtype`` object.
         """
-        return self._dtype
+        return self._geometry.dtype
 
     @property
     def axiskeys(self):
@@ -77,63 +165,63 @@ class VoxelsMetadata(dict):
         
         .. note:: By DVID convention, the axiskeys are expressed in fortran order.
         """
-        return self._axiskeys
-    
+        return self._geometry.axiskeys
 
-    def __init__(self, metadata):
+    def __init__(self, metadata, validation=None):
         """
         Constructor.
         
         :param metadata: Either a string containing the json text for the DVID metadata, 
                          or a corresponding dict of metadata (e.g. parsed from the json).
                          If a string is passed, invalid json will result in a ValueError exception.
+                         (If it's another ``VoxelsMetadata``, it isn't validated again.)
+        :param validation: How to check the metadata against its schema: 'off', 'sampled' or 'strict'.
+                           (Default: the global level, see ``pydvid.util.set_validation_level()``.)
         """
         assert isinstance( metadata, (dict, str) ), "Expected metadata to be a dict or json str."
+        if isinstance( metadata, VoxelsMetadata ):
+            # Already validated: just copy it.
+            super( VoxelsMetadata, self ).__init__( _copy_json( metadata ) )
+            self._geometry = metadata._geometry
+            return
+
         if isinstance( metadata, str ):
             metadata = json.loads( metadata )
 
         # Check schema...
-        jsonschema.validate( metadata, metadata_schema )
+        pydvid.util.validate_json( metadata, METADATA_SCHEMA, validation )
 
         # Init base class: just copy original metadata
         super( VoxelsMetadata, self ).__init__( **metadata )
+        self._geometry = VoxelsGeometry.from_json( metadata )
 
-        dtypes = []
-        for channel_fields in metadata["Properties"]["Values"]:
-            dtypes.append( numpy.dtype( channel_fields["DataType"] ) )
-
-        assert all( map( lambda dtype: dtype == dtypes[0], dtypes ) ), \
-            "Can't support heterogeneous channel types: {}".format( dtypes )
-        self._dtype = dtypes[0]
+    @classmethod
+    def create_trusted(cls, metadata, geometry=None):
+        """
+        Fast constructor for metadata that is known to be valid (e.g. produced by pydvid, or validated before):
+        The schema isn't checked, and the given dict (of parsed json) is used as-is, not copied.
         
-        # We always in include "channel" as the FIRST axis
-        # (DVID uses fortran-order notation.)
-        shape = []
-        minindex = []
-        minindex.append( 0 )
-        shape.append( len(metadata["Properties"]["Values"]) ) 
-        assert shape[0] is not None, \
-            "Volume metadata is not required to have a complete shape, "\
-            "but must at least have a completely specified number of channels."
+        :param geometry: The ``VoxelsGeometry`` of the metadata, if it is already known.
+        """
+        self = dict.__new__( cls )
+        dict.update( self, metadata )
+        self._geometry = geometry or VoxelsGeometry.from_json( metadata )
+        return self
 
-        for axisfields in metadata['Axes']:
-            # If size is 0, then the offset should be ignored.
-            if axisfields["Size"] is not None:
-                minindex.append( axisfields["Offset"] )
-            else:
-                minindex.append( None )
-            if not axisfields["Size"]:
-                shape.append( None )
-            else:
-                shape.append( axisfields["Size"] + axisfields["Offset"] )
+    def copy(self):
+        """
+        Return an independent copy of this metadata (without validating or parsing it again).
+        """
+        return VoxelsMetadata.create_trusted( _copy_json( self ), self._geometry )
 
-        self._shape = tuple(shape)
-        self._minindex = tuple(minindex)
-    
-        axiskeys = 'c'
-        for axisfields in metadata['Axes']:
-            axiskeys += str(axisfields["Label"]).lower()
-        self._axiskeys = axiskeys
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        # (Needed for pickling, since the class has __slots__.)
+        return ( _unpickle_metadata, (dict(self),) )
 
     def to_json(self):
         """
@@ -187,7 +275,8 @@ class VoxelsMetadata(dict):
         for _ in range( num_channels ):
             metadata["Properties"]["Values"].append( { "DataType" : dtype.name,
                                          "Label" : "" } )
-        return VoxelsMetadata(metadata)
+        # (Validated, since the parameters come from the caller: e.g. not every dtype is supported.)
+        return VoxelsMetadata( metadata )
 
 
     TYPENAMES = { ('uint8',  1) : 'grayscale8',
@@ -221,67 +310,69 @@ class VoxelsMetadata(dict):
             msg = "Don't support DVID typename '{}'".format( typename )
             raise Exception(msg)
     
-    if _have_vigra:
-        def create_axistags(self):
-            """
-            Generate a vigra.AxisTags object corresponding to this VoxelsMetadata.
-            (Requires vigra.)
-            """
-            tags = vigra.AxisTags()
-            tags.insert( 0, vigra.AxisInfo('c', typeFlags=vigra.AxisType.Channels) )
-            dtypes = []
-            channel_labels = []
-            for channel_fields in self["Properties"]["Values"]:
-                dtypes.append( numpy.dtype( channel_fields["DataType"] ).type )
-                channel_labels.append( channel_fields["Label"] )
-
-            # We monkey-patch the channel labels onto the axistags object as a new member
-            tags.channelLabels = channel_labels
-            for axisfields in self['Axes']:
-                key = str(axisfields["Label"]).lower()
-                res = axisfields["Resolution"]
-                tag = vigra.defaultAxistags(key)[0]
-                tag.resolution = res
-                tags.insert( len(tags), tag )
-                # TODO: Check resolution units, because apparently 
-                #        they can be different from one axis to the next...
-    
-            assert all( map( lambda dtype: dtype == dtypes[0], dtypes ) ), \
-                "Can't support heterogeneous channel types: {}".format( dtypes )
+    def create_axistags(self):
+        """
+        Generate a vigra.AxisTags object corresponding to this VoxelsMetadata.
+        (Requires vigra.)
+        """
+        vigra = _import_vigra()
+        if vigra is None:
+            raise ImportError( "create_axistags() requires vigra, which is not installed." )
+        tags = vigra.AxisTags()
+        tags.insert( 0, vigra.AxisInfo('c', typeFlags=vigra.AxisType.Channels) )
+        dtypes = []
+        channel_labels = []
+        for channel_fields in self["Properties"]["Values"]:
+            dtypes.append( numpy.dtype( channel_fields["DataType"] ).type )
+            channel_labels.append( channel_fields["Label"] )
 
-            return tags
-        
-        @classmethod
-        def create_volumeinfo_from_axistags(cls, shape, dtype, axistags):
-            assert False, "TODO..."
-            
+        # We monkey-patch the channel labels onto the axistags object as a new member
+        tags.channelLabels = channel_labels
+        for axisfields in self['Axes']:
+            key = str(axisfields["Label"]).lower()
+            res = axisfields["Resolution"]
+            tag = vigra.defaultAxistags(key)[0]
+            tag.resolution = res
+            tags.insert( len(tags), tag )
+            # TODO: Check resolution units, because apparently 
+            #        they can be different from one axis to the next...
 
-    if _have_h5py:    
-        @classmethod
-        def create_from_h5_dataset(cls, dataset):
-            """
-            Create a VolumeInfo object to describe the given h5 dataset object.
-
-            :param dataset: An hdf5 dataset object that meets the following criteria:\n
-                            * Indexed in F-order
-                            * Has an 'axistags' attribute, produced using vigra.AxisTags.toJSON()
-                            * Has an explicit channel axis
-                     
-            (Requires h5py.)
-            """
-            dtype = dataset.dtype.type
-            shape = dataset.shape
-            if 'dvid_metadata' in dataset.attrs:
-                metadata_json = dataset.attrs['dvid_metadata']
-                metadata = json.loads( metadata_json )
-                return VoxelsMetadata( metadata )
-            elif _have_vigra and 'axistags' in dataset.attrs:
-                axistags = vigra.AxisTags.fromJSON( dataset.attrs['axistags'] )
-                return cls.create_volumeinfo_from_axistags( shape, dtype, axistags )
-            else:
-                # Choose default axiskeys
-                default_keys = 'cxyzt'
-                axiskeys = default_keys[:len(shape)]
-                return VoxelsMetadata.create_default_metadata( shape, dtype, axiskeys, 1.0, "" )
-    
+        assert all( map( lambda dtype: dtype == dtypes[0], dtypes ) ), \
+            "Can't support heterogeneous channel types: {}".format( dtypes )
+
+        return tags
     
+    @classmethod
+    def create_volumeinfo_from_axistags(cls, shape, dtype, axistags):
+        assert False, "TODO..."
+            
+    @classmethod
+    def create_from_h5_dataset(cls, dataset):
+        """
+        Create a VolumeInfo object to describe the given h5 dataset object.
+
+        :param dataset: An hdf5 dataset object that meets the following criteria:\n
+                        * Indexed in F-order
+                        * Has an 'axistags' attribute, produced using vigra.AxisTags.toJSON()
+                        * Has an explicit channel axis
+                 
+        (Requires h5py.)
+        """
+        dtype = dataset.dtype.type
+        shape = dataset.shape
+        if 'dvid_metadata' in dataset.attrs:
+            metadata_json = dataset.attrs['dvid_metadata']
+            metadata = json.loads( metadata_json )
+            return VoxelsMetadata( metadata )
+        elif 'axistags' in dataset.attrs and _import_vigra() is not None:
+            axistags = _import_vigra().AxisTags.fromJSON( dataset.attrs['axistags'] )
+            return cls.create_volumeinfo_from_axistags( shape, dtype, axistags )
+        else:
+            # Choose default axiskeys
+            default_keys = 'cxyzt'
+            axiskeys = default_keys[:len(shape)]
+            return VoxelsMetadata.create_default_metadata( shape, dtype, axiskeys, 1.0, "" )
+
+def _unpickle_metadata( metadata ):
+    # (Python 2 can't pickle a reference to a classmethod, so this is a plain function.)
+    return VoxelsMetadata.create_trusted( metadata )
@@ -1,20 +1,61 @@
 import numpy
 
+from pydvid.errors import UnexpectedResponseError
+from pydvid.util import stream_readinto, stream_write
+
 class VoxelsNddataCodec(object):
+    """
+    Encodes/decodes voxels data to/from the raw (uncompressed) DVID nd-data format: 
+    the array's bytes, in fortran order.
+    
+    Subclasses may implement other transfer formats (e.g. compressed data).  
+    See ``register_codec()``.
+    """
+
+    # The name clients use to select this codec (see get_codec_class())
+    FORMAT_NAME = "raw"
+
+    # The <format> path parameter and extra query args to use in REST requests for this format.
+    REST_FORMAT = ""
+    REST_QUERY_ARGS = {}
 
     # Data is sent to/retrieved from the http response stream in chunks.
     STREAM_CHUNK_SIZE = 8192 # (bytes)
 
+    # Unless a fixed chunk_size is given to the constructor, the receive chunk size 
+    #  adapts: it grows (up to this size) as long as the stream keeps filling entire chunks.
+    MAX_STREAM_CHUNK_SIZE = 2**22 # (bytes)
+
+    # Encoded data is written to streams in spans of (at most) this size.
+    # Spans are memoryview slices of the array itself, so large spans cost nothing extra.
+    SEND_CHUNK_SIZE = 2**22 # (bytes)
+
+    # When converting to a different dtype or axis order, the data is staged 
+    #  in a scratch buffer of (at most) this size on its way to/from the stream.
+    # The staging buffer is small enough to stay in cache while it is scattered 
+    #  into (or gathered from) its final location, which keeps transposes cache-friendly.
+    STAGING_CHUNK_SIZE = 2**20 # (bytes)
+
     # Defined here for clients to use.
     VOLUME_MIMETYPE = "application/octet-stream"
     
-    def __init__(self, dtype):
+    class DtypeOverflowError(Exception):
+        """
+        Raised when decoding with check_overflow=True and 
+        the received data doesn't fit in the requested output dtype.
+        """
+        pass
+
+    def __init__(self, dtype, chunk_size=None):
         """
         dtype: The pixel type as a numpy dtype.
+        chunk_size: (Optional) A fixed number of bytes to receive from the stream at a time.
+                    By default, the chunk size adapts to the stream (see MAX_STREAM_CHUNK_SIZE).
         """
         self.dtype = dtype
+        self.chunk_size = chunk_size
         
-    def decode_to_ndarray(self, stream, full_roi_shape):
+    def decode_to_ndarray(self, stream, full_roi_shape, out_dtype=None, check_overflow=False, axes=None, order='F'):
         """
         Decode the info in the given stream to a numpy.ndarray.
         
@@ -22,23 +63,64 @@ class VoxelsNddataCodec(object):
                         Roi must include the channel dimension, and all channels of data must be requested.
                         (For example, it's not valid to request channel 2 of an RGB image.  
                         You must request all channels 0-3.)
+        out_dtype: (Optional) The dtype of the returned array.
+                   If it differs from the codec dtype, the data is converted chunk-by-chunk 
+                   as it is read from the stream, so no full-size temporary is needed.
+        check_overflow: If True, verify that every received value can be represented by out_dtype,
+                        and raise DtypeOverflowError otherwise.  
+                        (Only checked if out_dtype is a narrowing conversion.)
+        axes: (Optional) A permutation of the (DVID-ordered) axes of full_roi_shape.
+              Axis i of the returned array corresponds to axis axes[i] of the DVID data.
+        order: The memory order of the returned array, either 'F' (the DVID default) or 'C'.
+               If the requested axes/order doesn't match the DVID memory layout, 
+               the data is transposed chunk-by-chunk as it is read from the stream.
         """
-        # Note that dvid uses fortran order indexing
-        array = numpy.ndarray( full_roi_shape, dtype=self.dtype, order='F' )
-        buf = numpy.getbuffer(array)
-        self._read_to_buffer(buf, stream)
+        if out_dtype is None:
+            out_dtype = self.dtype
+        out_dtype = numpy.dtype(out_dtype)
+        if axes is None:
+            axes = range(len(full_roi_shape))
+        assert sorted(axes) == range(len(full_roi_shape)), \
+            "Invalid axes for shape {}: {}".format( full_roi_shape, axes )
+
+        out_shape = tuple( full_roi_shape[a] for a in axes )
+        array = numpy.ndarray( out_shape, dtype=out_dtype, order=order )
+
+        # Note that dvid uses fortran order indexing.
+        # This view of the output is indexed in DVID order.
+        dvid_view = array.transpose( numpy.argsort(axes) )
+
+        check_overflow = check_overflow and not numpy.can_cast(self.dtype, out_dtype)
+        decoded_stream = self._create_decoded_stream(stream)
+        if not dvid_view.flags['F_CONTIGUOUS']:
+            self._read_staged(dvid_view, decoded_stream, check_overflow)
+        elif out_dtype != self.dtype:
+            self._read_converted(dvid_view, decoded_stream, check_overflow)
+        else:
+            self._read_to_buffer(self._get_byte_view(dvid_view), decoded_stream)
+        self._finish_decoded_stream(decoded_stream)
         return array
 
     def encode_from_ndarray(self, stream, array):
         """
         Encode the array to the given bytestream.
+        If the stream has a ``rate_limiter`` attribute (see ``pydvid.rate_limiter``), the data is written at the permitted rate.
         
         Prerequisites:
         - array must be a numpy.ndarray
         - array must have the same dtype as this codec
         """
-        buf = self._get_buffer(array)
-        self._send_from_buffer(buf, stream)
+        rate_limiter = getattr( stream, 'rate_limiter', None )
+        for span in self._iter_encoded_spans(array):
+            if rate_limiter is None:
+                stream_write( stream, span )
+                continue
+            # Pace the transfer: write in small pieces, each one when the rate limit permits.
+            piece_size = rate_limiter.max_chunk_size or len(span)
+            for piece_start in range(0, len(span), piece_size):
+                piece = span[piece_start:piece_start+piece_size]
+                rate_limiter.throttle_bytes( len(piece) )
+                stream_write( stream, piece )
 
     def create_encoded_stream_from_ndarray(self, array):
         """
@@ -50,14 +132,75 @@ class VoxelsNddataCodec(object):
         - array must have the same dtype as this codec
         """
         buf = self._get_buffer(array)
-        return VoxelsNddataCodec.EncodedStream(buf)
+        if buf is not None:
+            return VoxelsNddataCodec.EncodedStream(buf)
+        return VoxelsNddataCodec.StagedEncodedStream( self._iter_staged_buffers(array),
+                                                      self.calculate_buffer_len(array.shape) )
+
+    def create_request_body(self, array):
+        """
+        Encode the array in a form that can be passed directly as the body of an http request
+        (e.g. ``HTTPConnection.request(..., body=...)``), and return it.
+        
+        If the array is F_CONTIGUOUS, the body is a memoryview of the array's memory (no copy), 
+        which httplib sends straight to the socket in a single call.
+        Otherwise, the body is a StagedEncodedStream.
+        In both cases, len(body) is the number of encoded bytes.
+
+        Prerequisites:
+        - array must be a numpy.ndarray
+        - array must have the same dtype as this codec
+        """
+        buf = self._get_buffer(array)
+        if buf is not None:
+            return buf
+        return self.create_encoded_stream_from_ndarray(array)
 
     def calculate_buffer_len(self, shape):
+        """
+        The number of bytes of raw (unencoded) voxels data for an array of the given shape.
+        """
         return numpy.prod(shape) * self.dtype.type().nbytes
+
+    def _create_decoded_stream(self, stream):
+        """
+        Return a stream that provides the raw voxels bytes for the given encoded stream.
+        Subclasses that decompress the data must override this (and _finish_decoded_stream).
+        """
+        return stream
+
+    def _finish_decoded_stream(self, decoded_stream):
+        """
+        Called after all voxels have been read from a stream created by _create_decoded_stream.
+        """
+        pass
+
+    def _iter_encoded_spans(self, array):
+        """
+        Generator.  Yields the encoded data for the given array, as a sequence of memoryviews.
+        Subclasses that compress the data must override this.
+        """
+        return self._iter_raw_spans(array)
+
+    def _iter_raw_spans(self, array):
+        """
+        Generator.  Yields the raw (unencoded) bytes of the array in fortran order, 
+        as a sequence of memoryviews.  F_CONTIGUOUS arrays are not copied.
+        Note: Each view is only valid until the next one is requested.
+        """
+        buf = self._get_buffer(array)
+        if buf is None:
+            for piece_buf in self._iter_staged_buffers(array):
+                yield piece_buf
+            return
+
+        for span_start in range(0, len(buf), self.SEND_CHUNK_SIZE):
+            yield buf[span_start:span_start+self.SEND_CHUNK_SIZE]
     
     def _get_buffer(self, array):
         """
-        Obtain a buffer for the given array.
+        Obtain a buffer (a memoryview of bytes, without copying) for the given array, 
+        or None if the array isn't F_CONTIGUOUS (in which case it must be sent in staged pieces).
 
         Prerequisites:
         - array must be a numpy.ndarray
@@ -69,53 +212,193 @@ class VoxelsNddataCodec(object):
         assert array.dtype == self.dtype, \
             "Wrong dtype.  Expected {}, got {}".format( self.dtype, array.dtype )
 
-        # Unfortunately, if the array isn't F_CONTIGUOUS, we have to copy it.
+        # If the array isn't F_CONTIGUOUS, we don't copy the whole thing.
+        # Instead, the caller sends it in small F-ordered pieces (see _iter_staged_buffers).
         if not array.flags['F_CONTIGUOUS']:
-            array_copy = numpy.empty_like(array, order='F')
-            array_copy[:] = array[:]
-            array = array_copy
+            return None
+        return self._get_byte_view(array)
+
+    def _iter_staged_buffers(self, array):
+        """
+        Generator.  Copy the given (non-F_CONTIGUOUS) array into a small staging buffer, 
+        one piece at a time, in F-order stream order.  Yields a memoryview for each piece.
+        Note: The same staging memory is re-used for every piece, so each view is only 
+              valid until the next one is requested.
+        """
+        scratch = None
+        for slicing in self._iter_staging_slicings(array.shape, self.dtype.itemsize, self.STAGING_CHUNK_SIZE):
+            source = array[slicing]
+            if scratch is None:
+                scratch = numpy.ndarray( (source.size,), dtype=self.dtype )
+                scratch_view = self._get_byte_view(scratch)
+            piece = scratch[:source.size].reshape( source.shape, order='F' )
+            piece[:] = source
+            yield scratch_view[:source.size*self.dtype.itemsize]
+
+    @classmethod
+    def _iter_staging_slicings(cls, shape, itemsize, max_bytes):
+        """
+        Generator.  Partition an F-order array of the given shape into pieces that are 
+        contiguous in the F-order stream and (if possible) no larger than max_bytes.
+        Yields the slicing for each piece, in stream order.
+        Every slicing has the same number of dimensions as the array.
+        """
+        shape = tuple(shape)
+        if not shape or 0 in shape:
+            return
+
+        # Find the slowest axis k for which a single 'layer' 
+        #  (i.e. one index of axis k, and all of the faster axes) fits in max_bytes
+        k = 0
+        layer_bytes = itemsize
+        while k < len(shape)-1 and layer_bytes * shape[k] <= max_bytes:
+            layer_bytes *= shape[k]
+            k += 1
+        layers_per_piece = max(1, max_bytes // layer_bytes)
+
+        # Iterate over the slower axes in F-order (i.e. the first of them changes fastest)
+        outer_shape = shape[k+1:]
+        for reversed_index in numpy.ndindex( *outer_shape[::-1] ):
+            outer_slicing = tuple( slice(i, i+1) for i in reversed_index[::-1] )
+            for layer_start in range(0, shape[k], layers_per_piece):
+                layer_stop = min( shape[k], layer_start + layers_per_piece )
+                yield (slice(None),)*k + (slice(layer_start, layer_stop),) + outer_slicing
 
-        return numpy.getbuffer(array)
-    
     @classmethod
-    def _read_to_buffer(cls, buf, stream):
+    def _get_byte_view(cls, array):
+        """
+        Return a memoryview of the bytes of the given F_CONTIGUOUS array (no copy).
+        The view is writable unless the array is read-only.
         """
-        Read the data from the stream into the given buffer.
+        # For an F_CONTIGUOUS array, reshape() produces a view, not a copy.
+        return memoryview( array.reshape( (-1,), order='F' ).view(numpy.uint8) )
+
+    def _read_to_buffer(self, view, stream):
+        """
+        Read the data from the stream into the given memoryview.
+        Data is received directly into the view (see ``pydvid.util.stream_readinto``), 
+        so no temporary strings are created if the stream supports it.
+        If the stream has a ``rate_limiter`` attribute, data is received no faster than it permits.
         """
-        # We could read it in one step, but instead we'll read it in chunks to avoid big temporaries.
-        # (See below.)
-        # buf[:] = stream.read( len(buf) )
+        chunk_size = self.chunk_size or self.STREAM_CHUNK_SIZE
+        adaptive = self.chunk_size is None
+        max_chunk_size = self.MAX_STREAM_CHUNK_SIZE
+        rate_limiter = getattr( stream, 'rate_limiter', None )
+        if rate_limiter is not None and rate_limiter.max_chunk_size is not None:
+            # Receive in small chunks, so the transfer is paced smoothly.
+            max_chunk_size = min( max_chunk_size, rate_limiter.max_chunk_size )
+            chunk_size = min( chunk_size, max_chunk_size )
+
+        total_bytes = len(view)
+        position = 0
+        while position < total_bytes:
+            next_chunk_bytes = min( total_bytes - position, chunk_size )
+            received_bytes = stream_readinto( stream, view[position:position+next_chunk_bytes] )
+            if received_bytes == 0:
+                raise UnexpectedResponseError( "Stream ended early: received only {} bytes.  (Expected {} bytes.)"
+                                               "".format( position, total_bytes ) )
+            position += received_bytes
+            if rate_limiter is not None:
+                rate_limiter.throttle_bytes( received_bytes )
+            if adaptive and received_bytes == chunk_size and chunk_size < max_chunk_size:
+                chunk_size = min( 2*chunk_size, max_chunk_size )
+
+    def _read_converted(self, array, stream, check_overflow):
+        """
+        Read the data from the stream (encoded with this codec's dtype) 
+        into the given F_CONTIGUOUS array, which has a different dtype.
+        """
+        # For an F_CONTIGUOUS array, this is a view, not a copy.
+        flat_array = array.reshape( (-1,), order='F' )
+        
+        itemsize = self.dtype.itemsize
+        scratch_len = max(1, min( len(flat_array), self.STAGING_CHUNK_SIZE // itemsize ))
+        scratch = numpy.ndarray( (scratch_len,), dtype=self.dtype )
+        scratch_view = self._get_byte_view(scratch)
 
-        # Read data from the stream in chunks
-        remaining_bytes = len(buf)
-        while remaining_bytes > 0:
-            next_chunk_bytes = min( remaining_bytes, VoxelsNddataCodec.STREAM_CHUNK_SIZE )
-            chunk_start = len(buf)-remaining_bytes
-            chunk_stop = len(buf)-(remaining_bytes-next_chunk_bytes)
-            buf[chunk_start:chunk_stop] = stream.read( next_chunk_bytes )
-            remaining_bytes -= next_chunk_bytes
+        remaining_items = len(flat_array)
+        while remaining_items > 0:
+            next_chunk_items = min( remaining_items, scratch_len )
+            chunk_start = len(flat_array)-remaining_items
+            chunk_stop = chunk_start + next_chunk_items
+
+            chunk = scratch[:next_chunk_items]
+            self._read_to_buffer( scratch_view[:next_chunk_items*itemsize], stream )
+            if check_overflow:
+                self._check_overflow( chunk, array.dtype )
+            flat_array[chunk_start:chunk_stop] = chunk
+            remaining_items -= next_chunk_items
+
+    def _read_staged(self, dvid_view, stream, check_overflow):
+        """
+        Read the data from the stream into the given (non-F_CONTIGUOUS) array view, 
+        which is indexed in DVID order but may have any memory layout and dtype.
+        Each piece of the stream is received into a small staging buffer 
+        and then scattered into its final location.
+        """
+        itemsize = self.dtype.itemsize
+        scratch = None
+        for slicing in self._iter_staging_slicings(dvid_view.shape, itemsize, self.STAGING_CHUNK_SIZE):
+            destination = dvid_view[slicing]
+            if scratch is None:
+                scratch = numpy.ndarray( (destination.size,), dtype=self.dtype )
+                scratch_view = self._get_byte_view(scratch)
+            self._read_to_buffer( scratch_view[:destination.size*itemsize], stream )
+            piece = scratch[:destination.size].reshape( destination.shape, order='F' )
+            if check_overflow:
+                self._check_overflow( piece, dvid_view.dtype )
+            destination[:] = piece
 
     @classmethod
-    def _send_from_buffer(cls, buf, stream):
+    def _check_overflow(cls, chunk, out_dtype):
         """
-        Write the given buffer out to the provided stream in chunks.
+        Raise DtypeOverflowError if any value in chunk falls outside the range of out_dtype
+        (or is NaN, if out_dtype is an integer type).
         """
-        remaining_bytes = len(buf)
-        while remaining_bytes > 0:
-            next_chunk_bytes = min( remaining_bytes, VoxelsNddataCodec.STREAM_CHUNK_SIZE )
-            chunk_start = len(buf)-remaining_bytes
-            chunk_stop = len(buf)-(remaining_bytes-next_chunk_bytes)
-            stream.write( buf[chunk_start:chunk_stop] )
-            remaining_bytes -= next_chunk_bytes
+        if out_dtype.kind in 'ui':
+            out_info = numpy.iinfo(out_dtype)
+            # (NaN compares False with everything, so the range check below wouldn't catch it.)
+            if chunk.dtype.kind == 'f' and numpy.isnan(chunk).any():
+                raise VoxelsNddataCodec.DtypeOverflowError(
+                    "Received data contains NaN, which can't be represented as {}".format( out_dtype ) )
+        elif out_dtype.kind == 'f':
+            out_info = numpy.finfo(out_dtype)
+        else:
+            return
         
+        # Compare as python scalars, to avoid surprising numpy type promotion (e.g. uint64 vs int64)
+        if chunk.dtype.kind in 'ui':
+            chunk_min, chunk_max = int(chunk.min()), int(chunk.max())
+            out_min, out_max = int(out_info.min), int(out_info.max)
+        else:
+            chunk_min, chunk_max = float(chunk.min()), float(chunk.max())
+            out_min, out_max = float(out_info.min), float(out_info.max)
+
+        if chunk_min < out_min or chunk_max > out_max:
+            raise VoxelsNddataCodec.DtypeOverflowError(
+                "Received data (range [{}, {}]) can't be represented as {} (range [{}, {}])"
+                "".format( chunk_min, chunk_max, out_dtype, out_min, out_max ) )
+
     class EncodedStream(object):
         """
         A simple stream object returned by VoxelsNddataCodec.create_encoded_stream_from_ndarray()
+        
+        The stream wraps a memoryview of the array's memory.
+        read() and peek() return memoryview slices of it (no copy).  
+        Use getvalue(), or call tobytes() on the result, if you need a str.
+
+        If a rate_limiter is assigned (see ``pydvid.rate_limiter``), read() and readinto() 
+        return data no faster than it permits.  (e.g. when the stream is sent as a request body.)
         """
+        rate_limiter = None
+
         def __init__(self, buf):
             assert buf is not None
             self._buffer = buf
             self._position = 0
+
+        def __len__(self):
+            return len(self._buffer)
         
         def seek(self, pos, whence):
             # This behavior of whence follows the standard python conventions for streams
@@ -144,7 +427,7 @@ class VoxelsNddataCodec(object):
         
         def getvalue(self):
             pos = self._position
-            data = self.read()
+            data = self.read().tobytes()
             self._position = pos
             return data
         
@@ -152,7 +435,19 @@ class VoxelsNddataCodec(object):
             return self._read(nbytes, True)
         
         def read(self, nbytes=None):
-            return self._read(nbytes)
+            encoded_data = self._read(nbytes)
+            if self.rate_limiter is not None:
+                self.rate_limiter.throttle_bytes( len(encoded_data) )
+            return encoded_data
+
+        def readinto(self, view):
+            """
+            Copy up to len(view) bytes of the encoded data into the given writable memoryview.
+            Returns the number of bytes copied.  (This is the only copy made.)
+            """
+            encoded_data = self.read( len(view) )
+            view[:len(encoded_data)] = encoded_data
+            return len(encoded_data)
 
         def _read(self, nbytes=None, peeking=False):
             assert self._buffer is not None, "Can't read: stream is already closed."
@@ -169,4 +464,123 @@ class VoxelsNddataCodec(object):
             if not peeking:
                 self._position  += nbytes
             return encoded_data
-    
\ No newline at end of file
+    
+    class StagedEncodedStream(object):
+        """
+        A simple (forward-only) stream object returned by VoxelsNddataCodec.create_encoded_stream_from_ndarray() 
+        for arrays that aren't F_CONTIGUOUS.  The encoded data is produced lazily, one staged piece at a time.
+        As with EncodedStream, a rate_limiter may be assigned to pace read().
+        """
+        rate_limiter = None
+
+        def __init__(self, piece_buffers, total_len):
+            """
+            piece_buffers: An iterator of buffers, e.g. from VoxelsNddataCodec._iter_staged_buffers()
+            total_len: The total number of bytes in the stream.
+            """
+            self._pieces = piece_buffers
+            self._total_len = total_len
+            self._current_piece = ""
+            self._piece_position = 0
+            self._position = 0
+            self._closed = False
+
+        def __len__(self):
+            return self._total_len
+
+        def tell(self):
+            return self._position
+
+        def close(self):
+            self._closed = True
+            self._pieces = None
+            self._current_piece = None
+
+        def closed(self):
+            return self._closed
+
+        def isatty(self):
+            return False
+
+        def read(self, nbytes=None):
+            assert not self._closed, "Can't read: stream is already closed."
+            remaining_bytes = self._total_len - self._position
+            if nbytes is None:
+                nbytes = remaining_bytes
+            else:
+                nbytes = min(remaining_bytes, nbytes)
+
+            encoded_chunks = []
+            while nbytes > 0:
+                if self._piece_position == len(self._current_piece):
+                    # Copy the next piece out of the (re-used) staging buffer
+                    self._current_piece = next(self._pieces).tobytes()
+                    self._piece_position = 0
+                start = self._piece_position
+                stop = min( len(self._current_piece), start + nbytes )
+                encoded_chunks.append( self._current_piece[start:stop] )
+                self._piece_position = stop
+                self._position += stop - start
+                nbytes -= stop - start
+            encoded_data = "".join( encoded_chunks )
+            if self.rate_limiter is not None:
+                self.rate_limiter.throttle_bytes( len(encoded_data) )
+            return encoded_data
+
+#
+# Codec registry
+#
+_codec_classes_by_format_name = {}
+_codec_classes_by_mimetype = {}
+
+# Codec instances are stateless (each stream gets its own compressor/decompressor),
+#  so they are shared by all requests: (codec_class, dtype.str) : codec
+_codec_instances = {}
+
+def register_codec( codec_class ):
+    """
+    Make the given VoxelsNddataCodec subclass available via get_codec_class() and get_codec_class_for_mimetype().
+    Can be used as a class decorator.
+    """
+    _codec_classes_by_format_name[codec_class.FORMAT_NAME] = codec_class
+    _codec_classes_by_mimetype[codec_class.VOLUME_MIMETYPE] = codec_class
+    return codec_class
+
+def get_codec_class( format_name ):
+    """
+    Return the registered codec class for the given format name, e.g. 'raw' or 'gzip'.
+    (None is equivalent to 'raw'.)
+    """
+    if format_name is None:
+        format_name = VoxelsNddataCodec.FORMAT_NAME
+    try:
+        return _codec_classes_by_format_name[format_name]
+    except KeyError:
+        raise ValueError( "Unknown voxels transfer format: '{}'.  Known formats are: {}"
+                          "".format( format_name, sorted(_codec_classes_by_format_name.keys()) ) )
+
+def get_codec( codec_class, dtype ):
+    """
+    Return a shared instance of the given codec class for the given dtype.
+    (Cheaper than constructing a new codec for every request.)
+    """
+    dtype = numpy.dtype( dtype )
+    key = (codec_class, dtype.str)
+    try:
+        return _codec_instances[key]
+    except KeyError:
+        codec = codec_class( dtype )
+        _codec_instances[key] = codec
+        return codec
+
+def get_codec_class_for_mimetype( mimetype, default=None ):
+    """
+    Return the registered codec class for the given mimetype (e.g. from a Content-Type header), 
+    or the given default if no codec is registered for it.
+    """
+    if mimetype is None:
+        return default
+    mimetype = mimetype.split(';')[0].strip().lower()
+    return _codec_classes_by_mimetype.get( mimetype, default )
+
+register_codec( VoxelsNddataCodec )
@@ -15,5 +15,8 @@ setup(name='pydvid',
       url='https://github.com/janelia-flyem/pydvid',
       packages=packages,
       package_data=package_data,
-      setup_requires=['jsonschema>=1.0']
+      setup_requires=['jsonschema>=1.0'],
+      install_requires=['futures; python_version < "3"'],
+      extras_require={ 'lz4' : ['lz4'],
+                       'zstd' : ['zstandard'] }
      )
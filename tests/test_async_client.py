@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from pydvid import voxels
+from pydvid.errors import DvidHttpError
+from pydvid.async_client import AsyncDvidClient
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class TestAsyncDvidClient(object):
+    
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server, which serves the test data from the file.
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls._generate_testdata_h5(cls.test_filepath)
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000, 
+                                                                             same_process=True, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        shutil.rmtree(cls._tmp_dir)
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+
+    @classmethod
+    def _generate_testdata_h5(cls, test_filepath):
+        """
+        Generate a temporary hdf5 file for the mock server to use (and us to compare against)
+        """
+        data = numpy.indices( (10, 100, 200) ).astype( numpy.uint32 )
+        cls.original_data = data
+        cls.data_uuid = "abcde"
+        cls.data_name = "indices_data"
+        cls.keyvalue_name = "my_keyvalue_stuff"
+        cls.voxels_metadata = voxels.VoxelsMetadata.create_default_metadata(data.shape, data.dtype, "cxyz", 1.0, "")
+        with H5MockServerDataFile( test_filepath ) as test_h5file:
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+            test_h5file.add_volume( "datasetA", cls.data_name, data, cls.voxels_metadata )
+            test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+
+    def test_get_repos_info(self):
+        client = AsyncDvidClient( "localhost:8000" )
+        info = client.get_repos_info().result()
+        assert info.values()[0]["DAG"]["Root"] == self.data_uuid
+        client.close()
+
+    def test_keyvalue(self):
+        client = AsyncDvidClient( "localhost:8000", max_concurrency=4 )
+        values = { "key{}".format(i) : "value{}".format(i) * 1000 for i in range(20) }
+        put_results = [ client.put_value( self.data_uuid, self.keyvalue_name, k, v ) for k,v in values.items() ]
+        client.wait( put_results )
+        for result in put_results:
+            assert result.result() is None
+
+        get_results = { k : client.get_value( self.data_uuid, self.keyvalue_name, k ) for k in values }
+        for key, result in get_results.items():
+            assert result.result() == values[key]
+        client.close()
+
+    def test_get_ndarray_concurrent(self):
+        client = AsyncDvidClient( "localhost:8000", max_concurrency=4 )
+        blocks = [ ((0,x,y,0), (3,x+5,y+25,200)) for x in (0,5) for y in range(0,100,25) ]
+
+        # Decode into slices of a preallocated array.
+        out = numpy.ndarray( tuple(numpy.subtract( blocks[0][1], blocks[0][0] )) + (len(blocks),), numpy.uint32, order='F' )
+        results = []
+        for i, (start, stop) in enumerate(blocks):
+            results.append( client.get_ndarray( self.data_uuid, self.data_name, self.voxels_metadata, start, stop, out=out[...,i] ) )
+        # Callbacks run when each block arrives
+        completed = []
+        for result in results:
+            result.add_done_callback( completed.append )
+        client.wait()
+
+        assert len(completed) == len(blocks)
+        for i, ((start, stop), result) in enumerate(zip(blocks, results)):
+            assert result.result().base is out
+            expected = self.original_data[ tuple( slice(a,b) for a,b in zip(start, stop) ) ]
+            assert (out[...,i] == expected).all()
+
+    def test_post_ndarray(self):
+        client = AsyncDvidClient( "localhost:8000" )
+        start, stop = (0,2,10,20), (3,4,30,60)
+        new_data = numpy.random.randint( 0, 1000, numpy.subtract(stop, start) ).astype( numpy.uint32 )
+        client.post_ndarray( self.data_uuid, self.data_name, self.voxels_metadata, start, stop, new_data ).result()
+        
+        # C-order data works too
+        c_data = numpy.ascontiguousarray( new_data + 1 )
+        client.post_ndarray( self.data_uuid, self.data_name, self.voxels_metadata, start, stop, c_data ).result()
+
+        roundtrip = client.get_ndarray( self.data_uuid, self.data_name, self.voxels_metadata, start, stop ).result()
+        assert (roundtrip == new_data + 1).all()
+        client.close()
+
+    def test_error(self):
+        client = AsyncDvidClient( "localhost:8000" )
+        result = client.get_value( self.data_uuid, self.keyvalue_name, "nonexistent_key" )
+        try:
+            result.result()
+        except DvidHttpError as ex:
+            assert ex.status_code == 404
+        else:
+            assert False, "Expected a DvidHttpError"
+        
+        # The client still works
+        assert client.get_repos_info().result()
+        client.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from pydvid import general, voxels
+from pydvid.errors import DvidHttpError
+from pydvid.dvid_connection import DvidConnection
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class TestBulkMetadata(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file with several volumes and a keyvalue instance
+        - Start the mock server
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.shapes = {}
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            for i in range(10):
+                name = "volume{}".format(i)
+                shape = (1, 10+i, 20, 30)
+                data = numpy.zeros( shape, dtype=numpy.uint8 )
+                metadata = voxels.VoxelsMetadata.create_default_metadata( shape, numpy.uint8, "cxyz", 1.0, "" )
+                test_h5file.add_volume( "datasetA", name, data, metadata )
+                cls.shapes[name] = shape
+            test_h5file.add_keyvalue_group( "datasetA", "my_keyvalue" )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_all_instances(self):
+        connection = DvidConnection( "localhost:8000" )
+        try:
+            metadata, errors = voxels.get_metadata_bulk( connection, self.data_uuid )
+        finally:
+            connection.close()
+        assert errors == {}
+        assert sorted( metadata.keys() ) == sorted( self.shapes.keys() ) # (Not the keyvalue instance)
+        for name, shape in self.shapes.items():
+            assert metadata[name].shape == shape
+
+    def test_repos_info(self):
+        connection = DvidConnection( "localhost:8000" )
+        try:
+            repos_info = general.get_repos_info( connection )
+            metadata, errors = voxels.get_metadata_bulk( connection, self.data_uuid, repos_info, validation='off' )
+        finally:
+            connection.close()
+        assert errors == {}
+        assert len(metadata) == len(self.shapes)
+
+    def test_errors(self):
+        connection = DvidConnection( "localhost:8000" )
+        try:
+            metadata, errors = voxels.get_metadata_bulk( connection, self.data_uuid,
+                                                         data_names=["volume0", "no_such_volume", "volume1"] )
+        finally:
+            connection.close()
+        assert sorted( metadata.keys() ) == ["volume0", "volume1"]
+        assert list( errors.keys() ) == ["no_such_volume"]
+        assert isinstance( errors["no_such_volume"], DvidHttpError )
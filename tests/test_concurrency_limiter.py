@@ -0,0 +1,152 @@
+import time
+import httplib
+
+from pydvid import concurrency_limiter
+from pydvid.concurrency_limiter import AdaptiveConcurrencyLimiter
+
+class FakeClock(object):
+    """
+    Replaces the time module in pydvid.concurrency_limiter, so response times can be simulated:
+    Advancing the clock's offset makes any requests in flight appear slower.
+    """
+    def __init__(self):
+        self.offset = 0.0
+
+    def time(self):
+        return time.time() + self.offset
+
+class TestAdaptiveConcurrencyLimiter(object):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        concurrency_limiter.time = self.clock
+
+    def tearDown(self):
+        concurrency_limiter.time = time
+
+    def _complete_request(self, limiter, status=httplib.OK):
+        permit = limiter.acquire()
+        limiter.record_response( permit, status )
+        limiter.release( permit )
+
+    def test_limit(self):
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=2 )
+        permits = [ limiter.acquire(), limiter.acquire() ]
+        assert limiter.acquire( timeout=0.05 ) is None
+        limiter.release( permits[0] )
+        limiter.release( permits[0] ) # no effect
+        assert limiter.stats['in_flight'] == 1
+        permits[0] = limiter.acquire( timeout=0.05 )
+        assert permits[0] is not None
+
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=2, max_limit=3 )
+
+        # Requests that don't use the full limit don't increase it.
+        for _ in range(10):
+            self._complete_request( limiter )
+        assert limiter.limit == 2
+
+        # Saturated: about one more per round-trip
+        for _ in range(2):
+            permits = [ limiter.acquire(), limiter.acquire() ]
+            for permit in permits:
+                limiter.record_response( permit, httplib.OK )
+                limiter.release( permit )
+        assert limiter.limit == 3
+
+        # ...but never above the max_limit
+        for _ in range(5):
+            permits = [ limiter.acquire() for _ in range(3) ]
+            for permit in permits:
+                limiter.record_response( permit, httplib.OK )
+                limiter.release( permit )
+        assert limiter.limit == 3
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=16, min_limit=2 )
+
+        # A burst of 503s for requests that were in flight at the same time only counts once.
+        permits = [ limiter.acquire() for _ in range(8) ]
+        for permit in permits:
+            limiter.record_response( permit, httplib.SERVICE_UNAVAILABLE )
+            limiter.release( permit )
+        assert limiter.limit == 8
+        assert limiter.stats['decreases'] == 1
+
+        # But subsequent requests that are rejected cut it again.
+        for _ in range(5):
+            self._complete_request( limiter, httplib.SERVICE_UNAVAILABLE )
+        assert limiter.limit == 2
+        assert limiter.stats['in_flight'] == 0
+
+    def _complete_request_with_latency(self, limiter, latency, url="/api/node/abc/grayscale/metadata"):
+        permit = limiter.acquire()
+        self.clock.offset += latency
+        limiter.record_response( permit, httplib.OK, url )
+        limiter.release( permit )
+
+    def test_latency_spike(self):
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=8, warmup_samples=5 )
+        for _ in range(10):
+            self._complete_request_with_latency( limiter, 0.01 )
+        assert limiter.stats['decreases'] == 0
+
+        self._complete_request_with_latency( limiter, 0.5 )
+        assert limiter.stats['decreases'] == 1
+        assert limiter.limit == 4
+
+        # Slow responses to requests that were in flight at the same time only count once.
+        permits = [ limiter.acquire() for _ in range(4) ]
+        self.clock.offset += 0.5
+        for permit in permits:
+            limiter.record_response( permit, httplib.OK, "/api/node/abc/grayscale/metadata" )
+        for permit in permits:
+            limiter.release( permit )
+        assert limiter.stats['decreases'] == 2
+        assert limiter.limit == 2
+
+    def test_latency_backoff_is_optional(self):
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=8, latency_backoff=False, warmup_samples=5 )
+        for _ in range(10):
+            self._complete_request_with_latency( limiter, 0.01 )
+        self._complete_request_with_latency( limiter, 0.5 )
+        assert limiter.stats['decreases'] == 0
+        assert limiter.limit == 8
+
+    def test_latency_floor(self):
+        # Doubling a very short response time isn't a spike.
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=8, warmup_samples=5 )
+        for _ in range(10):
+            self._complete_request_with_latency( limiter, 0.001 )
+        for _ in range(5):
+            self._complete_request_with_latency( limiter, 0.01 )
+        assert limiter.stats['decreases'] == 0
+
+    def test_latency_per_endpoint(self):
+        # Slow bulk reads among many quick metadata requests aren't a spike.
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=8, warmup_samples=5 )
+        small_read = "/api/node/abc/grayscale/raw/0_1_2/16_16_16/0_0_0"
+        large_read = "/api/node/abc/grayscale/raw/0_1_2/512_512_512/0_0_0"
+        for _ in range(20):
+            self._complete_request_with_latency( limiter, 0.01 )
+            self._complete_request_with_latency( limiter, 0.01, small_read )
+        for _ in range(5):
+            self._complete_request_with_latency( limiter, 2.0, large_read )
+        assert limiter.stats['decreases'] == 0
+        assert sorted( limiter.stats['latencies'].keys() ) == [ 'node/grayscale', 'node/grayscale/raw/2^12', 'node/grayscale/raw/2^28' ]
+
+    def test_freed_when_headers_arrive(self):
+        # A long-lived response doesn't hold its permit after its headers arrive.
+        limiter = AdaptiveConcurrencyLimiter( "testhost", initial_limit=2, min_limit=1 )
+        streaming_permits = [ limiter.acquire(), limiter.acquire() ]
+        for permit in streaming_permits:
+            limiter.record_response( permit, httplib.OK )
+        assert limiter.stats['in_flight'] == 0
+
+        # Even after the limit has been cut, other requests can proceed while the bodies are streamed.
+        self._complete_request( limiter, httplib.SERVICE_UNAVAILABLE )
+        assert limiter.limit == 1
+        assert limiter.acquire( timeout=0.05 ) is not None
+        for permit in streaming_permits:
+            limiter.release( permit )
@@ -0,0 +1,292 @@
+import os
+import time
+import shutil
+import httplib
+import tempfile
+import threading
+
+import numpy
+
+from pydvid import voxels, general
+from pydvid.dvid_connection import DvidConnection
+from pydvid.concurrency_limiter import AdaptiveConcurrencyLimiter
+from pydvid.rate_limiter import RateLimiter
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class TestDvidConnection(object):
+    
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server, which serves the test data from the file.
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls._generate_testdata_h5(cls.test_filepath)
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000, 
+                                                                             same_process=True, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        shutil.rmtree(cls._tmp_dir)
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+
+    @classmethod
+    def _generate_testdata_h5(cls, test_filepath):
+        """
+        Generate a temporary hdf5 file for the mock server to use (and us to compare against)
+        """
+        data = numpy.indices( (10, 100, 200) ).astype( numpy.uint32 )
+        cls.original_data = data
+        cls.data_uuid = "abcde"
+        cls.data_name = "indices_data"
+        voxels_metadata = voxels.VoxelsMetadata.create_default_metadata(data.shape, data.dtype, "cxyz", 1.0, "")
+        with H5MockServerDataFile( test_filepath ) as test_h5file:
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+            test_h5file.add_volume( "datasetA", cls.data_name, data, voxels_metadata )
+
+    def test_reuse(self):
+        connection = DvidConnection( "localhost:8000" )
+        for _ in range(5):
+            server_info = general.get_server_info( connection )
+            assert "DVID datastore" in server_info
+
+        # All requests were sent on the same keep-alive connection.
+        stats = connection.stats
+        assert stats['created'] == 1
+        assert stats['reused'] == 4
+        assert stats['in_use'] == 0
+        assert stats['idle'] == 1
+        connection.close()
+        assert connection.stats['idle'] == 0
+
+    def test_voxels_reuse(self):
+        connection = DvidConnection( "localhost:8000" )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        for _ in range(3):
+            subvolume = dvid_vol.get_ndarray( (0,2,20,30), (3,8,40,50) )
+            assert (subvolume == self.original_data[:, 2:8, 20:40, 30:50]).all()
+        assert connection.stats['created'] == 1
+        assert connection.stats['reused'] == 3
+        connection.close()
+
+    def test_half_read_response(self):
+        connection = DvidConnection( "localhost:8000" )
+        connection.request( "GET", "/api/server/info" )
+        response = connection.getresponse()
+        response.read(5)
+        
+        # The previous response wasn't finished, but the rest of it is small, 
+        #  so it is drained and the connection is reused.
+        server_info = general.get_server_info( connection )
+        assert "DVID datastore" in server_info
+        stats = connection.stats
+        assert stats['created'] == 1
+        assert stats['drained'] == 1
+        assert stats['idle'] == 1
+
+        # Same for a response that is closed explicitly.
+        connection.request( "GET", "/api/server/info" )
+        response = connection.getresponse()
+        response.read(5)
+        response.close()
+        stats = connection.stats
+        assert stats['drained'] == 2
+        assert stats['abandoned'] == 0
+        assert stats['idle'] == 1
+        connection.close()
+
+    def test_abandoned_response(self):
+        connection = DvidConnection( "localhost:8000", max_drain_bytes=1000 )
+        response = voxels.get_subvolume_response( connection, self.data_uuid, self.data_name, "raw", (0,0,0,0), (3,10,100,200) )
+        response.read(5)
+        response.close()
+
+        # Too much data was left to drain, so the connection was closed.
+        stats = connection.stats
+        assert stats['abandoned'] == 1
+        assert stats['drained'] == 0
+        assert stats['idle'] == 0
+
+        # A new connection is created for the next request.
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        subvolume = dvid_vol.get_ndarray( (0,2,20,30), (3,8,40,50) )
+        assert (subvolume == self.original_data[:, 2:8, 20:40, 30:50]).all()
+        assert connection.stats['created'] == 2
+        connection.close()
+
+    def test_reuse_with_high_file_descriptors(self):
+        # select() can't handle file descriptors >= 1024, but connections with such descriptors are still reused.
+        import resource
+        if resource.getrlimit( resource.RLIMIT_NOFILE )[0] < 1100:
+            raise nose.SkipTest( "Not enough file descriptors available" )
+        placeholders = []
+        try:
+            while not placeholders or placeholders[-1] < 1030:
+                placeholders.append( os.dup(0) )
+            connection = DvidConnection( "localhost:8000" )
+            for _ in range(3):
+                general.get_server_info( connection )
+            assert connection._idle_connections[-1][0].sock.fileno() >= 1024
+            assert connection.stats['created'] == 1
+            assert connection.stats['reused'] == 2
+            connection.close()
+        finally:
+            for fd in placeholders:
+                os.close( fd )
+
+    def test_idle_timeout(self):
+        connection = DvidConnection( "localhost:8000", idle_timeout=0.0 )
+        general.get_server_info( connection )
+        general.get_server_info( connection )
+        stats = connection.stats
+        assert stats['created'] == 2
+        assert stats['reused'] == 0
+        assert stats['expired'] == 1
+        connection.close()
+
+    def test_pipelined_responses(self):
+        connection = DvidConnection( "localhost:8000" )
+        requests = [ ("GET", "/api/server/info", None, {}) ] * 5
+        bodies = [ response.read() for response in connection.iter_pipelined_responses( requests ) ]
+        assert len(bodies) == 5
+        assert all( "DVID datastore" in body for body in bodies )
+        assert connection.stats['created'] == 1
+        assert connection.stats['idle'] == 1
+
+        # The server closes the connection after an error, so the rest of the requests aren't answered.
+        requests = [ ("GET", "/api/server/info", None, {}), ("GET", "/api/node/abcde/no_such_data/metadata", None, {}),
+                     ("GET", "/api/server/info", None, {}) ]
+        statuses = [ response.status for response in connection.iter_pipelined_responses( requests ) ]
+        assert statuses == [ httplib.OK, httplib.NOT_FOUND ]
+        assert connection.stats['reused'] == 1
+        assert connection.stats['idle'] == 0
+        connection.close()
+
+    def test_server_closed_connection(self):
+        connection = DvidConnection( "localhost:8000" )
+        general.get_server_info( connection )
+
+        # Simulate the server closing the idle keep-alive connection
+        idle_connection, _ = connection._idle_connections[-1]
+        idle_connection.sock.shutdown( 2 )
+        
+        server_info = general.get_server_info( connection )
+        assert "DVID datastore" in server_info
+        stats = connection.stats
+        assert stats['created'] == 2
+        assert stats['discarded'] == 1
+        connection.close()
+
+    def test_bounded_concurrency(self):
+        connection = DvidConnection( "localhost:8000", max_connections=2 )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        errors = []
+        def read_subvolumes():
+            try:
+                for _ in range(5):
+                    subvolume = dvid_vol.get_ndarray( (0,2,20,30), (3,8,40,50) )
+                    assert (subvolume == self.original_data[:, 2:8, 20:40, 30:50]).all()
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [ threading.Thread( target=read_subvolumes ) for _ in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors, errors
+        stats = connection.stats
+        assert stats['created'] <= 2
+        assert stats['in_use'] == 0
+        assert stats['created'] + stats['reused'] == 1 + 8*5 # (including the metadata request)
+        connection.close()
+
+    def test_pool_timeout(self):
+        connection = DvidConnection( "localhost:8000", max_connections=1, pool_timeout=0.1 )
+        connection.request( "GET", "/api/server/info" )
+        response = connection.getresponse()
+
+        # The only connection is still in use, so other threads can't get one.
+        errors = []
+        def get_info():
+            try:
+                general.get_server_info( connection )
+            except DvidConnection.PoolTimeoutError as ex:
+                errors.append(ex)
+        thread = threading.Thread( target=get_info )
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+
+        # Once the response has been read, the connection is available again.
+        response.read()
+        thread = threading.Thread( target=get_info )
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        assert connection.stats['created'] == 1
+        connection.close()
+
+    def test_concurrency_limiter(self):
+        limiter = AdaptiveConcurrencyLimiter( "localhost:8000", initial_limit=1 )
+        connection = DvidConnection( "localhost:8000", max_connections=4, pool_timeout=0.1, concurrency_limiter=limiter )
+        connection.request( "GET", "/api/server/info" )
+        assert limiter.stats['in_flight'] == 1
+
+        # The limiter permits only one request at a time, even though the pool has more connections.
+        errors = []
+        def get_info():
+            try:
+                general.get_server_info( connection )
+            except DvidConnection.PoolTimeoutError as ex:
+                errors.append(ex)
+        thread = threading.Thread( target=get_info )
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+
+        # The permit is released when the response headers arrive, even though the body hasn't been read yet.
+        # Since all permitted requests were in use, the limit grows.
+        response = connection.getresponse()
+        assert limiter.stats['in_flight'] == 0
+        assert limiter.limit == 2
+        thread = threading.Thread( target=get_info )
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        response.read()
+        assert 'server/info' in limiter.stats['latencies']
+        connection.close()
+
+    def test_rate_limiter(self):
+        # 600 kB per transfer, at 2 MB/s
+        rate_limiter = RateLimiter( bytes_per_second=2e6, burst_seconds=0.01 )
+        connection = DvidConnection( "localhost:8000", rate_limiter=rate_limiter )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        start, stop = (0,0,0,0), (3,10,100,50)
+
+        start_time = time.time()
+        subvolume = dvid_vol.get_ndarray( start, stop )
+        assert time.time() - start_time >= 0.25
+        assert (subvolume == self.original_data[:, 0:10, 0:100, 0:50]).all()
+
+        start_time = time.time()
+        dvid_vol.post_ndarray( start, stop, subvolume )
+        assert time.time() - start_time >= 0.25
+        connection.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import nose
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
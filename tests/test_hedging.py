@@ -0,0 +1,231 @@
+import io
+import os
+import time
+import shutil
+import httplib
+import tempfile
+import threading
+
+import numpy
+
+from pydvid import voxels, hedging
+from pydvid.dvid_connection import DvidConnection
+from pydvid.hedging import HedgingPolicy
+from pydvid.replicated_connection import ReplicatedDvidConnection
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile, H5CutoutRequestHandler
+
+class FakeConnection(object):
+    """
+    A thread-safe fake connection, whose responses arrive after the given delays (in order).
+    """
+    def __init__(self, *delays):
+        self.delays = list(delays)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url):
+        with self._lock:
+            self.requests += 1
+
+    def getresponse(self):
+        with self._lock:
+            delay = self.delays.pop(0) if self.delays else 0.0
+        time.sleep( delay )
+        return io.BytesIO( "data" )
+
+class FakeReplicatedConnection(ReplicatedDvidConnection):
+    """
+    A FakeConnection for each of several servers.
+    Reads go to the first server that isn't in avoid_hostnames.
+    """
+    def __init__(self, **servers):
+        self.servers = servers
+        self._thread_state = threading.local()
+
+    def request(self, method, url, avoid_hostnames=()):
+        hostnames = sorted( self.servers.keys() )
+        hostname = ( [ h for h in hostnames if h not in avoid_hostnames ] or hostnames )[0]
+        self._thread_state.hostname = hostname
+        self.servers[hostname].request( method, url )
+
+    @property
+    def current_hostname(self):
+        return self._thread_state.hostname
+
+    def getresponse(self):
+        return self.servers[self._thread_state.hostname].getresponse()
+
+def fake_request( connection ):
+    connection.request( "GET", "/data" )
+    response = connection.getresponse()
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+class TestHedgingPolicy(object):
+
+    def _warm_up(self, policy, connection):
+        for _ in range(policy.min_samples):
+            assert policy.call( fake_request, connection ) == "data"
+        assert policy.stats['delay'] is not None
+
+    def test_delay(self):
+        policy = HedgingPolicy( percentile=90.0, min_samples=10, min_delay=0.0 )
+        for i in range(9):
+            policy.record_latency( 0.001 )
+        assert policy.stats['delay'] is None
+        for i in range(91):
+            policy.record_latency( 0.001 * (i+1) )
+        assert abs( policy.stats['delay'] - 0.082 ) < 1e-9
+
+        policy = HedgingPolicy( min_samples=1, min_delay=0.5 )
+        policy.record_latency( 0.001 )
+        assert policy.stats['delay'] == 0.5
+
+    def test_hedge(self):
+        policy = HedgingPolicy( budget=1.0, min_samples=5, min_delay=0.05 )
+        connection = FakeConnection()
+        self._warm_up( policy, connection )
+
+        connection.delays = [1.0]
+        start_time = time.time()
+        assert policy.call( fake_request, connection ) == "data"
+        assert time.time() - start_time < 0.5
+        stats = policy.stats
+        assert stats['hedges'] == 1
+        assert stats['hedge_wins'] == 1
+
+        # Fast requests aren't duplicated
+        requests_before = connection.requests
+        for _ in range(10):
+            assert policy.call( fake_request, connection ) == "data"
+        assert connection.requests == requests_before + 10
+        assert policy.stats['hedges'] == 1
+
+    def test_budget(self):
+        policy = HedgingPolicy( budget=0.1, max_burst=1, min_samples=5, min_delay=0.05 )
+        connection = FakeConnection()
+        self._warm_up( policy, connection )
+
+        # The warm-up earned half a token: not enough for a duplicate.
+        connection.delays = [0.3]
+        start_time = time.time()
+        assert policy.call( fake_request, connection ) == "data"
+        assert time.time() - start_time >= 0.3
+        assert policy.stats['hedges'] == 0
+
+        # Now there's enough.  (And the slow response is no longer within the 95th percentile.)
+        for _ in range(25):
+            policy.call( fake_request, connection )
+        connection.delays = [0.3]
+        start_time = time.time()
+        assert policy.call( fake_request, connection ) == "data"
+        assert time.time() - start_time < 0.3
+        assert policy.stats['hedges'] == 1
+
+    def test_failure(self):
+        policy = HedgingPolicy( budget=1.0, min_samples=5, min_delay=0.05 )
+        connection = FakeConnection()
+        self._warm_up( policy, connection )
+
+        def failing_request( connection ):
+            fake_request( connection )
+            raise RuntimeError( "request failed" )
+
+        # Both requests fail: the original's exception is raised.
+        connection.delays = [0.3]
+        try:
+            policy.call( failing_request, connection )
+        except RuntimeError:
+            pass
+        else:
+            assert False, "Expected RuntimeError"
+        assert policy.stats['hedges'] == 1
+
+    def test_different_replica(self):
+        policy = HedgingPolicy( budget=1.0, min_samples=5, min_delay=0.05 )
+        connection = FakeReplicatedConnection( a=FakeConnection(), b=FakeConnection() )
+        self._warm_up( policy, connection )
+        assert connection.servers['a'].requests == 5
+        assert connection.servers['b'].requests == 0
+
+        # The duplicate goes to the other server.
+        connection.servers['a'].delays = [1.0]
+        start_time = time.time()
+        assert policy.call( fake_request, connection ) == "data"
+        assert time.time() - start_time < 0.5
+        assert policy.stats['hedge_wins'] == 1
+        assert connection.servers['a'].requests == 6
+        assert connection.servers['b'].requests == 1
+
+    def test_shared_threads(self):
+        threads_before = threading.active_count()
+        for _ in range(10):
+            policy = HedgingPolicy( budget=1.0, min_samples=5, min_delay=0.01 )
+            connection = FakeConnection()
+            self._warm_up( policy, connection )
+            connection.delays = [0.1]
+            assert policy.call( fake_request, connection ) == "data"
+            assert policy.stats['hedges'] == 1
+        assert threading.active_count() - threads_before <= hedging.MAX_WORKERS
+
+class TestHedgingWithServer(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server (in this process, so we can tell it to be slow)
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_volume"
+        cls.original_data = numpy.random.randint( 0, 1000, (1,10,20,30) ).astype( numpy.uint32 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( cls.original_data.shape, numpy.uint32, "cxyz", 1.0, "" )
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_volume( "datasetA", cls.data_name, cls.original_data, metadata )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+
+        cls.server = H5MockServer( cls.test_filepath, True, ("localhost", 8000), H5CutoutRequestHandler )
+        cls.server_thread = threading.Thread( target=cls.server.serve_forever )
+        cls.server_thread.start()
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.server.shutdown()
+        cls.server.shutdown_completed_event.wait()
+        cls.server_thread.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_slow_response(self):
+        connection = DvidConnection( "localhost:8000", concurrency_limiter=False )
+        policy = HedgingPolicy( budget=1.0, min_samples=5, min_delay=0.05 )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name, hedging=policy )
+        for _ in range(5):
+            assert (dvid_vol[:, 0:5, 0:5, 0:5] == self.original_data[:, 0:5, 0:5, 0:5]).all()
+
+        self.server.slow_delay = 1.0
+        self.server.slow_count = 1
+        start_time = time.time()
+        data = dvid_vol[:, 0:10, 5:20, 0:30]
+        assert time.time() - start_time < 0.5
+        assert (data == self.original_data[:, 0:10, 5:20, 0:30]).all()
+        assert policy.stats['hedge_wins'] == 1
+
+        # Let the slow request finish before the server shuts down.
+        time.sleep( 1.5 - (time.time() - start_time) )
+        connection.close()
+
+    def test_requires_thread_safe_connection(self):
+        try:
+            voxels.VoxelsAccessor( httplib.HTTPConnection( "localhost:8000" ), self.data_uuid, self.data_name, hedging=True )
+        except AssertionError:
+            pass
+        else:
+            assert False, "Expected AssertionError"
@@ -0,0 +1,127 @@
+import os
+import shutil
+import httplib
+import logging
+import tempfile
+
+import numpy
+
+import pydvid
+from pydvid import general, keyvalue, hooks
+from pydvid.dvid_connection import DvidConnection
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class RecordingHook(hooks.RequestHook):
+    def __init__(self):
+        self.events = []
+
+    def request_started(self, timing):
+        self.events.append( ('started', timing.method, timing.url) )
+
+    def response_received(self, timing):
+        self.events.append( ('received', timing.status) )
+
+    def request_finished(self, timing):
+        self.events.append( ('finished', timing.endpoint, timing.status, timing.error is None) )
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append( record.getMessage() )
+
+class TestHooks(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.keyvalue_name = "my_keyvalue"
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_no_global_patch(self):
+        """
+        Importing pydvid must not affect requests made by other libraries.
+        """
+        assert httplib.HTTPConnection.request.__module__ == 'httplib'
+        assert not hooks._hooks_in_use
+
+    def test_global_hook(self):
+        hook = RecordingHook()
+        hooks.add_hook( hook )
+        try:
+            connection = httplib.HTTPConnection( "localhost:8000" )
+            keyvalue.put_value( connection, self.data_uuid, self.keyvalue_name, "key", "value" )
+            assert keyvalue.get_value( connection, self.data_uuid, self.keyvalue_name, "key" ) == "value"
+        finally:
+            hooks.remove_hook( hook )
+        assert not hooks._hooks_in_use
+
+        url = "/api/node/{}/{}/key".format( self.data_uuid, self.keyvalue_name )
+        assert hook.events == [ ('started', 'POST', url), ('received', 200), ('finished', 'keyvalue', 200, True),
+                                ('started', 'GET', url), ('received', 200), ('finished', 'keyvalue', 200, True) ]
+
+        # No more events after removal
+        general.get_server_info( connection )
+        assert len(hook.events) == 6
+
+    def test_connection_hook(self):
+        hook = RecordingHook()
+        connection = DvidConnection( "localhost:8000" )
+        other_connection = DvidConnection( "localhost:8000" )
+        hooks.add_hook( hook, connection=connection )
+        try:
+            general.get_server_info( other_connection )
+            assert hook.events == []
+
+            general.get_server_info( connection )
+            assert hook.events == [ ('started', 'GET', '/api/server/info'), ('received', 200), ('finished', 'server', 200, True) ]
+
+            try:
+                keyvalue.get_value( connection, self.data_uuid, self.keyvalue_name, "nonexistent_key" )
+            except pydvid.errors.DvidHttpError:
+                pass
+            else:
+                assert False, "Expected DvidHttpError"
+            assert hook.events[-1] == ('finished', 'keyvalue', 404, False)
+        finally:
+            hooks.remove_hook( hook, connection=connection )
+            connection.close()
+            other_connection.close()
+        assert not hooks._hooks_in_use
+
+    def test_logging_hook(self):
+        logger = logging.getLogger( "test_hooks" )
+        logger.setLevel( logging.DEBUG )
+        handler = ListHandler()
+        logger.addHandler( handler )
+        hook = hooks.LoggingHook( logger )
+        hooks.add_hook( hook )
+        try:
+            general.get_server_info( httplib.HTTPConnection( "localhost:8000" ) )
+        finally:
+            hooks.remove_hook( hook )
+            logger.removeHandler( handler )
+        assert handler.messages[0] == "GET localhost:8000/api/server/info"
+        assert handler.messages[1].startswith( "GET localhost:8000/api/server/info -> 200 (" )
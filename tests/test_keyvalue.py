@@ -1,11 +1,16 @@
 import os
+import io
+import time
 import shutil
 import tempfile
 import httplib
 
 import h5py
+import numpy
 
-from pydvid import keyvalue
+from pydvid import keyvalue, hooks
+from pydvid.errors import DvidHttpError
+from pydvid.dvid_connection import DvidConnection
 from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
 
 class TestKeyValue(object):
@@ -81,6 +86,215 @@ class TestKeyValue(object):
         value = keyvalue.get_value( self.client_connection, self.data_uuid, self.data_name, 'key_abc' )
         assert value == 'abcdefghijklmnopqrstuvwxyz'
 
+class TestKeyValueBulk(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_keyvalue"
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_keyvalue_group( "datasetA", cls.data_name )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def setUp(self):
+        self.connection = DvidConnection( "localhost:8000", max_connections=4, concurrency_limiter=False )
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_put_and_get(self):
+        items = { "key{}".format(i) : "value{}".format(i)*i for i in range(100) }
+        results = list( keyvalue.put_values( self.connection, self.data_uuid, self.data_name, items ) )
+        assert sorted( key for key, _ in results ) == sorted( items.keys() )
+        assert all( error is None for _, error in results )
+
+        results = list( keyvalue.get_values( self.connection, self.data_uuid, self.data_name, sorted(items.keys()) ) )
+        assert len(results) == len(items)
+        for key, value, error in results:
+            assert error is None
+            assert value == items[key]
+
+        # Each batch of 16 requests was sent on a single connection from the pool
+        stats = self.connection.stats
+        assert stats['created'] <= 4
+        assert stats['created'] + stats['reused'] == 2 * 7
+
+    def test_put_without_consuming(self):
+        # The writes happen even if the results are ignored.
+        items = { "unconsumed{}".format(i) : "value{}".format(i) for i in range(50) }
+        keyvalue.put_values( self.connection, self.data_uuid, self.data_name, items )
+        deadline = time.time() + 10.0
+        while True:
+            results = list( keyvalue.get_values( self.connection, self.data_uuid, self.data_name, sorted(items.keys()) ) )
+            if all( error is None for _, _, error in results ) or time.time() > deadline:
+                break
+            time.sleep( 0.05 )
+        assert sorted( (key, value) for key, value, _ in results ) == sorted( items.items() )
+
+    def test_put_buffers(self):
+        expected = { "buffer{}".format(i) : "value{}".format(i) for i in range(8) }
+        items = [ (key, bytearray(value) if i % 2 else memoryview(value))
+                  for i, (key, value) in enumerate( sorted( expected.items() ) ) ]
+        results = list( keyvalue.put_values( self.connection, self.data_uuid, self.data_name, items, max_concurrency=1 ) )
+        assert all( error is None for _, error in results )
+        results = list( keyvalue.get_values( self.connection, self.data_uuid, self.data_name, [ key for key, _ in items ] ) )
+        assert sorted( (key, value) for key, value, _ in results ) == sorted( expected.items() )
+
+    def test_unexpected_errors_per_key(self):
+        def fail( requests ):
+            raise RuntimeError( "not a network error" )
+        self.connection.iter_pipelined_responses = fail
+        keys = sorted( "error{}".format(i) for i in range(20) )
+        results = list( keyvalue.put_values( self.connection, self.data_uuid, self.data_name, [ (key, "x") for key in keys ] ) )
+        assert sorted( key for key, _ in results ) == keys
+        assert all( isinstance( error, RuntimeError ) for _, error in results )
+
+        results = list( keyvalue.get_values( self.connection, self.data_uuid, self.data_name, keys ) )
+        assert sorted( key for key, _, _ in results ) == keys
+        assert all( value is None and isinstance( error, RuntimeError ) for _, value, error in results )
+
+    def test_missing_keys(self):
+        list( keyvalue.put_values( self.connection, self.data_uuid, self.data_name, [("present1", "a"), ("present2", "b")] ) )
+        keys = ["present1", "missing1", "missing2", "present2", "missing3"]
+        results = { key : (value, error) for key, value, error in
+                    keyvalue.get_values( self.connection, self.data_uuid, self.data_name, keys, pipeline_depth=5 ) }
+        assert sorted( results.keys() ) == sorted( keys )
+        assert results["present1"] == ("a", None)
+        assert results["present2"] == ("b", None)
+        for key in ["missing1", "missing2", "missing3"]:
+            value, error = results[key]
+            assert value is None
+            assert isinstance( error, DvidHttpError ) and error.status_code == httplib.NOT_FOUND
+
+    def test_not_pipelined(self):
+        # With a request hook, each key is requested separately (so the hook sees every request).
+        urls = []
+        class UrlRecorder(hooks.RequestHook):
+            def request_started(self, timing):
+                urls.append( timing.url )
+        recorder = UrlRecorder()
+        hooks.add_hook( recorder, connection=self.connection )
+        try:
+            items = [ ("hooked{}".format(i), "x"*i) for i in range(10) ]
+            assert all( error is None for _, error in
+                        keyvalue.put_values( self.connection, self.data_uuid, self.data_name, items ) )
+            results = sorted( keyvalue.get_values( self.connection, self.data_uuid, self.data_name,
+                                                   [ key for key, _ in items ] ) )
+        finally:
+            hooks.remove_hook( recorder, connection=self.connection )
+        assert results == sorted( (key, value, None) for key, value in items )
+        assert len(urls) == 20
+
+class TestKeyValueStreaming(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_blobs"
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_keyvalue_group( "datasetA", cls.data_name )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+        # Binary data, including NULs (and not a multiple of the chunk size)
+        cls.blob = numpy.random.randint( 0, 256, 3*2**20 + 123 ).astype( numpy.uint8 ).tostring()
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def setUp(self):
+        self.connection = DvidConnection( "localhost:8000", concurrency_limiter=False )
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_chunked_upload(self):
+        chunks = ( self.blob[i:i+100000] for i in range(0, len(self.blob), 100000) )
+        keyvalue.put_value_from( self.connection, self.data_uuid, self.data_name, "chunked_blob", chunks )
+        assert keyvalue.get_value( self.connection, self.data_uuid, self.data_name, "chunked_blob" ) == self.blob
+
+        # The connection is reused afterwards
+        keyvalue.put_value_from( self.connection, self.data_uuid, self.data_name, "empty", iter([]) )
+        assert keyvalue.get_value( self.connection, self.data_uuid, self.data_name, "empty" ) == ""
+        assert self.connection.stats['created'] == 1
+
+    def test_upload_with_length(self):
+        keyvalue.put_value_from( self.connection, self.data_uuid, self.data_name, "sized_blob", 
+                                 io.BytesIO( self.blob ), length=len(self.blob), chunk_bytes=2**16 )
+        assert keyvalue.get_value( self.connection, self.data_uuid, self.data_name, "sized_blob" ) == self.blob
+
+        # The wrong length is an error (and the connection isn't reused).
+        try:
+            keyvalue.put_value_from( self.connection, self.data_uuid, self.data_name, "short_blob", 
+                                     io.BytesIO( "abc" ), length=4 )
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected a ValueError"
+        assert self.connection.stats['in_use'] == 0
+        assert keyvalue.get_value( self.connection, self.data_uuid, self.data_name, "sized_blob" ) == self.blob
+
+    def test_download(self):
+        keyvalue.put_value( self.connection, self.data_uuid, self.data_name, "blob", self.blob )
+
+        chunks = list( keyvalue.iter_value_chunks( self.connection, self.data_uuid, self.data_name, "blob" ) )
+        assert max( len(chunk) for chunk in chunks ) <= 2**20
+        assert "".join( chunks ) == self.blob
+
+        output_file = io.BytesIO()
+        nbytes = keyvalue.get_value_to( self.connection, self.data_uuid, self.data_name, "blob", output_file )
+        assert nbytes == len(self.blob)
+        assert output_file.getvalue() == self.blob
+
+        buf = bytearray( len(self.blob) + 10 )
+        nbytes = keyvalue.get_value_to( self.connection, self.data_uuid, self.data_name, "blob", buf, chunk_bytes=2**16 )
+        assert nbytes == len(self.blob)
+        assert buf[:nbytes] == self.blob
+
+        try:
+            keyvalue.get_value_to( self.connection, self.data_uuid, self.data_name, "blob", bytearray(100) )
+        except ValueError:
+            pass
+        else:
+            assert False, "Expected a ValueError"
+
+        assert self.connection.stats['created'] == 1
+        assert self.connection.stats['in_use'] == 0
+
+    def test_abandoned_download(self):
+        keyvalue.put_value( self.connection, self.data_uuid, self.data_name, "blob2", self.blob )
+        chunks = keyvalue.iter_value_chunks( self.connection, self.data_uuid, self.data_name, "blob2" )
+        assert next(chunks) == self.blob[:2**20]
+        chunks.close()
+        assert self.connection.stats['in_use'] == 0
+
 if __name__ == "__main__":
     import sys
     import nose
@@ -0,0 +1,51 @@
+import os
+import sys
+import subprocess
+
+import pydvid
+
+def _imported_modules( statement ):
+    """
+    Run the given statement in a fresh interpreter, and return the names of the modules it imported.
+    """
+    script = "import sys\n" \
+             "before = set(sys.modules)\n" \
+             "{}\n" \
+             "print ' '.join( name for name in set(sys.modules) - before if sys.modules[name] is not None )\n" \
+             "".format( statement )
+    env = dict( os.environ )
+    env['PYTHONPATH'] = os.pathsep.join( [os.path.dirname( os.path.dirname( os.path.abspath( pydvid.__file__ ) ) )] +
+                                          filter( None, [env.get('PYTHONPATH')] ) )
+    return set( subprocess.check_output( [sys.executable, "-c", script], env=env ).split() )
+
+class TestLazyImport(object):
+
+    def test_import_pydvid(self):
+        modules = _imported_modules( "import pydvid" )
+        assert 'pydvid' in modules
+        for name in ('numpy', 'jsonschema', 'vigra', 'h5py', 'PyQt4', 'pydvid.voxels', 'pydvid.errors'):
+            assert name not in modules, "import pydvid shouldn't import {}".format( name )
+
+    def test_import_keyvalue(self):
+        modules = _imported_modules( "from pydvid import keyvalue, dvid_connection" )
+        assert 'pydvid.keyvalue' in modules and 'pydvid.dvid_connection' in modules
+        for name in ('numpy', 'jsonschema', 'concurrent.futures'):
+            assert name not in modules, "keyvalue requests shouldn't need {}".format( name )
+
+    def test_attribute_access(self):
+        modules = _imported_modules( "import pydvid\n"
+                                     "pydvid.voxels.VoxelsMetadata\n"
+                                     "assert set(pydvid.__all__) <= set(dir(pydvid))\n"
+                                     "try:\n"
+                                     "    pydvid.no_such_module\n"
+                                     "except AttributeError:\n"
+                                     "    pass\n"
+                                     "else:\n"
+                                     "    assert False" )
+        assert 'pydvid.voxels' in modules and 'numpy' in modules
+
+    def test_import_star(self):
+        modules = _imported_modules( "from pydvid import *\n"
+                                     "general, voxels, keyvalue, labelgraph, dvid_connection" )
+        assert 'pydvid.async_client' in modules
+        assert 'pydvid.gui' not in modules
@@ -0,0 +1,168 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+from pydvid import keyvalue, voxels, metrics
+from pydvid.dvid_connection import DvidConnection
+from pydvid.hooks import RequestTiming, instrumented
+from pydvid.metrics import MetricsRegistry, Histogram
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile, H5CutoutRequestHandler
+
+def _find( entries, name, **labels ):
+    matches = [ e for e in entries if e['name'] == name and all( e['labels'].get(k) == v for k,v in labels.items() ) ]
+    assert len(matches) == 1, "Expected exactly one {} with labels {}, found {}".format( name, labels, matches )
+    return matches[0]
+
+class TestMetricsRegistry(object):
+
+    def test_histogram(self):
+        histogram = Histogram( (1.0, 2.0, 5.0) )
+        for value in (0.5, 1.0, 1.5, 3.0, 10.0):
+            histogram.observe( value )
+        assert histogram.count == 5
+        assert histogram.sum == 16.0
+        assert histogram.cumulative_counts() == [(1.0, 2), (2.0, 3), (5.0, 4), (float('inf'), 5)]
+
+    def test_record(self):
+        registry = MetricsRegistry()
+        received = []
+        registry.add_callback( received.append )
+
+        timing = RequestTiming( 'keyvalue', attempt=2 )
+        timing.method = 'GET'
+        timing.status = 200
+        timing.first_byte = 0.002
+        timing.bytes_received = 1000
+        timing.finish()
+        registry.record( timing )
+        assert received == [timing]
+
+        snapshot = json.loads( registry.to_json() )
+        total = _find( snapshot['histograms'], 'pydvid_request_duration_seconds', endpoint='keyvalue', phase='total' )
+        assert total['count'] == 1
+        assert total['buckets'][-1] == [None, 1]
+        size = _find( snapshot['histograms'], 'pydvid_request_size_bytes', direction='received' )
+        assert size['sum'] == 1000
+        assert _find( snapshot['counters'], 'pydvid_requests_total', status='200' )['value'] == 1
+        assert _find( snapshot['counters'], 'pydvid_request_retries_total', endpoint='keyvalue' )['value'] == 1
+
+        registry.remove_callback( received.append )
+        registry.record( timing )
+        assert len(received) == 1
+
+    def test_prometheus(self):
+        registry = MetricsRegistry()
+        registry.describe( 'my_latency_seconds', 'histogram', 'Some latency' )
+        registry.observe( 'my_latency_seconds', 0.003, buckets=(0.001, 0.01), host='a"b' )
+        registry.increment( 'my_events_total', 2, kind='x' )
+        text = registry.to_prometheus()
+        lines = text.splitlines()
+        assert "# HELP my_latency_seconds Some latency" in lines
+        assert "# TYPE my_latency_seconds histogram" in lines
+        assert 'my_latency_seconds_bucket{host="a\\"b",le="0.001"} 0' in lines
+        assert 'my_latency_seconds_bucket{host="a\\"b",le="0.01"} 1' in lines
+        assert 'my_latency_seconds_bucket{host="a\\"b",le="+Inf"} 1' in lines
+        assert 'my_latency_seconds_count{host="a\\"b"} 1' in lines
+        assert "# TYPE my_events_total counter" in lines
+        assert 'my_events_total{kind="x"} 2' in lines
+
+    def test_disabled(self):
+        """
+        While instrumentation is disabled, the connection is passed through untouched.
+        """
+        @instrumented('test')
+        def request_func( connection ):
+            return connection
+
+        connection = object()
+        assert metrics.get_registry() is None
+        assert request_func( connection ) is connection
+
+class TestInstrumentedRequests(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server (in this process, so we can tell it to be busy)
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_volume"
+        cls.keyvalue_name = "my_keyvalue"
+        cls.original_data = numpy.random.randint( 0, 1000, (1,10,20,30) ).astype( numpy.uint32 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( cls.original_data.shape, numpy.uint32, "cxyz", 1.0, "" )
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_volume( "datasetA", cls.data_name, cls.original_data, metadata )
+            test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+
+        cls.server = H5MockServer( cls.test_filepath, True, ("localhost", 8000), H5CutoutRequestHandler )
+        cls.server_thread = threading.Thread( target=cls.server.serve_forever )
+        cls.server_thread.start()
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.server.shutdown()
+        cls.server.shutdown_completed_event.wait()
+        cls.server_thread.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def setUp(self):
+        self.registry = metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_voxels(self):
+        timings = []
+        self.registry.add_callback( timings.append )
+        connection = DvidConnection( "localhost:8000", concurrency_limiter=False )
+        try:
+            dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+            for _ in range(3):
+                assert (dvid_vol[:, 0:10, 0:20, 0:30] == self.original_data).all()
+            dvid_vol[:, 0:5, 0:5, 0:5] = self.original_data[:, 0:5, 0:5, 0:5]
+        finally:
+            connection.close()
+
+        assert [ (t.endpoint, t.method, t.status) for t in timings ] == \
+               [ ('metadata', 'GET', 200) ] + [ ('raw', 'GET', 200) ]*3 + [ ('raw', 'POST', 200) ]
+        for timing in timings[1:4]:
+            assert timing.bytes_received == self.original_data.nbytes
+            assert timing.first_byte > 0 and timing.transfer > 0
+            assert timing.total >= timing.acquire + timing.send + timing.first_byte + timing.transfer
+        assert timings[4].bytes_sent == 5*5*5*4
+
+        snapshot = self.registry.snapshot()
+        assert _find( snapshot['counters'], 'pydvid_requests_total', endpoint='raw', method='GET' )['value'] == 3
+        received = _find( snapshot['histograms'], 'pydvid_request_size_bytes', endpoint='raw', method='GET', direction='received' )
+        assert received['sum'] == 3 * self.original_data.nbytes
+        for phase in metrics.PHASES:
+            assert _find( snapshot['histograms'], 'pydvid_request_duration_seconds',
+                          endpoint='raw', method='GET', phase=phase )['count'] == 3
+
+    def test_retries(self):
+        connection = DvidConnection( "localhost:8000", concurrency_limiter=False )
+        try:
+            keyvalue.put_value( connection, self.data_uuid, self.keyvalue_name, "key", "value" )
+            self.server.busy_count = 2
+            assert keyvalue.get_value( connection, self.data_uuid, self.keyvalue_name, "key" ) == "value"
+        finally:
+            connection.close()
+
+        snapshot = self.registry.snapshot()
+        counters = snapshot['counters']
+        assert _find( counters, 'pydvid_requests_total', endpoint='keyvalue', method='POST', status='200' )['value'] == 1
+        assert _find( counters, 'pydvid_requests_total', endpoint='keyvalue', method='GET', status='503' )['value'] == 2
+        assert _find( counters, 'pydvid_requests_total', endpoint='keyvalue', method='GET', status='200' )['value'] == 1
+        assert _find( counters, 'pydvid_request_retries_total', endpoint='keyvalue', method='GET' )['value'] == 2
@@ -0,0 +1,136 @@
+import os
+import time
+import shutil
+import tempfile
+
+import numpy
+
+from pydvid import keyvalue, voxels, hooks, node_cache
+from pydvid.node_cache import NodeCache
+from pydvid.dvid_connection import DvidConnection
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class RequestCounter(hooks.RequestHook):
+    def __init__(self):
+        self.urls = []
+
+    def request_started(self, timing):
+        self.urls.append( timing.url )
+
+    def count(self, fragment):
+        return len( [ url for url in self.urls if fragment in url ] )
+
+class TestNodeCacheEntries(object):
+
+    def test_lru(self):
+        cache = NodeCache( max_bytes=100 )
+        instance = ('localhost', 8000, 'abc', 'data')
+        cache.put( 'a', instance, 'x'*40, locked=True )
+        cache.put( 'b', instance, 'y'*40, locked=True )
+        assert cache.get( 'a' ) == (True, 'x'*40) # Now 'b' is the least recently used
+        cache.put( 'c', instance, 'z'*40, locked=True )
+        assert cache.get( 'b' ) == (False, None)
+        assert cache.get( 'a' )[0] and cache.get( 'c' )[0]
+        assert cache.stats['bytes'] == 80
+
+        # Too large to cache at all
+        cache.put( 'd', instance, 'w'*101, locked=True )
+        assert cache.get( 'd' ) == (False, None)
+
+        cache.invalidate( instance )
+        assert cache.stats['entries'] == 0 and cache.stats['bytes'] == 0
+
+    def test_expiration(self):
+        cache = NodeCache( unlocked_ttl=0.05 )
+        instance = ('localhost', 8000, 'abc', 'data')
+        cache.put( 'locked', instance, 'value', locked=True )
+        cache.put( 'unlocked', instance, 'value', locked=False )
+        assert cache.get( 'unlocked' )[0]
+        time.sleep( 0.1 )
+        assert cache.get( 'unlocked' ) == (False, None)
+        assert cache.get( 'locked' ) == (True, 'value')
+
+        cache = NodeCache( unlocked_ttl=0 )
+        cache.put( 'unlocked', instance, 'value', locked=False )
+        assert cache.get( 'unlocked' ) == (False, None)
+
+class TestNodeCache(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_name = "my_volume"
+        cls.keyvalue_name = "my_keyvalue"
+        cls.original_data = numpy.random.randint( 0, 1000, (1,10,20,30) ).astype( numpy.uint32 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( cls.original_data.shape, numpy.uint32, "cxyz", 1.0, "" )
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_volume( "datasetA", cls.data_name, cls.original_data, metadata )
+            test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+            test_h5file.add_node( "datasetA", "abc01", locked=True )
+            test_h5file.add_node( "datasetA", "abc02" )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def setUp(self):
+        self.counter = RequestCounter()
+        self.connection = DvidConnection( "localhost:8000", concurrency_limiter=False )
+        hooks.add_hook( self.counter, connection=self.connection )
+
+    def tearDown(self):
+        node_cache.disable()
+        hooks.remove_hook( self.counter, connection=self.connection )
+        self.connection.close()
+
+    def test_locked_node(self):
+        cache = node_cache.enable( unlocked_ttl=0 )
+        for _ in range(3):
+            dvid_vol = voxels.VoxelsAccessor( self.connection, "abc01", self.data_name )
+            data = dvid_vol[:, 0:5, 0:10, 0:15]
+            assert (data == self.original_data[:, 0:5, 0:10, 0:15]).all()
+            data[:] = 0 # Callers get their own copy
+        assert self.counter.count( "/metadata" ) == 1
+        assert self.counter.count( "/raw/" ) == 1
+        assert self.counter.count( "/api/repos/info" ) == 0 # The cache has its own connection for that.
+        assert cache.stats['hits'] == 4
+        assert cache.stats['locked_nodes'] == 1
+
+        # Other subvolumes and axis orders are separate results.
+        assert (dvid_vol.get_ndarray( (0,0,0,0), (1,5,10,15), axis_order='czyx' ) ==
+                self.original_data[:, 0:5, 0:10, 0:15].transpose(0,3,2,1)).all()
+        assert self.counter.count( "/raw/" ) == 2
+
+    def test_unlocked_node(self):
+        node_cache.enable( unlocked_ttl=0 )
+        for _ in range(2):
+            voxels.get_metadata( self.connection, "abc02", self.data_name )
+        assert self.counter.count( "/metadata" ) == 2
+
+        node_cache.enable( unlocked_ttl=60.0 )
+        keyvalue.put_value( self.connection, "abc02", self.keyvalue_name, "key", "value1" )
+        for _ in range(2):
+            assert keyvalue.get_value( self.connection, "abc02", self.keyvalue_name, "key" ) == "value1"
+        assert self.counter.count( "/key" ) == 2 # 1 put, 1 get
+
+        # Writes invalidate the cached results
+        keyvalue.put_value( self.connection, "abc02", self.keyvalue_name, "key", "value2" )
+        assert keyvalue.get_value( self.connection, "abc02", self.keyvalue_name, "key" ) == "value2"
+
+    def test_disabled(self):
+        for _ in range(2):
+            voxels.get_metadata( self.connection, "abc01", self.data_name )
+        assert self.counter.count( "/metadata" ) == 2
@@ -0,0 +1,100 @@
+import io
+import time
+import cStringIO
+import threading
+
+import numpy
+
+from pydvid.rate_limiter import TokenBucket, RateLimiter
+from pydvid.voxels import VoxelsNddataCodec
+
+class RecordingStream(object):
+    """
+    A stream that records the size of each read, with a rate_limiter attribute for the codec to use.
+    """
+    def __init__(self, data, rate_limiter):
+        self._stream = cStringIO.StringIO( data )
+        self.rate_limiter = rate_limiter
+        self.read_sizes = []
+
+    def read(self, nbytes):
+        self.read_sizes.append( nbytes )
+        return self._stream.read( nbytes )
+
+class TestTokenBucket(object):
+
+    def test_rate(self):
+        bucket = TokenBucket( rate=1000, capacity=100 )
+
+        # The initial burst is free
+        assert bucket.consume( 100 ) == 0.0
+
+        start_time = time.time()
+        for _ in range(10):
+            bucket.consume( 20 )
+        elapsed = time.time() - start_time
+        assert 0.18 <= elapsed < 0.4, elapsed
+
+    def test_shared_by_threads(self):
+        bucket = TokenBucket( rate=1000, capacity=10 )
+        bucket.consume( 10 )
+        def consume():
+            for _ in range(5):
+                bucket.consume( 10 )
+        threads = [ threading.Thread( target=consume ) for _ in range(4) ]
+        start_time = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start_time
+        assert 0.18 <= elapsed < 0.4, elapsed
+
+class TestRateLimiter(object):
+
+    def test_request_rate(self):
+        limiter = RateLimiter( requests_per_second=100, burst_seconds=0.01 )
+        assert limiter.max_chunk_size is None
+        start_time = time.time()
+        for _ in range(21):
+            limiter.throttle_request()
+        elapsed = time.time() - start_time
+        assert 0.18 <= elapsed < 0.4, elapsed
+
+    def test_paced_decode(self):
+        data = numpy.random.randint( 0, 255, (1,100,100,20) ).astype( numpy.uint8 )
+        limiter = RateLimiter( bytes_per_second=1e6, burst_seconds=0.01 )
+        assert limiter.max_chunk_size == 10000
+
+        stream = RecordingStream( data.tostring(order='F'), limiter )
+        start_time = time.time()
+        decoded = VoxelsNddataCodec( data.dtype ).decode_to_ndarray( stream, data.shape )
+        elapsed = time.time() - start_time
+        assert (decoded == data).all()
+        assert max( stream.read_sizes ) <= limiter.max_chunk_size
+
+        # 200 kB at 1 MB/s
+        assert 0.18 <= elapsed < 0.4, elapsed
+
+    def test_paced_encode(self):
+        data = numpy.random.randint( 0, 255, (1,100,100,20) ).astype( numpy.uint8 )
+        limiter = RateLimiter( bytes_per_second=1e6, burst_seconds=0.01 )
+        codec = VoxelsNddataCodec( data.dtype )
+
+        output = io.BytesIO()
+        output.rate_limiter = limiter
+        start_time = time.time()
+        codec.encode_from_ndarray( output, data )
+        elapsed = time.time() - start_time
+        assert output.getvalue() == data.tostring(order='F')
+        assert 0.18 <= elapsed < 0.4, elapsed
+
+        # Encoded streams (e.g. request bodies) can be paced, too.
+        stream = codec.create_encoded_stream_from_ndarray( data )
+        stream.rate_limiter = RateLimiter( bytes_per_second=1e6, burst_seconds=0.01 )
+        assert len(stream) == data.nbytes
+        start_time = time.time()
+        while stream.read( 8192 ):
+            pass
+        elapsed = time.time() - start_time
+        assert 0.18 <= elapsed < 0.4, elapsed
@@ -0,0 +1,159 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+from pydvid import keyvalue, voxels
+from pydvid.replicated_connection import ReplicatedDvidConnection
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile, H5CutoutRequestHandler
+
+class TestReplicatedDvidConnection(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start two mock servers (a primary and a replica) with identical data
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_volume"
+        cls.keyvalue_name = "my_keyvalue"
+        cls.original_data = numpy.random.randint( 0, 1000, (1,10,20,30) ).astype( numpy.uint32 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( cls.original_data.shape, numpy.uint32, "cxyz", 1.0, "" )
+
+        cls.hostnames = [ "localhost:8000", "localhost:8001" ]
+        cls.servers = {}
+        cls.server_threads = {}
+        for hostname in cls.hostnames:
+            test_filepath = os.path.join( cls._tmp_dir, "test_data_{}.h5".format( hostname.split(':')[1] ) )
+            with H5MockServerDataFile( test_filepath ) as test_h5file:
+                test_h5file.add_volume( "datasetA", cls.data_name, cls.original_data, metadata )
+                test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+                test_h5file.add_node( "datasetA", cls.data_uuid )
+            cls._start_server( hostname, test_filepath )
+
+    @classmethod
+    def _start_server(cls, hostname, test_filepath):
+        server = H5MockServer( test_filepath, True, ("localhost", int(hostname.split(':')[1])), H5CutoutRequestHandler )
+        cls.servers[hostname] = server
+        cls.server_threads[hostname] = threading.Thread( target=server.serve_forever )
+        cls.server_threads[hostname].start()
+
+    @classmethod
+    def _stop_server(cls, hostname):
+        server = cls.servers.pop( hostname )
+        server.shutdown()
+        server.shutdown_completed_event.wait()
+        cls.server_threads.pop( hostname ).join()
+        return server.h5filepath
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        for hostname in list(cls.servers.keys()):
+            cls._stop_server( hostname )
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_reads_and_writes(self):
+        connection = ReplicatedDvidConnection( self.hostnames, health_check_interval=None, concurrency_limiter=False )
+        try:
+            dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+            for _ in range(20):
+                assert (dvid_vol[:, 0:5, 0:5, 0:5] == self.original_data[:, 0:5, 0:5, 0:5]).all()
+            stats = connection.stats
+            assert stats["localhost:8000"]['primary']
+            assert not stats["localhost:8001"]['primary']
+
+            # Reads are spread across both servers
+            assert stats["localhost:8000"]['requests'] > 0
+            assert stats["localhost:8001"]['requests'] > 0
+
+            # Writes go to the primary only
+            replica_requests = stats["localhost:8001"]['requests']
+            for i in range(5):
+                keyvalue.put_value( connection, self.data_uuid, self.keyvalue_name, "key", "value{}".format(i) )
+            stats = connection.stats
+            assert stats["localhost:8001"]['requests'] == replica_requests
+            assert stats["localhost:8000"]['healthy'] and stats["localhost:8001"]['healthy']
+        finally:
+            connection.close()
+
+    def test_read_from_primary(self):
+        connection = ReplicatedDvidConnection( self.hostnames, primary="localhost:8001", read_from_primary=False,
+                                               health_check_interval=None, concurrency_limiter=False )
+        try:
+            dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+            for _ in range(5):
+                dvid_vol[:, 0:5, 0:5, 0:5]
+            stats = connection.stats
+            assert stats["localhost:8001"]['primary']
+            assert stats["localhost:8001"]['requests'] == 0
+            assert stats["localhost:8000"]['requests'] == 6
+        finally:
+            connection.close()
+
+    def test_avoid_hostnames(self):
+        connection = ReplicatedDvidConnection( self.hostnames, health_check_interval=None, concurrency_limiter=False )
+        try:
+            for _ in range(10):
+                connection.request( "GET", "/api/server/info", avoid_hostnames=["localhost:8000"] )
+                assert connection.current_hostname == "localhost:8001"
+                connection.getresponse().read()
+
+            # If every server is to be avoided, one of them is used anyway.
+            connection.request( "GET", "/api/server/info", avoid_hostnames=self.hostnames )
+            assert connection.current_hostname in self.hostnames
+            connection.getresponse().read()
+        finally:
+            connection.close()
+
+    def test_health_checks(self):
+        connection = ReplicatedDvidConnection( self.hostnames, health_check_interval=None, concurrency_limiter=False )
+        try:
+            assert connection.check_health() == self.hostnames
+
+            # Take the replica down.
+            test_filepath = self._stop_server( "localhost:8001" )
+            assert connection.check_health() == ["localhost:8000"]
+            assert not connection.stats["localhost:8001"]['healthy']
+
+            # All reads go to the primary.
+            dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+            for _ in range(10):
+                assert (dvid_vol[:, 0:5, 0:5, 0:5] == self.original_data[:, 0:5, 0:5, 0:5]).all()
+            assert connection.stats["localhost:8001"]['requests'] == 0
+
+            # Bring it back.
+            self._start_server( "localhost:8001", test_filepath )
+            assert connection.check_health() == self.hostnames
+        finally:
+            connection.close()
+
+    def test_background_health_checks(self):
+        connection = ReplicatedDvidConnection( self.hostnames, health_check_interval=0.05, concurrency_limiter=False )
+        try:
+            test_filepath = self._stop_server( "localhost:8001" )
+            try:
+                # A failed request ejects the server right away.
+                # (The request is repeated on the primary.)
+                dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+                for _ in range(10):
+                    assert (dvid_vol[:, 0:5, 0:5, 0:5] == self.original_data[:, 0:5, 0:5, 0:5]).all()
+                assert connection.healthy_hostnames == ["localhost:8000"]
+            finally:
+                self._start_server( "localhost:8001", test_filepath )
+
+            # The background check readmits it.
+            deadline = time.time() + 2.0
+            while connection.healthy_hostnames != self.hostnames and time.time() < deadline:
+                time.sleep( 0.01 )
+            assert connection.healthy_hostnames == self.hostnames
+        finally:
+            connection.close()
@@ -0,0 +1,138 @@
+import gc
+import os
+import time
+import json
+import shutil
+import httplib
+import weakref
+import tempfile
+
+import numpy
+
+from pydvid import voxels
+from pydvid.general import RepoCatalog, get_repo_catalog
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
+
+class TestRepoCatalog(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        data = numpy.zeros( (1,10,20,30), dtype=numpy.uint8 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( data.shape, data.dtype, "cxyz", 1.0, "" )
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_volume( "datasetA", "grayscale", data, metadata )
+            test_h5file.add_keyvalue_group( "datasetA", "annotations" )
+            test_h5file.add_node( "datasetA", "abc01", locked=True )
+            test_h5file.add_node( "datasetA", "abc02" )
+            test_h5file.add_node( "datasetA", "abd03" )
+            test_h5file.add_node( "datasetB", "fed01" )
+        cls.server_proc, cls.shutdown_event = H5MockServer.create_and_start( cls.test_filepath, "localhost", 8000,
+                                                                             same_process=False, disable_server_logging=True )
+        cls.client_connection = httplib.HTTPConnection( "localhost:8000" )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.shutdown_event.set()
+        cls.server_proc.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_queries(self):
+        catalog = RepoCatalog( self.client_connection )
+        assert catalog.age is None
+        assert catalog.repo_uuid( "abc02" ) == catalog.repo_uuid( "abd03" )
+        assert catalog.repo_uuid( "abc02" ) != catalog.repo_uuid( "fed01" )
+        assert catalog.age is not None
+        assert len( catalog.repo_uuids() ) == 2
+        assert catalog.root( "abd03" ) == "abc01"
+        assert catalog.nodes( "abc01" ) == ["abc01", "abc02", "abd03"]
+        assert catalog.repo_info( "abc01" )["Alias"] == "datasetA"
+        assert catalog.node_info( "abc02" )["UUID"] == "abc02"
+
+        # The mock server's DAG is a chain of the alphabetized uuids
+        assert catalog.parents( "abc02" ) == ("abc01",)
+        assert catalog.children( "abc02" ) == ("abd03",)
+        assert catalog.ancestors( "abd03" ) == ["abc02", "abc01"]
+        assert catalog.is_ancestor( "abc01", "abd03" )
+        assert not catalog.is_ancestor( "abd03", "abc01" )
+
+        assert catalog.is_locked( "abc01" )
+        assert not catalog.is_locked( "abc02" )
+
+        assert catalog.data_instances( "abc01" ) == { "grayscale" : "grayscale8", "annotations" : "keyvalue" }
+        assert catalog.instance_type( "abc01", "annotations" ) == "keyvalue"
+        assert catalog.data_instances( "fed01" ) == {}
+
+    def test_uuid_prefixes(self):
+        catalog = RepoCatalog( self.client_connection )
+        assert catalog.resolve_uuid( "abd" ) == "abd03"
+        assert "abd" in catalog
+        assert "abc" not in catalog # ambiguous
+        assert "0123" not in catalog
+        try:
+            catalog.resolve_uuid( "abc" )
+        except RepoCatalog.UnknownNodeError:
+            pass
+        else:
+            assert False, "Expected UnknownNodeError"
+
+    def test_refresh(self):
+        catalog = RepoCatalog( self.client_connection, ttl=None )
+        catalog.refresh()
+        repo_uuid = catalog.repo_uuid( "fed01" )
+        assert not catalog.is_locked( "fed01" )
+        unchanged_repo_index = catalog._index.repos[ catalog.repo_uuid( "abc01" ) ]
+
+        self.client_connection.request( "POST", "/api/node/fed01/commit", body=json.dumps( { "note" : "Done" } ) )
+        response = self.client_connection.getresponse()
+        response.read()
+        assert response.status == httplib.OK
+
+        # Not refreshed yet
+        assert not catalog.is_locked( "fed01" )
+        catalog.refresh()
+        assert catalog.is_locked( "fed01" )
+        assert catalog.repo_uuid( "fed01" ) == repo_uuid
+
+        # The other repo's index was reused
+        assert catalog._index.repos[ catalog.repo_uuid( "abc01" ) ] is unchanged_repo_index
+
+    def test_ttl(self):
+        catalog = RepoCatalog( self.client_connection, ttl=0.1 )
+        catalog.root( "abc01" )
+        index = catalog._index
+        catalog.root( "abc01" )
+        assert catalog._index is index
+        time.sleep( 0.2 )
+        catalog.root( "abc01" )
+        assert catalog._index is not index
+
+    def test_refresh_on_miss(self):
+        catalog = RepoCatalog( self.client_connection, ttl=None, min_refresh_interval=0.0 )
+        catalog.refresh( repos_info={} )
+        assert catalog.repo_uuids() == []
+
+        # An unknown node triggers a refresh.
+        assert catalog.root( "abc02" ) == "abc01"
+
+    def test_shared_catalog(self):
+        assert get_repo_catalog( self.client_connection ) is get_repo_catalog( self.client_connection )
+        assert get_repo_catalog( self.client_connection ).instance_type( "abc01", "grayscale" ) == "grayscale8"
+
+        # The shared catalog goes away with its connection.
+        connection = httplib.HTTPConnection( "localhost:8000" )
+        catalog = weakref.ref( get_repo_catalog( connection ) )
+        assert catalog().repo_uuids()
+        connection.close()
+        del connection
+        gc.collect()
+        assert catalog() is None
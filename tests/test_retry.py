@@ -0,0 +1,285 @@
+import os
+import time
+import socket
+import shutil
+import httplib
+import tempfile
+import threading
+import email.utils
+
+import numpy
+
+from pydvid import general, keyvalue, voxels
+from pydvid.errors import DvidHttpError
+from pydvid.retry import RetryPolicy, CircuitBreaker, get_retry_after
+from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile, H5CutoutRequestHandler
+
+def _busy_error( headers=None ):
+    return DvidHttpError( "test request", httplib.SERVICE_UNAVAILABLE, "busy", "", "GET", "/", response_headers=headers )
+
+class FailingRequest(object):
+    """
+    A fake request function, which raises the given exceptions (in order) and then succeeds.
+    """
+    def __init__(self, *exceptions):
+        self.exceptions = list(exceptions)
+        self.calls = 0
+
+    def __call__(self, connection):
+        self.calls += 1
+        if self.exceptions:
+            raise self.exceptions.pop(0)
+        return "success"
+
+class TestRetryPolicy(object):
+
+    def test_compute_delay(self):
+        policy = RetryPolicy( base_delay=0.1, max_delay=1.0 )
+        for attempt, upper_bound in [(1, 0.1), (2, 0.2), (3, 0.4), (5, 1.0), (100, 1.0)]:
+            delays = [ policy.compute_delay( attempt ) for _ in range(100) ]
+            assert 0 <= min(delays) and max(delays) <= upper_bound
+
+            # Full jitter: the delays are spread over the whole range
+            assert max(delays) - min(delays) > upper_bound / 2
+
+        # Retry-After is a lower bound
+        assert policy.compute_delay( 1, retry_after=5.0 ) == 5.0
+
+    def test_get_retry_after(self):
+        assert get_retry_after( [] ) is None
+        assert get_retry_after( [('content-type', 'text/plain')] ) is None
+        assert get_retry_after( [('retry-after', '3')] ) == 3.0
+        assert get_retry_after( {'Retry-After' : '1.5'} ) == 1.5
+        assert get_retry_after( [('retry-after', 'garbage')] ) is None
+
+        http_date = email.utils.formatdate( time.time() + 10, usegmt=True )
+        assert 8.0 < get_retry_after( [('retry-after', http_date)] ) <= 10.0
+
+    def test_retries(self):
+        policy = RetryPolicy( base_delay=0.001, circuit_breaker=False )
+        request = FailingRequest( _busy_error(), _busy_error(), socket.error("Connection reset by peer") )
+        assert policy.call( request, None ) == "success"
+        assert request.calls == 4
+
+    def test_not_retried(self):
+        policy = RetryPolicy( base_delay=0.001, circuit_breaker=False )
+        not_found = DvidHttpError( "test request", httplib.NOT_FOUND, "not found", "", "GET", "/" )
+        request = FailingRequest( not_found )
+        try:
+            policy.call( request, None )
+        except DvidHttpError as ex:
+            assert ex is not_found
+        else:
+            assert False, "Expected DvidHttpError"
+        assert request.calls == 1
+
+    def test_socket_timeout_not_retried(self):
+        policy = RetryPolicy( base_delay=0.001, circuit_breaker=False )
+        request = FailingRequest( socket.timeout("timed out") )
+        try:
+            policy.call( request, None )
+        except socket.timeout:
+            pass
+        else:
+            assert False, "Expected socket.timeout"
+        assert request.calls == 1
+
+    def test_deadline_passes_during_delay(self):
+        # If the deadline passes just before the sleep, the (negative) remaining time isn't passed to time.sleep()
+        class SlowDelayPolicy(RetryPolicy):
+            def compute_delay(self, attempt, retry_after=None):
+                time.sleep( 0.1 )
+                return 1.0
+        policy = SlowDelayPolicy( timeout=0.05, circuit_breaker=False )
+        request = FailingRequest( _busy_error(), _busy_error() )
+        try:
+            policy.call( request, None )
+        except RetryPolicy.RetryTimeoutError:
+            pass
+        else:
+            assert False, "Expected RetryTimeoutError"
+        assert request.calls == 2
+
+    def test_timeout(self):
+        # Retries disabled
+        policy = RetryPolicy( timeout=0, circuit_breaker=False )
+        request = FailingRequest( _busy_error() )
+        try:
+            policy.call( request, None )
+        except RetryPolicy.RetryTimeoutError:
+            pass
+        else:
+            assert False, "Expected RetryTimeoutError"
+        assert request.calls == 1
+
+        # Retry-After is honoured, but not beyond the timeout
+        policy = RetryPolicy( timeout=0.3, circuit_breaker=False )
+        request = FailingRequest( *[ _busy_error( [('retry-after', '0.2')] ) ]*10 )
+        start_time = time.time()
+        try:
+            policy.call( request, None )
+        except RetryPolicy.RetryTimeoutError:
+            pass
+        else:
+            assert False, "Expected RetryTimeoutError"
+        assert 0.3 <= time.time() - start_time < 1.0
+        assert request.calls == 3
+
+    def test_connection_errors(self):
+        policy = RetryPolicy( base_delay=0.001, max_connection_attempts=3, circuit_breaker=False )
+        request = FailingRequest( *[ httplib.BadStatusLine("") ]*5 )
+        try:
+            policy.call( request, None )
+        except httplib.BadStatusLine:
+            pass
+        else:
+            assert False, "Expected the original exception"
+        assert request.calls == 3
+
+    def test_nested_calls(self):
+        """
+        Only the outermost call repeats failed requests.
+        """
+        policy = RetryPolicy( base_delay=0.001, circuit_breaker=False )
+        inner_request = FailingRequest( _busy_error(), _busy_error() )
+        outer_calls = []
+        def outer_request( connection ):
+            outer_calls.append( connection )
+            return policy.call( inner_request, connection )
+        assert policy.call( outer_request, None ) == "success"
+        assert inner_request.calls == 3
+        assert len(outer_calls) == 3
+
+class TestCircuitBreaker(object):
+
+    def test_transitions(self):
+        breaker = CircuitBreaker( "testhost", failure_threshold=3, reset_timeout=0.2 )
+        for _ in range(2):
+            assert breaker.acquire() == 0
+            breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert 0.1 < breaker.acquire() <= 0.3
+
+        # After the reset timeout, a single probe is allowed through.
+        time.sleep( 0.2 )
+        assert breaker.acquire() == 0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.acquire() > 0
+
+        # The probe failed: open again.
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        time.sleep( 0.3 )
+        assert breaker.acquire() == 0
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.acquire() == 0
+
+    def test_policy_waits_for_breaker(self):
+        breaker = CircuitBreaker( "testhost", failure_threshold=2, reset_timeout=0.2 )
+        policy = RetryPolicy( base_delay=0.001, circuit_breaker=breaker )
+        request = FailingRequest( _busy_error(), _busy_error() )
+        start_time = time.time()
+        assert policy.call( request, None ) == "success"
+        assert time.time() - start_time >= 0.2
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        # If the breaker won't close before the timeout, give up right away.
+        breaker.record_failure()
+        breaker.record_failure()
+        policy = RetryPolicy( timeout=0.1, circuit_breaker=breaker )
+        request = FailingRequest()
+        try:
+            policy.call( request, None )
+        except RetryPolicy.RetryTimeoutError:
+            pass
+        else:
+            assert False, "Expected RetryTimeoutError"
+        assert request.calls == 0
+
+class TestRetryWithServer(object):
+
+    @classmethod
+    def setupClass(cls):
+        """
+        Override.  Called by nosetests.
+        - Create an hdf5 file to store the test data
+        - Start the mock server (in this process, so we can tell it to be busy)
+        """
+        cls._tmp_dir = tempfile.mkdtemp()
+        cls.test_filepath = os.path.join( cls._tmp_dir, "test_data.h5" )
+        cls.data_uuid = "abcde"
+        cls.data_name = "my_volume"
+        cls.keyvalue_name = "my_keyvalue"
+        volume = numpy.zeros( (1,10,20,30), dtype=numpy.uint32 )
+        metadata = voxels.VoxelsMetadata.create_default_metadata( volume.shape, volume.dtype, "cxyz", 1.0, "" )
+        with H5MockServerDataFile( cls.test_filepath ) as test_h5file:
+            test_h5file.add_volume( "datasetA", cls.data_name, volume, metadata )
+            test_h5file.add_keyvalue_group( "datasetA", cls.keyvalue_name )
+            test_h5file.add_node( "datasetA", cls.data_uuid )
+
+        cls.server = H5MockServer( cls.test_filepath, True, ("localhost", 8000), H5CutoutRequestHandler )
+        cls.server_thread = threading.Thread( target=cls.server.serve_forever )
+        cls.server_thread.start()
+        cls.client_connection = httplib.HTTPConnection( "localhost:8000" )
+        keyvalue.put_value( cls.client_connection, cls.data_uuid, cls.keyvalue_name, "key", "value" )
+
+    @classmethod
+    def teardownClass(cls):
+        """
+        Override.  Called by nosetests.
+        """
+        cls.server.shutdown()
+        cls.server.shutdown_completed_event.wait()
+        cls.server_thread.join()
+        shutil.rmtree(cls._tmp_dir)
+
+    def test_busy(self):
+        self.server.busy_count = 3
+        assert keyvalue.get_value( self.client_connection, self.data_uuid, self.keyvalue_name, "key" ) == "value"
+        assert self.server.busy_count == 0
+
+        self.server.busy_count = 2
+        keyvalue.put_value( self.client_connection, self.data_uuid, self.keyvalue_name, "key", "value2" )
+        assert self.server.busy_count == 0
+        assert keyvalue.get_value( self.client_connection, self.data_uuid, self.keyvalue_name, "key" ) == "value2"
+
+    def test_retry_after(self):
+        self.server.busy_count = 1
+        self.server.busy_retry_after = 1
+        try:
+            start_time = time.time()
+            general.get_server_info( self.client_connection )
+            assert time.time() - start_time >= 1.0
+        finally:
+            self.server.busy_retry_after = None
+
+    def test_connection_reset(self):
+        self.server.reset_count = 2
+        server_info = general.get_server_info( self.client_connection )
+        assert "DVID datastore" in server_info
+        assert self.server.reset_count == 0
+
+    def test_voxels_accessor(self):
+        self.server.busy_count = 1
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name )
+        self.server.busy_count = 2
+        dvid_vol.post_ndarray( (0,0,0,0), (1,5,5,5), numpy.ones( (1,5,5,5), dtype=numpy.uint32 ) )
+        self.server.busy_count = 2
+        assert (dvid_vol[:,0:5,0:5,0:5] == 1).all()
+
+        # Retries disabled
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name, retry_timeout=0.0 )
+        self.server.busy_count = 1
+        try:
+            dvid_vol.get_ndarray( (0,0,0,0), (1,5,5,5) )
+        except voxels.VoxelsAccessor.ThrottleTimeoutException:
+            pass
+        else:
+            assert False, "Expected ThrottleTimeoutException"
+        finally:
+            self.server.busy_count = 0
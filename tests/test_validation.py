@@ -0,0 +1,90 @@
+import os
+import sys
+import subprocess
+
+import jsonschema
+
+import pydvid
+from pydvid.util import get_schema, get_validator, validate_json, set_validation_level, get_validation_level
+from pydvid.voxels import VoxelsMetadata
+
+SERVER_INFO_SCHEMA = 'dvid-server-info-v0.01.schema.json'
+
+class TestValidation(object):
+
+    def setUp(self):
+        self._original_level = get_validation_level()
+
+    def tearDown(self):
+        set_validation_level( *self._original_level )
+
+    def _check_rejected(self, instance, schema, validation=None):
+        try:
+            validate_json( instance, schema, validation )
+        except jsonschema.ValidationError:
+            pass
+        else:
+            assert False, "Expected a ValidationError"
+
+    def test_cache(self):
+        assert get_schema( SERVER_INFO_SCHEMA ) is get_schema( SERVER_INFO_SCHEMA )
+        assert get_schema( SERVER_INFO_SCHEMA ) == pydvid.util.parse_schema( SERVER_INFO_SCHEMA )
+        assert get_validator( SERVER_INFO_SCHEMA ) is get_validator( SERVER_INFO_SCHEMA )
+
+        # Validators for dict schemas aren't kept.
+        num_validators = len( pydvid.util._validators )
+        schema = { "type" : "object" }
+        assert get_validator( schema ) is not get_validator( schema )
+        assert len( pydvid.util._validators ) == num_validators
+        validate_json( {}, schema )
+        self._check_rejected( [], schema )
+
+    def test_levels(self):
+        set_validation_level( 'strict' )
+        self._check_rejected( "not an object", SERVER_INFO_SCHEMA )
+
+        # Per-call level overrides the global level
+        validate_json( "not an object", SERVER_INFO_SCHEMA, validation='off' )
+        set_validation_level( 'off' )
+        validate_json( "not an object", SERVER_INFO_SCHEMA )
+        self._check_rejected( "not an object", SERVER_INFO_SCHEMA, validation='strict' )
+
+    def test_sampled(self):
+        set_validation_level( 'sampled', sample_rate=0.0 )
+        validate_json( "not an object", SERVER_INFO_SCHEMA )
+        set_validation_level( 'sampled', sample_rate=1.0 )
+        self._check_rejected( "not an object", SERVER_INFO_SCHEMA )
+
+        set_validation_level( 'sampled', sample_rate=0.5 )
+        rejected = 0
+        for _ in range(1000):
+            try:
+                validate_json( "not an object", SERVER_INFO_SCHEMA )
+            except jsonschema.ValidationError:
+                rejected += 1
+        assert 300 < rejected < 700
+
+    def test_invalid_environment_level(self):
+        # (Checked with -O, so it can't be an assert.)
+        environment = dict( os.environ, PYDVID_VALIDATION="lenient",
+                            PYTHONPATH=os.path.dirname( os.path.dirname( os.path.abspath( pydvid.__file__ ) ) ) )
+        process = subprocess.Popen( [ sys.executable, "-O", "-c", "import pydvid.util" ],
+                                    env=environment, stderr=subprocess.PIPE )
+        _, stderr = process.communicate()
+        assert process.returncode != 0
+        assert "ValueError: Invalid PYDVID_VALIDATION level: lenient" in stderr
+
+    def test_voxels_metadata(self):
+        metadata = { "Axes" : [ { "Label" : "X", "Resolution" : 1.0, "Units" : "nm", "Size" : 10, "Offset" : 0 } ],
+                     "Properties" : { "Values" : [ { "DataType" : "uint8", "Label" : "" } ] } }
+        invalid_metadata = dict( metadata )
+        invalid_metadata["Axes"] = "not a list of axes"
+        try:
+            VoxelsMetadata( invalid_metadata, validation='strict' )
+        except jsonschema.ValidationError:
+            pass
+        else:
+            assert False, "Expected a ValidationError"
+
+        set_validation_level( 'off' )
+        assert VoxelsMetadata( metadata ).shape == (1, 10)
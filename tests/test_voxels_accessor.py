@@ -2,11 +2,14 @@ import os
 import shutil
 import tempfile
 import httplib
+import threading
 
 import numpy
 import h5py
+import concurrent.futures
 
 from pydvid import voxels
+from pydvid.dvid_connection import DvidConnection, get_shared_executor
 from mockserver.h5mockserver import H5MockServer, H5MockServerDataFile
 
 class TestVoxelsAccessor(object):
@@ -100,6 +103,171 @@ class TestVoxelsAccessor(object):
         # Compare to file
         self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, start, stop, subvolume)
 
+    def test_get_ndarray_out_dtype(self):
+        """
+        Get some data from the server, converted to a different dtype.
+        """
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name, 
+                                          out_dtype=numpy.uint8, check_overflow=True )
+        subvolume = dvid_vol.get_ndarray( start, stop )
+        assert subvolume.dtype == numpy.uint8
+         
+        stored_data = self._get_subvolume_from_file(self.test_filepath, self.data_uuid, self.data_name, start, stop)
+        assert (subvolume == stored_data).all()
+
+        # Per-call override
+        subvolume = dvid_vol.get_ndarray( start, stop, out_dtype=numpy.float32 )
+        assert subvolume.dtype == numpy.float32
+        assert (subvolume == stored_data).all()
+
+    def test_get_ndarray_axis_order(self):
+        """
+        Get some data from the server in C-order, with the axes reversed.
+        """
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name )
+        subvolume = dvid_vol.get_ndarray( start, stop, axis_order='ctzyx', order='C' )
+        assert subvolume.flags['C_CONTIGUOUS']
+         
+        stored_data = self._get_subvolume_from_file(self.test_filepath, self.data_uuid, self.data_name, start, stop)
+        assert subvolume.shape == stored_data.transpose(0,4,3,2,1).shape
+        assert (subvolume == stored_data.transpose(0,4,3,2,1)).all()
+
+    def test_post_ndarray_axis_order(self):
+        """
+        Post C-order data with the axes reversed, and verify that the server wrote it.
+        """
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        shape = numpy.subtract( stop, start )
+        subvolume = numpy.random.randint( 0,1000, shape ).astype( numpy.uint32 )
+        czyx_subvolume = numpy.ascontiguousarray( subvolume.transpose(0,4,3,2,1) )
+
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name )
+        dvid_vol.post_ndarray(start, stop, czyx_subvolume, axis_order='ctzyx')
+          
+        self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, start, stop, subvolume)        
+
+    def test_get_ndarray_small(self):
+        """
+        Get tiny subvolumes (via the small-request path), and compare them with the general path.
+        """
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name )
+        subvolumes = []
+        for start, stop in [ ((0,9,5,50,0), (4,10,6,51,1)), ((0,1,2,3,1), (4,3,4,5,3)) ]:
+            subvolume = dvid_vol.get_ndarray( numpy.array(start), numpy.array(stop) )
+            assert subvolume.flags['F_CONTIGUOUS'] and subvolume.flags['OWNDATA']
+            self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, start, stop, subvolume)
+            subvolumes.append( subvolume )
+
+        # Each result has its own memory (not the reused receive buffer)
+        self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, (0,9,5,50,0), (4,10,6,51,1), subvolumes[0])
+
+        small_request_max_bytes = voxels.voxels.SMALL_REQUEST_MAX_BYTES
+        voxels.voxels.SMALL_REQUEST_MAX_BYTES = 0
+        try:
+            subvolume = dvid_vol.get_ndarray( (0,1,2,3,1), (4,3,4,5,3) )
+        finally:
+            voxels.voxels.SMALL_REQUEST_MAX_BYTES = small_request_max_bytes
+        assert (subvolume == subvolumes[1]).all()
+
+    def test_subvolume_rest_uri(self):
+        """
+        The subvolume URI doesn't include the channel axis, and is the same for tuples and arrays.
+        """
+        uri = voxels.voxels._format_subvolume_rest_uri( "abc", "grayscale", "raw", (0,10,20,30), (1,11,22,33) )
+        assert uri == "/api/node/abc/grayscale/raw/0_1_2/1_2_3/10_20_30"
+        uri = voxels.voxels._format_subvolume_rest_uri( "abc", "grayscale", "raw", numpy.array((0,10,20,30)), numpy.array((1,11,22,33)),
+                                                        format="lz4", throttle=True )
+        assert uri == "/api/node/abc/grayscale/raw/0_1_2/1_2_3/10_20_30/lz4?throttle=on"
+
+        # Non-integer coordinates aren't truncated
+        try:
+            voxels.voxels._format_subvolume_rest_uri( "abc", "grayscale", "raw", (0,10,20,30.5), (1,11,22,33) )
+        except AssertionError:
+            pass
+        else:
+            assert False, "Expected AssertionError"
+
+    def test_get_ndarray_compressed(self):
+        """
+        Get some data from the server using each compressed transfer codec.
+        """
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        stored_data = self._get_subvolume_from_file(self.test_filepath, self.data_uuid, self.data_name, start, stop)
+        for compression in ['gzip', 'labelpalette']:
+            dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name, compression=compression )
+            subvolume = dvid_vol.get_ndarray( start, stop )
+            assert (subvolume == stored_data).all()
+
+    def test_post_ndarray_compressed(self):
+        """
+        Post data using each compressed transfer codec, and verify that the server wrote it.
+        """
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        shape = numpy.subtract( stop, start )
+        for compression in ['gzip', 'labelpalette']:
+            subvolume = numpy.random.randint( 0,10, shape ).astype( numpy.uint32 )
+            dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name, compression=compression )
+            dvid_vol.post_ndarray(start, stop, subvolume)
+            self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, start, stop, subvolume)
+
+    def test_get_ndarray_async(self):
+        """
+        Start several requests at once, and wait for all of them.
+        """
+        connection = DvidConnection( "localhost:8000", max_connections=3 )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        bounds = [ ((0,x,5,50,0), (4,x+1,20,150,3)) for x in range(8) ]
+        futures = [ dvid_vol.get_ndarray_async( start, stop ) for start, stop in bounds ]
+        subvolumes = voxels.wait_all( futures )
+        for (start, stop), subvolume in zip(bounds, subvolumes):
+            self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, start, stop, subvolume)
+        assert get_shared_executor( connection )._max_workers == 3
+        connection.close()
+
+    def test_getitem_setitem_async(self):
+        connection = DvidConnection( "localhost:8000" )
+        dvid_vol = voxels.VoxelsAccessor( connection, self.data_uuid, self.data_name )
+        new_data = numpy.random.randint( 0,1000, (4,2,15,100,3) ).astype( numpy.uint32 )
+        dvid_vol.setitem_async( numpy.s_[:,3:5,5:20,50:150,:], new_data ).result()
+        self._check_subvolume(self.test_filepath, self.data_uuid, self.data_name, (0,3,5,50,0), (4,5,20,150,3), new_data)
+
+        subvolume = dvid_vol.getitem_async( numpy.s_[1,3,5:20,50:150:2,:] ).result()
+        assert (subvolume == new_data[1,0,:,::2,:]).all()
+        connection.close()
+
+    def test_async_cancel_and_errors(self):
+        """
+        Requests that haven't started can be cancelled.
+        If one request fails, wait_all() cancels the rest.
+        """
+        # A plain HTTPConnection gets only one worker.
+        dvid_vol = voxels.VoxelsAccessor( self.client_connection, self.data_uuid, self.data_name )
+        executor = get_shared_executor( self.client_connection )
+        
+        # Occupy the worker, so the next requests must wait in the queue.
+        blocker = threading.Event()
+        executor.submit( blocker.wait )
+        start, stop = (0,9,5,50,0), (4,10,20,150,3)
+        cancelled = dvid_vol.get_ndarray_async( start, stop )
+        failing = dvid_vol.get_ndarray_async( (0,0,0,0,0), (1,1,1,1,1) ) # Invalid: doesn't include all channels
+        never_started = dvid_vol.get_ndarray_async( start, stop )
+        assert cancelled.cancel()
+        blocker.set()
+
+        try:
+            voxels.wait_all( [failing, never_started] )
+        except AssertionError:
+            pass
+        else:
+            assert False, "Expected the failing request to raise."
+        assert cancelled.cancelled()
+
+        # The last request may have started before it could be cancelled.
+        # Let it finish before other tests use the connection.
+        concurrent.futures.wait( [never_started] )
+
     def test_get_ndarray_throttled(self):
         """
         Get some data from the server and check it.
@@ -0,0 +1,109 @@
+import StringIO
+
+import numpy
+import nose
+
+from pydvid.errors import UnexpectedResponseError
+from pydvid.voxels.voxels_nddata_codec import get_codec_class, get_codec_class_for_mimetype
+from pydvid.voxels.voxels_compressed_codecs import CompressedVoxelsNddataCodec
+
+class TestVoxelsCompressedCodecs(object):
+
+    FORMAT_NAMES = ['gzip', 'lz4', 'zstd', 'labelpalette']
+
+    def test_roundtrip(self):
+        # Label-like data: few distinct values per block
+        data = numpy.random.randint(0,10, (1,100,200,30)).astype(numpy.uint64) + 2**40
+        for format_name in self.FORMAT_NAMES:
+            codec = self._create_codec( format_name, data.dtype )
+            body = codec.create_request_body(data)
+            assert len(body) < codec.calculate_buffer_len(data.shape) / 2, \
+                "{} didn't compress the data".format( format_name )
+
+            stream = StringIO.StringIO()
+            codec.encode_from_ndarray(stream, data)
+            assert stream.getvalue() == body
+            stream.seek(0)
+            roundtrip_data = codec.decode_to_ndarray(stream, data.shape)
+            self._assert_matching(roundtrip_data, data)
+
+            stream = codec.create_encoded_stream_from_ndarray(data)
+            roundtrip_data = codec.decode_to_ndarray(stream, data.shape)
+            self._assert_matching(roundtrip_data, data)
+
+    def test_roundtrip_c_order_out_dtype(self):
+        data = numpy.random.randint(0,255, (3,100,200)).astype(numpy.uint16)
+        c_data = numpy.ascontiguousarray( data.transpose() ).transpose()
+        for format_name in self.FORMAT_NAMES:
+            codec = self._create_codec( format_name, data.dtype )
+            # Use small chunks so blocks and reads don't line up with each other.
+            codec.STAGING_CHUNK_SIZE = 1000
+            codec.SEND_CHUNK_SIZE = 3000
+            stream = codec.create_encoded_stream_from_ndarray(c_data)
+            roundtrip_data = codec.decode_to_ndarray(stream, data.shape, out_dtype=numpy.uint8, check_overflow=True)
+            assert roundtrip_data.dtype == numpy.uint8
+            assert (roundtrip_data == data).all()
+
+    def test_labelpalette_small_reads(self):
+        # Each block arrives in many small pieces (and a truncated stream is an error).
+        from pydvid.voxels.voxels_compressed_codecs import _LabelPaletteCompressor, _LabelPaletteDecompressor
+        blocks = [ numpy.random.randint(0,300, 5000).astype(numpy.uint32) for _ in range(3) ]
+        compressor = _LabelPaletteCompressor( numpy.uint32 )
+        encoded = "".join( compressor.compress( block.tostring() ) for block in blocks )
+        decompressor = _LabelPaletteDecompressor( numpy.uint32 )
+        decoded = "".join( decompressor.decompress( encoded[i:i+7] ) for i in range(0, len(encoded), 7) )
+        assert decoded == "".join( block.tostring() for block in blocks )
+        assert decompressor.flush() == ""
+
+        decompressor = _LabelPaletteDecompressor( numpy.uint32 )
+        decompressor.decompress( encoded[:-1] )
+        nose.tools.assert_raises( Exception, decompressor.flush )
+
+    def test_labelpalette_invalid_indices(self):
+        from pydvid.voxels.voxels_compressed_codecs import _LabelPaletteDecompressor, _LABEL_PALETTE_HEADER
+        palette = numpy.array( [7], numpy.uint32 ).tostring()
+        index_out_of_range = _LABEL_PALETTE_HEADER.pack( 4, 1, 1 ) + palette + "\x00\x05\x00\x00"
+        empty_palette = _LABEL_PALETTE_HEADER.pack( 4, 0, 1 ) + "\x00\x00\x00\x00"
+        for encoded in (index_out_of_range, empty_palette):
+            decompressor = _LabelPaletteDecompressor( numpy.uint32 )
+            nose.tools.assert_raises( UnexpectedResponseError, decompressor.decompress, encoded )
+
+        # An empty block is fine, even with an empty palette.
+        assert _LabelPaletteDecompressor( numpy.uint32 ).decompress( _LABEL_PALETTE_HEADER.pack( 0, 0, 1 ) ) == ""
+
+    def test_excess_data(self):
+        data = numpy.random.randint(0,255, (3,100,200)).astype(numpy.uint8)
+        codec = get_codec_class('gzip')( data.dtype )
+        body = codec.create_request_body(data)
+        try:
+            codec.decode_to_ndarray( StringIO.StringIO(body), (3,100,199) )
+        except Exception as ex:
+            assert "longer than expected" in str(ex)
+        else:
+            assert False, "Expected an error due to excess data."
+
+    def test_mimetype_lookup(self):
+        for format_name in self.FORMAT_NAMES:
+            codec_class = get_codec_class(format_name)
+            assert issubclass( codec_class, CompressedVoxelsNddataCodec )
+            assert get_codec_class_for_mimetype( codec_class.VOLUME_MIMETYPE + "; charset=binary" ) is codec_class
+        assert get_codec_class_for_mimetype( "text/html" ) is None
+
+    def _create_codec(self, format_name, dtype):
+        try:
+            return get_codec_class(format_name)( dtype )
+        except ImportError as ex:
+            raise nose.SkipTest( str(ex) )
+
+    def _assert_matching(self, data, expected):
+        assert expected is not data
+        assert expected.dtype == data.dtype
+        assert expected.shape == data.shape
+        assert (expected == data).all(), "data didn't match"
+
+
+if __name__ == "__main__":
+    import sys
+    sys.argv.append("--nocapture")    # Don't steal stdout.  Show it on the console as usual.
+    sys.argv.append("--nologcapture") # Don't set the logging level to DEBUG.  Leave it alone.
+    nose.run(defaultTest=__file__)
@@ -1,6 +1,10 @@
+import copy
+import pickle
+
 import nose
 import numpy
 import h5py
+import jsonschema
 from pydvid.voxels import VoxelsMetadata
 
 class TestVolumeInfo( object ):
@@ -55,6 +59,37 @@ class TestVolumeInfo( object ):
         assert metadata['Axes'][1]["Resolution"] == 3.1
         assert metadata['Axes'][2]["Resolution"] == 40
     
+    def test_copy(self):
+        metadata = VoxelsMetadata(self.metadata_json)
+        for metadata_copy in ( metadata.copy(), copy.deepcopy( metadata ), VoxelsMetadata( metadata ),
+                               pickle.loads( pickle.dumps( metadata ) ) ):
+            assert isinstance( metadata_copy, VoxelsMetadata )
+            assert metadata_copy == metadata
+            assert metadata_copy.shape == metadata.shape
+            assert metadata_copy.axiskeys == metadata.axiskeys
+
+            # Copies are independent
+            metadata_copy.shape = (3, 10, 20, 30)
+            assert metadata_copy["Axes"][0]["Size"] == 10
+            assert metadata["Axes"][0]["Size"] == 100
+            assert metadata.shape == (3, 100, 200, 400)
+            assert metadata_copy.geometry.shape == (3, 10, 20, 30)
+
+        # The derived fields are shared, not recomputed
+        assert metadata.copy().geometry is metadata.geometry
+
+    def test_create_trusted(self):
+        parsed = VoxelsMetadata(self.metadata_json)
+        metadata = VoxelsMetadata.create_trusted( dict( parsed ) )
+        assert metadata.shape == parsed.shape
+        assert metadata.dtype == parsed.dtype
+        assert metadata.geometry == parsed.geometry
+
+        # No validation
+        metadata = VoxelsMetadata.create_trusted( { "Axes" : [], "Properties" : { "Values" : [ { "DataType" : "uint8" } ] },
+                                                    "Unexpected" : 1 } )
+        assert metadata.shape == (1,)
+
     def test_create_default_metadata(self):
         metadata = VoxelsMetadata.create_default_metadata( (2,10,11), numpy.int64, "cxy", 1.5, "nanometers" )
         metadata["Properties"]["Values"][0]["Label"] = "R"
@@ -71,6 +106,15 @@ class TestVolumeInfo( object ):
         assert metadata["Properties"]["Values"][0]["Label"] == "R"
         assert metadata["Properties"]["Values"][1]["Label"] == "G"
 
+    def test_create_default_metadata_validates(self):
+        # bool isn't a valid DVID voxel type
+        try:
+            VoxelsMetadata.create_default_metadata( (1,10,10), numpy.bool_, "cxy", 1.0, "parsecs" )
+        except jsonschema.ValidationError:
+            pass
+        else:
+            assert False, "Expected ValidationError"
+
     def test_create_axistags(self):
         try:
             import vigra
@@ -1,4 +1,7 @@
+import socket
+import httplib
 import StringIO
+import threading
 
 import numpy
 
@@ -41,6 +44,153 @@ class TestVoxelsNddataCodec(object):
         
         self._assert_matching(roundtrip_data, data)
  
+    def test_request_body_is_zero_copy(self):
+        data = numpy.random.randint(0,255, (3, 100, 200)).astype(numpy.uint16)
+        data = numpy.asfortranarray(data)
+        codec = VoxelsNddataCodec( data.dtype )
+        
+        body = codec.create_request_body(data)
+        assert isinstance(body, memoryview)
+        assert len(body) == codec.calculate_buffer_len(data.shape)
+
+        # The body shares memory with the array.
+        data[0,0,0] = 0x1234
+        assert body[0:2].tobytes() == numpy.uint16(0x1234).tostring()
+        
+        # So does the encoded stream
+        stream = codec.create_encoded_stream_from_ndarray(data)
+        first_bytes = stream.read(2)
+        assert isinstance(first_bytes, memoryview)
+        assert first_bytes.tobytes() == numpy.uint16(0x1234).tostring()
+        
+        # Non-F_CONTIGUOUS arrays are streamed in staged pieces instead.
+        body = codec.create_request_body(numpy.ascontiguousarray(data))
+        assert not isinstance(body, memoryview)
+        assert len(body) == codec.calculate_buffer_len(data.shape)
+
+    def test_decode_with_out_dtype(self):
+        data = numpy.random.randint(0,1000, (1,100,200,30)).astype(numpy.uint64)
+        codec = VoxelsNddataCodec( data.dtype )
+
+        # Use a small conversion chunk to exercise the chunked read loop
+        codec.STAGING_CHUNK_SIZE = 1000
+        for out_dtype in [numpy.uint32, numpy.uint16, numpy.float32]:
+            stream = StringIO.StringIO()
+            codec.encode_from_ndarray(stream, data)
+            stream.seek(0)
+            roundtrip_data = codec.decode_to_ndarray(stream, data.shape, out_dtype, check_overflow=True)
+            assert roundtrip_data.flags['F_CONTIGUOUS']
+            
+            self._assert_matching(roundtrip_data, data.astype(out_dtype))
+
+    def test_decode_with_out_dtype_overflow(self):
+        data = numpy.random.randint(0,1000, (1,100,200,3)).astype(numpy.uint64)
+        data[0,50,50,2] = 2**40
+        codec = VoxelsNddataCodec( data.dtype )
+
+        stream = StringIO.StringIO()
+        codec.encode_from_ndarray(stream, data)
+        stream.seek(0)
+        try:
+            codec.decode_to_ndarray(stream, data.shape, numpy.uint32, check_overflow=True)
+        except VoxelsNddataCodec.DtypeOverflowError:
+            pass
+        else:
+            assert False, "Expected an overflow error."
+
+        # Without the check, values are simply truncated.
+        stream.seek(0)
+        roundtrip_data = codec.decode_to_ndarray(stream, data.shape, numpy.uint32)
+        self._assert_matching(roundtrip_data, data.astype(numpy.uint32))
+
+    def test_decode_nan_to_int(self):
+        data = numpy.random.random( (1,10,20,3) ).astype(numpy.float32) * 100
+        data[0,5,5,1] = numpy.nan
+        codec = VoxelsNddataCodec( data.dtype )
+
+        stream = StringIO.StringIO()
+        codec.encode_from_ndarray(stream, data)
+        stream.seek(0)
+        try:
+            codec.decode_to_ndarray(stream, data.shape, numpy.uint8, check_overflow=True)
+        except VoxelsNddataCodec.DtypeOverflowError:
+            pass
+        else:
+            assert False, "Expected an overflow error for NaN."
+
+        # NaN is fine as a float.
+        stream.seek(0)
+        roundtrip_data = codec.decode_to_ndarray(stream, data.shape, numpy.float64, check_overflow=True)
+        assert numpy.isnan( roundtrip_data[0,5,5,1] )
+
+    def test_decode_with_axes(self):
+        data = numpy.random.randint(0,255, (3,100,200,30)).astype(numpy.uint8)
+        codec = VoxelsNddataCodec( data.dtype )
+        
+        # Use a small staging chunk so that each piece is smaller than a single plane.
+        codec.STAGING_CHUNK_SIZE = 1000
+        for axes, order, out_dtype in [ ((0,3,2,1), 'C', None),
+                                        ((0,3,2,1), 'F', None),
+                                        ((3,2,1,0), 'C', None),
+                                        ((1,0,2,3), 'F', numpy.float32),
+                                        ((0,3,2,1), 'C', numpy.uint16) ]:
+            stream = StringIO.StringIO()
+            codec.encode_from_ndarray(stream, data)
+            stream.seek(0)
+            roundtrip_data = codec.decode_to_ndarray(stream, data.shape, out_dtype, axes=axes, order=order)
+            assert roundtrip_data.flags[order + '_CONTIGUOUS']
+            
+            self._assert_matching(roundtrip_data, data.transpose(axes).astype(out_dtype or data.dtype))
+
+    def test_encode_c_order(self):
+        """
+        Arrays that aren't F_CONTIGUOUS are encoded in staged pieces.
+        """
+        data = numpy.random.randint(0,255, (3,100,200,30)).astype(numpy.uint16)
+        c_data = numpy.ascontiguousarray(data)
+        assert not c_data.flags['F_CONTIGUOUS']
+
+        codec = VoxelsNddataCodec( data.dtype )
+        codec.STAGING_CHUNK_SIZE = 1000
+
+        stream = StringIO.StringIO()
+        codec.encode_from_ndarray(stream, c_data)
+        stream.seek(0)
+        roundtrip_data = codec.decode_to_ndarray(stream, data.shape)
+        self._assert_matching(roundtrip_data, data)
+
+        stream = codec.create_encoded_stream_from_ndarray(c_data)
+        assert len(stream) == codec.calculate_buffer_len(data.shape)
+        roundtrip_data = codec.decode_to_ndarray(stream, data.shape)
+        self._assert_matching(roundtrip_data, data)
+
+    def test_decode_from_http_response(self):
+        """
+        Decode directly from an httplib.HTTPResponse, 
+        both with a Content-Length (received directly into the array) and with chunked encoding (fallback path).
+        """
+        data = numpy.random.randint(0,255, (3,100,200,30)).astype(numpy.uint16)
+        codec = VoxelsNddataCodec( data.dtype )
+        encoded = numpy.asfortranarray(data).tostring(order='F')
+
+        length_header = "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n".format( len(encoded) )
+        chunked_header = "HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+        chunked_body = "{:x}\r\n".format(len(encoded)) + encoded + "\r\n0\r\n\r\n"
+        for response_bytes in [ length_header + encoded, chunked_header + chunked_body ]:
+            server_sock, client_sock = socket.socketpair()
+            sender = threading.Thread( target=server_sock.sendall, args=(response_bytes,) )
+            sender.start()
+            try:
+                response = httplib.HTTPResponse(client_sock)
+                response.begin()
+                roundtrip_data = codec.decode_to_ndarray(response, data.shape)
+                assert response.read() == ""
+            finally:
+                sender.join()
+                server_sock.close()
+                client_sock.close()
+            self._assert_matching(roundtrip_data, data)
+
     def _assert_matching(self, data, expected):
         assert expected is not data
         assert expected.dtype == data.dtype